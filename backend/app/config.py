@@ -23,6 +23,124 @@ class Settings(BaseSettings):
     db_user: str
     db_password: str
     db_name: str
+    db_pool_size: int = 5 # Connections per worker
+    db_connect_timeout: int = 5 # Seconds before a MySQL connect attempt is abandoned
+
+    # Outbound campaigns
+    twilio_calls_per_second: float = 1.0 # Account CPS limit shared by all campaign dials
+    campaign_max_concurrent_calls: int = 10 # Default live-call cap per campaign, also the global cap
+    campaign_dispatch_interval: float = 0.5 # Seconds between dispatcher ticks
+    campaign_ring_timeout_seconds: int = 60 # Ring time of campaign dials; still 'dialing' after it, a target is dialed again
+
+    # Adaptive pacing
+    media_sessions_per_worker: int = 20 # Concurrent /media-stream bridges one worker can carry
+    pacing_window_seconds: int = 900 # Rolling window of dial outcomes used for answer rates
+    pacing_prior_answer_rate: float = 0.3 # Assumed answer rate before outcomes accumulate
+    pacing_prior_weight: float = 20.0 # Pseudo-calls backing the prior
+    pacing_safety_z: float = 2.0 # Std-devs of answer variance kept below media capacity
+
+    # Call scheduler
+    scheduler_horizon_seconds: int = 300 # Jobs due within this window are held in the timing wheel
+    scheduler_load_interval: int = 30 # Seconds between near-term job loads
+    scheduler_claim_ttl: int = 300 # Seconds before an unfinished claim is released
+
+    # Twilio REST client
+    twilio_http_timeout: float = 10.0 # Seconds per Twilio API request on the async client
+    twilio_api_base_url: Optional[str] = None # Override https://api.twilio.com, e.g. scripts/fake_twilio.py
+    ultravox_api_base_url: str = "https://api.ultravox.ai/api" # Override for scripts/fake_ultravox.py
+
+    # Webhook ingestion
+    webhook_workers: int = 4 # Background tasks applying webhook events (per gunicorn worker)
+    webhook_dedupe_memory_size: int = 50000 # Recent event keys remembered in memory
+    webhook_dedupe_retention_hours: int = 72 # Age after which webhook_events dedupe rows are purged
+
+    # Post-call pipeline
+    post_call_workers: int = 8 # Concurrent pipeline jobs per gunicorn worker
+    post_call_stage_concurrency: dict = {"transcript": 4, "summary": 2, "email": 2, "embed": 2, "archive": 4} # Per-stage caps within post_call_workers
+    post_call_max_attempts: int = 5 # Attempts before a job is dead-lettered
+    post_call_retry_backoff: int = 30 # Seconds before the first retry; doubles per attempt
+    post_call_poll_interval: float = 2.0 # Seconds between queue polls when idle
+    post_call_claim_ttl: int = 300 # Seconds before a crashed worker's claim is released
+    post_call_stage_timeout: float = 60.0 # Seconds a single stage may run
+    post_call_summary_model: str = "gpt-4o-mini"
+    post_call_email_from: Optional[str] = None
+    embedding_model: str = "text-embedding-ada-002"
+    smtp_host: Optional[str] = None # Follow-up emails are skipped when unset
+    smtp_port: int = 587
+    smtp_username: Optional[str] = None
+    smtp_password: Optional[str] = None
+
+    # Recording archive
+    recording_archive_dir: str = "archive/recordings" # Local copies of provider recordings
+    recording_archive_concurrency: int = 4 # Simultaneous downloads per gunicorn worker
+    recording_archive_chunk_bytes: int = 1048576 # Read/write block size; bounds memory per download
+    recording_accel_redirect_prefix: Optional[str] = None # nginx internal location serving recording_archive_dir, e.g. /_recordings/
+    local_recording_enabled: bool = False # Record both legs of the media bridge to <recording_archive_dir>/local
+    local_recording_buffer_seconds: float = 30.0 # Ring buffer per call; audio beyond it is dropped while the writer lags
+    local_recording_block_seconds: float = 2.0 # Audio flushed per sequential write
+    local_recording_lag_ms: int = 1000 # Late-frame allowance before a block is flushed
+
+    # Call event timeline
+    call_events_batch_size: int = 500 # Buffered events that trigger a batch insert
+    call_events_flush_ms: int = 250 # Max milliseconds an event waits in the buffer
+    call_events_max_buffer: int = 100000 # Oldest events are dropped beyond this while MySQL is down
+
+    # Cost reconciliation
+    reconcile_interval_seconds: int = 900 # Seconds between background runs; 0 disables
+    reconcile_page_size: int = 1000 # Calls per provider list page (Ultravox caps at 100)
+    reconcile_initial_days: int = 7 # Look-back of the first run of a source
+    ultravox_price_per_minute: float = 0.05 # USD per billed Ultravox minute
+
+    # Knowledge base vectorization
+    kb_chunk_tokens: int = 500 # Max tokens per knowledge-base chunk
+    kb_chunk_overlap_tokens: int = 50 # Trailing tokens of a chunk repeated at the start of the next
+    extraction_workers: int = 2 # Processes parsing uploaded documents per gunicorn worker
+    extraction_timeout_seconds: int = 300 # Parsing time allowed per file
+    extraction_max_memory_mb: int = 2048 # Address space of an extraction process (~250 MB before any document); larger documents fail
+    kb_embed_stream_chunks: int = 256 # Extracted chunks (across files) sent for embedding while extraction goes on
+    embedding_batch_max_inputs: int = 2048 # Inputs per embeddings request (provider limit)
+    embedding_batch_max_tokens: int = 300000 # Tokens per embeddings request (provider limit)
+    embedding_concurrency: int = 4 # Embedding requests in flight per gunicorn worker
+    embedding_requests_per_minute: int = 3000 # Account RPM limit for embeddings
+    embedding_tokens_per_minute: int = 1000000 # Account TPM limit for embeddings
+    embedding_price_per_1k_tokens: float = 0.0001 # USD, for per-document cost reports
+    embedding_cache_path: str = "cache/embeddings.sqlite3" # SQLite file shared by the workers on this host
+    embedding_cache_max_bytes: int = 2147483648 # Stored vectors kept before LRU eviction; 0 disables the cache
+    kb_index_refresh_seconds: int = 60 # Seconds between checks for chunks vectorized by other workers
+    kb_index_mode: str = "auto" # "exact", "ivf", or "auto" (IVF from kb_ivf_min_chunks on)
+    kb_ivf_min_chunks: int = 200000 # Corpus size at which "auto" switches to the IVF index
+    kb_ivf_nlist: int = 0 # Inverted lists; 0 picks sqrt(chunks)
+    kb_ivf_nprobe: int = 32 # Lists scanned per query; higher is slower with better recall
+    kb_index_rebuild_seconds: int = 3600 # Seconds between background IVF retrains; 0 disables
+    kb_vector_store_path: str = "cache/kb_vectors.bin" # Quantized vector file mapped by all workers; "" keeps a float32 index per worker
+    kb_vector_store_dtype: str = "int8" # "int8" (per-row scales) or "float16"
+    kb_keyword_search: bool = True # BM25 keyword index fused with vector results
+    kb_hybrid_candidates: int = 20 # Results taken from each of the vector and keyword rankings before fusion
+    kb_rrf_k: int = 60 # Reciprocal rank fusion constant; higher flattens the weight of top ranks
+    kb_answer_top_k: int = 3 # Passages returned by the question_and_answer tool
+    kb_answer_min_score: float = 0.0 # Cosine similarity below which passages are left out
+    kb_answer_max_chars: int = 4000 # Total passage text handed back to the agent
+    kb_answer_cache_size: int = 1000 # Recent answers kept per worker for similar questions; 0 disables
+    kb_answer_cache_threshold: float = 0.95 # Cosine similarity at which a cached question counts as the same
+    kb_answer_cache_ttl_seconds: int = 3600 # Age after which a cached answer is recomputed
+    kb_prefetch_enabled: bool = True # Start retrieval from the caller's transcript before the tool is invoked
+    kb_prefetch_debounce_ms: int = 300 # Silence in a user utterance after which it is prefetched
+    kb_prefetch_min_words: int = 3 # Shorter utterances ("yes", "okay") are not prefetched
+    kb_prefetch_min_overlap: float = 0.6 # Share of the tool question's keywords an utterance must contain
+    kb_prefetch_max_entries: int = 8 # Prefetched utterances kept per call
+
+    # Ultravox client tools
+    tool_max_concurrency: int = 32 # Invocations of one tool running at once per worker, unless its spec sets a limit
+
+    # Dial-list screening
+    screening_default_country_code: str = "1" # Prepended to numbers without '+'/'00'
+    screening_recent_days: int = 7 # Numbers dialed within this many days are skipped
+    screening_refresh_seconds: int = 300 # Reload interval of the in-memory DNC/recent sets
+
+    # call_logs partitioning / retention
+    call_logs_partitioning: bool = False # Maintain monthly RANGE partitions on start_time (enable with archive_service first)
+    call_logs_retention_months: int = 12 # Months kept in MySQL before archival
+    call_logs_archive_dir: str = "archive/call_logs" # Compressed NDJSON exports of archived months
 
     class Config:
         env_file = ".env"
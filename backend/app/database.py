@@ -1,52 +1,101 @@
 """
-This module initializes the MySQL database connection using mysql.connector
-and provides a function to create necessary tables.
+This module manages the MySQL connection pool using mysql.connector and
+provides a function to create necessary tables. The pool is created lazily
+(on first use or by the application lifespan), never at import time, and
+never on the event loop: there get_db_connection starts the creation in a
+worker thread and returns None until the pool exists.
 """
 import mysql.connector
 from mysql.connector import pooling
 from mysql.connector import Error
 from .config import settings
+import asyncio
 import logging
+import threading
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 db_pool = None
+_pool_lock = threading.Lock()
+_failed_attempts = 0
+_next_attempt_at = 0.0
+_background_init = None # Pool creation started from the event loop, while running
+
+# Backoff between pool creation attempts after a failure (seconds)
+POOL_RETRY_BASE_DELAY = 0.5
+POOL_RETRY_MAX_DELAY = 30.0
 
 def init_db_pool():
-    """Initializes the database connection pool."""
-    global db_pool
-    try:
-        logger.info(f"Attempting to connect to MySQL: Host={settings.db_host}, User={settings.db_user}, DB={settings.db_name}")
-        db_pool = pooling.MySQLConnectionPool(
-            pool_name="tfrtita_pool",
-            pool_size=5, # Adjust pool size as needed
-            host=settings.db_host,
-            port=settings.db_port,
-            user=settings.db_user,
-            password=settings.db_password,
-            database=settings.db_name
-        )
-        logger.info("MySQL connection pool created successfully.")
-        # Test connection
-        conn = db_pool.get_connection()
-        if conn.is_connected():
-            logger.info("Successfully connected to MySQL database.")
+    """
+    Initializes the database connection pool. Returns True on success.
+    Safe to call repeatedly; a no-op once the pool exists.
+    """
+    global db_pool, _failed_attempts, _next_attempt_at
+    with _pool_lock:
+        if db_pool is not None:
+            return True
+        try:
+            logger.info(f"Attempting to connect to MySQL: Host={settings.db_host}, User={settings.db_user}, DB={settings.db_name}")
+            pool = pooling.MySQLConnectionPool(
+                pool_name="tfrtita_pool",
+                pool_size=settings.db_pool_size,
+                host=settings.db_host,
+                port=settings.db_port,
+                user=settings.db_user,
+                password=settings.db_password,
+                database=settings.db_name,
+                connection_timeout=settings.db_connect_timeout
+            )
+            # Test connection
+            conn = pool.get_connection()
+            if not conn.is_connected():
+                raise Error("Failed to establish initial connection from pool.")
             conn.close()
-        else:
-            logger.error("Failed to establish initial connection from pool.")
-            db_pool = None # Reset pool if initial connection failed
+            db_pool = pool
+            _failed_attempts = 0
+            logger.info("MySQL connection pool created successfully.")
+            return True
+        except Error as e:
+            _failed_attempts += 1
+            delay = min(POOL_RETRY_MAX_DELAY, POOL_RETRY_BASE_DELAY * 2 ** (_failed_attempts - 1))
+            _next_attempt_at = time.monotonic() + delay
+            logger.error(f"Error while connecting to MySQL using Connection Pool (attempt {_failed_attempts}, next retry in {delay:.1f}s): {e}")
+            return False
 
-    except Error as e:
-        logger.error(f"Error while connecting to MySQL using Connection Pool: {e}")
-        db_pool = None # Ensure pool is None if initialization fails
+def retry_delay():
+    """Seconds until the next pool creation attempt is allowed (0 if allowed now)."""
+    return max(0.0, _next_attempt_at - time.monotonic())
+
+def close_db_pool():
+    """Drops the pool reference; pooled connections are closed as they are garbage collected."""
+    global db_pool
+    with _pool_lock:
+        db_pool = None
 
 def get_db_connection():
-    """Gets a connection from the pool."""
+    """
+    Gets a connection from the pool, creating the pool lazily on first use.
+    While MySQL is unreachable, creation is retried with exponential backoff
+    rather than on every call. Called from a coroutine, creation (which connects
+    to MySQL) runs in a worker thread and this call returns None meanwhile.
+    """
+    global _background_init
     if db_pool is None:
-        logger.error("Database pool is not initialized.")
-        return None
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            if retry_delay() == 0 and (_background_init is None or _background_init.done()):
+                _background_init = loop.run_in_executor(None, init_db_pool)
+            logger.error("Database pool is not initialized yet.")
+            return None
+        if retry_delay() > 0 or not init_db_pool():
+            logger.error("Database pool is not initialized.")
+            return None
     try:
         conn = db_pool.get_connection()
         if conn.is_connected():
@@ -55,6 +104,39 @@ def get_db_connection():
         logger.error(f"Error getting connection from pool: {e}")
     return None
 
+def ping_db():
+    """Returns True if a pooled connection can run a trivial query."""
+    conn = get_db_connection()
+    if conn is None:
+        return False
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        return True
+    except Error as e:
+        logger.error(f"Database ping failed: {e}")
+        return False
+    finally:
+        if cursor: cursor.close()
+        conn.close()
+
+def ensure_columns(cursor, table: str, columns: dict):
+    """
+    Adds any of `columns` ({name: column definition}) missing from an existing table,
+    so columns introduced after a table was first created reach older databases.
+    """
+    cursor.execute(
+        "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table,)
+    )
+    existing = {row[0].lower() for row in cursor.fetchall()}
+    for name, definition in columns.items():
+        if name.lower() not in existing:
+            logger.info(f"Adding column {table}.{name}")
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
 def create_tables():
     """
     Create the necessary tables in the MySQL database.
@@ -87,6 +169,9 @@ def create_tables():
             );
             """
         )
+        logger.info("Creating table: call_sid_index")
+        from .services.archive_service import archive_service
+        archive_service.create_tables(cursor)
         logger.info("Creating table: knowledge_base")
         cursor.execute(
             """
@@ -101,6 +186,9 @@ def create_tables():
             );
             """
         )
+        logger.info("Creating table: knowledge_base_chunks")
+        from .services.knowledge_base_service import knowledge_base_service
+        knowledge_base_service.create_tables(cursor)
         logger.info("Creating table: clients")
         cursor.execute(
             """
@@ -115,8 +203,42 @@ def create_tables():
             );
             """
         )
+        logger.info("Creating tables: call_daily_rollups, call_duration_sketch")
+        from .services.analytics_service import analytics_service
+        analytics_service.create_tables(cursor)
+        logger.info("Creating tables: campaigns, campaign_targets")
+        from .services.campaign_service import campaign_service
+        campaign_service.create_tables(cursor)
+        logger.info("Creating table: worker_media_sessions")
+        from .services.pacing_service import media_session_tracker
+        media_session_tracker.create_tables(cursor)
+        logger.info("Creating table: scheduled_calls")
+        from .services.scheduler_service import call_scheduler
+        call_scheduler.create_tables(cursor)
+        logger.info("Creating table: dnc_numbers")
+        from .services.screening_service import screening_service
+        screening_service.create_tables(cursor)
+        logger.info("Creating table: webhook_events")
+        from .services.webhook_service import webhook_ingestor
+        webhook_ingestor.create_tables(cursor)
+        logger.info("Creating tables: post_call_jobs, call_transcript_embeddings")
+        from .services.post_call_service import post_call_pipeline
+        post_call_pipeline.create_tables(cursor)
+        logger.info("Creating table: call_events")
+        from .services.call_events_service import call_events
+        call_events.create_tables(cursor)
+        logger.info("Creating table: call_recordings")
+        from .services.recording_service import recording_archiver
+        recording_archiver.create_tables(cursor)
+        from .services.call_recorder import recording_writer
+        recording_writer.create_tables(cursor)
+        logger.info("Creating table: reconciliation_state")
+        from .services.reconciliation_service import reconciliation_service
+        reconciliation_service.create_tables(cursor)
         conn.commit()
         logger.info("Tables checked/created successfully.")
+        if settings.call_logs_partitioning:
+            archive_service.ensure_future_partitions()
     except Error as e:
         logger.error(f"Error creating tables: {e}")
         # Consider rolling back if part of a larger transaction
@@ -126,12 +248,9 @@ def create_tables():
         if conn:
             conn.close()
 
-# Initialize the pool when the module is loaded
-init_db_pool()
-
 # Allow running this script directly to create tables (e.g., during deployment)
 if __name__ == "__main__":
-    if db_pool:
+    if init_db_pool():
         create_tables()
     else:
         logger.error("Database pool initialization failed. Cannot create tables.")
@@ -1,9 +1,28 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
-from .database import create_tables, get_db_connection, Error as DBError
-from .routes import credentials, calls, knowledge_base
+from fastapi.responses import Response, JSONResponse
+from contextlib import asynccontextmanager
+from .database import create_tables, init_db_pool, close_db_pool, ping_db, retry_delay
+from .routes import credentials, calls, knowledge_base, schedule, vectorization
 from .config import settings
+from .services.campaign_service import campaign_dispatcher
+from .services.pacing_service import media_session_tracker
+from .services.scheduler_service import call_scheduler
+from .services.call_log_writer import call_log_writer
+from .services.twilio_service import twilio_service
+from .services.post_call_service import post_call_pipeline
+from .services.recording_service import recording_archiver
+from .services.call_recorder import recording_writer
+from .services.call_events_service import call_events
+from .services.reconciliation_service import reconciliation_service
+from .services.retrieval_service import retrieval_service
+from .services.extraction_service import document_extractor
+from .services.answer_cache import answer_cache
+from .services.question_prefetch import QuestionPrefetcher
+from .services.ultravox_service import ultravox_service # Registers the client tools
+from .services.tool_registry import ToolDispatcher, tool_registry
+from .services.webhook_service import webhook_ingestor, apply_ultravox_event, ultravox_call, ultravox_event_key
+from .utils.metrics import metrics
 # from . import prompts # Removed import as file is empty
 import logging
 import json
@@ -13,6 +32,7 @@ import asyncio
 import websockets # For Ultravox connection
 import requests # For creating Ultravox call
 import traceback
+import time
 from datetime import datetime
 
 # Configure logging
@@ -22,7 +42,48 @@ logger = logging.getLogger(__name__)
 # Removed UltravoxSession import attempts as they consistently failed
 # We will use websockets.connect directly as per the example project
 
-app = FastAPI()
+async def connect_database():
+    """
+    Creates the MySQL pool in the background, retrying with backoff until MySQL is
+    reachable, then ensures the tables exist. Requests arriving before that get a
+    503 from routes that need the database and /readyz reports not ready.
+    """
+    while not await asyncio.to_thread(init_db_pool):
+        await asyncio.sleep(retry_delay())
+    logger.info("Running startup task: Ensuring database tables exist.")
+    await asyncio.to_thread(create_tables)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db_task = asyncio.create_task(connect_database())
+    campaign_dispatcher.start()
+    media_session_tracker.start()
+    call_scheduler.start()
+    call_log_writer.start()
+    webhook_ingestor.start()
+    post_call_pipeline.start()
+    call_events.start()
+    reconciliation_service.start()
+    retrieval_service.start()
+    yield
+    if not db_task.done():
+        db_task.cancel()
+    await call_scheduler.stop()
+    await campaign_dispatcher.stop()
+    await media_session_tracker.stop()
+    await webhook_ingestor.stop()
+    await reconciliation_service.stop()
+    await retrieval_service.stop()
+    await asyncio.to_thread(document_extractor.stop)
+    await post_call_pipeline.stop()
+    await recording_archiver.close()
+    await asyncio.to_thread(recording_writer.stop)
+    await call_events.stop()
+    await call_log_writer.stop()
+    await twilio_service.close()
+    close_db_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 # Keep track of active sessions (Twilio CallSid -> Session Data)
 # WARNING: This in-memory store is not suitable for production
@@ -41,22 +102,76 @@ app.add_middleware(
 app.include_router(credentials.router, prefix="/api/credentials", tags=["Credentials"])
 app.include_router(calls.router, prefix="/api/calls", tags=["Calls"])
 app.include_router(knowledge_base.router, prefix="/api/kb", tags=["KnowledgeBase"]) # Added KB router
-
-@app.on_event("startup")
-def startup_event():
-    logger.info("Running startup event: Ensuring database tables exist.")
-    create_tables()
+app.include_router(vectorization.router, prefix="/api/kb", tags=["KnowledgeBase"])
+app.include_router(schedule.router, prefix="/api/schedule", tags=["Schedule"])
 
 @app.get("/")
 async def root():
     return {"message": "Voice AI Call Agent Backend"}
 
+@app.get("/healthz")
+async def healthz():
+    """Liveness probe: the worker is up and serving its event loop."""
+    return {"status": "ok"}
+
+# Cached Ultravox reachability result (monotonic timestamp, reachable)
+_ultravox_probe = (0.0, False)
+ULTRAVOX_PROBE_TTL = 10.0
+
+def check_ultravox_reachable() -> bool:
+    try:
+        resp = requests.get(
+            f"{settings.ultravox_api_base_url.rstrip('/')}/accounts/me",
+            headers={"X-API-Key": settings.ultravox_api_key},
+            timeout=2
+        )
+        return resp.status_code < 500
+    except requests.RequestException as e:
+        logger.warning(f"Ultravox readiness probe failed: {e}")
+        return False
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness probe: MySQL answers queries and the Ultravox API is reachable."""
+    global _ultravox_probe
+    db_ok = await asyncio.to_thread(ping_db)
+    checked_at, ultravox_ok = _ultravox_probe
+    if time.monotonic() - checked_at > ULTRAVOX_PROBE_TTL:
+        ultravox_ok = await asyncio.to_thread(check_ultravox_reachable)
+        _ultravox_probe = (time.monotonic(), ultravox_ok)
+    ready = db_ok and ultravox_ok
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "database": db_ok, "ultravox": ultravox_ok}
+    )
+
+@app.get("/metrics")
+async def get_metrics():
+    """Counters and latency histograms of this worker process."""
+    snapshot = metrics.snapshot()
+    snapshot["call_log_writer_pending"] = call_log_writer.pending
+    snapshot["webhook_queue_pending"] = webhook_ingestor.pending
+    snapshot["call_events_pending"] = call_events.pending
+    snapshot["recording_downloads_active"] = recording_archiver.active
+    snapshot["local_recordings_active"] = recording_writer.active
+    snapshot["answer_cache_entries"] = len(answer_cache)
+    snapshot["answer_cache_hit_rate"] = round(answer_cache.hit_rate, 4)
+    return snapshot
+
 # --- Ultravox Call Creation ---
-async def create_ultravox_call(system_prompt: str, first_message: str) -> str:
+_link_tasks = set()
+
+def _log_link_failure(task: asyncio.Task):
+    _link_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.warning(f"Failed to link Ultravox call for cost reconciliation: {task.exception()}")
+
+async def create_ultravox_call(system_prompt: str, first_message: str, call_sid: str = None) -> str:
     """
     Creates a new Ultravox call in serverWebSocket mode and returns the joinUrl.
+    The Ultravox callId is linked to `call_sid` for cost reconciliation.
     """
-    url = "https://api.ultravox.ai/api/calls"
+    url = f"{settings.ultravox_api_base_url}/calls"
     if not settings.ultravox_api_key:
         logger.error("ULTRAVOX_API_KEY is not configured.")
         return ""
@@ -76,7 +191,8 @@ async def create_ultravox_call(system_prompt: str, first_message: str) -> str:
                 "outputSampleRate": 8000, # Match Twilio
                 "clientBufferSizeMs": 60
             }
-        }
+        },
+        "selectedTools": tool_registry.selected_tools(["question_and_answer"]),
         # "call_ended_webhook_url": f"{settings.base_url}/ultravox-webhook" # Removed invalid parameter
     }
     logger.info(f"Creating Ultravox call with payload: {json.dumps(payload, indent=2)}")
@@ -90,6 +206,11 @@ async def create_ultravox_call(system_prompt: str, first_message: str) -> str:
         body = resp.json()
         join_url = body.get("joinUrl") or ""
         logger.info(f"Ultravox joinUrl received: {join_url}")
+        if call_sid and body.get("callId"):
+            call_events.record(call_sid, "ultravox", "call.created", {"callId": body["callId"]})
+            link = asyncio.create_task(asyncio.to_thread(reconciliation_service.link_ultravox_call, call_sid, body["callId"]))
+            _link_tasks.add(link)
+            link.add_done_callback(_log_link_failure)
         return join_url
     except Exception as e:
         logger.error(f"Ultravox create call request failed: {e}", exc_info=True)
@@ -103,6 +224,7 @@ async def websocket_endpoint(websocket: WebSocket):
     """
     await websocket.accept()
     logger.info("Twilio WebSocket connection accepted.")
+    media_session_tracker.session_started()
 
     call_sid = None
     stream_sid = None
@@ -110,6 +232,9 @@ async def websocket_endpoint(websocket: WebSocket):
     session = None
     twilio_task = None
     uv_task = None
+    recording = None # Local dual-channel recording, when enabled
+    prefetcher = None # Speculative knowledge-base retrieval from the caller's transcript
+    tools = None # Tool invocations and all writes to uv_ws
 
     async def handle_ultravox_messages():
         nonlocal uv_ws, stream_sid, call_sid, session
@@ -118,6 +243,8 @@ async def websocket_endpoint(websocket: WebSocket):
                 if isinstance(raw_message, bytes):
                     try:
                         # Agent audio in PCM s16le -> convert to mulaw for Twilio
+                        if recording:
+                            recording.add_agent(raw_message)
                         mu_law_bytes = audioop.lin2ulaw(raw_message, 2)
                         payload_base64 = base64.b64encode(mu_law_bytes).decode('ascii')
                         await websocket.send_text(json.dumps({
@@ -140,24 +267,21 @@ async def websocket_endpoint(websocket: WebSocket):
                             text = msg_data.get("text") or msg_data.get("delta")
                             if role and text and session:
                                 session['transcript'] += f"{role.capitalize()}: {text}\n"
+                            if prefetcher:
+                                prefetcher.on_transcript(msg_data)
                         elif msg_type == "client_tool_invocation":
-                             toolName = msg_data.get("toolName", "")
-                             invocationId = msg_data.get("invocationId")
-                             logger.warning(f"Received unhandled tool invocation: {toolName} (ID: {invocationId})")
-                             error_result = {
-                                 "type": "client_tool_result",
-                                 "invocationId": invocationId,
-                                 "error_type": "not-implemented",
-                                 "error_message": f"Tool '{toolName}' is not implemented."
-                             }
-                             await uv_ws.send(json.dumps(error_result)) # Send back via uv_ws
+                            tools.dispatch(msg_data) # Runs as its own task; the result goes out through tools' writer
                         else:
+                            call_events.record(call_sid, "ultravox", msg_type or "unknown",
+                                               {k: v for k, v in msg_data.items() if k not in ("type", "eventType")})
                             logger.info(f"Received Ultravox message: {msg_type} - {msg_data}")
                     except Exception as e:
                         logger.error(f"Error processing Ultravox data message: {e} - Data: {raw_message}")
-        except websockets.exceptions.ConnectionClosedOK:
+        except websockets.exceptions.ConnectionClosedOK as e:
+             call_events.record(call_sid, "ultravox", "socket.closed", {"code": e.code, "reason": e.reason})
              logger.info(f"Ultravox WebSocket closed normally for CallSid={call_sid}.")
         except Exception as e:
+            call_events.record(call_sid, "ultravox", "socket.error", {"error": str(e)})
             logger.error(f"Error in handle_ultravox_messages for CallSid={call_sid}: {e}", exc_info=True)
         finally:
              logger.info(f"Ultravox message handler finished for CallSid={call_sid}.")
@@ -165,7 +289,7 @@ async def websocket_endpoint(websocket: WebSocket):
                  await websocket.close(code=1011, reason="Ultravox connection closed")
 
     async def handle_twilio_messages():
-        nonlocal call_sid, session, stream_sid, uv_ws, uv_task
+        nonlocal call_sid, session, stream_sid, uv_ws, uv_task, recording, prefetcher, tools
         try:
             while True:
                 message = await websocket.receive_text()
@@ -187,6 +311,7 @@ async def websocket_endpoint(websocket: WebSocket):
                          return
 
                     logger.info(f"Twilio stream started: streamSid={stream_sid}, callSid={call_sid}, caller={caller_number}")
+                    call_events.record(call_sid, "media", "stream.start", {"streamSid": stream_sid, "caller": caller_number})
 
                     if call_sid in sessions:
                         session = sessions[call_sid]
@@ -196,11 +321,15 @@ async def websocket_endpoint(websocket: WebSocket):
                         session = {"transcript": "", "callerNumber": caller_number, "callDetails": {}, "firstMessage": first_message, "streamSid": stream_sid}
                         sessions[call_sid] = session # Corrected indentation
 
+                    recording = recording_writer.open(call_sid)
+                    prefetcher = QuestionPrefetcher(call_sid)
+
                     # Define a default system prompt here
                     system_prompt = "You are a helpful AI assistant designed to handle phone calls."
-                    uv_join_url = await create_ultravox_call(system_prompt, first_message)
+                    uv_join_url = await create_ultravox_call(system_prompt, first_message, call_sid)
 
                     if not uv_join_url:
+                        call_events.record(call_sid, "ultravox", "call.create_failed")
                         logger.error(f"Failed to create Ultravox call for CallSid {call_sid}. Closing connection.")
                         await websocket.close(code=1011, reason="Ultravox call creation failed")
                         return
@@ -208,6 +337,8 @@ async def websocket_endpoint(websocket: WebSocket):
                     try:
                         # Connect directly using websockets library
                         uv_ws = await websockets.connect(uv_join_url)
+                        tools = ToolDispatcher(uv_ws, call_sid, {"prefetcher": prefetcher})
+                        call_events.record(call_sid, "ultravox", "socket.connected")
                         logger.info(f"Ultravox WebSocket connected via websockets.connect for CallSid {call_sid}.")
                         uv_task = asyncio.create_task(handle_ultravox_messages()) # Start listener
 
@@ -218,21 +349,26 @@ async def websocket_endpoint(websocket: WebSocket):
 
                 elif event == 'media':
                     payload_base64 = data['media']['payload']
-                    if uv_ws and uv_ws.state == websockets.protocol.State.OPEN:
+                    uv_open = uv_ws and uv_ws.state == websockets.protocol.State.OPEN
+                    if uv_open or recording:
                         try:
                             # Decode base64 to get raw µ-law bytes
                             mu_law_bytes = base64.b64decode(payload_base64)
                             # Transcode µ-law to PCM (s16le)
                             pcm_bytes = audioop.ulaw2lin(mu_law_bytes, 2)
+                            if recording:
+                                recording.add_caller(pcm_bytes, data['media'].get('timestamp'))
                             # Send PCM bytes to Ultravox
-                            await uv_ws.send(pcm_bytes)
-                            logger.debug(f"Sent {len(pcm_bytes)} PCM bytes to Ultravox for CallSid={call_sid}")
+                            if uv_open:
+                                await tools.send(pcm_bytes)
+                                logger.debug(f"Sent {len(pcm_bytes)} PCM bytes to Ultravox for CallSid={call_sid}")
                         except Exception as e:
                             logger.error(f"Error transcoding/sending Twilio audio to Ultravox for CallSid={call_sid}: {e}")
-                    else:
+                    if not uv_open:
                          logger.warning(f"Received Twilio media but Ultravox WS not open for CallSid={call_sid}")
 
                 elif event == 'stop':
+                    call_events.record(call_sid, "media", "stream.stop")
                     logger.info(f"Twilio stream stopped for CallSid={call_sid}: {data}")
                     break
 
@@ -242,14 +378,18 @@ async def websocket_endpoint(websocket: WebSocket):
                 else:
                     logger.warning(f"Received unknown Twilio event for CallSid={call_sid}: {event}")
 
-        except WebSocketDisconnect:
+        except WebSocketDisconnect as e:
+            call_events.record(call_sid, "media", "socket.disconnected", {"code": e.code})
             logger.info(f"Twilio WebSocket disconnected for CallSid={call_sid}.")
         except Exception as e:
             logger.error(f"Error in handle_twilio_messages for CallSid={call_sid}: {e}", exc_info=True)
         finally:
             logger.info(f"Twilio message handler finished for CallSid={call_sid}.")
             if uv_task and not uv_task.done(): uv_task.cancel()
+            if tools: await tools.close()
             if uv_ws and uv_ws.state == websockets.protocol.State.OPEN: await uv_ws.close()
+            if recording: recording.close()
+            if prefetcher: prefetcher.close()
             # Removed uv_session close
             if call_sid and call_sid in sessions:
                 del sessions[call_sid]
@@ -260,80 +400,38 @@ async def websocket_endpoint(websocket: WebSocket):
         await twilio_task
     except asyncio.CancelledError:
         logger.info(f"WebSocket endpoint task cancelled for CallSid={call_sid}")
+    finally:
+        media_session_tracker.session_ended()
 
 # --- Ultravox Webhook ---
 @app.post("/ultravox-webhook")
 async def ultravox_webhook_handler(request: Request):
     """
-    Handle incoming webhooks from Ultravox, specifically 'call.ended'.
+    Handle incoming webhooks from Ultravox, specifically 'call.ended'. Events are
+    acknowledged immediately and applied once by the webhook ingestor.
     """
-    conn = None
-    cursor = None
-    payload = {}
     try:
         payload = await request.json()
-        event_type = payload.get('event')
-
-        if event_type == 'call.ended':
-            call_data = payload.get('call', {})
-            call_sid = call_data.get('id')
-            transcription = call_data.get('transcription')
-            recording_url = call_data.get('recording_url')
-            agent_hangup_reason = call_data.get('agent_hangup_reason')
-
-            if not call_sid:
-                logger.error("Call ID missing in Ultravox call.ended webhook.")
-                return Response(status_code=400, detail="Missing call ID")
-
-            logger.info(f"Received Ultravox call.ended webhook for CallSid: {call_sid}")
-
-            conn = get_db_connection()
-            if conn is None:
-                logger.error(f"Database connection unavailable for Ultravox webhook: {call_sid}")
-                raise HTTPException(status_code=503, detail="Database unavailable")
-
-            cursor = conn.cursor()
-            update_fields = []
-            params = []
-            if transcription:
-                update_fields.append("transcription = %s")
-                params.append(transcription)
-            if recording_url:
-                update_fields.append("ultravox_recording_url = %s")
-                params.append(recording_url)
-            if agent_hangup_reason:
-                update_fields.append("agent_hangup_reason = %s")
-                params.append(agent_hangup_reason)
-
-            if not update_fields:
-                logger.info(f"No relevant fields to update from Ultravox webhook for CallSid: {call_sid}")
-                return Response(status_code=200)
-
-            params.append(call_sid)
-            sql = f"UPDATE call_logs SET {', '.join(update_fields)} WHERE call_sid = %s"
-
-            logger.info(f"Executing SQL from Ultravox webhook: {sql} with params: {params}")
-            cursor.execute(sql, tuple(params))
-            conn.commit()
-            logger.info(f"Call log updated from Ultravox webhook for CallSid: {call_sid}")
-
-            return Response(status_code=200)
-        else:
-            logger.info(f"Received unhandled Ultravox event type: {event_type}")
-            return Response(status_code=200)
-
     except json.JSONDecodeError:
         logger.error("Failed to decode JSON from Ultravox webhook.")
         raise HTTPException(status_code=400, detail="Invalid JSON")
-    except DBError as e:
-        logger.error(f"Database error processing Ultravox webhook for call {payload.get('call', {}).get('id')}: {e}")
-        raise HTTPException(status_code=500, detail="Database processing error")
-    except Exception as e:
-        logger.error(f"Unexpected error processing Ultravox webhook for call {payload.get('call', {}).get('id')}: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="Internal server error")
-    finally:
-        if cursor: cursor.close()
-        if conn: conn.close()
+
+    if not isinstance(payload, dict):
+        logger.error("Ultravox webhook body is not a JSON object.")
+        raise HTTPException(status_code=400, detail="Invalid payload")
+    call = ultravox_call(payload)
+    call_sid = call.get('id')
+    if not call_sid:
+        logger.error(f"Call ID missing in Ultravox {payload.get('event')} webhook.")
+        raise HTTPException(status_code=400, detail="Missing call ID")
+
+    logger.info(f"Received Ultravox {payload.get('event')} webhook for CallSid: {call_sid}")
+    call_events.record(call_sid, "ultravox", f"webhook.{payload.get('event')}", {
+        "agent_hangup_reason": call.get('agent_hangup_reason'),
+        "end_reason": call.get('endReason'),
+    })
+    webhook_ingestor.submit(ultravox_event_key(payload), call_sid, apply_ultravox_event, payload)
+    return Response(status_code=200)
 
 # Allow running directly via uvicorn for local testing
 if __name__ == "__main__":
@@ -1,20 +1,34 @@
 from fastapi import APIRouter, HTTPException, Request, Response, Depends, status as http_status
 from pydantic import BaseModel, Field
-from typing import List, Optional
-from datetime import datetime
+from typing import Dict, List, Optional
+from datetime import datetime, date, timedelta
 # Updated database import for MySQL connection pool
 from ..database import get_db_connection, Error as DBError # Using mysql.connector.Error as DBError
 # Import services
-from ..services.twilio_service import TwilioService
+from ..services.twilio_service import twilio_service
+from ..services.campaign_service import campaign_service, CampaignError
+from ..services.analytics_service import analytics_service
+from ..services.archive_service import archive_service, insert_call_logs
+from ..services.screening_service import screening_service
+from ..services.post_call_service import post_call_pipeline
+from ..services.call_events_service import call_events
+from ..services.recording_service import recording_archiver
+from ..services.webhook_service import webhook_ingestor, apply_twilio_status, twilio_event_key
 from ..config import settings # To get base_url if needed for TwiML URL
-from twilio.twiml.voice_response import VoiceResponse, Connect, Stream
+from ..utils.twiml import outbound_stream_twiml, stream_template
+from ..utils.range_response import RangeFileResponse
+from twilio.twiml.voice_response import VoiceResponse
+import asyncio
 import logging
+import os
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+INCOMING_STREAM_TEMPLATE = stream_template(("callSid", "callerNumber"), {"firstMessage": "Hello from TwiML"})
+
 # --- Pydantic Models ---
 
 class CallLogBase(BaseModel):
@@ -55,6 +69,20 @@ class CallLogResponse(BaseModel):
 class BulkCallRequest(BaseModel):
     phone_numbers: List[str]
     message_template: Optional[str] = None # Placeholder for potential future use
+    name: Optional[str] = None # Campaign name
+    max_concurrent_calls: Optional[int] = Field(None, gt=0)
+    pacing_mode: str = Field("fixed", pattern="^(fixed|adaptive)$")
+    target_concurrency: Optional[int] = Field(None, gt=0, description="Bridged calls to aim for in adaptive mode")
+    skip_recent: bool = True # Drop numbers called within screening_recent_days
+    stream_parameters: Optional[Dict[str, str]] = None # Extra <Stream> parameters for every call, e.g. firstMessage
+
+class ScreenRequest(BaseModel):
+    phone_numbers: List[str]
+    skip_recent: bool = True
+
+class DncRequest(BaseModel):
+    phone_numbers: List[str]
+    source: Optional[str] = None
 
 class ClientBase(BaseModel):
     name: str
@@ -84,24 +112,21 @@ class InitiateCallResponse(BaseModel):
     to: str
     from_num: str # Renamed to avoid conflict with Python keyword
 
-class BulkCallResult(BaseModel):
-    number: str
-    status: str
-    call_sid: Optional[str] = None
-    error: Optional[str] = None
+# Rejected numbers returned inline by /bulk; all of them are paged by /campaigns/{id}/rejected.
+REJECTED_SAMPLE_SIZE = 100
 
 class BulkCallResponse(BaseModel):
+    campaign_id: Optional[int] = None
+    status: str
     total_numbers: int
-    results: List[BulkCallResult]
+    screening: dict = {} # Count per screening reason
+    rejected: List[dict] = [] # The first REJECTED_SAMPLE_SIZE rejected numbers
 
 class ClientImportResponse(BaseModel):
     message: str
     inserted: int
     skipped: int
 
-# --- Service Instantiation ---
-twilio_service = TwilioService()
-
 # --- API Endpoints ---
 
 @router.post("/initiate", response_model=InitiateCallResponse)
@@ -117,19 +142,10 @@ async def initiate_single_call(call_request: InitiateCallRequest):
              raise HTTPException(status_code=400, detail="Missing 'from_number' and no default configured.")
 
         # Generate TwiML to connect to WebSocket stream
-        server_domain = settings.base_url.replace("http://", "").replace("https://", "")
-        stream_url = f"wss://{server_domain}/media-stream"
-        twiml = VoiceResponse()
-        connect = Connect()
-        stream = Stream(url=stream_url)
-        stream.parameter(name="callerNumber", value=effective_from_number)
-        stream.parameter(name="calleeNumber", value=call_request.to_number)
-        connect.append(stream)
-        twiml.append(connect)
-        twiml_string = str(twiml)
+        twiml_string = outbound_stream_twiml(effective_from_number, call_request.to_number)
 
         logger.info(f"Attempting to initiate call via TwilioService to {call_request.to_number} from {effective_from_number}...")
-        call = twilio_service.make_call(to_number=call_request.to_number, from_number=effective_from_number, twiml=twiml_string)
+        call = await twilio_service.make_call_async(to_number=call_request.to_number, from_number=effective_from_number, twiml=twiml_string)
 
         if not call or not call.sid:
              # Handle case where make_call failed internally but didn't raise exception
@@ -153,58 +169,141 @@ async def initiate_single_call(call_request: InitiateCallRequest):
         raise HTTPException(status_code=status_code, detail=detail_msg)
 
 
-@router.post("/bulk", response_model=BulkCallResponse)
+@router.post("/bulk", response_model=BulkCallResponse, status_code=http_status.HTTP_202_ACCEPTED)
 async def bulk_call_campaign(request: BulkCallRequest):
     """
-    Initiate bulk calls to multiple phone numbers.
-    Note: Consider using background tasks for large lists.
+    Create a call campaign for multiple phone numbers. The numbers are persisted and
+    dialed in the background by the campaign dispatcher; poll /campaigns/{id} for progress.
+    The response carries screening counts and a sample of the rejected numbers (all of
+    them: /campaigns/{id}/rejected); a list with no acceptable number is a 422.
     """
-    results = []
     from_number = settings.twilio_from_number
     if not from_number:
          logger.error("Missing TWILIO_FROM_NUMBER in configuration for bulk call.")
          raise HTTPException(status_code=500, detail="Twilio 'from' number not configured.")
+    if not request.phone_numbers:
+        raise HTTPException(status_code=400, detail="No phone numbers provided.")
 
-    logger.info(f"Starting bulk call campaign from {from_number} to {len(request.phone_numbers)} numbers.")
-    server_domain = settings.base_url.replace("http://", "").replace("https://", "")
-    stream_url = f"wss://{server_domain}/media-stream"
+    try:
+        screened = await asyncio.to_thread(
+            screening_service.screen_numbers, request.phone_numbers, request.skip_recent
+        )
+    except DBError as e:
+        logger.error(f"Database error screening bulk call numbers: {e}")
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+    numbers = screened.accepted
+    if not numbers:
+        raise HTTPException(status_code=http_status.HTTP_422_UNPROCESSABLE_ENTITY, detail={
+            "message": "Every number was rejected by screening.",
+            "screening": screened.summary(),
+            "rejected": screened.rejected(REJECTED_SAMPLE_SIZE),
+        })
 
-    for number in request.phone_numbers:
-        try:
-            # Generate TwiML for this specific call
-            twiml = VoiceResponse()
-            connect = Connect()
-            stream = Stream(url=stream_url)
-            stream.parameter(name="callerNumber", value=from_number)
-            stream.parameter(name="calleeNumber", value=number)
-            connect.append(stream)
-            twiml.append(connect)
-            twiml_string = str(twiml)
-
-            logger.info(f"Attempting bulk call via TwilioService to {number} from {from_number}...")
-            call = twilio_service.make_call(to_number=number, from_number=from_number, twiml=twiml_string)
-
-            if not call or not call.sid:
-                 raise Exception("Twilio service did not return a valid call object.")
-
-            logger.info(f"Bulk call initiated to {number} with SID: {call.sid}")
-            results.append(BulkCallResult(
-                number=number,
-                status="call_initiated",
-                call_sid=call.sid
-            ))
-        except Exception as e:
-            logger.error(f"Failed to initiate bulk call to {number}: {e}", exc_info=True)
-            results.append(BulkCallResult(
-                number=number,
-                status="failed",
-                error=str(e)
-            ))
-
-    return BulkCallResponse(
-        total_numbers=len(request.phone_numbers),
-        results=results
-    )
+    try:
+        campaign_id = await asyncio.to_thread(
+            campaign_service.create_campaign,
+            numbers, from_number,
+            name=request.name, max_concurrent_calls=request.max_concurrent_calls,
+            pacing_mode=request.pacing_mode, target_concurrency=request.target_concurrency,
+            stream_parameters=request.stream_parameters, rejected=screened.rejected()
+        )
+    except DBError as e:
+        logger.error(f"Database error creating campaign: {e}")
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+
+    logger.info(f"Queued bulk call campaign {campaign_id} from {from_number} to {len(numbers)} numbers "
+                f"({len(request.phone_numbers) - len(numbers)} screened out).")
+    return BulkCallResponse(campaign_id=campaign_id, status="running", total_numbers=len(numbers),
+                            screening=screened.summary(), rejected=screened.rejected(REJECTED_SAMPLE_SIZE))
+
+
+@router.post("/screen")
+async def screen_numbers(request: ScreenRequest):
+    """
+    Screen a dial list without creating a campaign: per-number normalized value and
+    reason (ok, invalid, duplicate, dnc, recently_called).
+    """
+    try:
+        screened = await asyncio.to_thread(
+            screening_service.screen_numbers, request.phone_numbers, request.skip_recent
+        )
+    except DBError as e:
+        logger.error(f"Database error screening numbers: {e}")
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+    return {"summary": screened.summary(), "results": screened.results()}
+
+
+@router.post("/dnc")
+async def add_dnc_numbers(request: DncRequest):
+    """
+    Add numbers to the do-not-call list.
+    """
+    try:
+        inserted = await asyncio.to_thread(screening_service.add_dnc, request.phone_numbers, request.source)
+    except DBError as e:
+        logger.error(f"Database error adding DNC numbers: {e}")
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+    return {"inserted": inserted}
+
+
+@router.get("/campaigns")
+async def list_campaigns(limit: int = 50):
+    """
+    List the most recent call campaigns.
+    """
+    try:
+        return await asyncio.to_thread(campaign_service.list_campaigns, limit)
+    except DBError as e:
+        logger.error(f"Database error listing campaigns: {e}")
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+
+
+@router.get("/campaigns/{campaign_id}")
+async def get_campaign_progress(campaign_id: int):
+    """
+    Progress of a call campaign: target counts per status and percent complete.
+    """
+    try:
+        progress = await asyncio.to_thread(campaign_service.get_progress, campaign_id)
+    except DBError as e:
+        logger.error(f"Database error reading campaign {campaign_id}: {e}")
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+    if progress is None:
+        raise HTTPException(status_code=404, detail=f"Campaign {campaign_id} not found.")
+    return progress
+
+
+@router.get("/campaigns/{campaign_id}/rejected")
+async def list_campaign_rejections(campaign_id: int, offset: int = 0, limit: int = 1000):
+    """
+    Numbers screened out of a campaign's dial list, with their reason, in submission order.
+    Page with offset/limit (limit at most 10000).
+    """
+    if offset < 0 or not 0 < limit <= 10000:
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit between 1 and 10000.")
+    try:
+        rejected = await asyncio.to_thread(campaign_service.list_rejections, campaign_id, offset, limit)
+    except DBError as e:
+        logger.error(f"Database error reading rejections of campaign {campaign_id}: {e}")
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+    return {"campaign_id": campaign_id, "offset": offset, "limit": limit, "rejected": rejected}
+
+
+@router.post("/campaigns/{campaign_id}/{action}")
+async def change_campaign_status(campaign_id: int, action: str):
+    """
+    Pause, resume or cancel a call campaign.
+    """
+    if action not in ("pause", "resume", "cancel"):
+        raise HTTPException(status_code=404, detail=f"Unknown campaign action '{action}'.")
+    try:
+        new_status = await asyncio.to_thread(campaign_service.set_status, campaign_id, action)
+        return {"campaign_id": campaign_id, "status": new_status}
+    except CampaignError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except DBError as e:
+        logger.error(f"Database error changing campaign {campaign_id}: {e}")
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
 
 
 @router.get("/history", response_model=CallLogResponse)
@@ -212,10 +311,13 @@ def get_call_history(
     page: int = 1,
     limit: int = 50,
     status: Optional[str] = None,
-    direction: Optional[str] = None
+    direction: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
 ):
     """
     Retrieve paginated call history with optional filtering by status and direction from MySQL.
+    A start/end time range lets MySQL prune call_logs partitions outside the range.
     """
     conn = None
     cursor = None
@@ -235,6 +337,12 @@ def get_call_history(
         if direction:
             conditions.append("direction = %s")
             params.append(direction)
+        if start:
+            conditions.append("start_time >= %s")
+            params.append(start)
+        if end:
+            conditions.append("start_time < %s")
+            params.append(end)
         where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
 
         # Get total count
@@ -270,6 +378,128 @@ def get_call_history(
         if conn: conn.close()
 
 
+@router.get("/pipeline")
+async def get_post_call_pipeline():
+    """
+    Post-call pipeline queue depth per stage (pending, running, dead) and dead-lettered jobs.
+    """
+    try:
+        depth = await asyncio.to_thread(post_call_pipeline.queue_depth)
+        dead = await asyncio.to_thread(post_call_pipeline.list_dead)
+    except DBError as e:
+        logger.error(f"Database error reading post-call pipeline: {e}")
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+    return {**depth, "dead_jobs": dead}
+
+
+@router.post("/pipeline/jobs/{job_id}/retry")
+async def retry_post_call_job(job_id: int):
+    """
+    Re-queue a dead-lettered post-call job.
+    """
+    try:
+        requeued = await asyncio.to_thread(post_call_pipeline.retry, job_id)
+    except DBError as e:
+        logger.error(f"Database error re-queueing post-call job {job_id}: {e}")
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+    if not requeued:
+        raise HTTPException(status_code=404, detail=f"No dead-lettered job {job_id}.")
+    post_call_pipeline.notify()
+    return {"job_id": job_id, "status": "pending"}
+
+
+@router.get("/{call_sid}/events")
+async def get_call_events(call_sid: str):
+    """
+    Ordered timeline of a call: Twilio status transitions, media stream and Ultravox
+    events, tool invocations and hangup reasons.
+    """
+    try:
+        events = await asyncio.to_thread(call_events.get_timeline, call_sid)
+    except DBError as e:
+        logger.error(f"Database error reading events for {call_sid}: {e}")
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+    return {"call_sid": call_sid, "events": events}
+
+
+@router.get("/{call_sid}/recording")
+async def get_call_recording(call_sid: str, request: Request, source: Optional[str] = None):
+    """
+    Streams the locally archived recording of a call (Ultravox by default, or
+    source=twilio) with HTTP Range support for seeking in the player.
+    """
+    try:
+        recording = await asyncio.to_thread(recording_archiver.get_recording, call_sid, source)
+    except DBError as e:
+        logger.error(f"Database error reading recording for {call_sid}: {e}")
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+    if recording is None:
+        raise HTTPException(status_code=404, detail="Recording not archived")
+    if not await asyncio.to_thread(os.path.exists, recording["file"]):
+        raise HTTPException(status_code=410, detail="Archived recording file is missing")
+    prefix = settings.recording_accel_redirect_prefix
+    return RangeFileResponse(
+        recording["file"],
+        media_type=recording["content_type"],
+        range_header=request.headers.get("range"),
+        accel_redirect=f"{prefix.rstrip('/')}/{recording['path']}" if prefix else None,
+        filename=os.path.basename(recording["path"]),
+    )
+
+
+@router.get("/history/archive")
+async def get_archived_call_history(
+    start: datetime,
+    end: datetime,
+    page: int = 1,
+    limit: int = 50,
+    status: Optional[str] = None,
+    direction: Optional[str] = None
+):
+    """
+    Retrieve call history for months that the retention job has moved out of MySQL.
+    Reads the compressed archive files, so it is much slower than /history.
+    """
+    if start >= end:
+        raise HTTPException(status_code=400, detail="'start' must be before 'end'.")
+    try:
+        calls = await asyncio.to_thread(
+            archive_service.query_archive, start, end,
+            status=status, direction=direction, page=page, limit=limit
+        )
+        return {"page": page, "limit": limit, "archived_months": archive_service.archived_months(), "calls": calls}
+    except Exception as e:
+        logger.error(f"Unexpected error reading call archive: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+
+
+@router.get("/analytics")
+def get_call_analytics(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    direction: Optional[str] = None,
+    status: Optional[str] = None,
+    group_by_day: bool = True
+):
+    """
+    Call volumes, answer rates, durations and costs for a day range (inclusive),
+    answered from the pre-aggregated daily rollups. Defaults to the last 30 days.
+    """
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=29)
+    if start > end:
+        raise HTTPException(status_code=400, detail="'start' must not be after 'end'.")
+    try:
+        result = analytics_service.query(start, end, direction=direction, status=status, group_by_day=group_by_day)
+        return {"start": start.isoformat(), "end": end.isoformat(), **result}
+    except DBError as e:
+        logger.error(f"MySQL Database error in get_call_analytics: {e}")
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+    except Exception as e:
+        logger.error(f"Unexpected error in get_call_analytics: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+
+
 # --- Client CRUD Operations ---
 
 @router.get("/clients", response_model=List[Client])
@@ -487,9 +717,6 @@ async def incoming_call(request: Request):
     """
     Handle the inbound call from Twilio.
     """
-    server_domain = settings.base_url.replace("http://", "").replace("https://", "")
-    stream_url = f"wss://{server_domain}/media-stream"
-
     try:
         form_data = await request.form()
         twilio_params = dict(form_data)
@@ -510,14 +737,9 @@ async def incoming_call(request: Request):
             conn = get_db_connection()
             if conn:
                 cursor = conn.cursor()
-                sql = """
-                    INSERT INTO call_logs (call_sid, from_number, to_number, direction, status, start_time)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    ON DUPLICATE KEY UPDATE status = VALUES(status)
-                """
                 start_time = datetime.utcnow()
                 params = (call_sid, caller_number, to_number, 'inbound', 'initiated', start_time)
-                cursor.execute(sql, params)
+                insert_call_logs(cursor, [params], update_status=True)
                 conn.commit()
                 logger.info(f"Logged start of incoming call: {call_sid}")
             else:
@@ -530,17 +752,9 @@ async def incoming_call(request: Request):
             if conn: conn.close()
 
         # Prepare TwiML response
-        twiml = VoiceResponse()
-        connect = Connect()
-        stream = Stream(url=stream_url)
-        stream.parameter(name="callSid", value=call_sid)
-        stream.parameter(name="callerNumber", value=caller_number)
         # Pass first message placeholder - WebSocket handler will fetch actual one if needed
-        stream.parameter(name="firstMessage", value="Hello from TwiML")
-        connect.append(stream)
-        twiml.append(connect)
-
-        return Response(content=str(twiml), media_type="application/xml")
+        twiml = INCOMING_STREAM_TEMPLATE.render(call_sid, caller_number)
+        return Response(content=twiml, media_type="application/xml")
 
     except Exception as e:
         logger.error(f"Error handling incoming call: {e}", exc_info=True)
@@ -552,73 +766,23 @@ async def incoming_call(request: Request):
 @router.post("/call-status")
 async def call_status_update(request: Request):
     """
-    Receive call status updates from Twilio and update the database.
+    Receive call status updates from Twilio. The update is acknowledged immediately and
+    applied in the background by the webhook ingestor (deduplicated, forward-only).
     """
-    conn = None
-    cursor = None
-    call_sid = None # Initialize call_sid
-    try:
-        form_data = await request.form()
-        status_data = dict(form_data)
-        call_sid = status_data.get('CallSid') # Get call_sid early for logging
-        logger.info(f"Received call status update for {call_sid}: {status_data}")
-
-        call_status = status_data.get('CallStatus')
-        call_direction = status_data.get('Direction')
-        duration = status_data.get('CallDuration')
-        recording_url = status_data.get('RecordingUrl')
-
-        if not call_sid:
-            logger.error("CallSid missing in status update")
-            return Response(status_code=200) # Ack Twilio
-
-        conn = get_db_connection()
-        if conn is None:
-            logger.error(f"Database connection unavailable for call status update: {call_sid}")
-            return Response(status_code=200) # Ack Twilio
-
-        cursor = conn.cursor()
-        update_fields = []
-        params = []
-        if call_status:
-            update_fields.append("status = %s")
-            params.append(call_status)
-        if call_direction:
-            update_fields.append("direction = %s")
-            params.append(call_direction)
-        if duration is not None: # Check for None explicitly
-            try:
-                 update_fields.append("duration = %s")
-                 params.append(int(duration))
-            except (ValueError, TypeError):
-                 logger.warning(f"Invalid duration value '{duration}' for CallSid {call_sid}. Skipping duration update.")
-        if recording_url:
-            update_fields.append("recording_url = %s")
-            params.append(recording_url)
-        if call_status in ['completed', 'failed', 'busy', 'no-answer', 'canceled']:
-             update_fields.append("end_time = %s")
-             params.append(datetime.utcnow())
-
-        if not update_fields:
-            logger.info(f"No relevant fields to update from Twilio status for CallSid: {call_sid}")
-            return Response(status_code=200)
-
-        params.append(call_sid)
-        sql = f"UPDATE call_logs SET {', '.join(update_fields)} WHERE call_sid = %s"
-
-        logger.info(f"Executing SQL for Twilio status: {sql} with params: {params}")
-        cursor.execute(sql, tuple(params))
-        conn.commit()
-        logger.info(f"Call log updated from Twilio status for CallSid: {call_sid}")
-
-        return Response(status_code=200)
-
-    except DBError as e:
-        logger.error(f"Database error updating call status for {call_sid}: {e}")
-        return Response(status_code=200) # Ack Twilio
-    except Exception as e:
-        logger.error(f"Unexpected error handling call status update for {call_sid}: {e}", exc_info=True)
+    form_data = await request.form()
+    status_data = dict(form_data)
+    call_sid = status_data.get('CallSid')
+    if request.query_params.get('campaign_target'):
+        # Campaign dials name their target in the callback URL (see CampaignDispatcher._dial).
+        status_data['campaign_target'] = request.query_params['campaign_target']
+    if not call_sid:
+        logger.error("CallSid missing in status update")
         return Response(status_code=200) # Ack Twilio
-    finally:
-        if cursor: cursor.close()
-        if conn: conn.close()
+    logger.info(f"Received call status update for {call_sid}: {status_data.get('CallStatus')}")
+    call_events.record(call_sid, "twilio", f"status.{status_data.get('CallStatus')}", {
+        "sequence": status_data.get('SequenceNumber'),
+        "duration": status_data.get('CallDuration'),
+        "direction": status_data.get('Direction'),
+    })
+    webhook_ingestor.submit(twilio_event_key(status_data), call_sid, apply_twilio_status, status_data)
+    return Response(status_code=200)
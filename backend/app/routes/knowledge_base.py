@@ -1,5 +1,5 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File, Depends
-from typing import List
+from typing import List, Optional
 import os
 import logging
 from ..services.google_drive_service import GoogleDriveService
@@ -101,42 +101,21 @@ async def list_supabase_tables(
 @router.post("/vectorize")
 async def vectorize_documents(
     files: List[str], 
-    supabase_table: str,
-    vectorization_service: VectorizationService = Depends(VectorizationService),
-    supabase_service: SupabaseService = Depends(SupabaseService)
+    supabase_table: Optional[str] = None,
+    vectorization_service: VectorizationService = Depends(VectorizationService)
 ):
+    """
+    Chunks and embeds the files into knowledge_base_chunks. With supabase_table, each
+    document's mean vector is also stored there.
+    """
     try:
-        vectorization_results = []
-        
-        for file_path in files:
-            # Detect file type and extract content
-            content = vectorization_service.extract_content(file_path)
-
-            # Generate vector (using await for the async method)
-            logger.info(f"Generating vector for {file_path}...")
-            vector = await vectorization_service.vectorize(content)
-            logger.info(f"Vector generated for {file_path}, length: {len(vector) if vector else 'N/A'}")
+        store_vector = None
+        if supabase_table:
+            supabase_service = SupabaseService()
+            store_vector = lambda file_path, vector: supabase_service.store_vector(supabase_table, file_path, vector)
 
-            if not vector:
-                 raise ValueError(f"Failed to generate vector for {file_path}")
-
-            # Store in Supabase
-            result = supabase_service.store_vector(
-                supabase_table, 
-                file_path, 
-                vector
-            )
-            
-            vectorization_results.append({
-                "file": file_path,
-                "vector_length": len(vector),
-                "stored": True
-            })
-        
-        return {
-            "message": "Vectorization complete",
-            "results": vectorization_results
-        }
+        report = await vectorization_service.vectorize_files(files, store_vector=store_vector)
+        return {"message": "Vectorization complete", **report}
     except Exception as e:
         logger.error(f"Vectorization failed: {e}")
         raise HTTPException(status_code=500, detail=f"Vectorization failed: {str(e)}")
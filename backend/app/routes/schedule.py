@@ -1,7 +1,13 @@
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from datetime import datetime, timedelta
+from pydantic import BaseModel, Field
+from datetime import datetime, timedelta, time, timezone
 from typing import Optional, List
+import asyncio
+import logging
+from ..database import Error as DBError
+from ..services.scheduler_service import call_scheduler, SchedulerError, DEFAULT_RETRY_ON
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -44,3 +50,73 @@ async def list_upcoming_meetings(
             }
         ]
     }
+
+class ScheduleCallRequest(BaseModel):
+    to_number: str
+    from_number: Optional[str] = None
+    run_at: Optional[datetime] = Field(None, description="UTC time of the first attempt (default: now)")
+    timezone: str = Field("UTC", description="Recipient IANA time zone, e.g. 'Europe/Paris'")
+    window_start: Optional[time] = Field(None, description="Local time calls may start, e.g. 09:00")
+    window_end: Optional[time] = Field(None, description="Local time calls must stop, e.g. 20:00")
+    max_attempts: int = Field(3, ge=1, le=20)
+    retry_backoff_seconds: int = Field(900, ge=0)
+    retry_backoff_multiplier: float = Field(2.0, ge=1.0)
+    retry_on: List[str] = list(DEFAULT_RETRY_ON)
+
+@router.post("/calls")
+async def schedule_call(request: ScheduleCallRequest):
+    """
+    Schedule a future outbound call with a retry policy and a local calling window.
+    """
+    run_at = request.run_at
+    if run_at and run_at.tzinfo:
+        run_at = run_at.astimezone(timezone.utc).replace(tzinfo=None)
+    try:
+        return await asyncio.to_thread(
+            call_scheduler.schedule_call, request.to_number, run_at,
+            from_number=request.from_number, tz_name=request.timezone,
+            window_start=request.window_start, window_end=request.window_end,
+            max_attempts=request.max_attempts, retry_backoff_seconds=request.retry_backoff_seconds,
+            retry_backoff_multiplier=request.retry_backoff_multiplier, retry_on=request.retry_on
+        )
+    except SchedulerError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DBError as e:
+        logger.error(f"Database error scheduling call: {e}")
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+
+@router.get("/calls")
+async def list_scheduled_calls(status: Optional[str] = None, limit: int = 100):
+    """
+    List scheduled calls, optionally filtered by status.
+    """
+    try:
+        return await asyncio.to_thread(call_scheduler.list_jobs, status, limit)
+    except DBError as e:
+        logger.error(f"Database error listing scheduled calls: {e}")
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+
+@router.get("/calls/{job_id}")
+async def get_scheduled_call(job_id: int):
+    try:
+        job = await asyncio.to_thread(call_scheduler.get_job, job_id)
+    except DBError as e:
+        logger.error(f"Database error reading scheduled call {job_id}: {e}")
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Scheduled call {job_id} not found.")
+    return job
+
+@router.delete("/calls/{job_id}")
+async def cancel_scheduled_call(job_id: int):
+    """
+    Cancel a scheduled call that has not been dialed yet.
+    """
+    try:
+        cancelled = await asyncio.to_thread(call_scheduler.cancel_job, job_id)
+    except DBError as e:
+        logger.error(f"Database error cancelling scheduled call {job_id}: {e}")
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+    if not cancelled:
+        raise HTTPException(status_code=409, detail=f"Scheduled call {job_id} is not pending.")
+    return {"id": job_id, "status": "cancelled"}
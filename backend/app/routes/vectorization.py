@@ -1,8 +1,12 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional
+import logging
+from ..database import Error as DBError
+from ..services.retrieval_service import retrieval_service
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 class DocumentMetadata(BaseModel):
     document_id: str
@@ -12,15 +16,10 @@ class DocumentMetadata(BaseModel):
     size: int
     last_modified: str
 
-class VectorizationRequest(BaseModel):
-    document_id: str
-    supabase_table: str
-    embedding_model: Optional[str] = "default"
-
 class VectorSearchRequest(BaseModel):
     query: str
     top_k: int = 5
-    supabase_table: str
+    supabase_table: Optional[str] = None # Unused; chunks are searched in the local index
 
 @router.get("/documents")
 async def list_drive_documents():
@@ -41,34 +40,19 @@ async def list_drive_documents():
         ]
     }
 
-@router.post("/vectorize")
-async def vectorize_document(request: VectorizationRequest):
-    """
-    Vectorize a document and store in Supabase
-    Supports Ultravox tool integration
-    """
-    # Implement document retrieval, text extraction, and vectorization
-    return {
-        "status": "vectorization_complete",
-        "document_id": request.document_id,
-        "vector_count": 100,
-        "supabase_table": request.supabase_table
-    }
-
 @router.post("/search")
 async def search_knowledge_base(request: VectorSearchRequest):
     """
     Perform vector similarity search in knowledge base
     Used by Ultravox for context retrieval
     """
-    # Implement vector similarity search in Supabase
-    return {
-        "query": request.query,
-        "results": [
-            {
-                "text": "Relevant context from document",
-                "similarity_score": 0.85,
-                "document_id": "doc_123"
-            }
-        ]
-    }
+    if not 1 <= request.top_k <= 100:
+        raise HTTPException(status_code=400, detail="top_k must be between 1 and 100")
+    try:
+        results = await retrieval_service.search(request.query, request.top_k)
+    except DBError as e:
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+    except RuntimeError as e:
+        logger.error(f"Knowledge base search failed: {e}")
+        raise HTTPException(status_code=502, detail=str(e))
+    return {"query": request.query, "results": results}
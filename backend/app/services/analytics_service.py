@@ -0,0 +1,311 @@
+"""
+Pre-aggregated daily call analytics.
+
+Calls are rolled up into one row per (day, direction, status) as soon as
+`call_status_update` records a terminal state, so analytics range queries
+never have to scan `call_logs`. Durations are additionally kept in a
+log-bucketed histogram (a DDSketch-style percentile sketch) so p50/p90/p99
+can be answered from the rollups with ~5% relative error.
+
+Run `python3 -m app.services.analytics_service` to rebuild the rollups from
+the existing `call_logs` rows (backfill).
+"""
+import math
+import logging
+import argparse
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from ..database import get_db_connection, Error as DBError
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ('completed', 'failed', 'busy', 'no-answer', 'canceled')
+
+# Relative accuracy of the duration sketch: bucket i covers (GAMMA^(i-1), GAMMA^i] seconds.
+SKETCH_GAMMA = 1.1
+_LOG_GAMMA = math.log(SKETCH_GAMMA)
+
+# SQL equivalent of normalize_direction(), used by the backfill.
+_SQL_DIRECTION = "CASE WHEN direction LIKE 'outbound%%' THEN 'outbound' ELSE COALESCE(direction, 'unknown') END"
+
+
+def normalize_direction(direction: Optional[str]) -> str:
+    """Twilio reports 'outbound-api'/'outbound-dial'; roll those up as 'outbound'."""
+    if not direction:
+        return 'unknown'
+    return 'outbound' if direction.startswith('outbound') else direction
+
+
+def duration_bucket(duration: Optional[int]) -> int:
+    """Maps a duration in seconds to its sketch bucket (0 holds zero-length calls)."""
+    if not duration or duration <= 0:
+        return 0
+    return max(1, math.ceil(math.log(duration) / _LOG_GAMMA))
+
+
+def bucket_value(bucket: int) -> float:
+    """Representative duration of a bucket (midpoint in log space)."""
+    if bucket <= 0:
+        return 0.0
+    return 2 * SKETCH_GAMMA ** bucket / (1 + SKETCH_GAMMA)
+
+
+def sketch_quantiles(buckets: Dict[int, int], quantiles=(0.5, 0.9, 0.99)) -> Dict[str, Optional[float]]:
+    """Computes approximate duration quantiles from merged bucket counts."""
+    total = sum(buckets.values())
+    result = {}
+    ordered = sorted(buckets.items())
+    for q in quantiles:
+        key = f"p{int(q * 100)}"
+        if total == 0:
+            result[key] = None
+            continue
+        rank = q * (total - 1)
+        seen = 0
+        for bucket, count in ordered:
+            seen += count
+            if seen > rank:
+                result[key] = round(bucket_value(bucket), 1)
+                break
+    return result
+
+
+class AnalyticsService:
+    def create_tables(self, cursor):
+        """Creates the rollup tables. Called from database.create_tables()."""
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS call_daily_rollups (
+                day DATE NOT NULL,
+                direction VARCHAR(20) NOT NULL,
+                status VARCHAR(50) NOT NULL,
+                call_count INT NOT NULL DEFAULT 0,
+                answered_count INT NOT NULL DEFAULT 0,
+                total_duration BIGINT NOT NULL DEFAULT 0,
+                total_cost DECIMAL(12, 5) NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, direction, status)
+            );
+            """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS call_duration_sketch (
+                day DATE NOT NULL,
+                direction VARCHAR(20) NOT NULL,
+                status VARCHAR(50) NOT NULL,
+                bucket SMALLINT NOT NULL,
+                bucket_count INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, direction, status, bucket)
+            );
+            """
+        )
+
+    def record_terminal_call(self, cursor, day: date, direction: str, status: str,
+                             duration: Optional[int], cost: Optional[float] = None):
+        """
+        Adds a single finished call to the rollups. Uses the caller's cursor so the
+        increment commits atomically with the call_logs status update.
+        """
+        direction = normalize_direction(direction)
+        duration = duration or 0
+        answered = 1 if status == 'completed' and duration > 0 else 0
+        cursor.execute(
+            """
+            INSERT INTO call_daily_rollups (day, direction, status, call_count, answered_count, total_duration, total_cost)
+            VALUES (%s, %s, %s, 1, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                call_count = call_count + 1,
+                answered_count = answered_count + VALUES(answered_count),
+                total_duration = total_duration + VALUES(total_duration),
+                total_cost = total_cost + VALUES(total_cost)
+            """,
+            (day, direction, status, answered, duration, cost or 0)
+        )
+        cursor.execute(
+            """
+            INSERT INTO call_duration_sketch (day, direction, status, bucket, bucket_count)
+            VALUES (%s, %s, %s, %s, 1)
+            ON DUPLICATE KEY UPDATE bucket_count = bucket_count + 1
+            """,
+            (day, direction, status, duration_bucket(duration))
+        )
+
+    def add_cost(self, cursor, day: date, direction: str, status: str, cost_delta: float):
+        """Adds a late-arriving cost (e.g. from reconciliation) to an existing rollup row."""
+        cursor.execute(
+            """
+            UPDATE call_daily_rollups SET total_cost = total_cost + %s
+            WHERE day = %s AND direction = %s AND status = %s
+            """,
+            (cost_delta, day, normalize_direction(direction), status)
+        )
+
+    def query(self, start: date, end: date, direction: Optional[str] = None,
+              status: Optional[str] = None, group_by_day: bool = True) -> dict:
+        """
+        Answers an analytics range query (inclusive dates) purely from the rollup tables.
+        """
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=True)
+            conditions = ["day BETWEEN %s AND %s"]
+            params: List = [start, end]
+            if direction:
+                conditions.append("direction = %s")
+                params.append(direction)
+            if status:
+                conditions.append("status = %s")
+                params.append(status)
+            where_clause = " WHERE " + " AND ".join(conditions)
+
+            cursor.execute(
+                f"SELECT day, direction, status, call_count, answered_count, total_duration, total_cost "
+                f"FROM call_daily_rollups{where_clause} ORDER BY day, direction, status",
+                tuple(params)
+            )
+            rollup_rows = cursor.fetchall()
+            cursor.execute(
+                f"SELECT day, bucket, SUM(bucket_count) AS bucket_count FROM call_duration_sketch{where_clause} "
+                f"GROUP BY day, bucket",
+                tuple(params)
+            )
+            sketch_rows = cursor.fetchall()
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+
+        return self._summarize(rollup_rows, sketch_rows, group_by_day)
+
+    def _summarize(self, rollup_rows, sketch_rows, group_by_day: bool) -> dict:
+        totals = self._empty_totals()
+        by_day: Dict[date, dict] = {}
+        by_direction: Dict[str, dict] = {}
+        by_status: Dict[str, int] = {}
+
+        for row in rollup_rows:
+            for bucket in (totals,
+                           by_day.setdefault(row['day'], self._empty_totals()),
+                           by_direction.setdefault(row['direction'], self._empty_totals())):
+                bucket['calls'] += row['call_count']
+                bucket['answered'] += row['answered_count']
+                bucket['total_duration'] += int(row['total_duration'])
+                bucket['total_cost'] += float(row['total_cost'])
+            by_status[row['status']] = by_status.get(row['status'], 0) + row['call_count']
+
+        overall_sketch: Dict[int, int] = {}
+        day_sketches: Dict[date, Dict[int, int]] = {}
+        for row in sketch_rows:
+            count = int(row['bucket_count'])
+            overall_sketch[row['bucket']] = overall_sketch.get(row['bucket'], 0) + count
+            day_sketch = day_sketches.setdefault(row['day'], {})
+            day_sketch[row['bucket']] = day_sketch.get(row['bucket'], 0) + count
+
+        result = {
+            "totals": self._finish(totals, overall_sketch),
+            "by_direction": {k: self._finish(v) for k, v in by_direction.items()},
+            "by_status": by_status,
+        }
+        if group_by_day:
+            result["days"] = [
+                {"day": day.isoformat(), **self._finish(values, day_sketches.get(day, {}))}
+                for day, values in sorted(by_day.items())
+            ]
+        return result
+
+    @staticmethod
+    def _empty_totals() -> dict:
+        return {"calls": 0, "answered": 0, "total_duration": 0, "total_cost": 0.0}
+
+    @staticmethod
+    def _finish(values: dict, sketch: Optional[Dict[int, int]] = None) -> dict:
+        calls = values['calls']
+        finished = dict(values)
+        finished['total_cost'] = round(values['total_cost'], 5)
+        finished['answer_rate'] = round(values['answered'] / calls, 4) if calls else None
+        finished['avg_duration'] = round(values['total_duration'] / values['answered'], 1) if values['answered'] else None
+        if sketch is not None:
+            finished['duration_percentiles'] = sketch_quantiles(sketch)
+        return finished
+
+    def backfill(self, start: Optional[date] = None, end: Optional[date] = None) -> Tuple[int, int]:
+        """
+        Rebuilds the rollups for the given day range (all days when omitted) from call_logs.
+        Existing rollup rows in the range are replaced, so the backfill is safe to re-run.
+        """
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            conditions = ["status IN (" + ", ".join(["%s"] * len(TERMINAL_STATUSES)) + ")",
+                          "start_time IS NOT NULL"]
+            params: List = list(TERMINAL_STATUSES)
+            day_conditions = []
+            day_params: List = []
+            if start:
+                conditions.append("start_time >= %s")
+                params.append(datetime.combine(start, datetime.min.time()))
+                day_conditions.append("day >= %s")
+                day_params.append(start)
+            if end:
+                conditions.append("start_time < DATE_ADD(%s, INTERVAL 1 DAY)")
+                params.append(end)
+                day_conditions.append("day <= %s")
+                day_params.append(end)
+            where_clause = " WHERE " + " AND ".join(conditions)
+            day_where = " WHERE " + " AND ".join(day_conditions) if day_conditions else ""
+
+            cursor.execute(f"DELETE FROM call_daily_rollups{day_where}", tuple(day_params))
+            cursor.execute(f"DELETE FROM call_duration_sketch{day_where}", tuple(day_params))
+            cursor.execute(
+                f"""
+                INSERT INTO call_daily_rollups (day, direction, status, call_count, answered_count, total_duration, total_cost)
+                SELECT DATE(start_time), {_SQL_DIRECTION}, status, COUNT(*),
+                       SUM(status = 'completed' AND COALESCE(duration, 0) > 0),
+                       SUM(COALESCE(duration, 0)), 0
+                FROM call_logs{where_clause}
+                GROUP BY DATE(start_time), {_SQL_DIRECTION}, status
+                """,
+                tuple(params)
+            )
+            rollup_rows = cursor.rowcount
+            # Same bucketing as duration_bucket(), evaluated inside MySQL.
+            cursor.execute(
+                f"""
+                INSERT INTO call_duration_sketch (day, direction, status, bucket, bucket_count)
+                SELECT DATE(start_time), {_SQL_DIRECTION}, status,
+                       CASE WHEN COALESCE(duration, 0) <= 0 THEN 0
+                            ELSE GREATEST(1, CEIL(LN(duration) / {_LOG_GAMMA!r})) END AS bucket,
+                       COUNT(*)
+                FROM call_logs{where_clause}
+                GROUP BY DATE(start_time), {_SQL_DIRECTION}, status, bucket
+                """,
+                tuple(params)
+            )
+            sketch_rows = cursor.rowcount
+            conn.commit()
+            logger.info(f"Analytics backfill complete: {rollup_rows} rollup rows, {sketch_rows} sketch rows.")
+            return rollup_rows, sketch_rows
+        except DBError as e:
+            logger.error(f"Database error during analytics backfill: {e}")
+            conn.rollback()
+            raise
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+
+
+analytics_service = AnalyticsService()
+
+# Allow running this module directly to backfill rollups from existing call_logs
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild daily call analytics rollups from call_logs.")
+    parser.add_argument("--start", type=date.fromisoformat, help="First day to rebuild (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, help="Last day to rebuild (YYYY-MM-DD)")
+    args = parser.parse_args()
+    analytics_service.backfill(args.start, args.end)
@@ -0,0 +1,137 @@
+"""
+Semantic cache of question_and_answer results.
+
+Across calls, callers ask the same few dozen questions in slightly different
+words. The cache keeps recent (question embedding -> answer) pairs in one
+preallocated float32 matrix, so a lookup is a single matrix-vector product:
+a question whose embedding has a cosine similarity of at least
+`kb_answer_cache_threshold` with a cached question gets the cached answer
+without retrieval. Exact repeats (same normalized text) are found through a
+dict before the question is even embedded.
+
+Entries expire after `kb_answer_cache_ttl_seconds`; when all
+`kb_answer_cache_size` slots are taken, the least recently used one is
+replaced. The retrieval service clears the cache whenever its index changes,
+i.e. after documents were (re-)vectorized by any worker. Hits, misses and the
+retrieval time saved (the time the cached answer originally took, less the
+lookup) are counted in metrics. One cache per worker process.
+"""
+import time
+import logging
+import threading
+from typing import Optional
+
+import numpy as np
+
+from ..config import settings
+from ..utils.metrics import metrics
+from .embedding_cache import normalize
+
+logger = logging.getLogger(__name__)
+
+LOOKUP_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01)
+
+
+def _text_key(question: str) -> str:
+    return normalize(question).casefold().rstrip("?!. ")
+
+
+class AnswerCache:
+    def __init__(self, capacity: Optional[int] = None, threshold: Optional[float] = None,
+                 ttl_seconds: Optional[float] = None):
+        self.capacity = capacity if capacity is not None else settings.kb_answer_cache_size
+        self.threshold = threshold if threshold is not None else settings.kb_answer_cache_threshold
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else settings.kb_answer_cache_ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.clear()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        """Drops every entry, e.g. because the knowledge base changed."""
+        with self._lock:
+            self._matrix = None  # allocated by the first put, once the dimensions are known
+            self._answers = [None] * self.capacity
+            self._keys = [None] * self.capacity
+            self._costs = np.zeros(self.capacity)
+            self._created = np.zeros(self.capacity)
+            self._used = np.full(self.capacity, -np.inf)  # -inf marks a free slot
+            self._texts = {}
+
+    def _hit(self, slot: int, start: float) -> Optional[str]:
+        now = time.monotonic()
+        if now - self._created[slot] > self.ttl_seconds:
+            return None
+        self._used[slot] = now
+        answer = self._answers[slot]
+        elapsed = time.perf_counter() - start
+        self.hits += 1
+        metrics.inc("kb.answer_cache_hits")
+        metrics.inc("kb.answer_cache_seconds_saved", max(0.0, self._costs[slot] - elapsed))
+        metrics.histogram("kb.answer_cache_lookup_seconds", LOOKUP_BUCKETS).observe(elapsed)
+        return answer
+
+    def get_exact(self, question: str) -> Optional[str]:
+        """The cached answer to this exact (normalized) question, without embedding it."""
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        slot = self._texts.get(_text_key(question))
+        return self._hit(slot, start) if slot is not None else None
+
+    def get_similar(self, vector: np.ndarray) -> Optional[str]:
+        """The cached answer of the most similar question above the threshold, if any."""
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        matrix = self._matrix
+        answer = None
+        if matrix is not None:
+            query = np.asarray(vector, dtype=np.float32)
+            scores = matrix @ query
+            # Expired entries must not outrank a fresh one for another phrasing of the question.
+            scores[time.monotonic() - self._created > self.ttl_seconds] = -np.inf
+            slot = int(np.argmax(scores))
+            if scores[slot] >= self.threshold * np.linalg.norm(query):
+                answer = self._hit(slot, start)
+        if answer is None:
+            self.misses += 1
+            metrics.inc("kb.answer_cache_misses")
+        return answer
+
+    def put(self, question: str, vector: np.ndarray, answer: str, cost_seconds: float):
+        """Caches the answer; cost_seconds is what retrieving it took."""
+        if not self.enabled:
+            return
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return
+        key = _text_key(question)
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != len(vector):
+                self._matrix = np.zeros((self.capacity, len(vector)), dtype=np.float32)
+            slot = self._texts.get(key)
+            if slot is None:
+                slot = int(np.argmin(self._used))  # a free slot, else the least recently used
+                if self._keys[slot] is not None:
+                    del self._texts[self._keys[slot]]
+            self._matrix[slot] = vector / norm
+            self._answers[slot], self._keys[slot], self._costs[slot] = answer, key, cost_seconds
+            self._created[slot] = self._used[slot] = time.monotonic()
+            self._texts[key] = slot
+
+
+answer_cache = AnswerCache()
@@ -0,0 +1,405 @@
+"""
+Monthly partitioning, archival and retention for call_logs.
+
+When partitioning is enabled, call_logs is RANGE-partitioned by month on
+TO_DAYS(start_time) so queries filtered on start_time only touch the months
+they need. MySQL requires the partitioning column in every unique key, so the
+primary key becomes (call_sid, start_time); lookups by call_sid still use the
+primary key prefix in each partition.
+
+With that key call_sid alone is no longer unique in call_logs, so
+`ON DUPLICATE KEY` cannot keep a call to one row. `call_sid_index` (call_sid
+PRIMARY KEY) takes over as the uniqueness guard: every call_logs INSERT goes
+through `insert_call_logs`, which claims the call_sid there first and only
+inserts calls that do not have a row yet (optionally updating the status of
+those that do). `enable_partitioning` fills the index from the existing rows
+before changing the key, and retention prunes it with the dropped months.
+
+The retention job exports every month older than `call_logs_retention_months`
+to gzip-compressed NDJSON under `call_logs_archive_dir` and then drops it
+(DROP PARTITION when partitioned, batched DELETEs otherwise). Archived months
+stay queryable through `query_archive`, which streams the export files.
+
+Usage:
+    python3 -m app.services.archive_service partition   # convert call_logs (one-off, offline)
+    python3 -m app.services.archive_service maintain    # add upcoming month partitions
+    python3 -m app.services.archive_service retention   # archive + drop old months (cron)
+"""
+import os
+import re
+import gzip
+import glob
+import json
+import logging
+import argparse
+from datetime import date, datetime
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from ..config import settings
+from ..database import get_db_connection, Error as DBError
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r"^p(\d{4})(\d{2})$")
+DELETE_BATCH_SIZE = 5000
+EXPORT_FETCH_SIZE = 2000
+
+# call_sid, from_number, to_number, direction, status, start_time
+CallLogRow = Tuple[str, str, str, str, str, datetime]
+
+INSERT_CALL_LOG_SQL = """
+    INSERT INTO call_logs (call_sid, from_number, to_number, direction, status, start_time)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE call_sid = call_sid
+"""
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + (value.month - 1) + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"p{month.year:04d}{month.month:02d}"
+
+
+def months_between(start: date, end: date) -> List[date]:
+    """All month starts from start's month up to and including end's month."""
+    months = []
+    current = month_start(start)
+    while current <= end:
+        months.append(current)
+        current = add_months(current, 1)
+    return months
+
+
+def insert_call_logs(cursor, rows: Sequence[CallLogRow], update_status: bool = False) -> int:
+    """
+    Inserts the rows whose call_sid has no call_logs row yet, inside the caller's
+    transaction; calls that already have one keep it (with `update_status`, its status
+    is set to the row's). Returns the number of rows inserted.
+
+    Claiming the call_sid in call_sid_index first serializes concurrent writers of the
+    same call on its primary key, so the existence check that follows sees any row a
+    competing writer committed, whether or not call_logs is partitioned.
+    """
+    first = {}
+    for row in rows:
+        first.setdefault(row[0], row)
+    rows = [first[call_sid] for call_sid in sorted(first)]  # one lock order for every writer
+    if not rows:
+        return 0
+    cursor.executemany("INSERT IGNORE INTO call_sid_index (call_sid, start_time) VALUES (%s, %s)",
+                       [(row[0], row[5]) for row in rows])
+    cursor.execute(
+        f"SELECT call_sid FROM call_logs WHERE call_sid IN ({', '.join(['%s'] * len(rows))}) FOR UPDATE",
+        tuple(row[0] for row in rows)
+    )
+    existing = {found[0] for found in cursor.fetchall()}
+    new_rows = [row for row in rows if row[0] not in existing]
+    if new_rows:
+        # The ON DUPLICATE KEY clause still covers unpartitioned tables whose older
+        # rows predate call_sid_index.
+        cursor.executemany(INSERT_CALL_LOG_SQL, new_rows)
+    if update_status and existing:
+        cursor.executemany("UPDATE call_logs SET status = %s WHERE call_sid = %s",
+                           [(row[4], row[0]) for row in rows if row[0] in existing])
+    return len(new_rows)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+class ArchiveService:
+    def __init__(self):
+        self.archive_dir = settings.call_logs_archive_dir
+        self.retention_months = settings.call_logs_retention_months
+
+    def create_tables(self, cursor):
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS call_sid_index (
+                call_sid VARCHAR(255) PRIMARY KEY,
+                start_time DATETIME NOT NULL,
+                INDEX idx_call_sid_index_start (start_time)
+            )
+            """
+        )
+        if self.list_partitions(cursor):
+            cursor.execute("SELECT 1 FROM call_sid_index LIMIT 1")
+            if cursor.fetchone() is None:
+                # Partitioned before the index existed: fill it once.
+                self._fill_call_sid_index(cursor)
+
+    def _fill_call_sid_index(self, cursor):
+        logger.info("Filling call_sid_index from call_logs...")
+        cursor.execute(
+            """
+            INSERT IGNORE INTO call_sid_index (call_sid, start_time)
+            SELECT call_sid, MIN(COALESCE(start_time, end_time, UTC_TIMESTAMP())) FROM call_logs GROUP BY call_sid
+            """
+        )
+
+    # --- Partition management ---
+
+    def list_partitions(self, cursor) -> List[str]:
+        cursor.execute(
+            """
+            SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = %s AND TABLE_NAME = 'call_logs' AND PARTITION_NAME IS NOT NULL
+            ORDER BY PARTITION_ORDINAL_POSITION
+            """,
+            (settings.db_name,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def enable_partitioning(self, months_ahead: int = 3):
+        """
+        Converts call_logs into a monthly RANGE-partitioned table. This rebuilds the
+        table, so run it once during a maintenance window rather than at startup.
+        """
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            if self.list_partitions(cursor):
+                logger.info("call_logs is already partitioned.")
+                return
+
+            cursor.execute("UPDATE call_logs SET start_time = COALESCE(end_time, UTC_TIMESTAMP()) WHERE start_time IS NULL")
+            self.create_tables(cursor)
+            self._fill_call_sid_index(cursor)
+            conn.commit()  # writers keep calls unique through the index from here on
+            cursor.execute("SELECT MIN(start_time) FROM call_logs")
+            oldest = cursor.fetchone()[0]
+            first_month = month_start((oldest or datetime.utcnow()).date())
+            last_month = add_months(month_start(datetime.utcnow().date()), months_ahead)
+
+            definitions = [
+                f"PARTITION {partition_name(m)} VALUES LESS THAN (TO_DAYS('{add_months(m, 1).isoformat()}'))"
+                for m in months_between(first_month, last_month)
+            ]
+            definitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+
+            logger.info(f"Partitioning call_logs into {len(definitions)} partitions...")
+            cursor.execute(
+                "ALTER TABLE call_logs MODIFY start_time DATETIME NOT NULL, "
+                "DROP PRIMARY KEY, ADD PRIMARY KEY (call_sid, start_time)"
+            )
+            cursor.execute(
+                "ALTER TABLE call_logs PARTITION BY RANGE (TO_DAYS(start_time)) ("
+                + ", ".join(definitions) + ")"
+            )
+            conn.commit()
+            logger.info("call_logs partitioned by month.")
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+
+    def ensure_future_partitions(self, months_ahead: int = 3):
+        """Splits pmax so partitions exist for the next `months_ahead` months."""
+        conn = get_db_connection()
+        if conn is None:
+            logger.error("Cannot maintain call_logs partitions: No database connection.")
+            return
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            existing = self.list_partitions(cursor)
+            if not existing:
+                logger.info("call_logs is not partitioned; skipping partition maintenance.")
+                return
+            months = [m for m in (self._partition_month(name) for name in existing) if m]
+            newest = max(months) if months else add_months(month_start(datetime.utcnow().date()), -1)
+            target = add_months(month_start(datetime.utcnow().date()), months_ahead)
+            missing = months_between(add_months(newest, 1), target)
+            if not missing:
+                return
+            definitions = [
+                f"PARTITION {partition_name(m)} VALUES LESS THAN (TO_DAYS('{add_months(m, 1).isoformat()}'))"
+                for m in missing
+            ]
+            definitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+            cursor.execute("ALTER TABLE call_logs REORGANIZE PARTITION pmax INTO (" + ", ".join(definitions) + ")")
+            conn.commit()
+            logger.info(f"Added call_logs partitions: {', '.join(partition_name(m) for m in missing)}")
+        except DBError as e:
+            logger.error(f"Error maintaining call_logs partitions: {e}")
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+
+    @staticmethod
+    def _partition_month(name: str) -> Optional[date]:
+        match = PARTITION_NAME.match(name)
+        return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+    # --- Retention ---
+
+    def run_retention(self, now: Optional[datetime] = None) -> List[Tuple[str, int]]:
+        """
+        Archives and removes every month older than the retention window.
+        Returns (month, exported_rows) for each archived month.
+        """
+        cutoff = add_months(month_start((now or datetime.utcnow()).date()), -self.retention_months)
+        os.makedirs(self.archive_dir, exist_ok=True)
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        archived = []
+        try:
+            cursor = conn.cursor()
+            partitions = self.list_partitions(cursor)
+            if partitions:
+                for name in partitions:
+                    month = self._partition_month(name)
+                    if not month or add_months(month, 1) > cutoff:
+                        continue
+                    rows = self._export(conn, month, f"SELECT * FROM call_logs PARTITION ({name})", ())
+                    cursor.execute(f"ALTER TABLE call_logs DROP PARTITION {name}")
+                    conn.commit()
+                    archived.append((month.isoformat()[:7], rows))
+                    logger.info(f"Archived and dropped partition {name} ({rows} rows).")
+            else:
+                cursor.execute("SELECT MIN(start_time) FROM call_logs WHERE start_time < %s", (cutoff,))
+                oldest = cursor.fetchone()[0]
+                if oldest:
+                    for month in months_between(month_start(oldest.date()), add_months(cutoff, -1)):
+                        bounds = (month, add_months(month, 1))
+                        rows = self._export(
+                            conn, month,
+                            "SELECT * FROM call_logs WHERE start_time >= %s AND start_time < %s", bounds
+                        )
+                        if rows:
+                            self._delete_month(conn, bounds)
+                            archived.append((month.isoformat()[:7], rows))
+                            logger.info(f"Archived and deleted {rows} call_logs rows for {month.isoformat()[:7]}.")
+            if archived:
+                self._prune_call_sid_index(conn, cutoff)
+            return archived
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+
+    def _export(self, conn, month: date, sql: str, params: tuple) -> int:
+        """
+        Streams the selected rows into a new gzip NDJSON file for the month. The file is
+        written under a temporary name, fsynced and renamed, so a crash never leaves a
+        partial archive behind and data is only dropped after the export is durable.
+        """
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        final_path = os.path.join(self.archive_dir, f"call_logs-{month.isoformat()[:7]}.{stamp}.ndjson.gz")
+        tmp_path = final_path + ".tmp"
+        rows = 0
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(sql, params)
+            with open(tmp_path, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as out:
+                while True:
+                    batch = cursor.fetchmany(EXPORT_FETCH_SIZE)
+                    if not batch:
+                        break
+                    out.write("".join(json.dumps(row, default=_json_default) + "\n" for row in batch).encode("utf-8"))
+                    rows += len(batch)
+                out.flush()
+                raw.flush()
+                os.fsync(raw.fileno())
+        finally:
+            cursor.close()
+        if rows:
+            os.replace(tmp_path, final_path)
+        else:
+            os.remove(tmp_path)
+        return rows
+
+    def _delete_month(self, conn, bounds: Tuple[date, date]):
+        cursor = conn.cursor()
+        try:
+            while True:
+                cursor.execute(
+                    "DELETE FROM call_logs WHERE start_time >= %s AND start_time < %s LIMIT %s",
+                    (*bounds, DELETE_BATCH_SIZE)
+                )
+                deleted = cursor.rowcount
+                conn.commit()
+                if deleted < DELETE_BATCH_SIZE:
+                    break
+        finally:
+            cursor.close()
+
+    def _prune_call_sid_index(self, conn, cutoff: date):
+        """Releases the call_sids of archived months, in batches like _delete_month."""
+        cursor = conn.cursor()
+        try:
+            while True:
+                cursor.execute("DELETE FROM call_sid_index WHERE start_time < %s LIMIT %s", (cutoff, DELETE_BATCH_SIZE))
+                deleted = cursor.rowcount
+                conn.commit()
+                if deleted < DELETE_BATCH_SIZE:
+                    break
+        finally:
+            cursor.close()
+
+    # --- Archive query path ---
+
+    def archived_months(self) -> List[str]:
+        months = set()
+        for path in glob.glob(os.path.join(self.archive_dir, "call_logs-*.ndjson.gz")):
+            months.add(os.path.basename(path)[len("call_logs-"):len("call_logs-") + 7])
+        return sorted(months)
+
+    def _iter_month(self, month: date) -> Iterator[dict]:
+        pattern = os.path.join(self.archive_dir, f"call_logs-{month.isoformat()[:7]}.*.ndjson.gz")
+        for path in sorted(glob.glob(pattern)):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def query_archive(self, start: datetime, end: datetime, status: Optional[str] = None,
+                      direction: Optional[str] = None, page: int = 1, limit: int = 50) -> List[dict]:
+        """
+        Slow path for months that have been archived: decompresses and filters the
+        export files for the months overlapping [start, end), newest month first.
+        """
+        start_iso, end_iso = start.isoformat(), end.isoformat()
+        wanted = page * limit
+        matches: List[dict] = []
+        for month in reversed(months_between(start.date(), end.date())):
+            month_matches = [
+                row for row in self._iter_month(month)
+                if row.get('start_time') and start_iso <= row['start_time'] < end_iso
+                and (not status or row.get('status') == status)
+                and (not direction or row.get('direction') == direction)
+            ]
+            month_matches.sort(key=lambda row: row['start_time'], reverse=True)
+            matches.extend(month_matches)
+            if len(matches) >= wanted:
+                break
+        return matches[(page - 1) * limit:wanted]
+
+
+archive_service = ArchiveService()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="call_logs partitioning and retention.")
+    parser.add_argument("command", choices=["partition", "maintain", "retention"])
+    parser.add_argument("--months-ahead", type=int, default=3)
+    args = parser.parse_args()
+    if args.command == "partition":
+        archive_service.enable_partitioning(args.months_ahead)
+    elif args.command == "maintain":
+        archive_service.ensure_future_partitions(args.months_ahead)
+    else:
+        for archived_month, exported in archive_service.run_retention():
+            print(f"{archived_month}: {exported} rows archived")
@@ -0,0 +1,175 @@
+"""
+Per-call event timeline (`call_events`).
+
+Twilio status transitions, media-stream lifecycle, Ultravox data messages,
+tool invocations with their latency and hangup reasons are recorded with
+`call_events.record()`, which only appends to an in-process buffer: it never
+touches MySQL and is safe to call from the media loop or worker threads. A
+background task batch-inserts the buffer every `call_events_batch_size` events
+or `call_events_flush_ms` milliseconds, whichever comes first, and stop()
+flushes what is left at shutdown.
+
+If MySQL is unavailable the batch is kept and retried; beyond
+`call_events_max_buffer` buffered events the oldest are dropped (and counted)
+rather than growing without bound.
+"""
+import json
+import asyncio
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import List, Optional
+
+from ..config import settings
+from ..database import get_db_connection, Error as DBError
+from ..utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+INSERT_SQL = ("INSERT INTO call_events (call_sid, occurred_at, source, event_type, data) "
+              "VALUES (%s, %s, %s, %s, %s)")
+MAX_DATA_CHARS = 2000
+
+
+class CallEventBuffer:
+    def __init__(self):
+        self.batch_size = settings.call_events_batch_size
+        self.flush_interval = settings.call_events_flush_ms / 1000
+        self.max_buffer = settings.call_events_max_buffer
+        self._buffer: deque = deque()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def create_tables(self, cursor):
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS call_events (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                call_sid VARCHAR(64) NOT NULL,
+                occurred_at DATETIME(3) NOT NULL,
+                source VARCHAR(16) NOT NULL, -- twilio, media, ultravox, tool
+                event_type VARCHAR(64) NOT NULL,
+                data TEXT NULL, -- compact JSON
+                INDEX idx_call_events_call (call_sid, occurred_at, id)
+            );
+            """
+        )
+
+    def record(self, call_sid: Optional[str], source: str, event_type: str, data: Optional[dict] = None):
+        """Appends an event to the buffer. Never blocks on I/O."""
+        if not call_sid:
+            return
+        encoded = json.dumps(data, separators=(",", ":"), default=str) if data else None
+        if encoded and len(encoded) > MAX_DATA_CHARS:
+            encoded = json.dumps({"truncated": encoded[:MAX_DATA_CHARS]})
+        with self._lock:
+            self._buffer.append((call_sid, datetime.utcnow(), source, event_type[:64], encoded))
+            if len(self._buffer) > self.max_buffer:
+                self._buffer.popleft()
+                metrics.inc("call_events.dropped")
+            full = len(self._buffer) >= self.batch_size
+        if full and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def start(self):
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._loop = None
+        while self._buffer:
+            if not await self._flush():
+                logger.error(f"Discarding {len(self._buffer)} call events at shutdown: database unavailable.")
+                break
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._buffer:
+                if not await self._flush() or len(self._buffer) < self.batch_size:
+                    break
+
+    def _take(self) -> List[tuple]:
+        with self._lock:
+            n = min(len(self._buffer), self.batch_size)
+            return [self._buffer.popleft() for _ in range(n)]
+
+    def _put_back(self, batch: List[tuple]):
+        with self._lock:
+            self._buffer.extendleft(reversed(batch))
+            while len(self._buffer) > self.max_buffer:
+                self._buffer.popleft()
+                metrics.inc("call_events.dropped")
+
+    async def _flush(self) -> bool:
+        batch = self._take()
+        if not batch:
+            return True
+        try:
+            with metrics.histogram("call_events.flush_seconds").time():
+                await asyncio.to_thread(self._write, batch)
+            metrics.inc("call_events.written", len(batch))
+            return True
+        except Exception as e:
+            logger.error(f"Failed to write {len(batch)} call events: {e}")
+            self._put_back(batch)
+            return False
+
+    def _write(self, batch: List[tuple]):
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(INSERT_SQL, batch)
+            conn.commit()
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+    def get_timeline(self, call_sid: str) -> List[dict]:
+        """Ordered events of a call, including ones still in this worker's buffer."""
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                "SELECT occurred_at, source, event_type, data FROM call_events "
+                "WHERE call_sid = %s ORDER BY occurred_at, id",
+                (call_sid,)
+            )
+            rows = cursor.fetchall()
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+        with self._lock:
+            buffered = [{"occurred_at": e[1], "source": e[2], "event_type": e[3], "data": e[4]}
+                        for e in self._buffer if e[0] == call_sid]
+        events = sorted(rows + buffered, key=lambda e: e["occurred_at"])
+        for event in events:
+            event["data"] = json.loads(event["data"]) if event["data"] else None
+        return events
+
+
+call_events = CallEventBuffer()
@@ -0,0 +1,101 @@
+"""
+Background writer for call_logs start rows.
+
+Dial paths enqueue the row and return as soon as Twilio hands back the SID; a
+single task per worker drains the queue and inserts rows in batches on a
+worker thread, so MySQL latency never sits on the event loop or in front of
+the next dial. Rows still queued at shutdown are flushed by stop().
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+from ..database import get_db_connection, Error as DBError
+from ..utils.metrics import metrics
+from .archive_service import CallLogRow, insert_call_logs
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 0.2 # Seconds a partial batch waits for more rows
+
+
+class CallLogWriter:
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+            logger.info("Call log writer started.")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        self._queue = None
+        logger.info("Call log writer stopped.")
+
+    def submit(self, call_sid: str, from_number: str, to_number: str, direction: str, status: str,
+               start_time: Optional[datetime] = None):
+        """Queues a call_logs row. Must be called from the event loop."""
+        self.start()
+        self._queue.put_nowait((call_sid, from_number, to_number, direction, status,
+                                start_time or datetime.utcnow()))
+        metrics.inc("call_log_writer.queued")
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch: List[CallLogRow] = []
+            row = await self._queue.get()
+            if row is None:
+                break
+            batch.append(row)
+            deadline = asyncio.get_running_loop().time() + FLUSH_INTERVAL
+            while len(batch) < BATCH_SIZE:
+                timeout = deadline - asyncio.get_running_loop().time()
+                try:
+                    row = self._queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self._queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[CallLogRow]):
+        try:
+            with metrics.histogram("call_log_writer.flush_seconds").time():
+                await asyncio.to_thread(self._write, batch)
+            metrics.inc("call_log_writer.written", len(batch))
+        except Exception as e:
+            metrics.inc("call_log_writer.failed", len(batch))
+            logger.error(f"Failed to log {len(batch)} outbound calls ({', '.join(r[0] for r in batch)}): {e}")
+
+    def _write(self, batch: List[CallLogRow]):
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            # Status callbacks may already have created and advanced the row; never overwrite it.
+            insert_call_logs(cursor, batch)
+            conn.commit()
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+
+call_log_writer = CallLogWriter()
@@ -0,0 +1,280 @@
+"""
+In-house dual-channel recording of the media bridge (`local_recording_enabled`).
+
+websocket_endpoint already sees every inbound µ-law frame from Twilio and every
+PCM chunk the agent sends back. A `CallRecording` places both into one
+preallocated stereo ring buffer (left = caller, right = agent, 16-bit PCM at
+8 kHz) by sample position:
+
+- caller frames at their Twilio media timestamp;
+- agent chunks where Twilio will play them: after the previous agent chunk,
+  but never before the current point of the stream clock (last inbound
+  timestamp plus the wall time since it arrived).
+
+Adding audio is a numpy slice copy under a lock, with no I/O on the event loop.
+A single `RecordingWriter` thread flushes every recording in blocks of
+`local_recording_block_seconds` once they are `local_recording_lag_ms` behind
+the stream clock (so late frames still land), zeroes the flushed region for
+reuse, and appends it to `<recording_archive_dir>/local/<call_sid>.wav`. If a
+chunk would overwrite audio that has not been flushed yet (the writer fell
+behind by the whole buffer) or arrives after its region was flushed, it is
+dropped and counted.
+
+When the call ends the writer flushes the rest, finalizes the WAV header and
+stores the file as source 'local' in call_recordings (served by
+GET /api/calls/{call_sid}/recording?source=local), with bytes written and
+dropped blocks also recorded on the call's event timeline.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+import numpy as np
+
+from ..config import settings
+from ..database import get_db_connection, ensure_columns
+from ..utils.metrics import metrics
+from .call_events_service import call_events
+from .recording_service import recording_archiver, _safe_name
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 8000
+CHANNELS = 2
+SAMPLE_BYTES = 2
+CALLER, AGENT = 0, 1
+SOURCE = 'local'
+WRITER_INTERVAL = 0.25 # Seconds between writer passes
+
+
+def wav_header(data_bytes: int) -> bytes:
+    block_align = CHANNELS * SAMPLE_BYTES
+    return b"".join((
+        b"RIFF", (36 + data_bytes).to_bytes(4, "little"), b"WAVE",
+        b"fmt ", (16).to_bytes(4, "little"), (1).to_bytes(2, "little"), CHANNELS.to_bytes(2, "little"),
+        SAMPLE_RATE.to_bytes(4, "little"), (SAMPLE_RATE * block_align).to_bytes(4, "little"),
+        block_align.to_bytes(2, "little"), (SAMPLE_BYTES * 8).to_bytes(2, "little"),
+        b"data", data_bytes.to_bytes(4, "little"),
+    ))
+
+
+class CallRecording:
+    def __init__(self, call_sid: str, path: str, buffer_seconds: float, block_seconds: float, lag_ms: int):
+        self.call_sid = call_sid
+        self.path = path
+        self.block_frames = int(block_seconds * SAMPLE_RATE)
+        self.lag_frames = int(lag_ms * SAMPLE_RATE / 1000)
+        # The writer holds back lag + up to one block; the ring must outlast both.
+        self.capacity = max(int(buffer_seconds * SAMPLE_RATE), self.lag_frames + 2 * self.block_frames)
+        self.ring = np.zeros((self.capacity, CHANNELS), dtype=np.int16)
+        self.flushed = 0           # frames already handed to the file
+        self.written_end = 0       # end of the furthest audio placed in the ring
+        self.agent_cursor = 0      # where the next agent chunk starts playing
+        self.dropped_blocks = 0
+        self.bytes_written = 0
+        self.closed = False
+        self._clock = (0, time.monotonic())  # (last inbound frame position, when it arrived)
+        self._lock = threading.Lock()
+        self._file = None
+
+    # --- Event loop side ---
+
+    def stream_position(self) -> int:
+        position, arrived = self._clock
+        return position + int((time.monotonic() - arrived) * SAMPLE_RATE)
+
+    def add_caller(self, pcm: bytes, timestamp_ms: Optional[int]):
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        start = int(timestamp_ms) * SAMPLE_RATE // 1000 if timestamp_ms is not None else self.stream_position()
+        self._clock = (start + len(samples), time.monotonic())
+        self._place(CALLER, start, samples)
+
+    def add_agent(self, pcm: bytes):
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        start = max(self.agent_cursor, self.stream_position())
+        self.agent_cursor = start + len(samples)
+        self._place(AGENT, start, samples)
+
+    def _place(self, channel: int, start: int, samples: np.ndarray):
+        with self._lock:
+            if self.closed:
+                return
+            end = start + len(samples)
+            if start < self.flushed or end - self.flushed > self.capacity:
+                self.dropped_blocks += 1
+                return
+            offset = start % self.capacity
+            first = min(len(samples), self.capacity - offset)
+            self.ring[offset:offset + first, channel] = samples[:first]
+            if first < len(samples):
+                self.ring[:len(samples) - first, channel] = samples[first:]
+            self.written_end = max(self.written_end, end)
+
+    def close(self):
+        """Marks the call finished; the writer thread flushes and finalizes the file."""
+        with self._lock:
+            self.closed = True
+        recording_writer.wake()
+
+    # --- Writer thread side ---
+
+    def _take(self, final: bool) -> Optional[np.ndarray]:
+        """Copies out the next flushable block and zeroes it in the ring, or None."""
+        with self._lock:
+            # Silence gaps are flushed too, so the file keeps the stream's timeline.
+            ready_end = self.written_end if final else self.stream_position() - self.lag_frames
+            frames = min(ready_end - self.flushed, self.block_frames, self.capacity - self.flushed % self.capacity)
+            if frames <= 0 or (frames < self.block_frames and not final and
+                               self.flushed % self.capacity + frames < self.capacity):
+                return None
+            offset = self.flushed % self.capacity
+            block = self.ring[offset:offset + frames].copy()
+            self.ring[offset:offset + frames] = 0
+            self.flushed += frames
+            return block
+
+    def flush(self, final: bool = False):
+        while True:
+            block = self._take(final)
+            if block is None:
+                return
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, "wb", buffering=0)
+                self._file.write(wav_header(0))
+            self._file.write(block.tobytes())
+            self.bytes_written += block.nbytes
+
+    def finalize(self) -> Optional[dict]:
+        self.flush(final=True)
+        if self._file is None:
+            return None
+        self._file.seek(0)
+        self._file.write(wav_header(self.bytes_written))
+        self._file.close()
+        digest = hashlib.sha256()
+        with open(self.path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return {
+            "call_sid": self.call_sid,
+            "source": SOURCE,
+            "source_url": "",
+            "path": os.path.relpath(self.path, recording_archiver.directory),
+            "content_type": "audio/wav",
+            "bytes": self.bytes_written + 44,
+            "sha256": digest.hexdigest(),
+            "archived_at": datetime.utcnow(),
+            "dropped_blocks": self.dropped_blocks,
+        }
+
+
+class RecordingWriter:
+    """One thread that flushes every active recording of this worker process."""
+
+    def __init__(self):
+        self._recordings: Dict[str, CallRecording] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+    def create_tables(self, cursor):
+        ensure_columns(cursor, "call_recordings", {"dropped_blocks": "INT NULL"})
+
+    @property
+    def active(self) -> int:
+        return len(self._recordings)
+
+    def open(self, call_sid: str) -> Optional[CallRecording]:
+        """Starts recording a call, or returns None when local recording is disabled."""
+        if not settings.local_recording_enabled or not call_sid:
+            return None
+        recording = CallRecording(
+            call_sid,
+            os.path.join(recording_archiver.directory, SOURCE, f"{_safe_name(call_sid)}.wav"),
+            settings.local_recording_buffer_seconds,
+            settings.local_recording_block_seconds,
+            settings.local_recording_lag_ms,
+        )
+        with self._lock:
+            self._recordings[call_sid] = recording
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name="recording-writer", daemon=True)
+                self._thread.start()
+        return recording
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stop(self):
+        """Finalizes every open recording and stops the thread. Blocking."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+            for recording in self._recordings.values():
+                recording.closed = True
+        if thread is not None:
+            self._wakeup.set()
+            thread.join()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(WRITER_INTERVAL)
+            self._wakeup.clear()
+            with self._lock:
+                recordings = list(self._recordings.values())
+                stopping = self._stopping
+            for recording in recordings:
+                try:
+                    if recording.closed:
+                        self._finish(recording)
+                    else:
+                        recording.flush()
+                except Exception as e:
+                    logger.error(f"Local recording of {recording.call_sid} failed: {e}", exc_info=True)
+                    with self._lock:
+                        self._recordings.pop(recording.call_sid, None)
+            if stopping:
+                return
+
+    def _finish(self, recording: CallRecording):
+        with self._lock:
+            self._recordings.pop(recording.call_sid, None)
+        row = recording.finalize()
+        metrics.inc("local_recording.bytes", recording.bytes_written)
+        metrics.inc("local_recording.dropped_blocks", recording.dropped_blocks)
+        call_events.record(recording.call_sid, "media", "recording.finished", {
+            "bytes": recording.bytes_written, "dropped_blocks": recording.dropped_blocks,
+        })
+        logger.info(f"Local recording of {recording.call_sid}: {recording.bytes_written} bytes, "
+                    f"{recording.dropped_blocks} dropped blocks")
+        if row is not None:
+            self._save(row)
+
+    def _save(self, row: dict):
+        conn = get_db_connection()
+        if conn is None:
+            logger.error(f"Database unavailable saving local recording of {row['call_sid']}.")
+            return
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "REPLACE INTO call_recordings (call_sid, source, source_url, path, content_type, bytes, sha256, "
+                "archived_at, dropped_blocks) VALUES (%(call_sid)s, %(source)s, %(source_url)s, %(path)s, "
+                "%(content_type)s, %(bytes)s, %(sha256)s, %(archived_at)s, %(dropped_blocks)s)",
+                row
+            )
+            conn.commit()
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+
+recording_writer = RecordingWriter()
@@ -0,0 +1,536 @@
+"""
+Outbound call campaigns.
+
+`/api/calls/bulk` persists a campaign and its targets and returns immediately.
+A background dispatcher then dials pending targets:
+
+- paced by a token bucket set to the Twilio account's calls-per-second limit,
+- capped by the number of live calls (per campaign and overall),
+- honouring pause/resume/cancel, which are plain status changes in MySQL.
+
+Each dial names its target in the status callback URL (`campaign_target`),
+so callbacks that arrive before make_call returns the SID (initiated,
+ringing, fast failures) still reach the target. A target still 'dialing'
+after campaign_ring_timeout_seconds never got a SID or a callback (e.g. the
+worker died mid-dial) and is put back to 'pending'.
+
+Campaigns created with pacing_mode='adaptive' size each tick's dials with the
+PacingController (see pacing_service) instead of the fixed live-call cap.
+
+Only one gunicorn worker dispatches at a time: workers compete for a MySQL
+named lock (GET_LOCK) and the holder runs the dispatch loop, so the CPS budget
+is account-wide rather than per worker. The call scheduler dials from the same
+worker through the same token bucket.
+"""
+import json
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+import mysql.connector
+
+from ..config import settings
+from ..database import get_db_connection, ensure_columns, Error as DBError
+from .twilio_service import twilio_service
+from .pacing_service import pacing_controller, LIVE_CALL_STALE_MINUTES
+from ..utils.rate_limit import TokenBucket
+from ..utils.twiml import outbound_stream_twiml
+
+logger = logging.getLogger(__name__)
+
+DISPATCHER_LOCK_NAME = "tfrtita_campaign_dispatcher"
+
+# Target statuses. Twilio call statuses are stored as-is once a call exists.
+PENDING = 'pending'
+DIALING = 'dialing'
+SKIPPED = 'skipped' # Never dialed because the campaign was cancelled
+LIVE_STATUSES = ('dialing', 'queued', 'initiated', 'ringing', 'in-progress')
+FINAL_STATUSES = ('completed', 'busy', 'no-answer', 'failed', 'canceled', 'skipped')
+
+INSERT_BATCH_SIZE = 1000
+REJECTED_NUMBER_LENGTH = 255 # Submitted numbers are stored as-is, invalid ones included
+DIAL_SWEEP_INTERVAL = 30 # Seconds between sweeps for targets stuck in 'dialing'
+
+
+class CampaignError(Exception):
+    pass
+
+
+class CampaignService:
+    def create_tables(self, cursor):
+        """Creates the campaign tables. Called from database.create_tables()."""
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS campaigns (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                name VARCHAR(255) NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'running',
+                from_number VARCHAR(50) NOT NULL,
+                max_concurrent_calls INT NOT NULL,
+                pacing_mode VARCHAR(10) NOT NULL DEFAULT 'fixed',
+                target_concurrency INT NULL,
+                stream_parameters TEXT NULL, -- JSON object of extra <Stream> parameters for every call
+                pacing_decision TEXT NULL, -- JSON of the adaptive pacing controller's latest decision
+                total_targets INT NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                completed_at DATETIME NULL,
+                INDEX idx_campaigns_status (status)
+            );
+            """
+        )
+        ensure_columns(cursor, "campaigns", {"pacing_decision": "TEXT NULL"})
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS campaign_targets (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                campaign_id INT NOT NULL,
+                phone_number VARCHAR(50) NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                call_sid VARCHAR(255) NULL,
+                error TEXT NULL,
+                dialed_at DATETIME NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                INDEX idx_targets_campaign_status (campaign_id, status, id),
+                INDEX idx_targets_call_sid (call_sid)
+            );
+            """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS campaign_rejections (
+                campaign_id INT NOT NULL,
+                position INT NOT NULL, -- order among the campaign's rejected numbers
+                phone_number VARCHAR(255) NOT NULL,
+                reason VARCHAR(30) NOT NULL,
+                PRIMARY KEY (campaign_id, position)
+            );
+            """
+        )
+
+    # --- Campaign management (called from routes, blocking) ---
+
+    def create_campaign(self, phone_numbers: List[str], from_number: str, name: Optional[str] = None,
+                        max_concurrent_calls: Optional[int] = None, pacing_mode: str = 'fixed',
+                        target_concurrency: Optional[int] = None,
+                        stream_parameters: Optional[Dict[str, str]] = None,
+                        rejected: Optional[List[dict]] = None) -> int:
+        """
+        Persists the campaign and its targets. `rejected` ({"number", "reason"} per number
+        screened out of the list) is kept for list_rejections.
+        """
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO campaigns (name, status, from_number, max_concurrent_calls, pacing_mode, "
+                "target_concurrency, stream_parameters, total_targets) VALUES (%s, 'running', %s, %s, %s, %s, %s, %s)",
+                (name, from_number, max_concurrent_calls or settings.campaign_max_concurrent_calls,
+                 pacing_mode, target_concurrency, json.dumps(stream_parameters) if stream_parameters else None,
+                 len(phone_numbers))
+            )
+            campaign_id = cursor.lastrowid
+            sql = "INSERT INTO campaign_targets (campaign_id, phone_number) VALUES (%s, %s)"
+            for i in range(0, len(phone_numbers), INSERT_BATCH_SIZE):
+                cursor.executemany(sql, [(campaign_id, n) for n in phone_numbers[i:i + INSERT_BATCH_SIZE]])
+            sql = "INSERT INTO campaign_rejections (campaign_id, position, phone_number, reason) VALUES (%s, %s, %s, %s)"
+            rejected = rejected or []
+            for i in range(0, len(rejected), INSERT_BATCH_SIZE):
+                cursor.executemany(sql, [
+                    (campaign_id, position, str(r['number'])[:REJECTED_NUMBER_LENGTH], r['reason'])
+                    for position, r in enumerate(rejected[i:i + INSERT_BATCH_SIZE], i)
+                ])
+            conn.commit()
+            logger.info(f"Created campaign {campaign_id} with {len(phone_numbers)} targets.")
+            return campaign_id
+        except DBError:
+            conn.rollback()
+            raise
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+
+    def set_status(self, campaign_id: int, action: str) -> str:
+        """Applies pause/resume/cancel. Returns the new campaign status."""
+        transitions = {
+            'pause': ('running', 'paused'),
+            'resume': ('paused', 'running'),
+            'cancel': (None, 'cancelled'),
+        }
+        allowed_from, new_status = transitions[action]
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT status FROM campaigns WHERE id = %s FOR UPDATE", (campaign_id,))
+            row = cursor.fetchone()
+            if not row:
+                raise CampaignError(f"Campaign {campaign_id} not found.")
+            current = row[0]
+            if current in ('completed', 'cancelled') or (allowed_from and current != allowed_from):
+                raise CampaignError(f"Cannot {action} a campaign that is {current}.")
+            cursor.execute("UPDATE campaigns SET status = %s WHERE id = %s", (new_status, campaign_id))
+            if action == 'cancel':
+                # Calls already in flight finish normally; nothing new is dialed.
+                cursor.execute(
+                    "UPDATE campaign_targets SET status = %s WHERE campaign_id = %s AND status = %s",
+                    (SKIPPED, campaign_id, PENDING)
+                )
+            conn.commit()
+            logger.info(f"Campaign {campaign_id}: {current} -> {new_status}")
+            return new_status
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+
+    def get_progress(self, campaign_id: int) -> Optional[dict]:
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM campaigns WHERE id = %s", (campaign_id,))
+            campaign = cursor.fetchone()
+            if not campaign:
+                return None
+            cursor.execute(
+                "SELECT status, COUNT(*) AS n FROM campaign_targets WHERE campaign_id = %s GROUP BY status",
+                (campaign_id,)
+            )
+            counts = {row['status']: row['n'] for row in cursor.fetchall()}
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+
+        total = campaign['total_targets']
+        pacing = json.loads(campaign.pop('pacing_decision') or 'null')
+        finished = sum(n for status, n in counts.items() if status in FINAL_STATUSES)
+        return {
+            **campaign,
+            "counts": counts,
+            "pending": counts.get(PENDING, 0),
+            "live": sum(n for status, n in counts.items() if status in LIVE_STATUSES),
+            "finished": finished,
+            "percent_complete": round(100.0 * finished / total, 1) if total else 100.0,
+            "pacing": pacing,
+        }
+
+    def list_rejections(self, campaign_id: int, offset: int = 0, limit: int = 1000) -> List[dict]:
+        """A page of the numbers screened out of the campaign's dial list."""
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                "SELECT phone_number AS number, reason FROM campaign_rejections "
+                "WHERE campaign_id = %s AND position >= %s ORDER BY position LIMIT %s",
+                (campaign_id, offset, limit)
+            )
+            return cursor.fetchall()
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+
+    def list_campaigns(self, limit: int = 50) -> List[dict]:
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM campaigns ORDER BY id DESC LIMIT %s", (limit,))
+            return cursor.fetchall()
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+
+    def on_call_status(self, cursor, call_sid: str, call_status: str, target_id: Optional[str] = None):
+        """
+        Mirrors a Twilio status callback onto the campaign target (if the call belongs
+        to a campaign). Uses the caller's cursor/transaction. `target_id` comes from the
+        callback URL of campaign dials and matches the target even before its call_sid
+        is recorded.
+        """
+        if not call_status:
+            return
+        if target_id:
+            try:
+                target_id = int(target_id)
+            except ValueError:
+                logger.warning(f"Ignoring invalid campaign_target {target_id!r} for CallSid {call_sid}")
+            else:
+                cursor.execute(
+                    "UPDATE campaign_targets SET status = %s, call_sid = COALESCE(call_sid, %s) "
+                    "WHERE id = %s AND status NOT IN (" + ", ".join(["%s"] * len(FINAL_STATUSES)) + ")",
+                    (call_status, call_sid, target_id, *FINAL_STATUSES)
+                )
+                return
+        cursor.execute(
+            "UPDATE campaign_targets SET status = %s WHERE call_sid = %s AND status NOT IN ("
+            + ", ".join(["%s"] * len(FINAL_STATUSES)) + ")",
+            (call_status, call_sid, *FINAL_STATUSES)
+        )
+
+
+class CampaignDispatcher:
+    """Background loop that dials pending campaign targets."""
+
+    def __init__(self):
+        self.bucket = TokenBucket(rate=settings.twilio_calls_per_second)
+        self.interval = settings.campaign_dispatch_interval
+        self._task: Optional[asyncio.Task] = None
+        self._lock_conn = None
+        self._in_flight: set = set()
+        self._next_sweep = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        await asyncio.to_thread(self._release_leadership)
+
+    async def _run(self):
+        while True:
+            try:
+                if await asyncio.to_thread(self._hold_leadership):
+                    await self._tick()
+                    await asyncio.sleep(self.interval)
+                else:
+                    await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Campaign dispatcher error: {e}", exc_info=True)
+                await asyncio.sleep(5)
+
+    # --- Leader election ---
+
+    @property
+    def is_leader(self) -> bool:
+        """Whether this worker holds the dispatcher lock, i.e. owns the account's CPS budget."""
+        return self._lock_conn is not None
+
+    def _hold_leadership(self) -> bool:
+        """Returns True while this worker holds the dispatcher lock (acquiring it if free)."""
+        if self._lock_conn is not None:
+            try:
+                self._lock_conn.ping(reconnect=False)
+                return True
+            except DBError:
+                logger.warning("Lost campaign dispatcher lock connection.")
+                self._lock_conn = None
+        try:
+            # A dedicated connection: the named lock lives as long as this session.
+            conn = mysql.connector.connect(
+                host=settings.db_host, port=settings.db_port, user=settings.db_user,
+                password=settings.db_password, database=settings.db_name,
+                connection_timeout=settings.db_connect_timeout
+            )
+            cursor = conn.cursor()
+            cursor.execute("SELECT GET_LOCK(%s, 0)", (DISPATCHER_LOCK_NAME,))
+            acquired = cursor.fetchone()[0] == 1
+            cursor.close()
+            if acquired:
+                self._lock_conn = conn
+                logger.info("This worker is now the campaign dispatcher.")
+                return True
+            conn.close()
+        except DBError as e:
+            logger.error(f"Error acquiring campaign dispatcher lock: {e}")
+        return False
+
+    def _release_leadership(self):
+        if self._lock_conn is not None:
+            try:
+                self._lock_conn.close() # Closing the session releases the named lock
+            except DBError:
+                pass
+            self._lock_conn = None
+
+    # --- Dispatch ---
+
+    async def _tick(self):
+        campaigns = await asyncio.to_thread(self._load_running)
+        pacing_controller.retain(c['id'] for c in campaigns)
+        if not campaigns:
+            return
+        now = asyncio.get_running_loop().time()
+        if now >= self._next_sweep:
+            self._next_sweep = now + DIAL_SWEEP_INTERVAL
+            await asyncio.to_thread(self._requeue_stale_dials, [c['id'] for c in campaigns])
+        # Claimed targets are 'dialing' in MySQL, so in-flight dials count as live.
+        global_live = sum(c['live'] for c in campaigns)
+        global_slots = settings.campaign_max_concurrent_calls - global_live
+        for campaign in campaigns:
+            if campaign['pending'] == 0 and campaign['live'] == 0:
+                await asyncio.to_thread(self._complete, campaign['id'])
+                continue
+            if campaign['pacing_mode'] == 'adaptive':
+                # Sized from answer rates and fleet media capacity instead of fixed caps.
+                slots = await asyncio.to_thread(pacing_controller.dials_for, campaign)
+            else:
+                slots = min(campaign['max_concurrent_calls'] - campaign['live'], global_slots)
+            if slots <= 0:
+                continue
+            targets = await asyncio.to_thread(self._claim_targets, campaign['id'], slots)
+            if campaign['pacing_mode'] != 'adaptive':
+                global_slots -= len(targets)
+            for target in targets:
+                await self.bucket.acquire()
+                task = asyncio.create_task(self._dial(campaign, target))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+
+    def _load_running(self) -> List[dict]:
+        conn = get_db_connection()
+        if conn is None:
+            return []
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                f"""
+                SELECT c.id, c.from_number, c.max_concurrent_calls, c.pacing_mode, c.target_concurrency,
+                    c.stream_parameters,
+                    (SELECT COUNT(*) FROM campaign_targets t
+                     WHERE t.campaign_id = c.id AND t.status = 'pending') AS pending,
+                    (SELECT COUNT(*) FROM campaign_targets t
+                     WHERE t.campaign_id = c.id AND t.status IN ({", ".join(["%s"] * len(LIVE_STATUSES))})
+                       AND t.updated_at > NOW() - INTERVAL {LIVE_CALL_STALE_MINUTES} MINUTE) AS live
+                FROM campaigns c WHERE c.status = 'running' ORDER BY c.id
+                """,
+                LIVE_STATUSES
+            )
+            campaigns = cursor.fetchall()
+            for campaign in campaigns:
+                campaign['stream_parameters'] = json.loads(campaign['stream_parameters'] or "{}")
+            return campaigns
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+
+    def _claim_targets(self, campaign_id: int, limit: int) -> List[dict]:
+        conn = get_db_connection()
+        if conn is None:
+            return []
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                "SELECT id, phone_number FROM campaign_targets WHERE campaign_id = %s AND status = %s "
+                "ORDER BY id LIMIT %s FOR UPDATE",
+                (campaign_id, PENDING, limit)
+            )
+            targets = cursor.fetchall()
+            if targets:
+                ids = [t['id'] for t in targets]
+                cursor.execute(
+                    f"UPDATE campaign_targets SET status = %s, dialed_at = UTC_TIMESTAMP() "
+                    f"WHERE id IN ({', '.join(['%s'] * len(ids))})",
+                    (DIALING, *ids)
+                )
+            conn.commit()
+            return targets
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+
+    def _requeue_stale_dials(self, campaign_ids: List[int]):
+        """Puts targets that have been 'dialing' longer than the ring timeout back to 'pending'."""
+        conn = get_db_connection()
+        if conn is None:
+            return
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"UPDATE campaign_targets SET status = %s, dialed_at = NULL "
+                f"WHERE campaign_id IN ({', '.join(['%s'] * len(campaign_ids))}) AND status = %s "
+                f"AND call_sid IS NULL AND dialed_at < UTC_TIMESTAMP() - INTERVAL %s SECOND",
+                (PENDING, *campaign_ids, DIALING, settings.campaign_ring_timeout_seconds)
+            )
+            requeued = cursor.rowcount
+            conn.commit()
+            if requeued:
+                logger.warning(f"Requeued {requeued} campaign targets stuck in 'dialing'.")
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+
+    def _complete(self, campaign_id: int):
+        conn = get_db_connection()
+        if conn is None:
+            return
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE campaigns SET status = 'completed', completed_at = UTC_TIMESTAMP() "
+                "WHERE id = %s AND status = 'running'",
+                (campaign_id,)
+            )
+            conn.commit()
+            logger.info(f"Campaign {campaign_id} completed.")
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+
+    async def _dial(self, campaign: dict, target: dict):
+        number = target['phone_number']
+        call_sid, status, error = None, 'failed', None
+        try:
+            twiml = outbound_stream_twiml(campaign['from_number'], number, campaign['stream_parameters'])
+            call = await twilio_service.make_call_async(
+                to_number=number, from_number=campaign['from_number'], twiml=twiml,
+                status_callback_query={'campaign_target': target['id']},
+                ring_timeout=settings.campaign_ring_timeout_seconds
+            )
+            call_sid, status = call.sid, call.status or 'queued'
+            logger.info(f"Campaign {campaign['id']}: dialed {number}, SID={call_sid}")
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Campaign {campaign['id']}: failed to dial {number}: {e}")
+        await asyncio.to_thread(self._record_dial, target['id'], call_sid, status, error)
+
+    def _record_dial(self, target_id: int, call_sid: Optional[str], status: str, error: Optional[str]):
+        conn = get_db_connection()
+        if conn is None:
+            logger.error(f"Database unavailable recording dial result for target {target_id}.")
+            return
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            # A status callback may already have advanced the target; only move it off 'dialing'.
+            cursor.execute(
+                "UPDATE campaign_targets SET call_sid = %s, error = %s, "
+                "status = IF(status = %s, %s, status) WHERE id = %s",
+                (call_sid, error, DIALING, status, target_id)
+            )
+            conn.commit()
+        except DBError as e:
+            logger.error(f"Database error recording dial result for target {target_id}: {e}")
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+
+
+campaign_service = CampaignService()
+campaign_dispatcher = CampaignDispatcher()
@@ -0,0 +1,158 @@
+"""
+Persistent, content-addressed embedding cache.
+
+Embeddings are keyed by SHA-256 of (model, normalized text), where
+normalization is Unicode NFC with whitespace runs collapsed, so re-vectorizing
+unchanged documents (or re-asking the same question) costs no API call. The
+cache is a SQLite file (`embedding_cache_path`, WAL mode) shared by every
+gunicorn worker on the host; vectors are stored as float32 blobs.
+
+When the stored vectors exceed `embedding_cache_max_bytes`, the least recently
+used entries are evicted down to 90% of the limit. Hits, misses, evictions and
+the dollars saved (at `embedding_price_per_1k_tokens`) are counted in metrics.
+All methods block; call them via asyncio.to_thread from the event loop.
+"""
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from ..config import settings
+from ..utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+EVICT_BATCH = 1000
+
+
+def normalize(text: str) -> str:
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(model: str, text: str) -> bytes:
+    return hashlib.sha256(f"{model}\0{normalize(text)}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.path = path or settings.embedding_cache_path
+        self.max_bytes = max_bytes if max_bytes is not None else settings.embedding_cache_max_bytes
+        self._local = threading.local()
+        self._size_lock = threading.Lock()
+        self._size: Optional[int] = None  # this process's estimate of the stored bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "path", None) != self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key BLOB PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL,"
+                " bytes INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+            self._local.conn, self._local.path = conn, self.path
+        return conn
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Cached vectors for texts, None where missing. Hits become most recently used."""
+        if not self.enabled or not texts:
+            return [None] * len(texts)
+        keys = [cache_key(model, t) for t in texts]
+        conn = self._conn()
+        found: Dict[bytes, np.ndarray] = {}
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+            ).fetchall()
+            found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+        if found:
+            now = time.time()
+            conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+        hits = sum(1 for k in keys if k in found)
+        metrics.inc("embedding_cache.hits", hits)
+        metrics.inc("embedding_cache.misses", len(keys) - hits)
+        return [found.get(k) for k in keys]
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        if not self.enabled or not texts:
+            return
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((cache_key(model, text), model, blob, len(blob), now))
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, bytes, last_used) VALUES (?, ?, ?, ?, ?)", rows
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._size_lock:
+            if self._size is None:
+                self._size = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM embeddings").fetchone()[0]
+            else:
+                self._size += sum(r[3] for r in rows)
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self) -> int:
+        """Removes least recently used entries until the cache is within 90% of max_bytes."""
+        conn = self._conn()
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        with self._size_lock:
+            # Other workers write to the same file, so start from the real size.
+            size = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM embeddings").fetchone()[0]
+            while size > target:
+                rows = conn.execute("SELECT key, bytes FROM embeddings ORDER BY last_used LIMIT ?",
+                                    (EVICT_BATCH,)).fetchall()
+                if not rows:
+                    break
+                victims, freed = [], 0
+                for key, nbytes in rows:
+                    if size - freed <= target:
+                        break
+                    victims.append((key,))
+                    freed += nbytes
+                conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+                size -= freed
+                removed += len(victims)
+            self._size = size
+        if removed:
+            metrics.inc("embedding_cache.evictions", removed)
+            logger.info(f"Evicted {removed} embeddings from the cache ({size} bytes kept)")
+        return removed
+
+    def record_savings(self, tokens: int):
+        metrics.inc("embedding_cache.tokens_saved", tokens)
+        metrics.inc("embedding_cache.dollars_saved", tokens / 1000 * settings.embedding_price_per_1k_tokens)
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM embeddings").fetchone()
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes}
+
+
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,150 @@
+"""
+Batched, rate-limited embedding of knowledge-base chunks.
+
+Chunks (from any number of documents) are packed into requests of up to
+`embedding_batch_max_inputs` inputs and `embedding_batch_max_tokens` tokens,
+the provider's per-request limits, and split evenly enough to keep
+`embedding_concurrency` requests busy. Batches run concurrently, at most
+`embedding_concurrency` at a time, paced by two token buckets shared by the
+worker process: requests per minute and tokens per minute. A failed batch is
+retried with exponential backoff before the whole call fails. Texts found in
+the embedding cache (embedding_cache.py) are not sent at all.
+"""
+import time
+import asyncio
+import logging
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..config import settings
+from ..utils.metrics import metrics
+from ..utils.rate_limit import TokenBucket
+from . import openai_service
+from .embedding_cache import embedding_cache
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 4
+RETRY_BASE_DELAY = 1.0 # Seconds; doubles per attempt
+
+
+def pack_batches(token_counts: Sequence[int], max_inputs: int, max_tokens: int) -> List[List[int]]:
+    """Groups input indices, in order, into batches within both per-request limits."""
+    batches, current, current_tokens = [], [], 0
+    for i, tokens in enumerate(token_counts):
+        if current and (len(current) >= max_inputs or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def embedding_cost(tokens: int) -> float:
+    return tokens / 1000 * settings.embedding_price_per_1k_tokens
+
+
+class EmbeddingResult(NamedTuple):
+    vectors: np.ndarray
+    tokens: int    # billed by the provider
+    requests: int
+    cached: np.ndarray  # bool per text: served from the embedding cache
+
+
+async def _cache_lookup(model: str, texts: Sequence[str]) -> list:
+    try:
+        return await asyncio.to_thread(embedding_cache.get_many, model, texts)
+    except Exception as e:
+        logger.warning(f"Embedding cache lookup failed: {e}")
+        return [None] * len(texts)
+
+
+async def _cache_store(model: str, texts: Sequence[str], vectors):
+    try:
+        await asyncio.to_thread(embedding_cache.put_many, model, texts, vectors)
+    except Exception as e:
+        logger.warning(f"Embedding cache store failed: {e}")
+
+
+class EmbeddingBatcher:
+    def __init__(self):
+        self._requests: Optional[TokenBucket] = None
+        self._tokens: Optional[TokenBucket] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _limits(self):
+        if self._semaphore is None:
+            rpm, tpm = settings.embedding_requests_per_minute, settings.embedding_tokens_per_minute
+            self._requests = TokenBucket(rpm / 60, capacity=max(1, rpm / 60))
+            self._tokens = TokenBucket(tpm / 60, capacity=max(settings.embedding_batch_max_tokens, tpm / 60))
+            self._semaphore = asyncio.Semaphore(settings.embedding_concurrency)
+        return self._requests, self._tokens, self._semaphore
+
+    async def embed(self, texts: Sequence[str], token_counts: Sequence[int],
+                    model: Optional[str] = None) -> EmbeddingResult:
+        """
+        Embeds texts (with their estimated token counts), taking what it can from the
+        embedding cache. Returns a float32 matrix with one row per text, the tokens billed,
+        the number of requests made and which texts were served from the cache.
+        """
+        model = model or settings.embedding_model
+        cached = await _cache_lookup(model, texts)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        if len(missing) < len(texts):
+            embedding_cache.record_savings(sum(token_counts[i] for i, v in enumerate(cached) if v is not None))
+
+        # Spread the work over at least embedding_concurrency requests when there is enough of it.
+        spread = settings.embedding_concurrency
+        missing_tokens = [token_counts[i] for i in missing]
+        batches = [[missing[j] for j in batch] for batch in pack_batches(
+            missing_tokens,
+            min(settings.embedding_batch_max_inputs, max(1, -(-len(missing) // spread))),
+            min(settings.embedding_batch_max_tokens, max(1, -(-sum(missing_tokens) // spread))),
+        )]
+        results = await asyncio.gather(*(
+            self._embed_batch([texts[i] for i in batch], sum(token_counts[i] for i in batch), model)
+            for batch in batches
+        ))
+        if not texts:
+            return EmbeddingResult(np.zeros((0, 0), dtype=np.float32), 0, 0, np.zeros(0, dtype=bool))
+        dimensions = len(results[0][0][0]) if results else len(cached[0])
+        matrix = np.empty((len(texts), dimensions), dtype=np.float32)
+        for i, vector in enumerate(cached):
+            if vector is not None:
+                matrix[i] = vector
+        billed = 0
+        for batch, (vectors, tokens) in zip(batches, results):
+            matrix[batch] = vectors
+            billed += tokens
+        return EmbeddingResult(matrix, billed, len(batches), np.array([v is not None for v in cached], dtype=bool))
+
+    async def _embed_batch(self, texts: List[str], estimated_tokens: int, model: str) -> Tuple[list, int]:
+        requests_bucket, tokens_bucket, semaphore = self._limits()
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            await requests_bucket.acquire()
+            await tokens_bucket.acquire(min(estimated_tokens, tokens_bucket.capacity))
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    vectors, tokens = await openai_service.get_embeddings(texts, model=model)
+                except Exception as e:
+                    metrics.inc("embeddings.failed_requests")
+                    if attempt == MAX_ATTEMPTS:
+                        raise
+                    logger.warning(f"Embedding batch of {len(texts)} inputs failed (attempt {attempt}): {e}")
+                else:
+                    metrics.histogram("embeddings.request_seconds").observe(time.perf_counter() - start)
+                    metrics.inc("embeddings.requests")
+                    metrics.inc("embeddings.inputs", len(texts))
+                    metrics.inc("embeddings.tokens", tokens)
+                    break
+            await asyncio.sleep(RETRY_BASE_DELAY * 2 ** (attempt - 1))
+        # Cached per request, so a cancelled embed() keeps what it was already billed for.
+        await _cache_store(model, texts, vectors)
+        return vectors, tokens
+
+
+embedding_batcher = EmbeddingBatcher()
@@ -0,0 +1,157 @@
+"""
+Document text extraction in a pool of worker processes.
+
+PyPDF2, python-docx and openpyxl are pure-Python parsers: run on the event
+loop (or in a thread, holding the GIL) a large document stalls every live
+call on the worker. `DocumentExtractor.blocks` runs utils/extraction.py's
+`run_extraction` in a ProcessPoolExecutor of `extraction_workers` processes
+(started on first use) and yields the document's text blocks as the worker
+produces them, so chunking and embedding can start before extraction ends.
+
+Workers put their blocks on one multiprocessing queue; a reader thread hands
+them to the asyncio queue of the job they belong to. Each file is limited to
+`extraction_timeout_seconds` of parsing, and each worker process to
+`extraction_max_memory_mb` of address space; a file exceeding either fails
+alone with an ExtractionError while the worker stays available.
+
+A worker process that dies (e.g. killed by the OOM killer) breaks its pool,
+and every job still running or queued on that pool fails with
+BrokenProcessPool. The pool is replaced and those files are submitted again:
+files whose job had not started go back to the pool, files whose job was
+running are retried one at a time in a single-process isolation pool. A file
+whose job kills the isolation worker too is the one that caused the failure
+and fails with an ExtractionError. Blocks a failed attempt already streamed
+are not repeated: the new attempt's blocks up to that point are skipped.
+"""
+import asyncio
+import logging
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator, Dict, Optional
+
+from ..config import settings
+from ..utils.extraction import init_worker, run_extraction
+from ..utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 4 # Attempts per file when dead workers break its pool
+
+
+class ExtractionError(Exception):
+    pass
+
+
+class DocumentExtractor:
+    def __init__(self):
+        self._pools: Dict[bool, ProcessPoolExecutor] = {}  # isolated -> pool
+        self._results = None
+        self._reader: Optional[threading.Thread] = None
+        self._jobs: Dict[int, tuple] = {}  # job id -> (event loop, asyncio queue)
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _submit(self, isolated: bool, *args):
+        with self._lock:
+            pool = self._pools.get(isolated)
+            if pool is None:
+                context = multiprocessing.get_context("spawn")  # no fork of a process running threads
+                if self._results is None:
+                    self._results = context.Queue()
+                    self._reader = threading.Thread(target=self._read, args=(self._results,),
+                                                    name="extraction-reader", daemon=True)
+                    self._reader.start()
+                pool = self._pools[isolated] = ProcessPoolExecutor(
+                    1 if isolated else settings.extraction_workers, mp_context=context, initializer=init_worker,
+                    initargs=(self._results, settings.extraction_max_memory_mb * 2 ** 20),
+                )
+            try:
+                return pool.submit(run_extraction, *args)
+            except BrokenProcessPool:
+                logger.warning("Extraction pool broken by a dead worker; starting a new one.")
+                pool.shutdown(wait=False)
+                del self._pools[isolated]
+        return self._submit(isolated, *args)
+
+    def _read(self, results):
+        while True:
+            item = results.get()
+            if item is None:
+                return
+            self._deliver(item[0], item[1:])
+
+    def _deliver(self, job_id: int, message: tuple):
+        job = self._jobs.get(job_id)
+        if job:
+            loop, queue = job
+            loop.call_soon_threadsafe(queue.put_nowait, (job_id, *message))
+
+    def _job_done(self, job_id: int, future):
+        # Normal ends arrive through the result queue; this only reports workers that died.
+        if future.cancelled() or future.exception() is None:
+            return
+        if isinstance(future.exception(), BrokenProcessPool):
+            self._deliver(job_id, ("broken", f"Extraction worker died: {future.exception()!r}"))
+        else:
+            self._deliver(job_id, ("error", f"Extraction worker failed: {future.exception()!r}"))
+
+    async def blocks(self, file_path: str) -> AsyncIterator[str]:
+        """The file's text blocks, in order; raises ExtractionError if extraction fails."""
+        loop, queue = asyncio.get_running_loop(), asyncio.Queue()
+        received: Dict[int, int] = {}  # job id of each attempt -> blocks it delivered
+        yielded, isolated, future = 0, False, None
+        try:
+            while True:
+                job_id = next(self._job_ids)
+                self._jobs[job_id] = (loop, queue)
+                received[job_id] = 0
+                started = False
+                # Submitting may start worker processes; keep that off the event loop.
+                future = await asyncio.to_thread(self._submit, isolated, job_id, file_path,
+                                                 settings.extraction_timeout_seconds)
+                future.add_done_callback(lambda f, job_id=job_id: self._job_done(job_id, f))
+                while True:
+                    attempt, kind, payload = await queue.get()
+                    if kind == "block":
+                        # Attempts produce the same blocks; pass on each one once, whichever attempt it came from.
+                        position = received[attempt]
+                        received[attempt] += 1
+                        if position == yielded:
+                            yielded += 1
+                            yield payload
+                    elif kind == "start":
+                        started = started or attempt == job_id
+                    elif kind == "end":
+                        metrics.inc("kb.extraction_blocks", payload)
+                        return
+                    elif kind == "broken" and not (isolated and started) and len(received) < MAX_ATTEMPTS:
+                        metrics.inc("kb.extraction_retries")
+                        logger.warning(f"Retrying extraction of {file_path}{' in isolation' if started else ''}: "
+                                       f"{payload}")
+                        isolated = isolated or started
+                        break
+                    else:
+                        metrics.inc("kb.extraction_failures")
+                        raise ExtractionError(payload)
+        finally:
+            for job_id in received:
+                self._jobs.pop(job_id, None)
+            if future:
+                future.cancel()  # not started yet if the consumer gave up early
+
+    def stop(self):
+        """Shuts the worker processes down (blocking)."""
+        with self._lock:
+            pools, results, reader = list(self._pools.values()), self._results, self._reader
+            self._pools, self._results, self._reader = {}, None, None
+        for pool in pools:
+            pool.shutdown(wait=True, cancel_futures=True)
+        if results is not None:
+            results.put(None)
+            reader.join(timeout=5)
+
+
+document_extractor = DocumentExtractor()
@@ -0,0 +1,87 @@
+"""
+Chunk storage for the knowledge base.
+
+Every vectorized document keeps its row in `knowledge_base` (now with chunk
+and token counts, the embedding cost and the mean chunk vector) and one row
+per chunk in `knowledge_base_chunks` with its character span in the extracted
+text, token count and float32 embedding. Re-vectorizing a document replaces
+its chunks in one transaction.
+"""
+import os
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+
+from ..database import get_db_connection, ensure_columns, Error as DBError
+from ..utils.chunking import Chunk
+
+logger = logging.getLogger(__name__)
+
+
+class KnowledgeBaseService:
+    def create_tables(self, cursor):
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS knowledge_base_chunks (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                document_id VARCHAR(255) NOT NULL,
+                chunk_index INT NOT NULL,
+                text MEDIUMTEXT NOT NULL,
+                token_count INT NOT NULL,
+                start_char INT NOT NULL, -- Span in the extracted document text
+                end_char INT NOT NULL,
+                model VARCHAR(100) NOT NULL,
+                vector MEDIUMBLOB NOT NULL, -- float32 array
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE KEY uq_kb_chunk (document_id, chunk_index)
+            );
+            """
+        )
+        ensure_columns(cursor, "knowledge_base", {
+            "chunk_count": "INT NULL",
+            "token_count": "INT NULL",
+            "embedding_cost": "DECIMAL(10, 6) NULL",
+            "vectorized_at": "DATETIME NULL",
+        })
+
+    def replace_document(self, document_id: str, chunks: List[Chunk], vectors: np.ndarray,
+                         model: str, embedding_cost: float, mime_type: Optional[str] = None):
+        """Stores a document's chunks and embeddings, replacing any previous version."""
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM knowledge_base_chunks WHERE document_id = %s", (document_id,))
+            cursor.executemany(
+                "INSERT INTO knowledge_base_chunks (document_id, chunk_index, text, token_count, start_char, "
+                "end_char, model, vector) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                [(document_id, c.index, c.text, c.token_count, c.start_char, c.end_char, model,
+                  np.asarray(v, dtype=np.float32).tobytes()) for c, v in zip(chunks, vectors)]
+            )
+            mean = vectors.mean(axis=0).astype(np.float32).tobytes() if len(chunks) else None
+            cursor.execute(
+                """
+                INSERT INTO knowledge_base (document_id, title, source, mime_type, vector,
+                                            chunk_count, token_count, embedding_cost, vectorized_at)
+                VALUES (%s, %s, 'upload', %s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE mime_type = VALUES(mime_type), vector = VALUES(vector),
+                    chunk_count = VALUES(chunk_count), token_count = VALUES(token_count),
+                    embedding_cost = VALUES(embedding_cost), vectorized_at = VALUES(vectorized_at)
+                """,
+                (document_id[:255], os.path.basename(document_id), mime_type, mean, len(chunks),
+                 sum(c.token_count for c in chunks), embedding_cost, datetime.utcnow())
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+
+knowledge_base_service = KnowledgeBaseService()
@@ -2,6 +2,10 @@ import openai
 from ..config import settings
 import logging
 import os
+import asyncio
+from typing import List, Tuple
+from .embedding_cache import embedding_cache
+from ..utils.chunking import token_counter
 
 logger = logging.getLogger(__name__)
 
@@ -32,7 +36,16 @@ except Exception as e:
 async def get_embedding(text: str, model="text-embedding-ada-002"):
     """
     Generates an embedding for the given text using the specified OpenAI model.
+    Served from the embedding cache when the same text was embedded before.
     """
+    try:
+        cached = (await asyncio.to_thread(embedding_cache.get_many, model, [text]))[0]
+        if cached is not None:
+            embedding_cache.record_savings(token_counter(model)(text))
+            return cached.tolist()
+    except Exception as e:
+        logger.warning(f"Embedding cache lookup failed: {e}")
+
     if not openai_client:
         logger.error("OpenAI client not initialized. Cannot get embedding.")
         return None
@@ -48,7 +61,24 @@ async def get_embedding(text: str, model="text-embedding-ada-002"):
         # embedding = response.data[0].embedding
 
         logger.debug(f"Successfully generated embedding for text snippet (length {len(text)}).")
-        return embedding
     except Exception as e:
         logger.error(f"OpenAI API call failed: {e}", exc_info=True)
         return None
+
+    try:
+        await asyncio.to_thread(embedding_cache.put_many, model, [text], [embedding])
+    except Exception as e:
+        logger.warning(f"Embedding cache store failed: {e}")
+    return embedding
+
+async def get_embeddings(texts: List[str], model="text-embedding-ada-002") -> Tuple[List[List[float]], int]:
+    """
+    Embeds many texts in one request. Returns the embeddings in input order and the
+    tokens billed. Unlike get_embedding, failures raise so batch callers can retry, and
+    the embedding cache is left to the caller (see embedding_service).
+    """
+    if not openai_client:
+        raise RuntimeError("OpenAI client not initialized.")
+    response = await openai_client.Embedding.acreate(input=texts, model=model)
+    data = sorted(response['data'], key=lambda item: item['index'])
+    return [item['embedding'] for item in data], response.get('usage', {}).get('total_tokens', 0)
@@ -0,0 +1,281 @@
+"""
+Adaptive pacing for outbound campaigns.
+
+A fixed dial rate either leaves media capacity idle (low answer rates) or
+overloads the workers' audio bridges (high answer rates). In adaptive mode the
+campaign dispatcher asks the PacingController how many dials to launch on each
+tick, based on:
+
+- the rolling answer rate of the campaign's recent dial outcomes (as recorded
+  by the Twilio status callbacks), smoothed towards a prior for small samples;
+- the campaign's bridged (in-progress) calls and the calls still ringing,
+  which will turn into bridged calls at roughly that rate;
+- the number of active /media-stream sessions across all workers, published by
+  each worker's MediaSessionTracker heartbeat, against their total capacity
+  (at most campaign_max_concurrent_calls).
+
+Dials are sized so the expected number of the campaign's bridged calls tracks
+its target while the fleet's sessions stay below media capacity with high
+probability (binomial upper bound). Each decision is stored on the campaign
+row, so any worker's status endpoint can show it.
+"""
+import os
+import json
+import math
+import socket
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from ..config import settings
+from ..database import get_db_connection, Error as DBError
+
+logger = logging.getLogger(__name__)
+
+ANSWERED_OUTCOMES = ('completed',)
+UNANSWERED_OUTCOMES = ('no-answer', 'busy', 'failed', 'canceled')
+RINGING_STATUSES = ('dialing', 'queued', 'initiated', 'ringing')
+BRIDGED_STATUS = 'in-progress'
+
+# Live targets not updated for this long are assumed to have lost their status callback.
+LIVE_CALL_STALE_MINUTES = 120
+
+# Heartbeats older than this are treated as dead workers.
+HEARTBEAT_INTERVAL = 2.0
+HEARTBEAT_STALE_SECONDS = 10
+
+
+def compute_dials(target: int, capacity: int, bridged: int, ringing: int,
+                  answer_rate: float, pending: int, z: float = 2.0, fleet_active: Optional[int] = None) -> int:
+    """
+    Number of new dials to launch now.
+
+    Expected answers from the campaign's ringing + new dials should fill the gap
+    between its `bridged` calls and `target`, while the fleet's active sessions
+    (`fleet_active`, the campaign's `bridged` if it is alone) plus the z-sigma upper
+    bound of those answers must stay within `capacity`.
+    """
+    if pending <= 0:
+        return 0
+    p = min(max(answer_rate, 0.01), 1.0)
+    active = bridged if fleet_active is None else fleet_active
+    gap = min(target, capacity) - bridged - ringing * p
+    if gap <= 0:
+        return 0
+    dials = int(gap / p)
+
+    # Largest n (ringing + new) with active + n*p + z*sqrt(n*p*(1-p)) <= capacity.
+    room = capacity - active
+    if room <= 0:
+        return 0
+    # Solve p*n + z*sqrt(p*(1-p))*sqrt(n) - room = 0 for sqrt(n).
+    b = z * math.sqrt(p * (1 - p))
+    root = (-b + math.sqrt(b * b + 4 * p * room)) / (2 * p)
+    max_outstanding = int(root * root)
+    dials = min(dials, max_outstanding - ringing)
+    return max(0, min(dials, pending))
+
+
+@dataclass
+class OutcomeWindow:
+    answered: int = 0
+    no_answer: int = 0
+    busy: int = 0
+    failed: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.answered + self.no_answer + self.busy + self.failed
+
+    def answer_rate(self, prior_rate: float, prior_weight: float) -> float:
+        """Answer rate smoothed with a Beta prior so early ticks are not erratic."""
+        return (self.answered + prior_rate * prior_weight) / (self.total + prior_weight)
+
+    def as_dict(self, prior_rate: float, prior_weight: float) -> dict:
+        total = self.total
+        return {
+            "window_calls": total,
+            "answer_rate": round(self.answer_rate(prior_rate, prior_weight), 4),
+            "no_answer_rate": round(self.no_answer / total, 4) if total else None,
+            "busy_rate": round(self.busy / total, 4) if total else None,
+        }
+
+
+class MediaSessionTracker:
+    """
+    Counts this worker's active /media-stream sessions and publishes the count to
+    MySQL so the (single) campaign dispatcher sees capacity across all workers.
+    """
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.capacity = settings.media_sessions_per_worker
+        self.active = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def session_started(self):
+        self.active += 1
+
+    def session_ended(self):
+        self.active = max(0, self.active - 1)
+
+    def create_tables(self, cursor):
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS worker_media_sessions (
+                worker_id VARCHAR(100) PRIMARY KEY,
+                active_sessions INT NOT NULL,
+                capacity INT NOT NULL,
+                updated_at DATETIME NOT NULL
+            );
+            """
+        )
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self._remove)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.to_thread(self._publish)
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    def _publish(self):
+        conn = get_db_connection()
+        if conn is None:
+            return
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO worker_media_sessions (worker_id, active_sessions, capacity, updated_at)
+                VALUES (%s, %s, %s, UTC_TIMESTAMP())
+                ON DUPLICATE KEY UPDATE active_sessions = VALUES(active_sessions),
+                    capacity = VALUES(capacity), updated_at = VALUES(updated_at)
+                """,
+                (self.worker_id, self.active, self.capacity)
+            )
+            conn.commit()
+        except DBError as e:
+            logger.error(f"Error publishing media session heartbeat: {e}")
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+    def _remove(self):
+        conn = get_db_connection()
+        if conn is None:
+            return
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM worker_media_sessions WHERE worker_id = %s", (self.worker_id,))
+            conn.commit()
+        except DBError as e:
+            logger.error(f"Error removing media session heartbeat: {e}")
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+
+class PacingController:
+    def __init__(self):
+        self.window_seconds = settings.pacing_window_seconds
+        self.prior_rate = settings.pacing_prior_answer_rate
+        self.prior_weight = settings.pacing_prior_weight
+        self.safety_z = settings.pacing_safety_z
+        self._stored: Dict[int, dict] = {}  # last decision written per running adaptive campaign
+
+    def fleet_capacity(self, cursor) -> Tuple[int, int]:
+        """(active media sessions, media capacity) summed over live workers."""
+        cursor.execute(
+            f"""
+            SELECT COALESCE(SUM(active_sessions), 0), COALESCE(SUM(capacity), 0)
+            FROM worker_media_sessions
+            WHERE updated_at > UTC_TIMESTAMP() - INTERVAL {HEARTBEAT_STALE_SECONDS} SECOND
+            """
+        )
+        active, capacity = cursor.fetchone()
+        return int(active), int(capacity)
+
+    def outcome_window(self, cursor, campaign_id: int) -> Tuple[OutcomeWindow, int, int]:
+        """Recent outcomes for the campaign plus its targets still ringing and bridged."""
+        statuses = ANSWERED_OUTCOMES + UNANSWERED_OUTCOMES + RINGING_STATUSES + (BRIDGED_STATUS,)
+        cursor.execute(
+            f"""
+            SELECT status, COUNT(*) FROM campaign_targets
+            WHERE campaign_id = %s AND status IN ({", ".join(["%s"] * len(statuses))})
+              AND (status IN ({", ".join(["%s"] * len(RINGING_STATUSES))})
+                   OR (status = %s AND updated_at > NOW() - INTERVAL {LIVE_CALL_STALE_MINUTES} MINUTE)
+                   OR updated_at > NOW() - INTERVAL %s SECOND)
+            GROUP BY status
+            """,
+            (campaign_id, *statuses, *RINGING_STATUSES, BRIDGED_STATUS, self.window_seconds)
+        )
+        counts = dict(cursor.fetchall())
+        window = OutcomeWindow(
+            answered=sum(counts.get(s, 0) for s in ANSWERED_OUTCOMES),
+            no_answer=counts.get('no-answer', 0),
+            busy=counts.get('busy', 0),
+            failed=counts.get('failed', 0) + counts.get('canceled', 0),
+        )
+        ringing = sum(counts.get(s, 0) for s in RINGING_STATUSES)
+        return window, ringing, counts.get(BRIDGED_STATUS, 0)
+
+    def dials_for(self, campaign: dict) -> int:
+        """Blocking: how many targets an adaptive campaign should dial this tick."""
+        conn = get_db_connection()
+        if conn is None:
+            return 0
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            fleet_active, fleet_capacity = self.fleet_capacity(cursor)
+            window, ringing, bridged = self.outcome_window(cursor, campaign['id'])
+            # The global live-call cap of fixed campaigns bounds adaptive ones too.
+            capacity = min(fleet_capacity, settings.campaign_max_concurrent_calls)
+            answer_rate = window.answer_rate(self.prior_rate, self.prior_weight)
+            target = campaign.get('target_concurrency') or campaign['max_concurrent_calls']
+            dials = compute_dials(
+                target=target, capacity=capacity, bridged=bridged, ringing=ringing,
+                answer_rate=answer_rate, pending=campaign['pending'], z=self.safety_z, fleet_active=fleet_active
+            )
+            decision = {
+                **window.as_dict(self.prior_rate, self.prior_weight),
+                "bridged": bridged, "fleet_active": fleet_active, "capacity": capacity, "ringing": ringing,
+                "target": target, "dials": dials,
+            }
+            if decision != self._stored.get(campaign['id']):
+                cursor.execute("UPDATE campaigns SET pacing_decision = %s WHERE id = %s",
+                               (json.dumps(decision), campaign['id']))
+                conn.commit()
+                self._stored[campaign['id']] = decision
+            return dials
+        except DBError as e:
+            logger.error(f"Pacing query failed for campaign {campaign['id']}: {e}")
+            return 0
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+    def retain(self, campaign_ids: Iterable[int]):
+        """Forgets the decisions of campaigns that are no longer running."""
+        running = set(campaign_ids)
+        for campaign_id in [c for c in self._stored if c not in running]:
+            del self._stored[campaign_id]
+
+
+media_session_tracker = MediaSessionTracker()
+pacing_controller = PacingController()
@@ -0,0 +1,479 @@
+"""
+Post-call pipeline: work that runs after a call has ended.
+
+Terminal call events only enqueue a job (in the caller's transaction); stages
+run later from the persistent `post_call_jobs` queue:
+
+    transcript -> summary -> email
+               -> embed
+               -> archive
+
+- transcript: fetches the final transcript from the Ultravox messages API and
+  stores it with the recording URL and hangup reason on call_logs.
+- summary: summarizes the transcript with OpenAI into call_logs.summary.
+- email: sends the summary to the client's email address over SMTP.
+- embed: stores an embedding of the transcript for later retrieval.
+- archive: downloads the Twilio and Ultravox recordings to local disk
+  (recording_service).
+
+Every worker process runs a bounded pool (`post_call_workers` concurrent jobs)
+with per-stage limits (`post_call_stage_concurrency`). Workers claim due jobs
+with a conditional UPDATE and a claim token, so each job runs once; claims of a
+crashed worker expire after `post_call_claim_ttl` seconds. Failed jobs are
+retried with exponential backoff and moved to status 'dead' after
+`post_call_max_attempts`; dead jobs can be re-queued from the API.
+"""
+import json
+import uuid
+import time
+import asyncio
+import logging
+import smtplib
+from email.message import EmailMessage
+from typing import Dict, List, Optional
+
+import numpy as np
+import requests
+
+from ..config import settings
+from ..database import get_db_connection, ensure_columns, Error as DBError
+from ..utils.metrics import metrics
+from . import openai_service
+from .recording_service import recording_archiver, RECORDING_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# stage -> stages enqueued once it finishes
+STAGES = {
+    'transcript': ('summary', 'embed', 'archive'),
+    'summary': ('email',),
+    'email': (),
+    'embed': (),
+    'archive': (),
+}
+FIRST_STAGE = 'transcript'
+
+PENDING, RUNNING, DONE, SKIPPED, DEAD = 'pending', 'running', 'done', 'skipped', 'dead'
+
+ULTRAVOX_API = settings.ultravox_api_base_url
+TRANSCRIPT_ROLES = {"MESSAGE_ROLE_AGENT": "Agent", "MESSAGE_ROLE_USER": "User"}
+EMBED_MAX_CHARS = 8000
+SUMMARY_PROMPT = ("Summarize this phone call between an AI agent and a customer in a few sentences. "
+                  "List any commitments, requested follow-ups and contact details mentioned.")
+
+
+class StageSkipped(Exception):
+    """Raised by a stage that has nothing to do for this call."""
+
+
+def enqueue(cursor, call_sid: str, stage: str = FIRST_STAGE, payload: Optional[dict] = None):
+    """Queues a pipeline stage for a call inside the caller's transaction (idempotent per call and stage)."""
+    cursor.execute(
+        "INSERT IGNORE INTO post_call_jobs (call_sid, stage, payload, max_attempts, next_run_at) "
+        "VALUES (%s, %s, %s, %s, UTC_TIMESTAMP())",
+        (call_sid, stage, json.dumps(payload) if payload else None, settings.post_call_max_attempts)
+    )
+
+
+# --- Stages (async; raise StageSkipped or an exception to retry) ---
+
+def _fetch_ultravox_messages(ultravox_call_id: str) -> List[dict]:
+    messages = []
+    url = f"{ULTRAVOX_API}/calls/{ultravox_call_id}/messages?pageSize=200"
+    while url:
+        resp = requests.get(url, headers={"X-API-Key": settings.ultravox_api_key}, timeout=10)
+        resp.raise_for_status()
+        body = resp.json()
+        messages.extend(body.get("results", []))
+        url = body.get("next")
+    return messages
+
+
+async def stage_transcript(job: dict, db):
+    call_data = job['payload'].get('call', {})
+    transcript = call_data.get('transcription')
+    if settings.ultravox_api_key:
+        messages = await asyncio.to_thread(_fetch_ultravox_messages, call_data.get('id') or job['call_sid'])
+        lines = [f"{TRANSCRIPT_ROLES[m['role']]}: {m['text']}" for m in messages
+                 if m.get('role') in TRANSCRIPT_ROLES and m.get('text')]
+        transcript = "\n".join(lines) or transcript
+    await db(
+        "UPDATE call_logs SET transcription = COALESCE(%s, transcription), "
+        "ultravox_recording_url = COALESCE(%s, ultravox_recording_url), "
+        "agent_hangup_reason = COALESCE(%s, agent_hangup_reason) WHERE call_sid = %s",
+        (transcript, call_data.get('recording_url'), call_data.get('agent_hangup_reason'), job['call_sid'])
+    )
+    if not transcript:
+        raise StageSkipped("no transcript")
+
+
+async def stage_summary(job: dict, db):
+    if not openai_service.openai_client:
+        raise StageSkipped("OpenAI not configured")
+    row = await db("SELECT transcription FROM call_logs WHERE call_sid = %s", (job['call_sid'],), fetch=True)
+    if not row or not row[0]:
+        raise StageSkipped("no transcript")
+    response = await openai_service.openai_client.ChatCompletion.acreate(
+        model=settings.post_call_summary_model,
+        messages=[{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": row[0]}],
+        request_timeout=settings.post_call_stage_timeout
+    )
+    summary = response['choices'][0]['message']['content'].strip()
+    await db("UPDATE call_logs SET summary = %s WHERE call_sid = %s", (summary, job['call_sid']))
+
+
+def _send_email(to_address: str, subject: str, body: str):
+    message = EmailMessage()
+    message['From'] = settings.post_call_email_from or settings.smtp_username
+    message['To'] = to_address
+    message['Subject'] = subject
+    message.set_content(body)
+    with smtplib.SMTP(settings.smtp_host, settings.smtp_port, timeout=settings.post_call_stage_timeout) as smtp:
+        smtp.starttls()
+        if settings.smtp_username:
+            smtp.login(settings.smtp_username, settings.smtp_password)
+        smtp.send_message(message)
+
+
+async def stage_email(job: dict, db):
+    if not settings.smtp_host:
+        raise StageSkipped("SMTP not configured")
+    row = await db(
+        """
+        SELECT l.summary, l.email_sent, COALESCE(l.email_address, c.email) FROM call_logs l
+        LEFT JOIN clients c ON c.phone_number = IF(l.direction = 'inbound', l.from_number, l.to_number)
+        WHERE l.call_sid = %s
+        """,
+        (job['call_sid'],), fetch=True
+    )
+    if not row or not row[0] or not row[2]:
+        raise StageSkipped("no summary or recipient")
+    if row[1]:
+        return  # sent by an earlier attempt whose status update was lost
+    summary, _, address = row
+    await asyncio.to_thread(_send_email, address, "Summary of our call", summary)
+    await db(
+        "UPDATE call_logs SET email_sent = TRUE, email_address = %s, email_text = %s WHERE call_sid = %s",
+        (address, summary, job['call_sid'])
+    )
+
+
+async def stage_embed(job: dict, db):
+    if not openai_service.openai_client:
+        raise StageSkipped("OpenAI not configured")
+    row = await db("SELECT transcription FROM call_logs WHERE call_sid = %s", (job['call_sid'],), fetch=True)
+    if not row or not row[0]:
+        raise StageSkipped("no transcript")
+    embedding = await openai_service.get_embedding(row[0][:EMBED_MAX_CHARS], model=settings.embedding_model)
+    if embedding is None:
+        raise RuntimeError("embedding request failed")
+    await db(
+        "REPLACE INTO call_transcript_embeddings (call_sid, model, vector) VALUES (%s, %s, %s)",
+        (job['call_sid'], settings.embedding_model, np.asarray(embedding, dtype=np.float32).tobytes())
+    )
+
+
+async def stage_archive(job: dict, db):
+    row = await db("SELECT recording_url, ultravox_recording_url FROM call_logs WHERE call_sid = %s",
+                   (job['call_sid'],), fetch=True)
+    urls = dict(zip(RECORDING_COLUMNS, row)) if row else {}
+    urls = {source: url for source, url in urls.items() if url}
+    if not urls:
+        raise StageSkipped("no recording")
+    for source, url in urls.items():
+        done = await db("SELECT 1 FROM call_recordings WHERE call_sid = %s AND source = %s",
+                        (job['call_sid'], source), fetch=True)
+        if done:
+            continue  # archived by an earlier attempt
+        archived = await recording_archiver.archive(job['call_sid'], source, url)
+        await db(
+            "REPLACE INTO call_recordings (call_sid, source, source_url, path, content_type, bytes, sha256, archived_at) "
+            "VALUES (%(call_sid)s, %(source)s, %(source_url)s, %(path)s, %(content_type)s, %(bytes)s, %(sha256)s, "
+            "%(archived_at)s)",
+            archived
+        )
+
+
+STAGE_HANDLERS = {
+    'transcript': stage_transcript,
+    'summary': stage_summary,
+    'email': stage_email,
+    'embed': stage_embed,
+    'archive': stage_archive,
+}
+
+
+class PostCallPipeline:
+    def __init__(self):
+        self.workers = settings.post_call_workers
+        self.stage_limits = {stage: settings.post_call_stage_concurrency.get(stage, self.workers) for stage in STAGES}
+        self.poll_interval = settings.post_call_poll_interval
+        self.claim_ttl = settings.post_call_claim_ttl
+        self._running: Dict[str, int] = {stage: 0 for stage in STAGES}
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight: set = set()
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def create_tables(self, cursor):
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS post_call_jobs (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                call_sid VARCHAR(255) NOT NULL,
+                stage VARCHAR(32) NOT NULL,
+                status VARCHAR(16) NOT NULL DEFAULT 'pending', -- pending, running, done, skipped, dead
+                payload MEDIUMTEXT NULL, -- JSON handed to the stage (e.g. the Ultravox call object)
+                attempts INT NOT NULL DEFAULT 0,
+                max_attempts INT NOT NULL DEFAULT 5,
+                next_run_at DATETIME NOT NULL,
+                claim_token VARCHAR(32) NULL,
+                claimed_until DATETIME NULL,
+                last_error TEXT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                UNIQUE KEY uq_post_call_stage (call_sid, stage),
+                INDEX idx_post_call_due (status, stage, next_run_at),
+                INDEX idx_post_call_claim (claim_token)
+            );
+            """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS call_transcript_embeddings (
+                call_sid VARCHAR(255) PRIMARY KEY,
+                model VARCHAR(100) NOT NULL,
+                vector MEDIUMBLOB NOT NULL, -- float32 array
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """
+        )
+        ensure_columns(cursor, "call_logs", {
+            "summary": "TEXT NULL",
+            "email_sent": "BOOLEAN NULL",
+            "email_address": "VARCHAR(255) NULL",
+            "email_text": "TEXT NULL",
+        })
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._poll_loop())
+            logger.info(f"Post-call pipeline started: {self.workers} workers, stage limits {self.stage_limits}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        # Let running stages finish; unfinished claims expire and are retried elsewhere.
+        if self._in_flight:
+            await asyncio.wait(self._in_flight, timeout=settings.post_call_stage_timeout)
+
+    def notify(self):
+        """Wakes the poller early (e.g. right after a webhook enqueued work)."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _poll_loop(self):
+        while True:
+            try:
+                await self._fill()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Post-call pipeline poll failed: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _fill(self):
+        free = self.workers - len(self._in_flight)
+        if free <= 0:
+            return
+        wanted = {stage: min(free, limit - self._running[stage]) for stage, limit in self.stage_limits.items()}
+        wanted = {stage: n for stage, n in wanted.items() if n > 0}
+        if not wanted:
+            return
+        jobs = await asyncio.to_thread(self._claim, wanted, free)
+        for job in jobs:
+            self._running[job['stage']] += 1
+            task = asyncio.create_task(self._run_job(job))
+            self._in_flight.add(task)
+            task.add_done_callback(self._job_finished)
+
+    def _job_finished(self, task: asyncio.Task):
+        self._in_flight.discard(task)
+        self.notify()
+
+    def _claim(self, wanted: Dict[str, int], limit: int) -> List[dict]:
+        conn = get_db_connection()
+        if conn is None:
+            return []
+        cursor = None
+        token = uuid.uuid4().hex
+        try:
+            cursor = conn.cursor(dictionary=True)
+            # Jobs whose worker died mid-stage go back to the queue.
+            cursor.execute(
+                "UPDATE post_call_jobs SET status = %s, claim_token = NULL "
+                "WHERE status = %s AND claimed_until < UTC_TIMESTAMP()",
+                (PENDING, RUNNING)
+            )
+            claimed = 0
+            for stage, n in wanted.items():
+                n = min(n, limit - claimed)
+                if n <= 0:
+                    break
+                cursor.execute(
+                    "UPDATE post_call_jobs SET status = %s, claim_token = %s, attempts = attempts + 1, "
+                    "claimed_until = UTC_TIMESTAMP() + INTERVAL %s SECOND "
+                    "WHERE status = %s AND stage = %s AND next_run_at <= UTC_TIMESTAMP() ORDER BY next_run_at LIMIT %s",
+                    (RUNNING, token, self.claim_ttl, PENDING, stage, n)
+                )
+                claimed += cursor.rowcount
+            conn.commit()
+            if not claimed:
+                return []
+            cursor.execute(
+                "SELECT id, call_sid, stage, payload, attempts, max_attempts FROM post_call_jobs WHERE claim_token = %s",
+                (token,)
+            )
+            jobs = cursor.fetchall()
+            for job in jobs:
+                job['payload'] = json.loads(job['payload'] or "{}")
+                job['claim_token'] = token
+            return jobs
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+    async def _run_job(self, job: dict):
+        stage = job['stage']
+        start = time.perf_counter()
+        status, error = DONE, None
+        try:
+            await asyncio.wait_for(STAGE_HANDLERS[stage](job, self._execute), settings.post_call_stage_timeout)
+        except StageSkipped as e:
+            status, error = SKIPPED, str(e)
+        except Exception as e:
+            status, error = (DEAD if job['attempts'] >= job['max_attempts'] else PENDING), f"{type(e).__name__}: {e}"
+        finally:
+            self._running[stage] -= 1
+        metrics.histogram(f"post_call.{stage}_seconds").observe(time.perf_counter() - start)
+        metrics.inc(f"post_call.{stage}.{'retry' if status == PENDING else status}")
+        if status == PENDING:
+            logger.warning(f"Post-call {stage} for {job['call_sid']} failed (attempt {job['attempts']}): {error}")
+        elif status == DEAD:
+            logger.error(f"Post-call {stage} for {job['call_sid']} dead-lettered after {job['attempts']} attempts: {error}")
+        try:
+            await asyncio.to_thread(self._finish, job, status, error)
+        except Exception as e:
+            logger.error(f"Failed to record post-call {stage} result for {job['call_sid']}: {e}")
+
+    async def _execute(self, sql: str, params: tuple, fetch: bool = False):
+        """Runs one statement for a stage on a pooled connection."""
+        return await asyncio.to_thread(self._execute_blocking, sql, params, fetch)
+
+    def _execute_blocking(self, sql: str, params: tuple, fetch: bool):
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            if fetch:
+                return cursor.fetchone()
+            conn.commit()
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+    def _finish(self, job: dict, status: str, error: Optional[str]):
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            backoff = settings.post_call_retry_backoff * 2 ** (job['attempts'] - 1)
+            # The claim token guards against finishing a job whose claim expired and was re-taken.
+            cursor.execute(
+                "UPDATE post_call_jobs SET status = %s, last_error = %s, claim_token = NULL, claimed_until = NULL, "
+                "next_run_at = IF(%s = 'pending', UTC_TIMESTAMP() + INTERVAL %s SECOND, next_run_at) "
+                "WHERE id = %s AND claim_token = %s",
+                (status, error, status, backoff, job['id'], job['claim_token'])
+            )
+            if cursor.rowcount and status == DONE:
+                for next_stage in STAGES[job['stage']]:
+                    enqueue(cursor, job['call_sid'], next_stage)
+            conn.commit()
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+    # --- Queue inspection (blocking, called from routes) ---
+
+    def queue_depth(self) -> dict:
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT stage, status, COUNT(*), MIN(next_run_at) FROM post_call_jobs "
+                "WHERE status IN (%s, %s, %s) GROUP BY stage, status",
+                (PENDING, RUNNING, DEAD)
+            )
+            depth = {stage: {PENDING: 0, RUNNING: 0, DEAD: 0, "oldest_due": None} for stage in STAGES}
+            for stage, status, count, oldest in cursor.fetchall():
+                depth.setdefault(stage, {})[status] = count
+                if status == PENDING:
+                    depth[stage]["oldest_due"] = oldest
+            return {"stages": depth, "local_running": dict(self._running)}
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+    def list_dead(self, limit: int = 100) -> List[dict]:
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                "SELECT id, call_sid, stage, attempts, last_error, updated_at FROM post_call_jobs "
+                "WHERE status = %s ORDER BY updated_at DESC LIMIT %s",
+                (DEAD, limit)
+            )
+            return cursor.fetchall()
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+    def retry(self, job_id: int) -> bool:
+        """Re-queues a dead-lettered job with a fresh attempt budget."""
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE post_call_jobs SET status = %s, attempts = 0, next_run_at = UTC_TIMESTAMP() "
+                "WHERE id = %s AND status = %s",
+                (PENDING, job_id, DEAD)
+            )
+            conn.commit()
+            return cursor.rowcount > 0
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+
+post_call_pipeline = PostCallPipeline()
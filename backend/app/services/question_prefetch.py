@@ -0,0 +1,132 @@
+"""
+Speculative knowledge-base retrieval while the caller is still speaking.
+
+By the time Ultravox invokes `question_and_answer`, the caller's question has
+already streamed in as user `transcript` messages, and the model has spent
+hundreds of milliseconds deciding to call the tool. A `QuestionPrefetcher`
+(one per call) follows the caller's current utterance (`text` replaces it,
+`delta` extends it, `final` ends it) and, once no new words arrived for
+`kb_prefetch_debounce_ms` or the utterance is final, starts
+`retrieval_service.answer_context` for it in the background. Results (or the
+still running tasks) are kept keyed by the normalized utterance text; the last
+`kb_prefetch_max_entries` utterances are kept per call.
+
+When the tool is invoked, `answer` reuses a prefetched result if the model's
+question is the same normalized text, or if at least `kb_prefetch_min_overlap`
+of the question's keyword tokens (utils/keyword_index.tokenize) occur in the
+utterance: the model usually restates what the caller said, and retrieval for
+the utterance then finds the same passages. A result that is still running is
+awaited, having had a head start. Otherwise the question is answered by a
+fresh query. Hits, misses and speculative queries are counted in metrics.
+"""
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+from ..config import settings
+from ..utils.metrics import metrics
+from ..utils.keyword_index import tokenize
+from .answer_cache import _text_key
+from .retrieval_service import retrieval_service
+
+logger = logging.getLogger(__name__)
+
+ANSWER_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class QuestionPrefetcher:
+    def __init__(self, call_sid: Optional[str] = None):
+        self.call_sid = call_sid
+        self.debounce_seconds = settings.kb_prefetch_debounce_ms / 1000
+        self._utterance = ""
+        self._ordinal = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._prefetched = OrderedDict()  # normalized text -> (keyword tokens, task)
+
+    @property
+    def enabled(self) -> bool:
+        return settings.kb_prefetch_enabled
+
+    def on_transcript(self, message: dict):
+        """Follows a user transcript message; (re)arms the debounce timer for its utterance."""
+        if not self.enabled or message.get("role") != "user":
+            return
+        ordinal = message.get("ordinal")
+        if ordinal != self._ordinal:
+            self._ordinal, self._utterance = ordinal, ""
+        if message.get("text") is not None:
+            self._utterance = message["text"]
+        elif message.get("delta"):
+            self._utterance += message["delta"]
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if message.get("final"):
+            self._prefetch(self._utterance)
+            self._ordinal, self._utterance = None, ""
+        else:
+            self._timer = asyncio.get_running_loop().call_later(self.debounce_seconds, self._prefetch, self._utterance)
+
+    def _prefetch(self, text: str):
+        self._timer = None
+        key = _text_key(text)
+        tokens = set(tokenize(text))
+        if len(key.split()) < settings.kb_prefetch_min_words or not tokens or key in self._prefetched:
+            return
+        task = asyncio.create_task(retrieval_service.answer_context(text))
+        task.add_done_callback(self._log_failure)
+        self._prefetched[key] = (tokens, task)
+        while len(self._prefetched) > settings.kb_prefetch_max_entries:
+            _, (_, stale) = self._prefetched.popitem(last=False)
+            stale.cancel()
+        metrics.inc("kb.prefetch_queries")
+        logger.debug(f"Prefetching knowledge-base answer for CallSid={self.call_sid}: {text!r}")
+
+    def _log_failure(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            logger.warning(f"Speculative retrieval failed for CallSid={self.call_sid}: {task.exception()}")
+
+    def _match(self, question: str) -> Optional[asyncio.Task]:
+        """The prefetch task whose utterance the question restates, if any."""
+        entry = self._prefetched.get(_text_key(question))
+        if entry:
+            return entry[1]
+        wanted = set(tokenize(question))
+        best, best_overlap = None, 0.0
+        if wanted:
+            for tokens, task in reversed(self._prefetched.values()):  # newest first wins ties
+                overlap = len(wanted & tokens) / len(wanted)
+                if overlap > best_overlap:
+                    best, best_overlap = task, overlap
+        return best if best_overlap >= settings.kb_prefetch_min_overlap else None
+
+    async def answer(self, question: str) -> str:
+        """Knowledge-base context for the tool call, from a matching prefetch when there is one."""
+        start = time.perf_counter()
+        task = self._match(question) if self.enabled else None
+        context = None
+        if task is not None:
+            try:
+                context = await asyncio.shield(task)
+                metrics.inc("kb.prefetch_hits")
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    raise
+            except Exception:
+                pass  # logged by the task callback; answered fresh below
+        if context is None:
+            metrics.inc("kb.prefetch_misses")
+            context = await retrieval_service.answer_context(question)
+        metrics.histogram("kb.tool_answer_seconds", ANSWER_BUCKETS).observe(time.perf_counter() - start)
+        return context
+
+    def close(self):
+        """Cancels pending prefetches when the call ends."""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        for _, task in self._prefetched.values():
+            task.cancel()
+        self._prefetched.clear()
@@ -0,0 +1,334 @@
+"""
+Cost reconciliation for call_logs.
+
+Instead of fetching prices call by call, the reconciler pages through the
+provider list APIs (Twilio Calls.json with PageSize up to 1000, Ultravox
+/calls) and applies each page with a handful of statements: the page is bulk
+inserted into a temporary table and joined against call_logs by SID (one
+indexed UPDATE per key column). Daily rollups receive the newly priced amounts through
+analytics_service.add_cost.
+
+Each source keeps a high-water mark in `reconciliation_state`. A run starts
+just before the mark and advances it to the newest call seen, but never past
+the oldest call that the provider had not priced yet, so late prices are
+picked up by a later run. Only rows whose cost is still NULL are updated, so
+overlapping windows are harmless.
+
+Runs every `reconcile_interval_seconds` in one gunicorn worker at a time
+(MySQL GET_LOCK), or on demand:
+
+    python3 -m app.services.reconciliation_service [--source twilio|ultravox]
+
+Both endpoints can be pointed at local fakes with TWILIO_API_BASE_URL and
+ULTRAVOX_API_BASE_URL (see scripts/fake_twilio.py, scripts/fake_ultravox.py).
+"""
+import re
+import math
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import Iterator, List, Optional, Tuple
+
+import mysql.connector
+import requests
+
+from ..config import settings
+from ..database import get_db_connection, ensure_columns, Error as DBError
+from ..utils.metrics import metrics
+from .analytics_service import analytics_service
+from .twilio_service import TWILIO_API_BASE
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_LOCK_NAME = "tfrtita_cost_reconciliation"
+TWILIO = 'twilio'
+ULTRAVOX = 'ultravox'
+# Twilio's EndTime filter has day granularity; re-read the previous day too.
+TWILIO_OVERLAP = timedelta(days=1)
+ULTRAVOX_OVERLAP = timedelta(hours=1)
+
+# (sid, cost, segments, created/ended time)
+CostRecord = Tuple[str, float, Optional[int], datetime]
+
+
+def _naive_utc(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+
+def _parse_duration_seconds(value) -> Optional[float]:
+    """Ultravox durations are strings like '123.456s'."""
+    if value is None:
+        return None
+    match = re.fullmatch(r"\s*([\d.]+)s?\s*", str(value))
+    return float(match.group(1)) if match else None
+
+
+def iter_twilio_pages(since: datetime, session: Optional[requests.Session] = None) -> Iterator[dict]:
+    """Completed-call pages from the Twilio Calls list API, newest first."""
+    session = session or requests.Session()
+    base = (settings.twilio_api_base_url or TWILIO_API_BASE).rstrip("/")
+    url = f"{base}/2010-04-01/Accounts/{settings.twilio_account_sid}/Calls.json"
+    params = {"Status": "completed", "EndTime>": (since - TWILIO_OVERLAP).strftime("%Y-%m-%d"),
+              "PageSize": settings.reconcile_page_size}
+    while url:
+        resp = session.get(url, params=params, auth=(settings.twilio_account_sid, settings.twilio_auth_token),
+                           timeout=30)
+        resp.raise_for_status()
+        page = resp.json()
+        metrics.inc("reconcile.twilio.pages")
+        yield page
+        next_uri = page.get("next_page_uri")
+        url, params = (f"{base}{next_uri}", None) if next_uri else (None, None)
+
+
+def fetch_twilio_costs(since: datetime, session: Optional[requests.Session] = None
+                       ) -> Iterator[Tuple[List[CostRecord], Optional[datetime]]]:
+    """
+    Yields (priced records, oldest unpriced end time) per page. Twilio prices are
+    negative amounts; segments are the billed minutes.
+    """
+    for page in iter_twilio_pages(since, session):
+        records, oldest_unpriced = [], None
+        for call in page.get("calls", []):
+            if not call.get("end_time"):
+                continue
+            ended = _naive_utc(parsedate_to_datetime(call["end_time"]))
+            if call.get("price") is None:
+                oldest_unpriced = min(oldest_unpriced or ended, ended)
+                continue
+            duration = int(call.get("duration") or 0)
+            records.append((call["sid"], abs(float(call["price"])), math.ceil(duration / 60), ended))
+        yield records, oldest_unpriced
+
+
+def fetch_ultravox_costs(since: datetime, session: Optional[requests.Session] = None
+                         ) -> Iterator[Tuple[List[CostRecord], Optional[datetime]]]:
+    """
+    Yields (priced records, oldest unpriced creation time) per page of the Ultravox
+    calls list (newest first), stopping once calls are older than `since`. Cost is
+    the billed duration at settings.ultravox_price_per_minute.
+    """
+    session = session or requests.Session()
+    url = f"{settings.ultravox_api_base_url.rstrip('/')}/calls"
+    params = {"pageSize": min(settings.reconcile_page_size, 100)}
+    stop_before = since - ULTRAVOX_OVERLAP
+    while url:
+        resp = session.get(url, params=params, headers={"X-API-Key": settings.ultravox_api_key}, timeout=30)
+        resp.raise_for_status()
+        page = resp.json()
+        metrics.inc("reconcile.ultravox.pages")
+        records, oldest_unpriced, reached_end = [], None, False
+        for call in page.get("results", []):
+            created = _naive_utc(datetime.fromisoformat(call["created"].replace("Z", "+00:00")))
+            if created < stop_before:
+                reached_end = True
+                break
+            billed = _parse_duration_seconds(call.get("billedDuration"))
+            if not call.get("ended") or billed is None:
+                oldest_unpriced = min(oldest_unpriced or created, created)
+                continue
+            records.append((call["callId"], round(billed / 60 * settings.ultravox_price_per_minute, 5),
+                            None, created))
+        yield records, oldest_unpriced
+        url, params = (None if reached_end else page.get("next")), None
+
+
+class ReconciliationService:
+    def __init__(self):
+        self.interval = settings.reconcile_interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    def create_tables(self, cursor):
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS reconciliation_state (
+                source VARCHAR(32) PRIMARY KEY,
+                high_water DATETIME NOT NULL,
+                last_run_at DATETIME NULL,
+                last_matched INT NOT NULL DEFAULT 0
+            );
+            """
+        )
+        ensure_columns(cursor, "call_logs", {
+            "cost": "DECIMAL(10, 5) NULL",
+            "segments": "INT NULL",
+            "ultravox_cost": "DECIMAL(10, 5) NULL",
+            "ultravox_call_id": "VARCHAR(64) NULL, ADD INDEX idx_call_logs_ultravox (ultravox_call_id)",
+        })
+
+    def link_ultravox_call(self, call_sid: str, ultravox_call_id: str):
+        """Remembers which Ultravox call served a Twilio call so its cost can be matched."""
+        conn = get_db_connection()
+        if conn is None:
+            logger.error(f"Database unavailable linking Ultravox call {ultravox_call_id} to {call_sid}.")
+            return
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE call_logs SET ultravox_call_id = %s WHERE call_sid = %s",
+                           (ultravox_call_id, call_sid))
+            conn.commit()
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+    # --- Runs ---
+
+    def _high_water(self, cursor, source: str) -> datetime:
+        cursor.execute("SELECT high_water FROM reconciliation_state WHERE source = %s", (source,))
+        row = cursor.fetchone()
+        if row:
+            return row[0]
+        return datetime.utcnow() - timedelta(days=settings.reconcile_initial_days)
+
+    def _apply_page(self, conn, source: str, records: List[CostRecord]) -> int:
+        """Matches one page to call_logs by SID and writes costs with set-based statements."""
+        if not records:
+            return 0
+        cost_column = "cost" if source == TWILIO else "ultravox_cost"
+        # Ultravox calls are matched by their linked ultravox_call_id first, then by call_sid
+        # (calls whose id is the CallSid); one indexed join per column rather than an OR.
+        matches = ["call_sid"] if source == TWILIO else ["ultravox_call_id", "call_sid"]
+        cursor = conn.cursor()
+        try:
+            cursor.execute("DROP TEMPORARY TABLE IF EXISTS recon_page")
+            cursor.execute(
+                "CREATE TEMPORARY TABLE recon_page (sid VARCHAR(255) PRIMARY KEY, cost DECIMAL(10, 5), "
+                "segments INT NULL, call_sid VARCHAR(255) NULL)"
+            )
+            # mysql-connector rewrites this executemany into one multi-row INSERT.
+            cursor.executemany("INSERT IGNORE INTO recon_page (sid, cost, segments) VALUES (%s, %s, %s)",
+                               [(sid, cost, segments) for sid, cost, segments, _ in records])
+            for column in matches:
+                cursor.execute(
+                    f"UPDATE recon_page r JOIN call_logs l ON l.{column} = r.sid SET r.call_sid = l.call_sid "
+                    f"WHERE r.call_sid IS NULL AND l.{cost_column} IS NULL"
+                )
+            # Rollups first, while the newly priced rows are still distinguishable by a NULL cost.
+            cursor.execute(
+                "SELECT DATE(l.start_time), l.direction, l.status, SUM(r.cost) FROM recon_page r "
+                "JOIN call_logs l ON l.call_sid = r.call_sid WHERE l.start_time IS NOT NULL "
+                "GROUP BY DATE(l.start_time), l.direction, l.status"
+            )
+            for day, direction, status, total in cursor.fetchall():
+                analytics_service.add_cost(cursor, day, direction or 'outbound', status, float(total))
+            segments = ", l.segments = r.segments" if source == TWILIO else ""
+            cursor.execute(
+                f"UPDATE call_logs l JOIN recon_page r ON l.call_sid = r.call_sid "
+                f"SET l.{cost_column} = r.cost{segments}"
+            )
+            matched = cursor.rowcount
+            cursor.execute("DROP TEMPORARY TABLE recon_page")
+            conn.commit()
+            return matched
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def reconcile(self, source: str) -> dict:
+        """One incremental pass over a source. Blocking."""
+        fetch = fetch_twilio_costs if source == TWILIO else fetch_ultravox_costs
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        started = datetime.utcnow()
+        try:
+            cursor = conn.cursor()
+            since = self._high_water(cursor, source)
+            newest, oldest_unpriced = since, None
+            fetched = matched = 0
+            with requests.Session() as session:
+                for records, page_unpriced in fetch(since, session):
+                    fetched += len(records)
+                    matched += self._apply_page(conn, source, records)
+                    if records:
+                        newest = max(newest, max(r[3] for r in records))
+                    if page_unpriced:
+                        oldest_unpriced = min(oldest_unpriced or page_unpriced, page_unpriced)
+            high_water = min(newest, oldest_unpriced) if oldest_unpriced else newest
+            cursor.execute(
+                """
+                INSERT INTO reconciliation_state (source, high_water, last_run_at, last_matched)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE high_water = VALUES(high_water), last_run_at = VALUES(last_run_at),
+                    last_matched = VALUES(last_matched)
+                """,
+                (source, high_water, started, matched)
+            )
+            conn.commit()
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+        metrics.inc(f"reconcile.{source}.matched", matched)
+        result = {"source": source, "since": since, "high_water": high_water, "fetched": fetched, "matched": matched}
+        logger.info(f"Cost reconciliation: {result}")
+        return result
+
+    def run_all(self) -> List[dict]:
+        sources = [TWILIO] + ([ULTRAVOX] if settings.ultravox_api_key else [])
+        results = []
+        for source in sources:
+            with metrics.histogram(f"reconcile.{source}_seconds", buckets=(1, 5, 15, 60, 300, 900)).time():
+                results.append(self.reconcile(source))
+        return results
+
+    def _run_if_leader(self) -> Optional[List[dict]]:
+        """Runs all sources unless another worker holds the reconciliation lock."""
+        lock_conn = None
+        try:
+            lock_conn = mysql.connector.connect(
+                host=settings.db_host, port=settings.db_port, user=settings.db_user,
+                password=settings.db_password, database=settings.db_name,
+                connection_timeout=settings.db_connect_timeout
+            )
+            cursor = lock_conn.cursor()
+            cursor.execute("SELECT GET_LOCK(%s, 0)", (RECONCILE_LOCK_NAME,))
+            acquired = cursor.fetchone()[0] == 1
+            cursor.close()
+            if not acquired:
+                return None
+            return self.run_all()
+        finally:
+            if lock_conn is not None:
+                lock_conn.close()  # releases the named lock
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self._run_if_leader)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Cost reconciliation failed: {e}", exc_info=True)
+
+
+reconciliation_service = ReconciliationService()
+
+
+if __name__ == "__main__":
+    import argparse
+    from ..database import init_db_pool
+
+    parser = argparse.ArgumentParser(description="Reconcile call costs from the Twilio and Ultravox list APIs.")
+    parser.add_argument("--source", choices=[TWILIO, ULTRAVOX], help="Only this source (default: all configured)")
+    args = parser.parse_args()
+    if not init_db_pool():
+        raise SystemExit("Database unavailable.")
+    results = [reconciliation_service.reconcile(args.source)] if args.source else reconciliation_service.run_all()
+    for result in results:
+        print(result)
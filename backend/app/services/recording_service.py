@@ -0,0 +1,260 @@
+"""
+Local archive of call recordings.
+
+`recording_url` (Twilio) and `ultravox_recording_url` point at provider
+storage that expires and is slow to fetch from the UI. The post-call
+pipeline's `archive` stage hands both to `recording_archiver.archive()`, which
+streams each recording to `recording_archive_dir/<source>/<call_sid>.<ext>`:
+
+- fixed memory per download: the body is read in `recording_archive_chunk_bytes`
+  blocks, each written (and hashed) in a worker thread before the next is read;
+- at most `recording_archive_concurrency` downloads run at once per process;
+- the SHA-256 is computed while streaming and stored in `call_recordings`;
+- an interrupted download leaves `<call_sid>.part`; the next attempt re-hashes
+  it and continues with a `Range: bytes=<size>-` request (or starts over if the
+  server ignores ranges).
+
+Archived files are served by GET /api/calls/{call_sid}/recording with Range
+support (utils/range_response.py; X-Accel-Redirect when behind nginx).
+
+Backfill older calls into the pipeline:
+    python3 -m app.services.recording_service --days 30
+"""
+import os
+import re
+import time
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from typing import Optional
+from urllib.parse import urlparse
+
+import aiohttp
+
+from ..config import settings
+from ..database import get_db_connection, Error as DBError
+from ..utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+TWILIO, ULTRAVOX = 'twilio', 'ultravox'
+RECORDING_COLUMNS = {TWILIO: 'recording_url', ULTRAVOX: 'ultravox_recording_url'}
+EXTENSIONS = {
+    'audio/wav': 'wav', 'audio/x-wav': 'wav', 'audio/wave': 'wav',
+    'audio/mpeg': 'mp3', 'audio/mp3': 'mp3',
+    'audio/ogg': 'ogg', 'audio/flac': 'flac', 'audio/x-flac': 'flac',
+}
+MEDIA_TYPES = {'wav': 'audio/wav', 'mp3': 'audio/mpeg', 'ogg': 'audio/ogg', 'flac': 'audio/flac'}
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class IncompleteDownload(IOError):
+    """The connection ended before the announced length; the .part file is kept for resuming."""
+
+
+def _safe_name(call_sid: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_-]", "_", call_sid)
+
+
+def _hash_file(path: str, chunk_bytes: int) -> "hashlib._Hash":
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_bytes), b""):
+            digest.update(block)
+    return digest
+
+
+def _write_block(f, digest, block: bytes):
+    f.write(block)
+    digest.update(block)
+
+
+def _close_file(f):
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+
+class RecordingArchiver:
+    def __init__(self):
+        self.directory = settings.recording_archive_dir
+        self.chunk_bytes = settings.recording_archive_chunk_bytes
+        self.concurrency = settings.recording_archive_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.active = 0 # Downloads in flight
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def create_tables(self, cursor):
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS call_recordings (
+                call_sid VARCHAR(255) NOT NULL,
+                source VARCHAR(16) NOT NULL, -- twilio, ultravox
+                source_url TEXT NOT NULL,
+                path VARCHAR(512) NOT NULL, -- relative to recording_archive_dir
+                content_type VARCHAR(100) NOT NULL,
+                bytes BIGINT NOT NULL,
+                sha256 CHAR(64) NOT NULL,
+                archived_at DATETIME NOT NULL,
+                PRIMARY KEY (call_sid, source)
+            );
+            """
+        )
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60)
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _auth(self, url: str) -> tuple:
+        """Provider credentials for provider-hosted URLs (never sent to third-party storage)."""
+        parsed = urlparse(url)
+        host, hostname = parsed.netloc, parsed.hostname or ""
+        if hostname == "twilio.com" or hostname.endswith(".twilio.com") or (settings.twilio_api_base_url and host == urlparse(settings.twilio_api_base_url).netloc):
+            return aiohttp.BasicAuth(settings.twilio_account_sid, settings.twilio_auth_token), {}
+        if host == urlparse(settings.ultravox_api_base_url).netloc and settings.ultravox_api_key:
+            return None, {"X-API-Key": settings.ultravox_api_key}
+        return None, {}
+
+    async def archive(self, call_sid: str, source: str, url: str) -> dict:
+        """Downloads one recording into the archive; returns its call_recordings row values."""
+        session = self._get_session()
+        folder = os.path.join(self.directory, source)
+        part = os.path.join(folder, f"{_safe_name(call_sid)}.part")
+        await asyncio.to_thread(os.makedirs, folder, exist_ok=True)
+        async with self._semaphore:
+            self.active += 1
+            try:
+                start = time.perf_counter()
+                offset = os.path.getsize(part) if os.path.exists(part) else 0
+                digest = await asyncio.to_thread(_hash_file, part, self.chunk_bytes) if offset else hashlib.sha256()
+                auth, headers = self._auth(url)
+                if offset:
+                    headers["Range"] = f"bytes={offset}-"
+                async with session.get(url, auth=auth, headers=headers) as resp:
+                    if offset and resp.status == 416:
+                        # The part no longer matches the remote file; start over next attempt.
+                        await asyncio.to_thread(os.remove, part)
+                        raise IncompleteDownload(f"stale partial download of {call_sid} ({source}) discarded")
+                    resp.raise_for_status()
+                    total = resp.content_length
+                    if resp.status == 206:
+                        match = CONTENT_RANGE.match(resp.headers.get("Content-Range", ""))
+                        if not match or int(match.group(1)) != offset:
+                            raise IncompleteDownload(f"unexpected Content-Range for {call_sid} ({source})")
+                        total = int(match.group(3)) if match.group(3) != "*" else None
+                        metrics.inc("recordings.resumed")
+                    elif offset:
+                        offset, digest = 0, hashlib.sha256()  # server ignored the range
+                    content_type = resp.content_type or "application/octet-stream"
+                    f = await asyncio.to_thread(open, part, "ab" if offset else "wb")
+                    size, block = offset, bytearray()
+                    try:
+                        async for piece in resp.content.iter_chunked(self.chunk_bytes):
+                            block += piece
+                            if len(block) >= self.chunk_bytes:
+                                await asyncio.to_thread(_write_block, f, digest, bytes(block))
+                                size += len(block)
+                                block.clear()
+                        if block:
+                            await asyncio.to_thread(_write_block, f, digest, bytes(block))
+                            size += len(block)
+                    except aiohttp.ClientPayloadError as e:
+                        # Connection dropped mid-body; the part file is resumed on the next attempt.
+                        raise IncompleteDownload(f"{call_sid} ({source}): connection closed after {size} of "
+                                                 f"{total} bytes") from e
+                    finally:
+                        await asyncio.to_thread(_close_file, f)
+                if total is not None and size != total:
+                    raise IncompleteDownload(f"{call_sid} ({source}): {size} of {total} bytes received")
+                name = f"{_safe_name(call_sid)}.{EXTENSIONS.get(content_type, 'bin')}"
+                await asyncio.to_thread(os.replace, part, os.path.join(folder, name))
+            finally:
+                self.active -= 1
+        metrics.inc("recordings.archived")
+        metrics.inc("recordings.bytes", size - offset)
+        metrics.histogram("recordings.download_seconds", buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 300)).observe(
+            time.perf_counter() - start
+        )
+        return {
+            "call_sid": call_sid,
+            "source": source,
+            "source_url": url,
+            "path": f"{source}/{name}",
+            "content_type": content_type,
+            "bytes": size,
+            "sha256": digest.hexdigest(),
+            "archived_at": datetime.utcnow(),
+        }
+
+    # --- Lookups (blocking, called from routes) ---
+
+    def get_recording(self, call_sid: str, source: Optional[str] = None) -> Optional[dict]:
+        """The archived recording of a call (Ultravox preferred unless `source` is given)."""
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=True)
+            sql = "SELECT source, path, content_type, bytes, sha256 FROM call_recordings WHERE call_sid = %s"
+            params = [call_sid]
+            if source:
+                sql += " AND source = %s"
+                params.append(source)
+            cursor.execute(sql + " ORDER BY source = %s DESC LIMIT 1", (*params, ULTRAVOX))
+            row = cursor.fetchone()
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+        if row is None:
+            return None
+        row["file"] = os.path.join(self.directory, row["path"])
+        if not row["content_type"].startswith("audio/"):
+            row["content_type"] = MEDIA_TYPES.get(row["path"].rsplit(".", 1)[-1], row["content_type"])
+        return row
+
+    def backfill(self, days: int) -> int:
+        """Queues the archive stage for recent calls with a provider recording. Returns jobs added."""
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT IGNORE INTO post_call_jobs (call_sid, stage, max_attempts, next_run_at) "
+                "SELECT call_sid, 'archive', %s, UTC_TIMESTAMP() FROM call_logs "
+                "WHERE start_time >= UTC_TIMESTAMP() - INTERVAL %s DAY "
+                "AND (recording_url IS NOT NULL OR ultravox_recording_url IS NOT NULL)",
+                (settings.post_call_max_attempts, days)
+            )
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+
+recording_archiver = RecordingArchiver()
+
+
+if __name__ == "__main__":
+    import argparse
+    from ..database import init_db_pool
+
+    parser = argparse.ArgumentParser(description="Queue recording archival for recent calls.")
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+    if not init_db_pool():
+        raise SystemExit("Database unavailable.")
+    print(f"Queued {recording_archiver.backfill(args.days)} archive jobs.")
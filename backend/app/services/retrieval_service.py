@@ -0,0 +1,443 @@
+"""
+Knowledge-base retrieval for /api/kb/search and the question_and_answer tool.
+
+Each worker process loads the chunk embeddings of `knowledge_base_chunks`
+(for the configured embedding model) into an in-memory index and answers
+queries from it: the question is embedded (through the embedding cache, so
+repeated questions cost no API call), scored against the index and the texts
+of the best chunks are read back by primary key.
+
+The index is exact (VectorIndex) for small corpora and approximate (IVFIndex,
+`kb_ivf_nprobe` lists scanned per query) from `kb_ivf_min_chunks` on, or as
+forced by `kb_index_mode`. It is loaded on startup and then kept in sync
+incrementally: immediately after this worker vectorizes documents, and
+otherwise when the periodic check (`kb_index_refresh_seconds`) sees a
+different row count or highest id, which covers documents vectorized by other
+workers. Every `kb_index_rebuild_seconds` the IVF index is retrained in the
+background so centroids follow the corpus and removed chunks are dropped.
+
+With `kb_vector_store_path` set, the workers of a host share one quantized,
+memory-mapped vector file (utils/vector_store.py) instead: when the table
+changed, the first worker to take the file's publish lock rebuilds it from
+MySQL (retraining the IVF centroids if the corpus is large enough) and swaps
+it in atomically; the others wait for the lock and map the new file.
+
+Alongside the vectors each worker keeps a BM25 keyword index of the chunk
+texts (utils/keyword_index.py), synced incrementally by the same loads, so
+literal identifiers like SKUs or policy numbers are found even when their
+embeddings are not close. Searches run both lookups and merge the rankings
+by reciprocal rank fusion.
+"""
+import time
+import asyncio
+import logging
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..config import settings
+from ..database import get_db_connection, Error as DBError
+from ..utils.metrics import metrics
+from ..utils.keyword_index import KeywordIndex
+from ..utils.vector_index import VectorIndex, IVFIndex, normalize_rows, train_centroids
+from ..utils.vector_store import MappedVectorIndex, publish_lock, write_vector_file
+from . import openai_service
+from .answer_cache import answer_cache
+
+logger = logging.getLogger(__name__)
+
+SEARCH_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+LOAD_BATCH = 5000
+KEYWORD_COMPACT_FRACTION = 0.2 # Share of removed chunks at which keyword postings are compacted
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Ids with their fused scores, sum of 1 / (k + rank) over the rankings, best first."""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda entry: -entry[1])
+
+
+class RetrievalService:
+    def __init__(self):
+        self.index = VectorIndex.empty()
+        self._signature: Optional[Tuple[int, int]] = None
+        self._max_id = 0
+        self.keywords = KeywordIndex()
+        self._keyword_max_id = 0
+        self._sync_lock = threading.Lock()
+        self._journal: Optional[list] = None  # changes applied while a rebuild trains
+        self._refresh = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    # --- Loading ---
+
+    def _table_signature(self, cursor) -> Tuple[int, int]:
+        cursor.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM knowledge_base_chunks WHERE model = %s",
+                       (settings.embedding_model,))
+        count, max_id = cursor.fetchone()
+        return int(count), int(max_id)
+
+    def _fetch_vectors(self, cursor, condition: str, params: tuple, expected: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ids and a float32 matrix of the chunks matching `condition`, streamed in batches."""
+        cursor.execute(f"SELECT id, vector FROM knowledge_base_chunks WHERE model = %s AND {condition} ORDER BY id",
+                       (settings.embedding_model,) + params)
+        ids = np.empty(expected, dtype=np.int64)
+        matrix = None
+        loaded = 0
+        while True:
+            rows = cursor.fetchmany(LOAD_BATCH)
+            if not rows:
+                break
+            for chunk_id, blob in rows:
+                vector = np.frombuffer(blob, dtype=np.float32)
+                if matrix is None:
+                    matrix = np.empty((max(expected, len(rows)), len(vector)), dtype=np.float32)
+                if loaded == len(ids):  # rows inserted while loading
+                    ids = np.resize(ids, 2 * loaded + 1)
+                    matrix = np.resize(matrix, (2 * loaded + 1, matrix.shape[1]))
+                ids[loaded] = chunk_id
+                matrix[loaded] = vector
+                loaded += 1
+        if matrix is None:
+            return ids[:0], np.zeros((0, self.index.dimensions), dtype=np.float32)
+        return ids[:loaded], matrix[:loaded]
+
+    def _use_ivf(self, chunks: int) -> bool:
+        mode = settings.kb_index_mode
+        return mode == "ivf" or (mode == "auto" and chunks >= settings.kb_ivf_min_chunks)
+
+    def _build(self, ids: np.ndarray, matrix: np.ndarray):
+        if len(ids) and self._use_ivf(len(ids)):
+            return IVFIndex.train(ids, matrix, nlist=settings.kb_ivf_nlist or None, nprobe=settings.kb_ivf_nprobe)
+        return VectorIndex(ids, matrix)
+
+    def load(self, force: bool = False) -> bool:
+        """
+        Brings the index up to date with the chunk table: the first load (or a forced one)
+        builds it from scratch, later ones add new chunks and drop removed ones. Blocking.
+        """
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            checked_at = time.time()
+            signature = self._table_signature(cursor)
+            if signature == self._signature and not force:
+                return False
+            if settings.kb_vector_store_path:
+                self._load_file(cursor, signature, checked_at)
+            else:
+                self._load_memory(cursor, signature, force)
+            if settings.kb_keyword_search:
+                self._sync_keywords(cursor, signature)
+            self._signature = signature
+            answer_cache.clear()  # answers may be based on replaced or missing chunks
+            return True
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+    def _changed_ids(self, cursor, live: np.ndarray, max_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Ids in `live` no longer in the table, and table ids up to max_id missing from `live`."""
+        cursor.execute("SELECT id FROM knowledge_base_chunks WHERE model = %s AND id <= %s",
+                       (settings.embedding_model, max_id))
+        current = np.fromiter((row[0] for row in cursor.fetchall()), dtype=np.int64)
+        return np.setdiff1d(live, current), np.setdiff1d(current, live)
+
+    def _load_memory(self, cursor, signature: Tuple[int, int], force: bool):
+        start = time.perf_counter()
+        count, max_id = signature
+        with self._sync_lock:
+            if force or not isinstance(self.index, (VectorIndex, IVFIndex)) or self._signature is None:
+                ids, matrix = self._fetch_vectors(cursor, "id <= %s", (max_id,), count)
+                self.index = self._build(ids, matrix)
+                if self._journal is not None:
+                    self._journal = None  # a rebuild in progress is superseded
+                added, removed = len(ids), 0
+                metrics.inc("kb.index_loads")
+            else:
+                added, removed = self._sync(cursor, count, max_id)
+            self._max_id = max_id
+        index = self.index
+        logger.info(f"Knowledge-base index updated (+{added}/-{removed}): {len(index)} chunks x "
+                    f"{index.dimensions} dims, {type(index).__name__} ({index.nbytes / 2 ** 20:.1f} MiB), "
+                    f"{time.perf_counter() - start:.2f}s")
+
+    def _sync(self, cursor, count: int, max_id: int) -> Tuple[int, int]:
+        new_ids, new_matrix = self._fetch_vectors(cursor, "id > %s AND id <= %s", (self._max_id, max_id),
+                                                  max(0, count - len(self.index)))
+        removed = np.zeros(0, dtype=np.int64)
+        if len(self.index) + len(new_ids) != count:
+            # Chunks were replaced (or committed late with older ids): diff the id sets.
+            removed, late = self._changed_ids(cursor, self.index.live_ids(), self._max_id)
+            if len(late):
+                late_ids, late_matrix = self._fetch_vectors(
+                    cursor, f"id IN ({', '.join(['%s'] * len(late))})", tuple(late.tolist()), len(late))
+                new_ids = np.concatenate([new_ids, late_ids])
+                new_matrix = np.concatenate([new_matrix, late_matrix]) if len(new_ids) > len(late_ids) else late_matrix
+        self._apply(new_ids, new_matrix, removed)
+        return len(new_ids), len(removed)
+
+    def _index_texts(self, cursor, condition: str, params: tuple) -> int:
+        """Adds the texts of the chunks matching `condition` to the keyword index, a batch at a time."""
+        cursor.execute(f"SELECT id, text FROM knowledge_base_chunks WHERE model = %s AND {condition} ORDER BY id",
+                       (settings.embedding_model,) + params)
+        added = 0
+        while True:
+            rows = cursor.fetchmany(LOAD_BATCH)
+            if not rows:
+                return added
+            self.keywords.add([row[0] for row in rows], [row[1] for row in rows])
+            added += len(rows)
+
+    def _sync_keywords(self, cursor, signature: Tuple[int, int]):
+        """Adds chunks new since the last sync to the keyword index and drops removed ones."""
+        start = time.perf_counter()
+        count, max_id = signature
+        keywords = self.keywords
+        added = self._index_texts(cursor, "id > %s AND id <= %s", (self._keyword_max_id, max_id))
+        removed = np.zeros(0, dtype=np.int64)
+        if len(keywords) != count:
+            removed, late = self._changed_ids(cursor, keywords.live_ids(), max_id)
+            keywords.remove(removed)
+            if len(late):
+                added += self._index_texts(cursor, f"id IN ({', '.join(['%s'] * len(late))})", tuple(late.tolist()))
+        self._keyword_max_id = max_id
+        if keywords.removed_fraction > KEYWORD_COMPACT_FRACTION:
+            keywords.compact()
+        if added or len(removed):
+            logger.info(f"Keyword index updated (+{added}/-{len(removed)}): {len(keywords)} chunks, "
+                        f"{keywords.vocabulary_size} terms, {keywords.segments} segments "
+                        f"({keywords.nbytes / 2 ** 20:.1f} MiB), {time.perf_counter() - start:.2f}s")
+
+    def _open_file(self, path: str, signature: Tuple[int, int], checked_at: float) -> Optional[MappedVectorIndex]:
+        """The vector file at `path` if it is at least as recent as `signature`, else None."""
+        current = self.index
+        try:
+            index = MappedVectorIndex(path, nprobe=settings.kb_ivf_nprobe)
+        except (OSError, ValueError):  # not published yet, or not a vector file
+            return None
+        if index.model != settings.embedding_model or (
+                index.signature != signature and index.snapshot_time < checked_at):
+            return None
+        if isinstance(current, MappedVectorIndex) and current.file_id == index.file_id:
+            return current
+        return index
+
+    def _load_file(self, cursor, signature: Tuple[int, int], checked_at: float):
+        """Maps the shared vector file, rebuilding and publishing it first if it is stale."""
+        path = settings.kb_vector_store_path
+        index = self._open_file(path, signature, checked_at)
+        if index is None:
+            with publish_lock(path):
+                index = self._open_file(path, signature, checked_at)  # another worker may have published it
+                if index is None:
+                    self._publish_file(cursor, path, signature, checked_at)
+                    index = MappedVectorIndex(path, nprobe=settings.kb_ivf_nprobe)
+        if index is not self.index:
+            self.index = index
+            metrics.inc("kb.index_loads")
+            logger.info(f"Mapped knowledge-base vector file {path}: {len(index)} chunks x {index.dimensions} dims, "
+                        f"{index.dtype}, {index.nlist} lists ({index.nbytes / 2 ** 20:.1f} MiB)")
+
+    def _publish_file(self, cursor, path: str, signature: Tuple[int, int], checked_at: float):
+        start = time.perf_counter()
+        count, max_id = signature
+        ids, matrix = self._fetch_vectors(cursor, "id <= %s", (max_id,), count)
+        centroids = None
+        if len(ids) and self._use_ivf(len(ids)):
+            centroids = train_centroids(normalize_rows(matrix), settings.kb_ivf_nlist or None)
+        write_vector_file(path, ids, matrix, settings.kb_vector_store_dtype, centroids, signature,
+                          settings.embedding_model, checked_at)
+        metrics.inc("kb.index_publishes")
+        logger.info(f"Published knowledge-base vector file {path}: {len(ids)} chunks, "
+                    f"{time.perf_counter() - start:.2f}s")
+
+    def _apply(self, ids: np.ndarray, matrix: np.ndarray, removed: np.ndarray):
+        if len(removed):
+            self.index.remove(removed)
+        if len(ids):
+            if not len(self.index) and isinstance(self.index, VectorIndex):
+                self.index = self._build(ids, matrix)
+            else:
+                self.index.add(ids, matrix)
+        if self._journal is not None:
+            self._journal.append((ids, matrix, removed))
+
+    def rebuild(self) -> bool:
+        """
+        Retrains the index from its live vectors (new IVF centroids, masked removals dropped,
+        or a switch to IVF once the corpus outgrew exact search). Searches and incremental
+        updates continue on the old index meanwhile. Blocking and CPU-heavy.
+        """
+        with self._sync_lock:
+            index = self.index
+            if isinstance(index, MappedVectorIndex) or not len(index) or not (
+                    isinstance(index, IVFIndex) or self._use_ivf(len(index))):
+                return False  # vector files are retrained whenever they are published
+            ids, matrix = index.vectors()
+            self._journal = []
+        start = time.perf_counter()
+        rebuilt = IVFIndex.train(ids, matrix.copy() if isinstance(index, VectorIndex) else matrix,
+                                 nlist=settings.kb_ivf_nlist or None, nprobe=settings.kb_ivf_nprobe)
+        with self._sync_lock:
+            if self._journal is None:
+                return False  # a full load replaced the index meanwhile
+            for new_ids, new_matrix, removed in self._journal:
+                if len(removed):
+                    rebuilt.remove(removed)
+                if len(new_ids):
+                    rebuilt.add(new_ids, new_matrix)
+            self._journal = None
+            self.index = rebuilt
+        metrics.inc("kb.index_rebuilds")
+        logger.info(f"Rebuilt knowledge-base IVF index: {len(rebuilt)} chunks, {rebuilt.nlist} lists, "
+                    f"{time.perf_counter() - start:.1f}s")
+        return True
+
+    def request_refresh(self):
+        """Syncs the index soon, e.g. after documents were vectorized."""
+        self._refresh.set()
+
+    def start(self):
+        if not self._tasks:
+            self._refresh = asyncio.Event()
+            self._refresh.set()  # initial load
+            self._tasks = [asyncio.create_task(self._loop())]
+            if settings.kb_index_rebuild_seconds > 0 and not settings.kb_vector_store_path:
+                self._tasks.append(asyncio.create_task(self._rebuild_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._refresh.wait(), timeout=settings.kb_index_refresh_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._refresh.clear()
+            try:
+                await asyncio.to_thread(self.load)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Loading the knowledge-base index failed: {e}")
+
+    async def _rebuild_loop(self):
+        while True:
+            await asyncio.sleep(settings.kb_index_rebuild_seconds)
+            try:
+                await asyncio.to_thread(self.rebuild)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Rebuilding the knowledge-base index failed: {e}", exc_info=True)
+
+    # --- Queries ---
+
+    def search_vector(self, vector: np.ndarray, top_k: int, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Chunk ids and similarities of the top_k chunks. CPU-bound; releases the GIL."""
+        with metrics.histogram("kb.search_seconds", SEARCH_BUCKETS).time():
+            return self.index.search(vector, top_k, nprobe)
+
+    def search_keywords(self, query: str, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Chunk ids and BM25 scores of the top_k keyword matches."""
+        with metrics.histogram("kb.keyword_search_seconds", SEARCH_BUCKETS).time():
+            return self.keywords.search(query, top_k)
+
+    def _fetch_chunks(self, ids: List[int]) -> dict:
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                f"SELECT id, document_id, chunk_index, text FROM knowledge_base_chunks "
+                f"WHERE id IN ({', '.join(['%s'] * len(ids))})",
+                ids
+            )
+            return {row["id"]: row for row in cursor.fetchall()}
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+    async def search(self, query: str, top_k: int = 5, vector: Optional[List[float]] = None) -> List[dict]:
+        """
+        The top_k chunks best matching the query. With keyword search enabled the vector and
+        BM25 rankings (kb_hybrid_candidates each) are fused; the keyword lookup runs while
+        the query is being embedded (unless its embedding is passed in), and answers alone
+        if embedding fails.
+        """
+        start = time.perf_counter()
+        hybrid = settings.kb_keyword_search and len(self.keywords) > 0
+        candidates = max(top_k, settings.kb_hybrid_candidates) if hybrid else top_k
+        lookups = [openai_service.get_embedding(query, model=settings.embedding_model) if vector is None
+                   else asyncio.sleep(0, result=vector)]
+        if hybrid:
+            lookups.append(asyncio.to_thread(self.search_keywords, query, candidates))
+        vector, *keyword_hits = await asyncio.gather(*lookups)
+        keyword_ids, keyword_scores = keyword_hits[0] if keyword_hits else (np.zeros(0, dtype=np.int64), None)
+        if vector is not None:
+            ids, scores = await asyncio.to_thread(self.search_vector, np.asarray(vector, dtype=np.float32), candidates)
+        elif len(keyword_ids):
+            logger.warning("Embedding the query failed; answering from keyword matches only.")
+            ids, scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        else:
+            raise RuntimeError("Embedding the query failed.")
+        ranked = reciprocal_rank_fusion([ids.tolist(), keyword_ids.tolist()], settings.kb_rrf_k)[:top_k]
+        if not ranked:
+            return []
+        rows = await asyncio.to_thread(self._fetch_chunks, [i for i, _ in ranked])
+        metrics.histogram("kb.retrieve_seconds").observe(time.perf_counter() - start)
+        similarity = dict(zip(ids.tolist(), scores.tolist()))
+        keyword = dict(zip(keyword_ids.tolist(), keyword_scores.tolist())) if len(keyword_ids) else {}
+        return [
+            {"text": rows[i]["text"],
+             "similarity_score": round(similarity[i], 4) if i in similarity else None,
+             "keyword_score": round(keyword[i], 4) if i in keyword else None,
+             "score": round(fused, 6),
+             "document_id": rows[i]["document_id"], "chunk_index": rows[i]["chunk_index"]}
+            for i, fused in ranked if i in rows
+        ]
+
+    async def answer_context(self, question: str) -> str:
+        """
+        Knowledge-base passages for the agent to answer the question from, served from the
+        answer cache when the same or a very similar question was answered recently.
+        """
+        start = time.perf_counter()
+        cached = answer_cache.get_exact(question)
+        if cached is not None:
+            return cached
+        vector = await openai_service.get_embedding(question, model=settings.embedding_model)
+        if vector is not None:
+            cached = answer_cache.get_similar(vector)
+            if cached is not None:
+                return cached
+        results = await self.search(question, settings.kb_answer_top_k, vector=vector)
+        results = [r for r in results if r["keyword_score"] is not None
+                   or r["similarity_score"] >= settings.kb_answer_min_score]
+        passages, size = [], 0
+        for r in results:
+            if passages and size + len(r["text"]) > settings.kb_answer_max_chars:
+                break
+            passages.append(r["text"][:settings.kb_answer_max_chars])
+            size += len(passages[-1])
+        context = "\n\n".join(passages)
+        if vector is not None:
+            answer_cache.put(question, vector, context, time.perf_counter() - start)
+        return context
+
+
+retrieval_service = RetrievalService()
@@ -0,0 +1,403 @@
+"""
+Durable call scheduler: future dials, retries and calling windows.
+
+Jobs live in the `scheduled_calls` table. Each worker keeps only the jobs due
+within the next `scheduler_horizon_seconds` in an in-memory hierarchical timing
+wheel, refreshed by an indexed range query on (status, run_at) every
+`scheduler_load_interval` seconds, so the table is never scanned per tick.
+
+Only the worker elected as campaign dispatcher claims and dials due jobs, so
+its token bucket keeps scheduled and campaign dials together within the
+account's calls-per-second limit; on other workers fired timers are dropped and
+the loader re-arms still-pending jobs. Claims are a conditional UPDATE (status
+'pending' -> 'claimed' with a per-batch claim token), so a job is never dialed
+twice even across a leadership handover. Claims that are never completed
+(worker crash) expire after `scheduler_claim_ttl` seconds.
+
+Retries: when the Twilio status callback reports an outcome listed in the
+job's `retry_on`, the job is re-armed with exponential backoff, moved into the
+recipient's local calling window.
+"""
+import uuid
+import asyncio
+import logging
+from datetime import datetime, time as dtime, timedelta, timezone
+from typing import List, Optional, Sequence
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from ..config import settings
+from ..database import get_db_connection, Error as DBError
+from ..utils.timing_wheel import TimingWheel
+from .analytics_service import TERMINAL_STATUSES
+from .campaign_service import campaign_dispatcher
+from ..utils.twiml import outbound_stream_twiml
+from .pacing_service import media_session_tracker
+from .twilio_service import twilio_service
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETRY_ON = ('no-answer', 'busy', 'failed')
+CLAIM_BATCH_SIZE = 200
+_OUTCOME_COLUMNS = ("id, attempt, max_attempts, retry_backoff_seconds, retry_backoff_multiplier, retry_on, "
+                    "timezone, window_start, window_end")
+LOAD_LIMIT = 50000
+
+
+class SchedulerError(Exception):
+    pass
+
+
+def to_epoch(value: datetime) -> float:
+    """Naive UTC datetime (as stored in MySQL) -> epoch seconds."""
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+def next_in_window(candidate: datetime, tz_name: str, window_start: Optional[dtime],
+                   window_end: Optional[dtime]) -> datetime:
+    """
+    Earliest naive-UTC time >= candidate that falls inside the recipient's local
+    calling window [window_start, window_end). Windows may wrap past midnight.
+    """
+    if window_start is None or window_end is None or window_start == window_end:
+        return candidate
+    tz = ZoneInfo(tz_name or "UTC")
+    local = candidate.replace(tzinfo=timezone.utc).astimezone(tz)
+    t = local.time()
+    if window_start < window_end:
+        inside = window_start <= t < window_end
+    else:
+        inside = t >= window_start or t < window_end
+    if inside:
+        return candidate
+    day = local.date()
+    if window_start < window_end and t >= window_end:
+        day += timedelta(days=1)
+    opening = datetime.combine(day, window_start, tzinfo=tz)
+    return opening.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _as_time(value) -> Optional[dtime]:
+    """MySQL TIME columns come back as timedelta."""
+    if value is None or isinstance(value, dtime):
+        return value
+    seconds = int(value.total_seconds())
+    return dtime(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+class CallScheduler:
+    def __init__(self):
+        self.horizon = settings.scheduler_horizon_seconds
+        self.load_interval = settings.scheduler_load_interval
+        self.claim_ttl = settings.scheduler_claim_ttl
+        self.wheel = TimingWheel(tick=1.0, slots_per_wheel=64, levels=3,
+                                 start=datetime.now(timezone.utc).timestamp())
+        self._tasks: List[asyncio.Task] = []
+        self._in_flight: set = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _on_loop(self, fn, *args):
+        """The wheel is only touched from the event loop; route helpers run in threads."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(fn, *args)
+
+    def create_tables(self, cursor):
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS scheduled_calls (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                to_number VARCHAR(50) NOT NULL,
+                from_number VARCHAR(50) NOT NULL,
+                run_at DATETIME NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                attempt INT NOT NULL DEFAULT 0,
+                max_attempts INT NOT NULL DEFAULT 3,
+                retry_backoff_seconds INT NOT NULL DEFAULT 900,
+                retry_backoff_multiplier FLOAT NOT NULL DEFAULT 2.0,
+                retry_on VARCHAR(100) NOT NULL DEFAULT 'no-answer,busy,failed',
+                timezone VARCHAR(64) NOT NULL DEFAULT 'UTC',
+                window_start TIME NULL,
+                window_end TIME NULL,
+                call_sid VARCHAR(255) NULL,
+                last_status VARCHAR(50) NULL,
+                claimed_by VARCHAR(100) NULL,
+                claim_token CHAR(32) NULL,
+                claimed_until DATETIME NULL,
+                last_error TEXT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                INDEX idx_scheduled_due (status, run_at),
+                INDEX idx_scheduled_call_sid (call_sid),
+                INDEX idx_scheduled_claim (claim_token)
+            );
+            """
+        )
+
+    # --- Job management (blocking, called from routes) ---
+
+    def schedule_call(self, to_number: str, run_at: Optional[datetime] = None, from_number: Optional[str] = None,
+                      tz_name: str = "UTC", window_start: Optional[dtime] = None, window_end: Optional[dtime] = None,
+                      max_attempts: int = 3, retry_backoff_seconds: int = 900,
+                      retry_backoff_multiplier: float = 2.0, retry_on: Sequence[str] = DEFAULT_RETRY_ON) -> dict:
+        try:
+            ZoneInfo(tz_name)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise SchedulerError(f"Unknown time zone '{tz_name}'.")
+        unknown = [status for status in retry_on if status not in TERMINAL_STATUSES]
+        if unknown:
+            raise SchedulerError(f"Unknown call outcome(s) in retry_on: {', '.join(unknown)}; "
+                                 f"expected any of {', '.join(TERMINAL_STATUSES)}.")
+        retry_on = list(dict.fromkeys(retry_on))
+        run_at = next_in_window(run_at or datetime.utcnow(), tz_name, window_start, window_end)
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO scheduled_calls (to_number, from_number, run_at, max_attempts, retry_backoff_seconds,
+                    retry_backoff_multiplier, retry_on, timezone, window_start, window_end)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """,
+                (to_number, from_number or settings.twilio_from_number, run_at, max_attempts, retry_backoff_seconds,
+                 retry_backoff_multiplier, ",".join(retry_on), tz_name, window_start, window_end)
+            )
+            job_id = cursor.lastrowid
+            conn.commit()
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+        # Near-term jobs go straight into this worker's wheel; others arrive via the loader.
+        if to_epoch(run_at) - datetime.now(timezone.utc).timestamp() < self.horizon:
+            self._on_loop(self.wheel.schedule, job_id, to_epoch(run_at))
+        return self.get_job(job_id)
+
+    def get_job(self, job_id: int) -> Optional[dict]:
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM scheduled_calls WHERE id = %s", (job_id,))
+            job = cursor.fetchone()
+            if job:
+                job['window_start'] = _as_time(job['window_start'])
+                job['window_end'] = _as_time(job['window_end'])
+            return job
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+
+    def list_jobs(self, status: Optional[str] = None, limit: int = 100) -> List[dict]:
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=True)
+            if status:
+                cursor.execute(
+                    "SELECT * FROM scheduled_calls WHERE status = %s ORDER BY run_at LIMIT %s", (status, limit)
+                )
+            else:
+                cursor.execute("SELECT * FROM scheduled_calls ORDER BY id DESC LIMIT %s", (limit,))
+            jobs = cursor.fetchall()
+            for job in jobs:
+                job['window_start'] = _as_time(job['window_start'])
+                job['window_end'] = _as_time(job['window_end'])
+            return jobs
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+
+    def cancel_job(self, job_id: int) -> bool:
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE scheduled_calls SET status = 'cancelled' WHERE id = %s AND status = 'pending'", (job_id,)
+            )
+            conn.commit()
+            cancelled = cursor.rowcount == 1
+        finally:
+            if cursor: cursor.close()
+            if conn: conn.close()
+        self._on_loop(self.wheel.cancel, job_id)
+        return cancelled
+
+    def on_call_status(self, cursor, call_sid: str, call_status: str):
+        """
+        Applies a terminal Twilio status to the scheduled job that placed the call,
+        re-arming it for a retry when the policy allows. Uses the caller's cursor.
+        """
+        cursor.execute(
+            f"SELECT {_OUTCOME_COLUMNS} FROM scheduled_calls WHERE call_sid = %s AND status = 'dialed' FOR UPDATE",
+            (call_sid,)
+        )
+        row = cursor.fetchone()
+        if row:
+            self._apply_outcome(cursor, row, call_status)
+
+    def _apply_outcome(self, cursor, row, call_status: str):
+        (job_id, attempt, max_attempts, backoff, multiplier, retry_on,
+         tz_name, window_start, window_end) = row
+        attempt += 1
+        if call_status in retry_on.split(",") and attempt < max_attempts:
+            delay = backoff * multiplier ** (attempt - 1)
+            run_at = next_in_window(datetime.utcnow() + timedelta(seconds=delay), tz_name,
+                                    _as_time(window_start), _as_time(window_end))
+            cursor.execute(
+                "UPDATE scheduled_calls SET status = 'pending', attempt = %s, run_at = %s, last_status = %s, "
+                "call_sid = NULL, claimed_by = NULL, claim_token = NULL, claimed_until = NULL WHERE id = %s",
+                (attempt, run_at, call_status, job_id)
+            )
+            logger.info(f"Scheduled call {job_id}: {call_status}, retry {attempt + 1}/{max_attempts} at {run_at}")
+        else:
+            final = 'completed' if call_status == 'completed' else 'exhausted'
+            cursor.execute(
+                "UPDATE scheduled_calls SET status = %s, attempt = %s, last_status = %s WHERE id = %s",
+                (final, attempt, call_status, job_id)
+            )
+
+    # --- Background loops ---
+
+    def start(self):
+        if not self._tasks:
+            self._loop = asyncio.get_running_loop()
+            self._tasks = [asyncio.create_task(self._load_loop()), asyncio.create_task(self._tick_loop())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    async def _load_loop(self):
+        while True:
+            try:
+                jobs = await asyncio.to_thread(self._load_due)
+                for job_id, run_at in jobs:
+                    if job_id not in self.wheel:
+                        self.wheel.schedule(job_id, to_epoch(run_at))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Scheduler load failed: {e}", exc_info=True)
+            await asyncio.sleep(self.load_interval)
+
+    def _load_due(self):
+        """Releases expired claims and returns (id, run_at) of jobs due within the horizon."""
+        conn = get_db_connection()
+        if conn is None:
+            return []
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE scheduled_calls SET status = 'pending', claimed_by = NULL, claim_token = NULL "
+                "WHERE status = 'claimed' AND claimed_until < UTC_TIMESTAMP()"
+            )
+            conn.commit()
+            cursor.execute(
+                "SELECT id, run_at FROM scheduled_calls WHERE status = 'pending' "
+                "AND run_at < UTC_TIMESTAMP() + INTERVAL %s SECOND ORDER BY run_at LIMIT %s",
+                (self.horizon, LOAD_LIMIT)
+            )
+            return cursor.fetchall()
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+    async def _tick_loop(self):
+        while True:
+            await asyncio.sleep(1.0)
+            due = self.wheel.advance(datetime.now(timezone.utc).timestamp())
+            if not campaign_dispatcher.is_leader:
+                continue  # the leader dials; the loader re-arms anything still pending here
+            for i in range(0, len(due), CLAIM_BATCH_SIZE):
+                try:
+                    jobs = await asyncio.to_thread(self._claim, due[i:i + CLAIM_BATCH_SIZE])
+                except Exception as e:
+                    logger.error(f"Scheduler claim failed: {e}", exc_info=True)
+                    continue
+                for job in jobs:
+                    task = asyncio.create_task(self._dial(job))
+                    self._in_flight.add(task)
+                    task.add_done_callback(self._in_flight.discard)
+
+    def _claim(self, job_ids: List[int]) -> List[dict]:
+        """Atomically claims the still-pending jobs among job_ids for this worker."""
+        conn = get_db_connection()
+        if conn is None:
+            return []
+        cursor = None
+        token = uuid.uuid4().hex
+        try:
+            cursor = conn.cursor(dictionary=True)
+            placeholders = ", ".join(["%s"] * len(job_ids))
+            cursor.execute(
+                f"UPDATE scheduled_calls SET status = 'claimed', claimed_by = %s, claim_token = %s, "
+                f"claimed_until = UTC_TIMESTAMP() + INTERVAL %s SECOND "
+                f"WHERE id IN ({placeholders}) AND status = 'pending' AND run_at <= UTC_TIMESTAMP()",
+                (media_session_tracker.worker_id, token, self.claim_ttl, *job_ids)
+            )
+            conn.commit()
+            if cursor.rowcount == 0:
+                return []
+            cursor.execute(
+                "SELECT id, to_number, from_number, attempt FROM scheduled_calls WHERE claim_token = %s", (token,)
+            )
+            return cursor.fetchall()
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+    async def _dial(self, job: dict):
+        call_sid, error = None, None
+        try:
+            await campaign_dispatcher.bucket.acquire()
+            twiml = outbound_stream_twiml(job['from_number'], job['to_number'])
+            call = await twilio_service.make_call_async(
+                to_number=job['to_number'], from_number=job['from_number'], twiml=twiml
+            )
+            call_sid = call.sid
+            logger.info(f"Scheduled call {job['id']} dialed {job['to_number']}, SID={call_sid}")
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Scheduled call {job['id']} failed to dial {job['to_number']}: {e}")
+        await asyncio.to_thread(self._record_dial, job, call_sid, error)
+
+    def _record_dial(self, job: dict, call_sid: Optional[str], error: Optional[str]):
+        conn = get_db_connection()
+        if conn is None:
+            logger.error(f"Database unavailable recording scheduled call {job['id']}.")
+            return
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            if call_sid:
+                cursor.execute(
+                    "UPDATE scheduled_calls SET status = 'dialed', call_sid = %s, claimed_until = NULL WHERE id = %s",
+                    (call_sid, job['id'])
+                )
+            else:
+                # Dial errors count as a 'failed' outcome for the retry policy.
+                cursor.execute("UPDATE scheduled_calls SET last_error = %s WHERE id = %s", (error, job['id']))
+                cursor.execute(f"SELECT {_OUTCOME_COLUMNS} FROM scheduled_calls WHERE id = %s FOR UPDATE", (job['id'],))
+                self._apply_outcome(cursor, cursor.fetchone(), 'failed')
+            conn.commit()
+        except DBError as e:
+            logger.error(f"Database error recording scheduled call {job['id']}: {e}")
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+
+call_scheduler = CallScheduler()
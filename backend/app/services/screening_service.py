@@ -0,0 +1,144 @@
+"""
+Dial-list screening in front of the bulk/campaign path.
+
+Every submitted list is normalized in vectorized batches and checked for
+duplicates within the list, do-not-call entries (`dnc_numbers`) and numbers
+already called within `screening_recent_days` (from `call_logs`). The DNC and
+recent-call sets are loaded from MySQL into memory-compact Bloom filters with
+exact hash-index confirmation, and refreshed every `screening_refresh_seconds`,
+so screening a list of millions of numbers never queries MySQL per number.
+"""
+import time
+import logging
+import threading
+from collections import Counter
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from ..config import settings
+from ..database import get_db_connection, Error as DBError
+from ..utils.number_screening import (
+    NumberSet, normalize_numbers, format_e164, screen, REASON_OK
+)
+
+logger = logging.getLogger(__name__)
+
+LOAD_FETCH_SIZE = 100000
+
+
+class ScreeningResult:
+    def __init__(self, numbers: Sequence[str], normalized: np.ndarray, reasons: np.ndarray):
+        self.numbers = numbers
+        self.normalized = normalized
+        self.reasons = reasons
+
+    @property
+    def accepted(self) -> List[str]:
+        """E.164 numbers that passed screening, in submission order."""
+        return format_e164(self.normalized[self.reasons == REASON_OK])
+
+    def summary(self) -> dict:
+        return dict(Counter(self.reasons.tolist()))
+
+    def rejected(self, limit: Optional[int] = None) -> List[dict]:
+        """Rejected numbers with their reason, in submission order (the first `limit` of them)."""
+        idx = np.flatnonzero(self.reasons != REASON_OK)[:limit]
+        return [{"number": self.numbers[i], "reason": self.reasons[i]} for i in idx.tolist()]
+
+    def results(self) -> List[dict]:
+        e164 = format_e164(self.normalized)
+        return [
+            {"number": number, "normalized": normalized, "reason": reason}
+            for number, normalized, reason in zip(self.numbers, e164, self.reasons.tolist())
+        ]
+
+
+class ScreeningService:
+    def __init__(self):
+        self.country_code = settings.screening_default_country_code
+        self.recent_days = settings.screening_recent_days
+        self.refresh_seconds = settings.screening_refresh_seconds
+        self.dnc: Optional[NumberSet] = None
+        self.recent: Optional[NumberSet] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def create_tables(self, cursor):
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS dnc_numbers (
+                phone_number BIGINT PRIMARY KEY, -- E.164 digits without '+'
+                source VARCHAR(100) NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """
+        )
+
+    def _fetch_column(self, cursor, sql: str, params: tuple = ()) -> list:
+        cursor.execute(sql, params)
+        values = []
+        while True:
+            rows = cursor.fetchmany(LOAD_FETCH_SIZE)
+            if not rows:
+                return values
+            values.extend(row[0] for row in rows)
+
+    def refresh(self, force: bool = False):
+        """Rebuilds the DNC and recent-call sets when stale. Blocking."""
+        with self._lock:
+            if not force and self.dnc is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+                return
+            conn = get_db_connection()
+            if conn is None:
+                raise DBError("Database connection unavailable.")
+            cursor = None
+            try:
+                cursor = conn.cursor()
+                dnc = self._fetch_column(cursor, "SELECT phone_number FROM dnc_numbers")
+                recent = self._fetch_column(
+                    cursor,
+                    "SELECT DISTINCT to_number FROM call_logs "
+                    "WHERE start_time > UTC_TIMESTAMP() - INTERVAL %s DAY AND direction LIKE 'outbound%%'",
+                    (self.recent_days,)
+                )
+            finally:
+                if cursor: cursor.close()
+                conn.close()
+            self.dnc = NumberSet(np.asarray(dnc, dtype=np.int64))
+            self.recent = NumberSet(normalize_numbers(recent, self.country_code))
+            self._loaded_at = time.monotonic()
+            logger.info(f"Screening sets loaded: {len(self.dnc)} DNC numbers, {len(self.recent)} recently called.")
+
+    def screen_numbers(self, numbers: Sequence[str], check_recent: bool = True) -> ScreeningResult:
+        """Screens a dial list. Blocking (CPU-bound); call via asyncio.to_thread from routes."""
+        self.refresh()
+        normalized = normalize_numbers(numbers, self.country_code)
+        reasons = screen(normalized, self.dnc, self.recent if check_recent else None)
+        return ScreeningResult(numbers, normalized, reasons)
+
+    def add_dnc(self, numbers: Sequence[str], source: Optional[str] = None) -> int:
+        normalized = normalize_numbers(numbers, self.country_code)
+        valid = np.unique(normalized[normalized != 0])
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "INSERT IGNORE INTO dnc_numbers (phone_number, source) VALUES (%s, %s)",
+                [(int(v), source) for v in valid.tolist()]
+            )
+            conn.commit()
+            inserted = cursor.rowcount
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+        with self._lock:
+            if self.dnc is not None:
+                self.dnc.add(valid)
+        return inserted
+
+
+screening_service = ScreeningService()
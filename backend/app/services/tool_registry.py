@@ -0,0 +1,210 @@
+"""
+Client tools offered to Ultravox agents, and their dispatch.
+
+Each tool is declared once as a ToolSpec registered in `tool_registry`. The
+spec yields both the tool's `selectedTools` entry in the call-creation
+payload (including its `"timeout"`) and how its invocations run: Ultravox
+stops waiting for a `client_tool_result` after that timeout, so a handler
+still running then is cancelled and an error result is sent instead.
+Invocations of a tool beyond its `max_concurrency` on this worker wait for a
+slot, within the same timeout.
+
+A ToolDispatcher per Ultravox socket runs every `client_tool_invocation` as
+its own task, so a slow tool never holds up the socket's message loop (and
+with it the agent's audio). Everything sent to the socket, tool results and
+the caller's audio alike, goes through the dispatcher's single writer task.
+
+Per tool, latency is observed in the `tools.<name>_seconds` histogram and
+outcomes are counted as `tools.<name>.<ok|error|timeout>`; invocations and
+results are recorded on the call's event timeline.
+"""
+import json
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from ..config import settings
+from ..utils.metrics import metrics
+from .call_events_service import call_events
+
+logger = logging.getLogger(__name__)
+
+TOOL_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0)
+WRITER_QUEUE = 256 # Messages waiting for the socket writer before senders wait
+
+
+class ToolCall(NamedTuple):
+    invocation_id: str
+    parameters: dict
+    call_sid: Optional[str]
+    context: dict  # per-call objects handlers may use, e.g. the call's QuestionPrefetcher
+
+
+@dataclass
+class ToolSpec:
+    name: str
+    description: str
+    handler: Callable[[ToolCall], Awaitable[str]]  # returns the result text for the agent
+    parameters: Dict[str, str] = field(default_factory=dict)  # required string parameters -> description
+    timeout: float = 20.0
+    max_concurrency: Optional[int] = None  # per worker; tool_max_concurrency when None
+    error_message: str = "An error occurred while processing your request."
+    ends_call: bool = False  # the dispatcher's on_end_call runs after a successful result
+
+    def selected_tool(self) -> dict:
+        """The tool's `selectedTools` entry for creating an Ultravox call."""
+        return {"temporaryTool": {
+            "modelToolName": self.name,
+            "description": self.description,
+            "dynamicParameters": [
+                {
+                    "name": name,
+                    "location": "PARAMETER_LOCATION_BODY",
+                    "schema": {"type": "string", "description": description},
+                    "required": True,
+                }
+                for name, description in self.parameters.items()
+            ],
+            "timeout": f"{self.timeout:g}s",
+            "client": {},
+        }}
+
+
+def tool_result(invocation_id: str, result: Optional[str] = None, error_type: Optional[str] = None,
+                error_message: Optional[str] = None) -> dict:
+    if error_type:
+        return {"type": "client_tool_result", "invocationId": invocation_id,
+                "error_type": error_type, "error_message": error_message}
+    return {"type": "client_tool_result", "invocationId": invocation_id,
+            "result": result, "response_type": "tool-response"}
+
+
+class ToolRegistry:
+    def __init__(self):
+        self.specs: Dict[str, ToolSpec] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def register(self, spec: ToolSpec) -> ToolSpec:
+        self.specs[spec.name] = spec
+        return spec
+
+    def selected_tools(self, names: Optional[Sequence[str]] = None) -> List[dict]:
+        """`selectedTools` for the named tools (all registered tools by default)."""
+        return [self.specs[name].selected_tool() for name in (names if names is not None else self.specs)]
+
+    def _semaphore(self, spec: ToolSpec) -> asyncio.Semaphore:
+        if spec.name not in self._semaphores:
+            self._semaphores[spec.name] = asyncio.Semaphore(spec.max_concurrency or settings.tool_max_concurrency)
+        return self._semaphores[spec.name]
+
+    async def _run(self, spec: ToolSpec, call: ToolCall) -> str:
+        async with self._semaphore(spec):
+            return await spec.handler(call)
+
+    async def invoke(self, name: str, call: ToolCall) -> dict:
+        """Runs one invocation to its client_tool_result, within the tool's timeout."""
+        spec = self.specs.get(name)
+        if spec is None:
+            logger.warning(f"Received unhandled tool invocation: {name} (ID: {call.invocation_id})")
+            metrics.inc("tools.not_implemented")
+            return tool_result(call.invocation_id, error_type="not-implemented",
+                               error_message=f"Tool '{name}' is not implemented.")
+        start = time.perf_counter()
+        try:
+            result = tool_result(call.invocation_id, await asyncio.wait_for(self._run(spec, call), spec.timeout))
+            outcome = "ok"
+        except asyncio.TimeoutError:
+            logger.error(f"Tool {name} timed out after {spec.timeout:g}s for CallSid={call.call_sid}")
+            result = tool_result(call.invocation_id, error_type="implementation-error",
+                                 error_message=f"The {name} tool did not respond in time.")
+            outcome = "timeout"
+        except Exception as e:
+            logger.error(f"Error in tool {name} for CallSid={call.call_sid}: {e}", exc_info=True)
+            result = tool_result(call.invocation_id, error_type="implementation-error", error_message=spec.error_message)
+            outcome = "error"
+        metrics.histogram(f"tools.{name}_seconds", TOOL_BUCKETS).observe(time.perf_counter() - start)
+        metrics.inc(f"tools.{name}.{outcome}")
+        return result
+
+
+tool_registry = ToolRegistry()
+
+
+class ToolDispatcher:
+    """Runs one Ultravox socket's tool invocations as tasks and owns its writes."""
+
+    def __init__(self, socket, call_sid: Optional[str] = None, context: Optional[dict] = None,
+                 on_end_call: Optional[Callable[[], Awaitable]] = None, registry: ToolRegistry = tool_registry):
+        self.socket = socket
+        self.call_sid = call_sid
+        self.context = context or {}
+        self.on_end_call = on_end_call
+        self.registry = registry
+        self._queue: asyncio.Queue = asyncio.Queue(WRITER_QUEUE)
+        self._tasks = set()
+        self._closed = False
+        self._writer = asyncio.create_task(self._write())
+
+    @property
+    def active(self) -> int:
+        return len(self._tasks)
+
+    async def send(self, message):
+        """Queues a text or binary message for the socket; dropped once the socket is gone."""
+        if not self._closed:
+            await self._queue.put(message)
+
+    async def drain(self):
+        """Waits until everything queued so far has been written (or the socket is gone)."""
+        if not self._closed:
+            await self._queue.join()
+
+    async def _write(self):
+        try:
+            while True:
+                message = await self._queue.get()
+                try:
+                    await self.socket.send(message)
+                finally:
+                    self._queue.task_done()
+        except Exception as e:
+            logger.warning(f"Ultravox socket writer stopped for CallSid={self.call_sid}: {e}")
+        finally:
+            self._closed = True
+            while not self._queue.empty():  # releases senders waiting for room
+                self._queue.get_nowait()
+                self._queue.task_done()
+
+    def dispatch(self, message: dict) -> asyncio.Task:
+        """Starts a client_tool_invocation message's tool without waiting for it."""
+        task = asyncio.create_task(self._invoke(message))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _invoke(self, message: dict):
+        name = message.get("toolName", "")
+        invocation_id = message.get("invocationId")
+        start = time.perf_counter()
+        call_events.record(self.call_sid, "tool", "invocation", {"tool": name, "invocationId": invocation_id})
+        call = ToolCall(invocation_id, message.get("parameters") or {}, self.call_sid, self.context)
+        result = await self.registry.invoke(name, call)
+        await self.send(json.dumps(result))
+        call_events.record(self.call_sid, "tool", "result", {
+            "tool": name, "invocationId": invocation_id, "error_type": result.get("error_type"),
+            "latency_ms": round((time.perf_counter() - start) * 1000, 2)
+        })
+        spec = self.registry.specs.get(name)
+        if spec and spec.ends_call and "result" in result and self.on_end_call:
+            await self.drain()  # the result goes out before the call ends
+            await self.on_end_call()
+
+    async def close(self):
+        """Cancels running invocations and the writer."""
+        self._closed = True
+        tasks = list(self._tasks) + [self._writer]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,11 +1,34 @@
 from twilio.rest import Client
+from twilio.http.async_http_client import AsyncTwilioHttpClient
 from ..config import settings
 from ..database import get_db_connection, Error as DBError # Added DB imports (using mysql.connector.Error as DBError)
+from ..utils.metrics import metrics
+from .call_log_writer import call_log_writer
+from .archive_service import insert_call_logs
 from datetime import datetime # Added datetime
+from typing import Optional
+from urllib.parse import urlencode
+import time
 import logging # Added logging
 
 logger = logging.getLogger(__name__)
 
+TWILIO_API_BASE = "https://api.twilio.com"
+
+
+class _RebasedAsyncHttpClient(AsyncTwilioHttpClient):
+    """Sends API requests to settings.twilio_api_base_url (e.g. a local fake server)."""
+
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url.rstrip("/")
+
+    async def request(self, method, url, *args, **kwargs):
+        if url.startswith(TWILIO_API_BASE):
+            url = self.base_url + url[len(TWILIO_API_BASE):]
+        return await super().request(method, url, *args, **kwargs)
+
+
 class TwilioService:
     def __init__(self):
         # Ensure credentials are valid
@@ -16,6 +39,63 @@ class TwilioService:
              self.client = None
         else:
             self.client = Client(settings.twilio_account_sid, settings.twilio_auth_token)
+        self._async_client = None
+
+    def _status_callback_args(self, query: Optional[dict] = None) -> dict:
+        url = f"{settings.base_url}/api/calls/call-status"
+        return dict(
+            status_callback=f"{url}?{urlencode(query)}" if query else url,
+            status_callback_method="POST",
+            status_callback_event=["initiated", "ringing", "answered", "completed"]
+        )
+
+    def _get_async_client(self) -> Client:
+        # Created on first use so the aiohttp session binds to the running loop;
+        # the session's connection pool keeps TLS connections to Twilio alive between dials.
+        if self._async_client is None:
+            kwargs = dict(timeout=settings.twilio_http_timeout)
+            http_client = (_RebasedAsyncHttpClient(settings.twilio_api_base_url, **kwargs)
+                           if settings.twilio_api_base_url else AsyncTwilioHttpClient(**kwargs))
+            self._async_client = Client(settings.twilio_account_sid, settings.twilio_auth_token,
+                                        http_client=http_client)
+        return self._async_client
+
+    async def close(self):
+        if self._async_client is not None:
+            await self._async_client.http_client.close()
+            self._async_client = None
+
+    async def make_call_async(self, to_number: str, from_number: str, twiml: str,
+                              status_callback_query: Optional[dict] = None, ring_timeout: Optional[int] = None):
+        """
+        Non-blocking make_call: awaits the Twilio API over a pooled aiohttp session and
+        returns once the SID is known. The call_logs insert is handed to call_log_writer.
+        `status_callback_query` is added to the status callback URL, so callbacks can be
+        matched to the caller's records before the SID is known.
+        """
+        if not self.client:
+            logger.error("Twilio client not initialized due to missing credentials.")
+            raise Exception("Twilio client not initialized.")
+
+        start = time.perf_counter()
+        try:
+            call_resource = await self._get_async_client().calls.create_async(
+                to=to_number,
+                from_=from_number,
+                twiml=twiml,
+                **({"timeout": ring_timeout} if ring_timeout else {}),
+                **self._status_callback_args(status_callback_query)
+            )
+        except Exception as e:
+            metrics.inc("twilio.dial.errors")
+            logger.error(f"Twilio API call failed: to={to_number}, from={from_number}. Error: {e}")
+            raise
+        finally:
+            metrics.histogram("twilio.dial_seconds").observe(time.perf_counter() - start)
+        metrics.inc("twilio.dial.ok")
+        logger.info(f"Twilio API call successful. SID={call_resource.sid}, Status={call_resource.status}")
+        call_log_writer.submit(call_resource.sid, from_number, to_number, 'outbound', call_resource.status)
+        return call_resource
 
     def make_call(self, to_number: str, from_number: str, twiml: str): # Changed url to twiml
         call_resource = None # Initialize call resource to None
@@ -30,10 +110,8 @@ class TwilioService:
                 to=to_number,
                 from_=from_number,
                 twiml=twiml,
-                # Add status callback to receive updates for outbound calls too
-                status_callback=f"{settings.base_url}/api/calls/call-status", # BASE_URL must be in .env
-                status_callback_method="POST",
-                status_callback_event=["initiated", "ringing", "answered", "completed"]
+                # Add status callback to receive updates for outbound calls too (BASE_URL must be in .env)
+                **self._status_callback_args()
             )
             # Log success immediately after API call returns
             logger.info(f"Twilio API call successful. SID={call_resource.sid}, Status={call_resource.status}")
@@ -45,15 +123,10 @@ class TwilioService:
                 conn = get_db_connection()
                 if conn:
                     cursor = conn.cursor()
-                    sql = """
-                        INSERT INTO call_logs (call_sid, from_number, to_number, direction, status, start_time)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                        ON DUPLICATE KEY UPDATE status = VALUES(status)
-                    """
                     start_time = datetime.utcnow()
                     # Use call_resource.sid from the Twilio response
                     params = (call_resource.sid, from_number, to_number, 'outbound', call_resource.status, start_time)
-                    cursor.execute(sql, params)
+                    insert_call_logs(cursor, [params], update_status=True)
                     conn.commit()
                     logger.info(f"Logged start of outbound call: {call_resource.sid}")
                 else:
@@ -75,3 +148,5 @@ class TwilioService:
             logger.error(f"Twilio API call failed: to={to_number}, from={from_number}. Error: {e}", exc_info=True)
             # Re-raise the exception so the calling route knows it failed
             raise e
+
+twilio_service = TwilioService()
@@ -8,12 +8,79 @@ import logging
 from fastapi import WebSocket
 import websockets
 from twilio.rest import Client
+from ..config import settings
+from .retrieval_service import retrieval_service
+from .tool_registry import ToolCall, ToolDispatcher, ToolSpec, tool_registry
 
 logger = logging.getLogger(__name__)
 
+
+async def answer_question(call: ToolCall) -> str:
+    """question_and_answer: passages from the knowledge base, through the call's QuestionPrefetcher if any."""
+    question = call.parameters.get("question") or ""
+    prefetcher = call.context.get("prefetcher")
+    if prefetcher:
+        context = await prefetcher.answer(question)
+    else:
+        context = await retrieval_service.answer_context(question)
+    return context or "No information about this was found in the knowledge base."
+
+
+async def schedule_meeting(call: ToolCall) -> str:
+    """
+    schedule_meeting: meant to finalize the booking through N8N. Since N8N is not
+    available, a placeholder confirmation is returned.
+    """
+    parameters = call.parameters
+    name = parameters.get("name")
+    email = parameters.get("email")
+    purpose = parameters.get("purpose")
+    datetime_str = parameters.get("datetime")
+    location = parameters.get("location")
+    logger.info(f"Received schedule_meeting parameters: name={name}, email={email}, purpose={purpose}, datetime={datetime_str}, location={location}")
+
+    # Simulate Google Calendar integration
+    # In a real implementation, you would use the Google Calendar API to schedule the meeting
+    # and store the event details in a database
+    return f"Meeting scheduled successfully for {name} at {location} on {datetime_str} to discuss {purpose}."
+
+
+async def hang_up(call: ToolCall) -> str:
+    logger.info(f"Received hangUp tool invocation, ending call (CallSid={call.call_sid})")
+    return "Call ended successfully"
+
+
+tool_registry.register(ToolSpec(
+    name="question_and_answer",
+    description="Get answers to customer questions especially about AI employees",
+    handler=answer_question,
+    parameters={"question": "Question to be answered"},
+    timeout=20,
+))
+tool_registry.register(ToolSpec(
+    name="schedule_meeting",
+    description="Schedule a meeting for a customer. Returns a message indicating whether the booking was successful or not.",
+    handler=schedule_meeting,
+    parameters={
+        "name": "Customer's name",
+        "email": "Customer's email",
+        "purpose": "Purpose of the Meeting",
+        "datetime": "Meeting Datetime",
+        "location": "Meeting location",
+    },
+    timeout=20,
+    error_message="An error occurred while scheduling your meeting.",
+))
+tool_registry.register(ToolSpec(
+    name="hangUp",
+    description="End the call",
+    handler=hang_up,
+    ends_call=True,
+))
+
 class UltravoxService:
     def __init__(self):
-        self.api_key = os.getenv("ULTRAVOX_API_KEY")
+        self.api_key = os.getenv("ULTRAVOX_API_KEY") or settings.ultravox_api_key
         self.base_url = "https://api.ultravox.ai/api/calls"  # Replace with the actual Ultravox API base URL if different
         self.model = "fixie-ai/ultravox-70B"
         self.voice = "Tanya-English"
@@ -50,88 +117,7 @@ class UltravoxService:
                     "clientBufferSizeMs": self.buffer_size
                 }
             },
-            "selectedTools": [
-                {
-                    "temporaryTool": {
-                        "modelToolName": "question_and_answer",
-                        "description": "Get answers to customer questions especially about AI employees",
-                        "dynamicParameters": [
-                            {
-                                "name": "question",
-                                "location": "PARAMETER_LOCATION_BODY",
-                                "schema": {
-                                    "type": "string",
-                                    "description": "Question to be answered"
-                                },
-                                "required": True
-                            }
-                        ],
-                        "timeout": "20s",
-                        "client": {},
-                    },
-                },
-                {
-                    "temporaryTool": {
-                        "modelToolName": "schedule_meeting",
-                        "description": "Schedule a meeting for a customer. Returns a message indicating whether the booking was successful or not.",
-                        "dynamicParameters": [
-                            {
-                                "name": "name",
-                                "location": "PARAMETER_LOCATION_BODY",
-                                "schema": {
-                                    "type": "string",
-                                    "description": "Customer's name"
-                                },
-                                "required": True
-                            },
-                            {
-                                "name": "email",
-                                "location": "PARAMETER_LOCATION_BODY",
-                                "schema": {
-                                    "type": "string",
-                                    "description": "Customer's email"
-                                },
-                                "required": True
-                            },
-                            {
-                                "name": "purpose",
-                                "location": "PARAMETER_LOCATION_BODY",
-                                "schema": {
-                                    "type": "string",
-                                    "description": "Purpose of the Meeting"
-                                },
-                                "required": True
-                            },
-                            {
-                                "name": "datetime",
-                                "location": "PARAMETER_LOCATION_BODY",
-                                "schema": {
-                                    "type": "string",
-                                    "description": "Meeting Datetime"
-                                },
-                                "required": True
-                            },
-                            {
-                                "name": "location",
-                                "location": "PARAMETER_LOCATION_BODY",
-                                "schema": {
-                                    "type": "string",
-                                    "description": "Meeting location"
-                                },
-                                "required": True
-                            }
-                        ],
-                        "timeout": "20s",
-                        "client": {},
-                    },
-                },
-                {"temporaryTool": {
-                    "modelToolName": "hangUp",
-                    "description": "End the call",
-                    "client": {},
-                }
-                }
-            ]
+            "selectedTools": tool_registry.selected_tools(),
         }
 
         try:
@@ -147,82 +133,12 @@ class UltravoxService:
             logger.error(f"Ultravox create call request failed: {e}")
             return ""
 
-    async def handle_question_and_answer(self, uv_ws, invocation_id: str, question: str):
-        """
-        Handle "question_and_answer" - simplified version without Pinecone.
-        """
-        try:
-            # Replace with a simple static response or a call to another service
-            answer_message = f"Answering question: {question}.  (This is a placeholder response.)"
-
-            # Respond back to Ultravox
-            tool_result = {
-                "type": "client_tool_result",
-                "invocationId": invocationId,
-                "result": answer_message,
-                "response_type": "tool-response"
-            }
-            await uv_ws.send(json.dumps(tool_result))
-        except Exception as e:
-            logger.error(f"Error in Q&A tool: {e}")
-            # Send error result back to Ultravox
-            error_result = {
-                "type": "client_tool_result",
-                "invocationId": invocationId,
-                "error_type": "implementation-error",
-                "error_message": "An error occurred while processing your request."
-            }
-            await uv_ws.send(json.dumps(error_result))
-
-    async def handle_schedule_meeting(self, uv_ws, session, invocation_id: str, parameters):
-        """
-        Uses N8N to finalize a meeting schedule.
-        """
-        # This function needs to be implemented to interact with N8N
-        # Since N8N is not available, a placeholder response is used
-        try:
-            name = parameters.get("name")
-            email = parameters.get("email")
-            purpose = parameters.get("purpose")
-            datetime_str = parameters.get("datetime")
-            location = parameters.get("location")
-
-            logger.info(f"Received schedule_meeting parameters: name={name}, email={email}, purpose={purpose}, datetime={datetime_str}, location={location}")
-
-            # Placeholder response
-            booking_message = f"Meeting scheduled successfully for {name} at {location} on {datetime_str} to discuss {purpose}."
-
-            # Simulate Google Calendar integration
-            # In a real implementation, you would use the Google Calendar API to schedule the meeting
-            # and store the event details in a database
-
-            # Return the final outcome to Ultravox
-            tool_result = {
-                "type": "client_tool_result",
-                "invocationId": invocationId,
-                "result": booking_message,
-                "response_type": "tool-response"
-            }
-            await uv_ws.send(json.dumps(tool_result))
-            logger.info(f"Sent schedule_meeting result to Ultravox: {booking_message}")
-
-        except Exception as e:
-            logger.error(f"Error scheduling meeting: {e}")
-            # Send error result back to Ultravox
-            error_result = {
-                "type": "client_tool_result",
-                "invocationId": invocationId,
-                "error_type": "implementation-error",
-                "error_message": "An error occurred while scheduling your meeting."
-            }
-            await uv_ws.send(json.dumps(error_result))
-            logger.info("Sent error message for schedule_meeting to Ultravox.")
-
     async def process_media_stream(self, websocket: WebSocket, call_sid: str, stream_sid: str, first_message: str, voice: str = None):
         """
         Handles the Twilio <Stream> WebSocket and connects to Ultravox via WebSocket.
         """
         uv_ws = None  # Ultravox WebSocket connection
+        tools = None  # Tool invocations and all writes to uv_ws
         try:
             # Simulate getting call history
             call_history = "Previous calls: No previous calls found."
@@ -242,6 +158,7 @@ class UltravoxService:
             # Connect to Ultravox WebSocket
             try:
                 uv_ws = await websockets.connect(uv_join_url)
+                tools = ToolDispatcher(uv_ws, call_sid, on_end_call=uv_ws.close)
                 logger.info("Ultravox WebSocket connected.")
             except Exception as e:
                 logger.error(f"Error connecting to Ultravox WebSocket: {e}")
@@ -300,37 +217,8 @@ class UltravoxService:
                                     transcription += f"{role_cap} says: {text}\n"
 
                             elif msg_type == "client_tool_invocation":
-                                toolName = msg_data.get("toolName", "")
-                                invocationId = msg_data.get("invocationId")
-                                parameters = msg_data.get("parameters", {})
-                                logger.info(f"Invoking tool: {toolName} with invocationId: {invocationId} and parameters: {parameters}")
-
-                                if toolName == "question_and_answer":
-                                    question = parameters.get('question')
-                                    await self.handle_question_and_answer(uv_ws, invocationId, question)
-                                elif toolName == "schedule_meeting":
-                                    await self.handle_schedule_meeting(uv_ws, {}, invocationId, parameters) # Removed session
-                                elif toolName == "hangUp":
-                                    logger.info("Received hangUp tool invocation")
-                                    # Send success response back to the agent
-                                    tool_result = {
-                                        "type": "client_tool_result",
-                                        "invocationId": invocationId,
-                                        "result": "Call ended successfully",
-                                        "response_type": "tool-response"
-                                    }
-                                    await uv_ws.send(json.dumps(tool_result))
-
-                                    # End the call process:
-                                    logger.info(f"Ending call (CallSid={call_sid})")
-                                    end_reason = "agent_hangup"
-
-                                    # Close Ultravox WebSocket
-                                    if uv_ws and uv_ws.state == websockets.protocol.State.OPEN:
-                                        await uv_ws.close()
-
-                                    # End Twilio call - This part needs to be handled in the main app
-                                    return  # Exit the Ultravox handler
+                                logger.info(f"Invoking tool: {msg_data.get('toolName')} with invocationId: {msg_data.get('invocationId')} and parameters: {msg_data.get('parameters', {})}")
+                                tools.dispatch(msg_data)  # hangUp closes uv_ws once its result is sent
                             elif msg_type == "new_stage":
                                 # Handle new call stage
                                 logger.info("Received new_stage event")
@@ -393,7 +281,7 @@ class UltravoxService:
                         # Send PCM bytes to Ultravox
                         if uv_ws and uv_ws.state == websockets.protocol.State.OPEN:
                             try:
-                                await uv_ws.send(pcm_bytes)
+                                await tools.send(pcm_bytes)
                        
                             except Exception as e:
                                 logger.error(f"Error sending PCM to Ultravox: {e}")
@@ -409,6 +297,8 @@ class UltravoxService:
         except Exception as e:
             logger.error(f"Error in process_media_stream: {e}")
         finally:
+            if tools:
+                await tools.close()
             if uv_ws and uv_ws.state == websockets.protocol.State.OPEN:
                 await uv_ws.close()
 
@@ -1,11 +1,20 @@
 import os
+import time
+import asyncio
 import magic
 # from sentence_transformers import SentenceTransformer # Removed local model
 from .openai_service import get_embedding # Import OpenAI embedding function
-import PyPDF2
-import docx
-import pandas as pd
+from .embedding_service import embedding_batcher, embedding_cost
+from .knowledge_base_service import knowledge_base_service
+from .retrieval_service import retrieval_service
+from .extraction_service import document_extractor
+from ..config import settings
+from ..utils.chunking import StreamingChunker
+from ..utils.extraction import extract_blocks
+from ..utils.metrics import metrics
+import numpy as np
 import logging
+from typing import Callable, List, Optional
 
 logger = logging.getLogger(__name__)
 
@@ -23,47 +32,13 @@ class VectorizationService:
 
     def extract_content(self, file_path):
         """
-        Extract text content from various file types
+        Extract text content from various file types, in this process (see
+        document_extractor for extraction off the event loop)
         """
-        file_type = self.detect_file_type(file_path)
-        
         try:
-            if 'pdf' in file_type:
-                return self._extract_pdf(file_path)
-            elif 'word' in file_type or 'document' in file_type:
-                return self._extract_docx(file_path)
-            elif 'sheet' in file_type or 'excel' in file_type:
-                return self._extract_excel(file_path)
-            elif 'text' in file_type:
-                with open(file_path, 'r') as f:
-                    return f.read()
-            else:
-                raise ValueError(f"Unsupported file type: {file_type}")
+            return ''.join(extract_blocks(file_path, self.detect_file_type(file_path)))
         except Exception as e:
             raise ValueError(f"Content extraction failed: {str(e)}") from e
-        """
-        Extract text from PDF files
-        """
-        with open(file_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            text = ''
-            for page in reader.pages:
-                text += page.extract_text() + '\n'
-            return text
-
-    def _extract_docx(self, file_path):
-        """
-        Extract text from Word documents
-        """
-        doc = docx.Document(file_path)
-        return '\n'.join([paragraph.text for paragraph in doc.paragraphs])
-
-    def _extract_excel(self, file_path):
-        """
-        Extract text from Excel files
-        """
-        # Convert all data to string before joining
-        return df.to_string(index=False)
 
     # Keep the original method name, ensure it's async
     async def vectorize(self, content: str):
@@ -81,3 +56,132 @@ class VectorizationService:
         else:
             logger.error("Failed to get embedding from OpenAI.")
             raise ValueError("Failed to generate embedding using OpenAI service.")
+
+    async def vectorize_files(self, files: List[str], store_vector: Optional[Callable[[str, list], None]] = None):
+        """
+        Extracts and chunks the files, embeds the chunks of all of them in packed batches and
+        stores them in knowledge_base_chunks. `store_vector(file, mean_vector)` is called for
+        each stored document (e.g. to mirror it to Supabase). Returns a per-document report.
+
+        Files are extracted in the extraction process pool and chunked as their blocks arrive;
+        whenever kb_embed_stream_chunks chunks (of any files) are ready, they are sent for
+        embedding while extraction goes on. Chunks of a file whose extraction fails are not
+        embedded unless a request already carried them.
+        """
+        start = time.perf_counter()
+        model = settings.embedding_model
+        extracted = {f: [] for f in files}
+        pending, batches, failed = [], [], set()
+
+        def flush():
+            nonlocal pending
+            if pending:
+                batches.append((pending, asyncio.create_task(embedding_batcher.embed(
+                    [c.text for _, c in pending], [c.token_count for _, c in pending], model))))
+                pending = []
+
+        def drop(file_path):
+            """Stops embedding the chunks of a file whose extraction failed."""
+            nonlocal pending
+            failed.add(file_path)
+            pending = [entry for entry in pending if entry[0] != file_path]
+            # Batches mix files: a batch still running is cancelled and its other files'
+            # chunks queued again (requests it completed are served from the embedding cache).
+            kept = []
+            for entries, task in batches:
+                if task.done() or all(f != file_path for f, _ in entries):
+                    kept.append((entries, task))
+                else:
+                    task.cancel()
+                    pending.extend(entry for entry in entries if entry[0] not in failed)
+            batches[:] = kept
+
+        async def extract(file_path):
+            chunker = StreamingChunker(settings.kb_chunk_tokens, settings.kb_chunk_overlap_tokens, model)
+            try:
+                async for block in document_extractor.blocks(file_path):
+                    chunks = await asyncio.to_thread(chunker.feed, block)
+                    extracted[file_path] += chunks
+                    pending.extend((file_path, c) for c in chunks)
+                    if len(pending) >= settings.kb_embed_stream_chunks:
+                        flush()
+            except Exception:
+                drop(file_path)
+                raise
+            chunks = await asyncio.to_thread(chunker.finish)
+            extracted[file_path] += chunks
+            pending.extend((file_path, c) for c in chunks)
+
+        outcomes = await asyncio.gather(*(extract(f) for f in files), return_exceptions=True)
+        flush()
+        try:
+            results = await asyncio.gather(*(task for _, task in batches))
+        except BaseException:
+            for _, task in batches:
+                task.cancel()
+            raise
+
+        reports, documents = [], []
+        for file_path, outcome in zip(files, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"Extraction failed for {file_path}: {outcome}")
+                reports.append({"file": file_path, "stored": False, "error": str(outcome)})
+            elif not extracted[file_path]:
+                reports.append({"file": file_path, "stored": False, "error": "No text extracted"})
+            else:
+                documents.append((file_path, extracted[file_path]))
+
+        # Rows of every batch back to (file, chunk index); batches mix documents, so each
+        # chunk is billed its estimated tokens times its batch's billed/sent ratio.
+        dimensions = next((r.vectors.shape[1] for r in results if r.vectors.size), 0)
+        vectors = {f: np.empty((len(chunks), dimensions), dtype=np.float32) for f, chunks in documents}
+        cached = {f: np.zeros(len(chunks), dtype=bool) for f, chunks in documents}
+        sent = {f: np.zeros(len(chunks)) for f, chunks in documents}
+        for (entries, _), result in zip(batches, results):
+            estimated = np.array([c.token_count for _, c in entries], dtype=np.int64)
+            batch_sent = estimated * ~result.cached
+            ratio = result.tokens / batch_sent.sum() if batch_sent.sum() else 0.0
+            for row, (file_path, chunk) in enumerate(entries):
+                if file_path in vectors:
+                    vectors[file_path][chunk.index] = result.vectors[row]
+                    cached[file_path][chunk.index] = result.cached[row]
+                    sent[file_path][chunk.index] = batch_sent[row] * ratio
+
+        all_chunks = [c for _, chunks in documents for c in chunks]
+        tokens_billed = sum(r.tokens for r in results)
+        requests = sum(r.requests for r in results)
+        cached_chunks = sum(int(c.sum()) for c in cached.values())
+        cached_tokens = sum(c.token_count for f, chunks in documents for c in chunks if cached[f][c.index])
+        for file_path, chunks in documents:
+            doc_vectors = vectors[file_path]
+            tokens = round(float(sent[file_path].sum()))
+            report = {"file": file_path, "chunks": len(chunks), "cached_chunks": int(cached[file_path].sum()),
+                      "tokens": tokens, "embedding_cost": round(embedding_cost(tokens), 6), "stored": False}
+            try:
+                await asyncio.to_thread(knowledge_base_service.replace_document, file_path, chunks, doc_vectors,
+                                        model, report["embedding_cost"])
+                if store_vector is not None:
+                    await asyncio.to_thread(store_vector, file_path, doc_vectors.mean(axis=0).tolist())
+                report["stored"] = True
+            except Exception as e:
+                logger.error(f"Storing chunks of {file_path} failed: {e}", exc_info=True)
+                report["error"] = str(e)
+            reports.append(report)
+
+        retrieval_service.request_refresh()
+        elapsed = time.perf_counter() - start
+        metrics.inc("kb.documents_vectorized", sum(1 for r in reports if r["stored"]))
+        metrics.inc("kb.chunks_embedded", len(all_chunks))
+        logger.info(f"Vectorized {len(documents)}/{len(files)} documents: {len(all_chunks)} chunks, "
+                    f"{cached_chunks} from cache, {tokens_billed} tokens in {requests} requests, {elapsed:.2f}s")
+        return {
+            "results": reports,
+            "chunks": len(all_chunks),
+            "cached_chunks": cached_chunks,
+            "tokens": tokens_billed,
+            "embedding_requests": requests,
+            "embedding_cost": round(embedding_cost(tokens_billed), 6),
+            "cost_saved": round(embedding_cost(cached_tokens), 6),
+            "seconds": round(elapsed, 3),
+            "chunks_per_second": round(len(all_chunks) / elapsed, 1) if elapsed > 0 else None,
+        }
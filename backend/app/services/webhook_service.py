@@ -0,0 +1,302 @@
+"""
+Idempotent, order-tolerant webhook ingestion for Twilio status callbacks and
+Ultravox events.
+
+Routes parse the request, call `webhook_ingestor.submit()` and acknowledge
+immediately; the database work runs afterwards on a small pool of worker
+tasks. Each event carries a dedupe key (Twilio: CallSid + CallStatus +
+SequenceNumber). Keys are checked against a bounded in-memory set on arrival
+and claimed with INSERT IGNORE into `webhook_events` in the same transaction
+that applies the event, so provider retries and duplicates delivered to other
+gunicorn workers are applied once.
+
+Ultravox call.ended events queue the post-call pipeline (post_call_service).
+
+Twilio callbacks may arrive out of order, so call statuses only move forward
+through STATUS_RANK: a late 'ringing' after 'completed' is recorded as seen
+but does not change the call, its campaign target, scheduler job or rollups.
+
+Events of one call always go to the same worker, so they are applied in
+arrival order. Events still queued at shutdown are drained by stop().
+
+The queues are in memory only: an event is acknowledged before it is stored,
+so events still queued when a worker process dies without a clean shutdown
+(OOM kill, SIGKILL, host loss) are lost. This is accepted to keep the
+acknowledgement off the database.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Optional
+
+from ..config import settings
+from ..database import get_db_connection, Error as DBError
+from ..utils.metrics import metrics
+from .analytics_service import analytics_service, TERMINAL_STATUSES
+from .archive_service import insert_call_logs
+from .campaign_service import campaign_service
+from .scheduler_service import call_scheduler
+from . import post_call_service
+
+logger = logging.getLogger(__name__)
+
+# Forward-only call status progression; every terminal status ranks last.
+STATUS_RANK = {
+    'queued': 0,
+    'initiated': 1,
+    'ringing': 2,
+    'in-progress': 3,
+    **{status: 4 for status in TERMINAL_STATUSES},
+}
+
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.5 # Seconds; doubles per attempt
+PURGE_INTERVAL = 3600
+
+
+def is_forward(previous: Optional[str], new: str) -> bool:
+    """True if moving a call from `previous` to `new` advances its status."""
+    if new not in STATUS_RANK:
+        return previous is None
+    return previous is None or STATUS_RANK[new] > STATUS_RANK.get(previous, -1)
+
+
+def twilio_event_key(data: dict) -> str:
+    return f"tw:{data.get('CallSid')}:{data.get('CallStatus')}:{data.get('SequenceNumber', '')}"
+
+
+def ultravox_call(payload: dict) -> dict:
+    """The `call` object of an Ultravox webhook, or {} if it is missing or not an object."""
+    call = payload.get('call') or {}
+    return call if isinstance(call, dict) else {}
+
+
+def ultravox_event_key(payload: dict) -> str:
+    return f"uv:{ultravox_call(payload).get('id')}:{payload.get('event')}"
+
+
+def apply_twilio_status(cursor, data: dict) -> bool:
+    """
+    Applies a Twilio status callback inside the caller's transaction.
+    Returns False if the callback was stale (status did not move forward).
+    """
+    call_sid = data['CallSid']
+    call_status = data.get('CallStatus')
+    call_direction = data.get('Direction')
+    duration = data.get('CallDuration')
+    recording_url = data.get('RecordingUrl')
+    try:
+        duration = int(duration) if duration is not None else None
+    except (ValueError, TypeError):
+        logger.warning(f"Invalid duration value '{duration}' for CallSid {call_sid}. Skipping duration update.")
+        duration = None
+
+    # Lock the row and remember its previous state so the analytics rollups
+    # only count the first transition into a terminal status.
+    cursor.execute(
+        "SELECT status, direction, start_time, duration FROM call_logs WHERE call_sid = %s FOR UPDATE",
+        (call_sid,)
+    )
+    previous = cursor.fetchone()
+    if previous is None:
+        # The callback beat the background call_logs writer (or the call was placed
+        # elsewhere); create the row from the callback so no transition is lost.
+        insert_call_logs(cursor, [(call_sid, data.get('From') or '', data.get('To') or '',
+                                   call_direction or 'outbound', 'queued', datetime.utcnow())])
+        previous = (None, call_direction, None, None)
+
+    prev_status, prev_direction, start_time, prev_duration = previous
+    forward = bool(call_status) and is_forward(prev_status, call_status)
+
+    update_fields = []
+    params = []
+    if forward:
+        update_fields.append("status = %s")
+        params.append(call_status)
+        if call_direction:
+            update_fields.append("direction = %s")
+            params.append(call_direction)
+        if call_status in TERMINAL_STATUSES:
+            update_fields.append("end_time = %s")
+            params.append(datetime.utcnow())
+    if duration is not None:
+        update_fields.append("duration = %s")
+        params.append(duration)
+    if recording_url:
+        update_fields.append("recording_url = %s")
+        params.append(recording_url)
+
+    if update_fields:
+        params.append(call_sid)
+        cursor.execute(f"UPDATE call_logs SET {', '.join(update_fields)} WHERE call_sid = %s", tuple(params))
+    if not forward:
+        return False
+
+    campaign_service.on_call_status(cursor, call_sid, call_status, data.get('campaign_target'))
+    if call_status in TERMINAL_STATUSES:
+        call_scheduler.on_call_status(cursor, call_sid, call_status)
+        analytics_service.record_terminal_call(
+            cursor,
+            day=(start_time or datetime.utcnow()).date(),
+            direction=call_direction or prev_direction,
+            status=call_status,
+            duration=duration if duration is not None else prev_duration
+        )
+    return True
+
+
+def apply_ultravox_event(cursor, payload: dict) -> bool:
+    """
+    Applies an Ultravox webhook event inside the caller's transaction. call.ended only
+    queues the post-call pipeline, which stores the transcript and recording.
+    """
+    if payload.get('event') != 'call.ended':
+        logger.info(f"Received unhandled Ultravox event type: {payload.get('event')}")
+        return True
+    call = ultravox_call(payload)
+    call_sid = call['id']
+    post_call_service.enqueue(cursor, call_sid, payload={'call': call})
+    logger.info(f"Queued post-call pipeline for CallSid: {call_sid}")
+    return True
+
+
+class WebhookIngestor:
+    def __init__(self):
+        self.workers = settings.webhook_workers
+        self.seen_capacity = settings.webhook_dedupe_memory_size
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._queues = []
+        self._tasks = []
+        self._purge_task: Optional[asyncio.Task] = None
+
+    def create_tables(self, cursor):
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS webhook_events (
+                event_key VARCHAR(191) PRIMARY KEY,
+                received_at DATETIME NOT NULL,
+                INDEX idx_webhook_events_received (received_at)
+            );
+            """
+        )
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queues = [asyncio.Queue() for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._run(q)) for q in self._queues]
+        self._purge_task = asyncio.create_task(self._purge_loop())
+        logger.info(f"Webhook ingestor started with {self.workers} workers.")
+
+    async def stop(self):
+        if not self._tasks:
+            return
+        self._purge_task.cancel()
+        for queue in self._queues:
+            await queue.put(None)
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
+        logger.info("Webhook ingestor stopped.")
+
+    @property
+    def pending(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def submit(self, key: str, call_id: str, handler: Callable[[object, dict], bool], data: dict) -> bool:
+        """
+        Queues an event for processing. Returns False if the key was already seen by
+        this worker. Must be called from the event loop.
+        """
+        metrics.inc("webhooks.received")
+        if key in self._seen:
+            self._seen.move_to_end(key)
+            metrics.inc("webhooks.duplicate")
+            return False
+        self._remember(key)
+        self.start()
+        queue = self._queues[hash(call_id) % len(self._queues)]
+        queue.put_nowait((key, handler, data, time.perf_counter()))
+        return True
+
+    def _remember(self, key: str):
+        self._seen[key] = None
+        if len(self._seen) > self.seen_capacity:
+            self._seen.popitem(last=False)
+
+    async def _run(self, queue: asyncio.Queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            key, handler, data, received = item
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                try:
+                    with metrics.histogram("webhooks.process_seconds").time():
+                        await asyncio.to_thread(self._process, key, handler, data)
+                    break
+                except Exception as e:
+                    if attempt == MAX_ATTEMPTS:
+                        metrics.inc("webhooks.failed")
+                        self._seen.pop(key, None)
+                        logger.error(f"Dropping webhook event {key} after {attempt} attempts: {e}")
+                    else:
+                        logger.warning(f"Webhook event {key} failed (attempt {attempt}): {e}")
+                        await asyncio.sleep(RETRY_BASE_DELAY * 2 ** (attempt - 1))
+            metrics.histogram("webhooks.end_to_end_seconds").observe(time.perf_counter() - received)
+
+    def _process(self, key: str, handler: Callable[[object, dict], bool], data: dict):
+        conn = get_db_connection()
+        if conn is None:
+            raise DBError("Database connection unavailable.")
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT IGNORE INTO webhook_events (event_key, received_at) VALUES (%s, UTC_TIMESTAMP())",
+                (key,)
+            )
+            if cursor.rowcount == 0:
+                conn.rollback()
+                metrics.inc("webhooks.duplicate")
+                logger.info(f"Skipping already-processed webhook event {key}")
+                return
+            if not handler(cursor, data):
+                metrics.inc("webhooks.stale")
+                logger.info(f"Ignored out-of-order webhook event {key}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(PURGE_INTERVAL)
+            try:
+                await asyncio.to_thread(self._purge)
+            except Exception as e:
+                logger.warning(f"Failed to purge old webhook events: {e}")
+
+    def _purge(self):
+        conn = get_db_connection()
+        if conn is None:
+            return
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "DELETE FROM webhook_events WHERE received_at < UTC_TIMESTAMP() - INTERVAL %s HOUR",
+                (settings.webhook_dedupe_retention_hours,)
+            )
+            conn.commit()
+        finally:
+            if cursor: cursor.close()
+            conn.close()
+
+
+webhook_ingestor = WebhookIngestor()
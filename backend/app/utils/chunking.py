@@ -0,0 +1,183 @@
+"""
+Token-aware splitting of extracted documents into overlapping chunks.
+
+Token counts use tiktoken's encoding for the embedding model when the package
+and its encoding files are available; otherwise a regex approximation of BPE
+(a word piece per ~4 characters, one token per punctuation mark) is used,
+which errs on the side of more tokens.
+
+Text is split on paragraph and sentence boundaries and packed greedily into
+chunks of at most `max_tokens`; each chunk starts with the trailing sentences
+of the previous one, up to `overlap_tokens`, so an answer spanning a boundary
+is still retrievable. Sentences longer than a chunk are cut on word
+boundaries (words longer than a chunk, by characters). Every chunk keeps its
+character span in the source text.
+
+`StreamingChunker` chunks a document that arrives in blocks (see
+utils/extraction.py): once FLUSH_CHUNKS chunks' worth of text is buffered, all
+chunks but the last are final; chunking resumes at the start of the last
+one, so the result matches chunking the whole text in one go.
+"""
+import re
+import logging
+import threading
+from functools import lru_cache
+from typing import Callable, List, NamedTuple
+
+logger = logging.getLogger(__name__)
+_counter_lock = threading.Lock()
+
+FLUSH_CHUNKS = 32 # Chunks of buffered text at which a StreamingChunker emits
+
+# A sentence runs to a ./!/? followed by whitespace or the end, or to a line break;
+# punctuation followed by anything else ($3.50, example.com, v1.2) stays inside it.
+_SEGMENT = re.compile(r"(?:[^\n.!?]|[.!?]+(?=[^\s.!?]))*(?:[.!?]+(?=\s|$)|\n\s*\n|\n|$)")
+_APPROX_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+class Chunk(NamedTuple):
+    index: int
+    text: str
+    token_count: int
+    start_char: int
+    end_char: int
+
+
+def _approx_tokens(text: str) -> int:
+    return sum((len(m) + 3) // 4 if m[0].isalnum() or m[0] == "_" else 1 for m in _APPROX_TOKEN.findall(text))
+
+
+def token_counter(model: str) -> Callable[[str], int]:
+    """A function counting tokens of text for `model`."""
+    with _counter_lock:
+        return _load_counter(model)
+
+
+@lru_cache(maxsize=4)
+def _load_counter(model: str) -> Callable[[str], int]:
+    try:
+        import tiktoken
+        encoding = tiktoken.encoding_for_model(model)
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception as e:
+        logger.info(f"tiktoken unavailable for {model} ({e}); using approximate token counts.")
+        return _approx_tokens
+
+
+def _segments(text: str):
+    """(start, end) spans of sentences and paragraph breaks, covering the text without gaps."""
+    position = 0
+    for match in _SEGMENT.finditer(text):
+        if match.end() > match.start():
+            if match.start() > position:  # never expected; keeps any unmatched text
+                yield position, match.start()
+            yield match.start(), match.end()
+            position = match.end()
+    if position < len(text):
+        yield position, len(text)
+
+
+def _split_long(text: str, start: int, end: int, max_tokens: int, count: Callable[[str], int]):
+    """Cuts an over-long span on word boundaries (within words if need be) into pieces of at most max_tokens."""
+    piece_start, piece_tokens = None, 0
+    for word in re.finditer(r"\S+\s*", text[start:end]):
+        w_start, w_end = start + word.start(), start + word.end()
+        tokens = count(word.group())
+        if tokens > max_tokens:
+            if piece_start is not None:
+                yield piece_start, w_start
+            step = max(1, (w_end - w_start) * max_tokens // tokens)
+            for cut in range(w_start, w_end, step):
+                yield cut, min(cut + step, w_end)
+            piece_start, piece_tokens = None, 0
+            continue
+        if piece_start is not None and piece_tokens + tokens > max_tokens:
+            yield piece_start, w_start
+            piece_start, piece_tokens = None, 0
+        if piece_start is None:
+            piece_start = w_start
+        piece_tokens += tokens
+    if piece_start is not None:
+        yield piece_start, end
+
+
+def chunk_text(text: str, max_tokens: int = 500, overlap_tokens: int = 50,
+               model: str = "text-embedding-ada-002") -> List[Chunk]:
+    """Splits text into chunks of at most max_tokens with about overlap_tokens carried over."""
+    count = token_counter(model)
+    spans = []  # (start, end, tokens) of units that each fit in a chunk
+    for start, end in _segments(text):
+        tokens = count(text[start:end])
+        if tokens > max_tokens:
+            spans.extend((s, e, count(text[s:e])) for s, e in _split_long(text, start, end, max_tokens, count))
+        else:
+            spans.append((start, end, tokens))
+
+    chunks: List[Chunk] = []
+    current: list = []
+    current_tokens = 0
+
+    def emit():
+        body = text[current[0][0]:current[-1][1]]
+        if body.strip():
+            stripped = len(body) - len(body.lstrip())
+            chunks.append(Chunk(len(chunks), body.strip(), current_tokens,
+                                current[0][0] + stripped, current[0][0] + stripped + len(body.strip())))
+
+    for span in spans:
+        if current and current_tokens + span[2] > max_tokens:
+            emit()
+            # Carry trailing units of the emitted chunk into the next one.
+            carried, carried_tokens = [], 0
+            for unit in reversed(current):
+                if carried_tokens + unit[2] > overlap_tokens or carried_tokens + unit[2] + span[2] > max_tokens:
+                    break
+                carried.insert(0, unit)
+                carried_tokens += unit[2]
+            current, current_tokens = carried, carried_tokens
+        current.append(span)
+        current_tokens += span[2]
+    if current:
+        emit()
+    return chunks
+
+
+class StreamingChunker:
+    """Incremental chunk_text: feed text blocks in order, then finish."""
+
+    def __init__(self, max_tokens: int = 500, overlap_tokens: int = 50, model: str = "text-embedding-ada-002"):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.model = model
+        self.chunks = 0      # chunks emitted so far
+        self._buffer = ""
+        self._offset = 0     # position of the buffer in the document text
+
+    def _emit(self, final: bool) -> List[Chunk]:
+        pending = chunk_text(self._buffer, self.max_tokens, self.overlap_tokens, self.model)
+        if not final:
+            if len(pending) < 2:
+                return []
+            resume = pending[-1].start_char
+            pending = pending[:-1]
+        emitted = [Chunk(self.chunks + i, c.text, c.token_count, self._offset + c.start_char, self._offset + c.end_char)
+                   for i, c in enumerate(pending)]
+        self.chunks += len(emitted)
+        if final:
+            self._offset += len(self._buffer)
+            self._buffer = ""
+        else:
+            self._offset += resume
+            self._buffer = self._buffer[resume:]
+        return emitted
+
+    def feed(self, block: str) -> List[Chunk]:
+        """Chunks that are final once this block is added."""
+        self._buffer += block
+        if len(self._buffer) < FLUSH_CHUNKS * self.max_tokens * 4:  # ~4 characters per token
+            return []
+        return self._emit(final=False)
+
+    def finish(self) -> List[Chunk]:
+        """The remaining chunks, at the end of the document."""
+        return self._emit(final=True)
@@ -0,0 +1,136 @@
+"""
+Text extraction from knowledge-base documents, one block at a time.
+
+`extract_blocks` yields a document's text in blocks as the parser reaches
+them: a PDF page, BLOCK_PARAGRAPHS Word paragraphs, ROWS_PER_BLOCK rows of a
+spreadsheet sheet (openpyxl in read_only mode, which streams the sheet XML
+instead of loading the workbook) or BLOCK_CHARS of a text file. Concatenated,
+the blocks are the document text (pages, paragraph and row groups end with a
+newline).
+
+The parsers are CPU-bound pure Python, so services/extraction_service.py runs
+`run_extraction` in worker processes: `init_worker` caps the process's
+address space (RLIMIT_AS, so an oversized document fails with MemoryError
+instead of exhausting the host) and each job arms a SIGALRM timer that
+interrupts parsing after its time limit. A job first puts (job id, "start",
+worker pid) on the pool's result queue, then its blocks as (job id, "block",
+text) as they are produced, followed by (job id, "end", block count) or
+(job id, "error", message).
+"""
+import os
+import signal
+import resource
+from typing import Iterator, Optional
+
+import magic
+
+BLOCK_CHARS = 65536 # Text file characters per block
+BLOCK_PARAGRAPHS = 200 # Word paragraphs per block
+ROWS_PER_BLOCK = 500 # Spreadsheet rows per block
+
+_results = None  # the pool's result queue, set by init_worker
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+def detect_file_type(file_path: str) -> str:
+    return magic.Magic(mime=True).from_file(file_path)
+
+
+def _pdf_blocks(file_path: str) -> Iterator[str]:
+    import PyPDF2
+    with open(file_path, 'rb') as file:
+        for page in PyPDF2.PdfReader(file).pages:
+            yield (page.extract_text() or '') + '\n'
+
+
+def _docx_blocks(file_path: str) -> Iterator[str]:
+    import docx
+    paragraphs = []
+    for paragraph in docx.Document(file_path).paragraphs:
+        paragraphs.append(paragraph.text)
+        if len(paragraphs) == BLOCK_PARAGRAPHS:
+            yield '\n'.join(paragraphs) + '\n'
+            paragraphs = []
+    if paragraphs:
+        yield '\n'.join(paragraphs) + '\n'
+
+
+def _excel_blocks(file_path: str) -> Iterator[str]:
+    """Rows as tab-separated cell values, each sheet introduced by its name."""
+    import openpyxl
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            lines = [f"Sheet: {sheet.title}"]
+            for row in sheet.iter_rows(values_only=True):
+                cells = ['' if value is None else str(value) for value in row]
+                if any(cells):
+                    lines.append('\t'.join(cells).rstrip('\t'))
+                if len(lines) >= ROWS_PER_BLOCK:
+                    yield '\n'.join(lines) + '\n'
+                    lines = []
+            if lines:
+                yield '\n'.join(lines) + '\n'
+    finally:
+        workbook.close()
+
+
+def _text_blocks(file_path: str) -> Iterator[str]:
+    with open(file_path, 'r', errors='replace') as f:
+        while True:
+            block = f.read(BLOCK_CHARS)
+            if not block:
+                return
+            yield block
+
+
+def extract_blocks(file_path: str, file_type: Optional[str] = None) -> Iterator[str]:
+    """The document's text in blocks; raises ValueError for unsupported types."""
+    file_type = file_type or detect_file_type(file_path)
+    if 'pdf' in file_type:
+        return _pdf_blocks(file_path)
+    elif 'sheet' in file_type or 'excel' in file_type:  # before 'document': ...officedocument.spreadsheetml...
+        return _excel_blocks(file_path)
+    elif 'word' in file_type or 'document' in file_type:
+        return _docx_blocks(file_path)
+    elif 'text' in file_type:
+        return _text_blocks(file_path)
+    raise ValueError(f"Unsupported file type: {file_type}")
+
+
+def _on_alarm(signum, frame):
+    raise ExtractionTimeout()
+
+
+def init_worker(results, max_memory_bytes: int):
+    global _results
+    _results = results
+    if max_memory_bytes > 0:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory_bytes, max_memory_bytes))
+    signal.signal(signal.SIGALRM, _on_alarm)
+
+
+def run_extraction(job_id: int, file_path: str, timeout_seconds: float) -> int:
+    """Streams one document's blocks to the result queue; returns the number of blocks."""
+    blocks = 0
+    _results.put((job_id, "start", os.getpid()))
+    try:
+        signal.setitimer(signal.ITIMER_REAL, timeout_seconds)
+        try:
+            for block in extract_blocks(file_path):
+                _results.put((job_id, "block", block))
+                blocks += 1
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    except ExtractionTimeout:
+        _results.put((job_id, "error", f"Extraction exceeded {timeout_seconds:g}s"))
+    except MemoryError:
+        _results.put((job_id, "error", "Extraction exceeded the memory limit"))
+    except Exception as e:
+        _results.put((job_id, "error", f"Content extraction failed: {e}"))
+    else:
+        _results.put((job_id, "end", blocks))
+    return blocks
@@ -0,0 +1,244 @@
+"""
+In-memory BM25 keyword index over knowledge-base chunks.
+
+Embedding similarity blurs exact identifiers (product names, SKUs, policy
+numbers); this index matches them literally. Text is lowercased and split
+into word tokens; hyphen/dot/slash compounds such as "sku-4471-b" are kept
+whole in addition to their parts, so both "SKU-4471-B" and "4471" match.
+
+Postings are stored compactly as NumPy arrays in immutable segments: terms
+are interned to int32 ids and a segment holds, sorted by (term, document),
+one int32 document array and one uint16 term-frequency array plus CSR
+offsets per distinct term. Each `add` batch becomes a new segment; the newest
+segments are merged while the older one is less than twice the size of the
+newer, which keeps O(log n) segments and amortizes merge work. Removed
+documents are masked and dropped at the next merge touching them (or by
+`compact`); until then they still count towards document frequencies.
+
+A query reads the postings of its (stopword-filtered) terms from every
+segment and sums BM25 contributions per document with vectorized NumPy
+operations, so cost follows the length of the posting lists involved, not
+the corpus size. Terms in nearly all documents (idf below MIN_IDF) are
+ignored like stopwords. Terms in more than COMMON_TERM_FRACTION of the
+documents are not scanned either: they only add their score to the
+RERANK_CANDIDATES best documents matched by the rarer terms (or, for a query
+of common terms only, by the least frequent of them), much like Lucene's
+common-terms query. That bounds the cost of queries full of frequent words,
+whose ranking becomes approximate; identifiers and other rare terms are
+always scored exactly.
+
+Searches may run concurrently with one writer: writers publish a new state
+tuple instead of mutating arrays a reader may hold.
+"""
+import re
+import math
+import threading
+from collections import Counter
+from typing import Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from .vector_index import _NO_RESULTS, _top_k
+
+K1 = 1.2
+B = 0.75
+MIN_IDF = 0.1 # Terms in nearly every document (~90%+) weigh too little to score; treated as stopwords
+COMMON_TERM_FRACTION = 0.1 # Terms in more of the documents than this only rerank rarer terms' matches
+RERANK_CANDIDATES = 10000 # Best candidates kept for common terms to rerank
+DENSE_RATIO = 16 # Candidate postings above documents / DENSE_RATIO are summed in a dense array, not sorted
+TOKEN = re.compile(r"\w+(?:[-./]\w+)*")
+STOPWORDS = frozenset("""
+a about an and are as at be but by can could did do does for from had has have how i if in into is it its
+me my no not of on or our please so than that the their them then there these they this to was we were
+what when where which who why will with would you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens without stopwords; compounds also yield their parts."""
+    tokens = []
+    for token in TOKEN.findall(text.lower()):
+        if token not in STOPWORDS:
+            tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-./_]", token) if part and part not in STOPWORDS)
+    return tokens
+
+
+def _bm25(idf: float, tfs: np.ndarray, doc_lengths: np.ndarray, average_length: float) -> np.ndarray:
+    """BM25 term weights, computed in float32 with in-place operations."""
+    tfs = tfs.astype(np.float32)
+    norm = doc_lengths.astype(np.float32)
+    norm *= np.float32(K1 * B / average_length)
+    norm += np.float32(K1 * (1 - B))
+    norm += tfs
+    tfs *= np.float32(idf * (K1 + 1))
+    tfs /= norm
+    return tfs
+
+
+class _Segment:
+    """Immutable postings of a batch of documents, grouped by term."""
+    __slots__ = ("terms", "offsets", "docs", "tfs")
+
+    def __init__(self, term_ids: np.ndarray, docs: np.ndarray, tfs: np.ndarray):
+        order = np.lexsort((docs, term_ids))
+        term_ids, self.docs, self.tfs = term_ids[order], docs[order].astype(np.int32), tfs[order]
+        self.terms, starts = np.unique(term_ids, return_index=True)
+        self.offsets = np.append(starts, len(term_ids)).astype(np.int64)
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        i = np.searchsorted(self.terms, term_id)
+        if i == len(self.terms) or self.terms[i] != term_id:
+            return self.docs[:0], self.tfs[:0]
+        return self.docs[self.offsets[i]:self.offsets[i + 1]], self.tfs[self.offsets[i]:self.offsets[i + 1]]
+
+    def triples(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return np.repeat(self.terms, np.diff(self.offsets)), self.docs, self.tfs
+
+
+def _merge(segments: Sequence[_Segment], alive: np.ndarray) -> _Segment:
+    term_ids, docs, tfs = (np.concatenate(parts) for parts in zip(*(s.triples() for s in segments)))
+    keep = alive[docs]
+    return _Segment(term_ids[keep], docs[keep], tfs[keep])
+
+
+class KeywordIndex:
+    def __init__(self):
+        self._vocabulary = {}
+        self._lock = threading.Lock()
+        # Published state: segments, per-document arrays (chunk ids, lengths, alive mask; valid
+        # up to `documents`), live document count and their total length.
+        self._state = ((), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=bool), 0, 0, 0)
+
+    def __len__(self) -> int:
+        return self._state[5]
+
+    @property
+    def vocabulary_size(self) -> int:
+        return len(self._vocabulary)
+
+    @property
+    def nbytes(self) -> int:
+        segments, chunk_ids, lengths, alive = self._state[:4]
+        return chunk_ids.nbytes + lengths.nbytes + alive.nbytes + sum(
+            s.terms.nbytes + s.offsets.nbytes + s.docs.nbytes + s.tfs.nbytes for s in segments)
+
+    @property
+    def segments(self) -> int:
+        return len(self._state[0])
+
+    def add(self, ids: Sequence[int], texts: Iterable[str]):
+        """Indexes a batch of chunks (id, text) as one new segment."""
+        term_ids, docs, tfs, doc_lengths = [], [], [], []
+        with self._lock:
+            segments, chunk_ids, lengths, alive, documents, live, total = self._state
+            vocabulary = self._vocabulary
+            for doc, text in enumerate(texts, start=documents):
+                counts = Counter(tokenize(text))
+                doc_lengths.append(sum(counts.values()))
+                for term, tf in counts.items():
+                    term_id = vocabulary.get(term)
+                    if term_id is None:
+                        term_id = vocabulary[term] = len(vocabulary)
+                    term_ids.append(term_id)
+                    docs.append(doc)
+                    tfs.append(min(tf, 65535))
+            added = len(doc_lengths)
+            if added != len(ids):
+                raise ValueError("ids and texts differ in length")
+            if not added:
+                return
+            needed = documents + added
+            if needed > len(chunk_ids):
+                capacity = max(needed, len(chunk_ids) + len(chunk_ids) // 4, 1024)
+                chunk_ids, lengths, alive = (np.resize(a, capacity) for a in (chunk_ids, lengths, alive))
+            # Entries beyond the published document count are invisible to readers.
+            chunk_ids[documents:needed] = ids
+            lengths[documents:needed] = doc_lengths
+            alive[documents:needed] = True
+            segment = _Segment(np.array(term_ids, dtype=np.int32), np.array(docs, dtype=np.int32),
+                               np.array(tfs, dtype=np.uint16))
+            segments = list(segments) + [segment]
+            while len(segments) > 1 and len(segments[-2]) <= 2 * len(segments[-1]):
+                segments[-2:] = [_merge(segments[-2:], alive)]
+            self._state = (tuple(segments), chunk_ids, lengths, alive, needed,
+                           live + added, total + int(sum(doc_lengths)))
+
+    def remove(self, ids: np.ndarray):
+        """Masks the chunks with these ids."""
+        with self._lock:
+            segments, chunk_ids, lengths, alive, documents, live, total = self._state
+            hit = np.flatnonzero(np.isin(chunk_ids[:documents], ids) & alive[:documents])
+            if not len(hit):
+                return
+            alive[hit] = False
+            self._state = (segments, chunk_ids, lengths, alive, documents,
+                           live - len(hit), total - int(lengths[hit].sum()))
+
+    def compact(self):
+        """Merges all segments into one, dropping removed documents' postings."""
+        with self._lock:
+            segments, *rest = self._state
+            if len(segments) > 1 or (segments and not rest[2][:rest[3]].all()):
+                self._state = ((_merge(segments, rest[2]),), *rest)
+
+    def live_ids(self) -> np.ndarray:
+        _, chunk_ids, _, alive, documents = self._state[:5]
+        return chunk_ids[:documents][alive[:documents]]
+
+    @property
+    def removed_fraction(self) -> float:
+        documents, live = self._state[4], self._state[5]
+        return 1 - live / documents if documents else 0.0
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The chunk ids and BM25 scores of the k best-matching chunks, best first."""
+        segments, chunk_ids, lengths, alive, documents, live, total = self._state
+        term_ids = {self._vocabulary.get(term) for term in tokenize(query)} - {None}
+        if not live or not term_ids or k <= 0:
+            return _NO_RESULTS
+        average_length = total / live
+        rare, common = [], []
+        for term_id in term_ids:
+            postings = [s.postings(term_id) for s in segments]
+            df = sum(len(docs) for docs, _ in postings)
+            idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+            if df and idf >= MIN_IDF:
+                (common if df > COMMON_TERM_FRACTION * live else rare).append((df, postings, idf))
+        if not rare and not common:
+            return _NO_RESULTS
+        if not rare:
+            # Only common terms: the least frequent one selects the candidates.
+            common.sort(key=lambda term: term[0])
+            rare.append(common.pop(0))
+        postings = [(d, _bm25(idf, tfs, lengths[d], average_length)) for _, term, idf in rare for d, tfs in term]
+        if len(rare) == 1:
+            # A term lists each document once, and segments hold ascending document ranges.
+            matched, scores = np.concatenate([d for d, _ in postings]), np.concatenate([w for _, w in postings])
+        elif sum(len(d) for d, _ in postings) * DENSE_RATIO >= documents:
+            dense = np.zeros(documents, dtype=np.float32)
+            for docs, weights in postings:
+                dense[docs] += weights  # documents are unique within a term's postings
+            matched = np.flatnonzero(dense)
+            scores = dense[matched]
+        else:
+            matched, inverse = np.unique(np.concatenate([d for d, _ in postings]), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate([w for _, w in postings])).astype(np.float32)
+        if common and len(matched) > RERANK_CANDIDATES:
+            keep = np.sort(np.argpartition(scores, len(scores) - RERANK_CANDIDATES)[-RERANK_CANDIDATES:])
+            matched, scores = matched[keep], scores[keep]
+        for _, postings, idf in common:
+            # Common terms only rerank the candidates: scatter their term frequencies into a
+            # per-document array and read the candidates' back, rather than scoring every posting.
+            frequencies = np.zeros(documents, dtype=np.uint16)
+            for term_docs, tfs in postings:
+                frequencies[term_docs] = tfs
+            found = frequencies[matched]
+            hit = found > 0
+            scores[hit] += _bm25(idf, found[hit], lengths[matched[hit]], average_length)
+        scores[~alive[matched]] = -np.inf
+        return _top_k(chunk_ids[matched], scores, k)
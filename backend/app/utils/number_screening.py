@@ -0,0 +1,187 @@
+"""
+Vectorized phone-number normalization and set-membership structures used to
+screen large dial lists (see services/screening_service.py).
+
+Numbers are handled as int64 E.164 digit strings (e.g. +14155550123 ->
+14155550123) so whole batches can be normalized, deduplicated and tested with
+NumPy/pandas operations instead of per-number Python work.
+"""
+import math
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+INVALID = 0
+
+REASON_OK = "ok"
+REASON_INVALID = "invalid"
+REASON_DUPLICATE = "duplicate"
+REASON_DNC = "dnc"
+REASON_RECENT = "recently_called"
+
+MAX_CHARS = 32  # longer inputs are treated as invalid
+_POW10 = 10 ** np.arange(19, dtype=np.int64)
+
+
+def normalize_numbers(numbers: Sequence[str], default_country_code: str = "1",
+                      national_max_digits: int = 10, chunk: int = 1 << 20) -> np.ndarray:
+    """
+    Normalizes raw dial strings to E.164 digits as int64 (INVALID for unusable input).
+
+    '+' or '00' prefixes mark international numbers; otherwise one trunk '0' is
+    dropped and the default country code is prepended unless the number already
+    starts with it and is longer than a national number.
+    """
+    numbers = numbers if isinstance(numbers, list) else list(numbers)
+    out = np.zeros(len(numbers), dtype=np.int64)
+    for start in range(0, len(numbers), chunk):
+        out[start:start + chunk] = _normalize_chunk(numbers[start:start + chunk], default_country_code,
+                                                    national_max_digits)
+    return out
+
+
+def _normalize_chunk(numbers: list, cc: str, national_max_digits: int) -> np.ndarray:
+    # Work on a fixed-width code point matrix (one row per number) instead of per-string Python.
+    n = len(numbers)
+    too_long = np.fromiter((v is None or len(str(v)) > MAX_CHARS for v in numbers), dtype=bool, count=n)
+    chars = np.array(numbers, dtype=f"U{MAX_CHARS}").view(np.uint32).reshape(n, MAX_CHARS)
+    is_digit = (chars >= 48) & (chars <= 57)
+    count = is_digit.sum(axis=1)
+    # Place value of each digit is 10 ** (digits to its right); leading zeros add nothing.
+    rank = count[:, None] - np.cumsum(is_digit, axis=1)
+    value = np.where(is_digit & (rank < 19),
+                     (chars - 48).astype(np.int64) * _POW10[np.minimum(rank, 18)], 0).sum(axis=1)
+
+    rows = np.arange(n)
+    first = np.argmax((chars != 32) & (chars != 9), axis=1)  # first non-blank character
+    first_char = chars[rows, first]
+    leading = value // _pow10(count - 1)
+    second = (value // _pow10(count - 2)) % 10
+    starts_00 = (first_char == 48) & (count >= 2) & (leading == 0) & (second == 0) & (chars[rows, first + 1] == 48)
+    international = (first_char == 43) | starts_00
+    length = count - np.where(starts_00, 2, 0)
+    trunk = ~international & (count > 0) & (leading == 0)
+    length = length - trunk
+
+    cc_value, cc_len = int(cc), len(cc)
+    has_cc = (value // _pow10(length - cc_len) == cc_value) & (length > national_max_digits)
+    add_cc = ~international & ~has_cc
+    value = np.where(add_cc, value + cc_value * _pow10(length), value)
+    length = length + np.where(add_cc, cc_len, 0)
+
+    valid = (length >= 8) & (length <= 15) & (value >= _pow10(length - 1)) & ~too_long
+    return np.where(valid, value, INVALID)
+
+
+def _pow10(exponents: np.ndarray) -> np.ndarray:
+    return _POW10[np.clip(exponents, 0, 18)]
+
+
+def format_e164(values: np.ndarray) -> list:
+    return ["+" + str(v) if v != INVALID else None for v in values.tolist()]
+
+
+def _mix64(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer, vectorized over uint64 arrays (wrapping arithmetic)."""
+    with np.errstate(over="ignore"):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+class BloomFilter:
+    """
+    Bloom filter over int64 keys with double hashing, sized for `capacity` keys
+    at false-positive rate `error_rate`. add/contains operate on whole arrays.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(1, capacity)
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def _positions(self, keys: np.ndarray) -> np.ndarray:
+        k = keys.astype(np.uint64, copy=False)
+        h1 = _mix64(k)
+        h2 = _mix64(k ^ np.uint64(0x9E3779B97F4A7C15)) | np.uint64(1)
+        i = np.arange(self.hashes, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            combined = h1[:, None] + i[None, :] * h2[:, None]
+        return (combined % np.uint64(self.size)).astype(np.int64)
+
+    def add(self, keys: np.ndarray, chunk: int = 1 << 20):
+        for start in range(0, len(keys), chunk):
+            pos = self._positions(keys[start:start + chunk]).ravel()
+            np.bitwise_or.at(self.bits, pos >> 3, (1 << (pos & 7)).astype(np.uint8))
+        self.count += len(keys)
+
+    def contains(self, keys: np.ndarray, chunk: int = 1 << 20) -> np.ndarray:
+        out = np.empty(len(keys), dtype=bool)
+        for start in range(0, len(keys), chunk):
+            pos = self._positions(keys[start:start + chunk])
+            hit = (self.bits[pos >> 3] >> (pos & 7).astype(np.uint8)) & 1
+            out[start:start + chunk] = hit.all(axis=1)
+        return out
+
+
+class NumberSet:
+    """
+    Exact membership for a screening list: a Bloom filter answers most lookups
+    (all true negatives) and its positives are confirmed against a hash index.
+    """
+
+    def __init__(self, values: Iterable[int] = (), error_rate: float = 0.001):
+        arr = np.unique(np.asarray(list(values) if not isinstance(values, np.ndarray) else values, dtype=np.int64))
+        arr = arr[arr != INVALID]
+        self.bloom = BloomFilter(len(arr) or 1, error_rate)
+        if len(arr):
+            self.bloom.add(arr)
+        self.index = pd.Index(arr)  # pandas keeps an int64 hash table behind the index
+        self.extra: set = set()     # added since the last rebuild
+
+    def __len__(self):
+        return len(self.index) + len(self.extra)
+
+    def add(self, values: np.ndarray):
+        values = values[values != INVALID]
+        self.bloom.add(values)
+        self.extra.update(values.tolist())
+
+    def contains(self, values: np.ndarray) -> np.ndarray:
+        hits = self.bloom.contains(values)
+        candidates = np.flatnonzero(hits)
+        if len(candidates):
+            confirmed = self.index.get_indexer(values[candidates]) >= 0
+            if self.extra:
+                confirmed |= np.fromiter((v in self.extra for v in values[candidates].tolist()),
+                                         dtype=bool, count=len(candidates))
+            hits[candidates] = confirmed
+        return hits
+
+
+def screen(normalized: np.ndarray, dnc: Optional[NumberSet] = None,
+           recent: Optional[NumberSet] = None) -> np.ndarray:
+    """
+    Per-number screening reasons for a normalized batch. Precedence:
+    invalid > dnc > recently_called > duplicate (the first occurrence is kept).
+    """
+    reasons = np.full(len(normalized), REASON_OK, dtype=object)
+    valid = normalized != INVALID
+    reasons[~valid] = REASON_INVALID
+
+    blocked = ~valid
+    if dnc is not None and len(dnc):
+        is_dnc = valid & dnc.contains(normalized)
+        reasons[is_dnc] = REASON_DNC
+        blocked |= is_dnc
+    if recent is not None and len(recent):
+        is_recent = ~blocked & recent.contains(normalized)
+        reasons[is_recent] = REASON_RECENT
+        blocked |= is_recent
+
+    duplicate = ~blocked & pd.Series(normalized).duplicated(keep="first").to_numpy()
+    reasons[duplicate] = REASON_DUPLICATE
+    return reasons
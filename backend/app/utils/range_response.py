@@ -0,0 +1,99 @@
+"""
+File responses with HTTP Range support (Starlette 0.27's FileResponse has none).
+
+`RangeFileResponse` answers a single `bytes=` range with 206 and the whole file
+otherwise. Behind nginx it only sends an X-Accel-Redirect header and nginx
+serves the bytes itself (sendfile, ranges included). When the ASGI server
+offers the `http.response.zerocopysend` extension the selected range is handed
+over as a file descriptor; otherwise it is streamed with positional reads in a
+worker thread, one `chunk_size` block at a time.
+"""
+import os
+import asyncio
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 256 * 1024
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Returns the inclusive (start, end) of a single `bytes=` range, None to send the
+    whole file, or raises ValueError if the range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[6:].strip().partition("-")
+    if not first:
+        if not last:
+            return None
+        start, end = max(0, size - int(last)), size - 1  # suffix range: last N bytes
+    else:
+        start, end = int(first), (int(last) if last else size - 1)
+    end = min(end, size - 1)
+    if start > end:
+        raise ValueError(f"unsatisfiable range {header!r} for {size} bytes")
+    return start, end
+
+
+class RangeFileResponse(Response):
+    def __init__(self, path: str, media_type: str, range_header: Optional[str] = None,
+                 accel_redirect: Optional[str] = None, filename: Optional[str] = None,
+                 chunk_size: int = CHUNK_SIZE):
+        self.path = path
+        self.media_type = media_type
+        self.chunk_size = chunk_size
+        self.background = None
+        self.body = b""
+        headers = {"accept-ranges": "bytes"}
+        if filename:
+            headers["content-disposition"] = f"inline; filename*=utf-8''{quote(filename)}"
+        if accel_redirect:
+            # nginx resolves the internal location and handles Range itself.
+            self.status_code = 200
+            self.start = self.length = 0
+            headers["x-accel-redirect"] = accel_redirect
+            self.init_headers(headers)
+            return
+        size = os.stat(path).st_size
+        try:
+            selected = parse_range(range_header, size)
+        except ValueError:
+            self.status_code, self.start, self.length = 416, 0, 0
+            headers["content-range"] = f"bytes */{size}"
+            self.init_headers(headers)
+            return
+        if selected is None:
+            self.status_code, self.start, self.length = 200, 0, size
+        else:
+            self.status_code, self.start, self.length = 206, selected[0], selected[1] - selected[0] + 1
+            headers["content-range"] = f"bytes {selected[0]}-{selected[1]}/{size}"
+        self.init_headers(headers)
+        self.headers["content-length"] = str(self.length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.length or scope.get("method") == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+            return
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": fd,
+                            "offset": self.start, "count": self.length})
+                return
+            offset, remaining = self.start, self.length
+            while remaining:
+                chunk = await asyncio.to_thread(os.pread, fd, min(self.chunk_size, remaining), offset)
+                if not chunk:
+                    break  # file truncated underneath us
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining:
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            os.close(fd)
@@ -0,0 +1,106 @@
+"""
+Hierarchical timing wheel.
+
+Timers are kept in a small set of slot arrays (wheels) of increasing
+resolution: the innermost wheel has one slot per tick, each outer wheel slot
+spans a full revolution of the wheel inside it. Scheduling and expiring are
+O(1) per timer regardless of how many timers are pending; timers in outer
+wheels cascade inward as time reaches their slot.
+"""
+from typing import Dict, Hashable, List, Optional, Set
+
+
+class TimingWheel:
+    def __init__(self, tick: float = 1.0, slots_per_wheel: int = 64, levels: int = 4, start: float = 0.0):
+        self.tick = tick
+        self.slots = slots_per_wheel
+        self.levels = levels
+        self.current_tick = int(start // tick)
+        # wheels[level][slot] -> set of keys
+        self.wheels: List[List[Set[Hashable]]] = [[set() for _ in range(slots_per_wheel)] for _ in range(levels)]
+        self.deadlines: Dict[Hashable, int] = {}  # key -> absolute expiry tick
+        self._overflow: Set[Hashable] = set()     # beyond the outermost wheel's span
+        self._slot_of: Dict[Hashable, Set[Hashable]] = {}  # key -> slot (or overflow) holding it
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+    @property
+    def span(self) -> float:
+        """Seconds covered by the wheels before timers land in the overflow set."""
+        return self.tick * self.slots ** self.levels
+
+    def _place(self, key: Hashable, deadline_tick: int):
+        delta = deadline_tick - self.current_tick
+        target = self._overflow
+        if delta <= 0:
+            target = self.wheels[0][self.current_tick % self.slots]
+        else:
+            for level in range(self.levels):
+                if delta < self.slots ** (level + 1):
+                    target = self.wheels[level][(deadline_tick // self.slots ** level) % self.slots]
+                    break
+        target.add(key)
+        self._slot_of[key] = target
+
+    def schedule(self, key: Hashable, when: float):
+        """Schedules (or reschedules) `key` to expire at time `when`."""
+        if key in self.deadlines:
+            self.cancel(key)
+        deadline_tick = int(when // self.tick)
+        self.deadlines[key] = deadline_tick
+        self._place(key, deadline_tick)
+
+    def cancel(self, key: Hashable) -> bool:
+        if self.deadlines.pop(key, None) is None:
+            return False
+        self._slot_of.pop(key).discard(key)
+        return True
+
+    def advance(self, now: float) -> List[Hashable]:
+        """Moves the wheel to `now` and returns the keys whose deadline has passed."""
+        target_tick = int(now // self.tick)
+        expired: List[Hashable] = []
+        # Always process the current slot so timers scheduled "in the past" fire.
+        expired.extend(self._drain(self.wheels[0][self.current_tick % self.slots], target_tick))
+        while self.current_tick < target_tick:
+            self.current_tick += 1
+            if self.current_tick % self.slots == 0:
+                self._cascade(1)
+            expired.extend(self._drain(self.wheels[0][self.current_tick % self.slots], target_tick))
+        return expired
+
+    def _drain(self, slot: Set[Hashable], target_tick: int) -> List[Hashable]:
+        fired = []
+        for key in list(slot):
+            if self.deadlines.get(key, target_tick + 1) <= target_tick:
+                slot.discard(key)
+                del self.deadlines[key]
+                del self._slot_of[key]
+                fired.append(key)
+        return fired
+
+    def _cascade(self, level: int):
+        if level >= self.levels:
+            # Pull overflow timers that now fit inside the wheels.
+            for key in list(self._overflow):
+                if self.deadlines[key] - self.current_tick < self.slots ** self.levels:
+                    self._overflow.discard(key)
+                    self._place(key, self.deadlines[key])
+            return
+        slot_index = (self.current_tick // self.slots ** level) % self.slots
+        if slot_index == 0:
+            self._cascade(level + 1)
+        slot = self.wheels[level][slot_index]
+        keys = list(slot)
+        slot.clear()
+        for key in keys:
+            self._place(key, self.deadlines[key])
+
+    def next_deadline(self) -> Optional[float]:
+        if not self.deadlines:
+            return None
+        return min(self.deadlines.values()) * self.tick
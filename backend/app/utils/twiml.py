@@ -0,0 +1,74 @@
+"""
+Precompiled <Connect><Stream> TwiML documents.
+
+The document around the per-call <Parameter> values is identical for every
+call with the same stream URL and parameter layout, so it is rendered once per
+layout into literal fragments; rendering a call only escapes and joins the
+per-call values. Static per-campaign parameters are escaped once and baked
+into the template.
+"""
+from functools import lru_cache
+from typing import Dict, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape
+
+from ..config import settings
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>'
+
+# Attribute-value normalization would turn literal newlines and tabs into spaces.
+_ATTR_ENTITIES = {'"': "&quot;", "\n": "&#10;", "\r": "&#13;", "\t": "&#9;"}
+
+
+def escape_attr(value) -> str:
+    """Escapes a value for a double-quoted XML attribute."""
+    return escape("" if value is None else str(value), _ATTR_ENTITIES)
+
+
+@lru_cache(maxsize=1)
+def media_stream_url() -> str:
+    """wss:// URL of this backend's /media-stream endpoint (settings.base_url is fixed per process)."""
+    server_domain = settings.base_url.replace("http://", "").replace("https://", "")
+    return f"wss://{server_domain}/media-stream"
+
+
+class StreamTemplate:
+    """
+    TwiML that connects the call to a media stream, with `names` filled per call
+    (in order) and `static_params` fixed for every call rendered from it.
+    """
+
+    def __init__(self, stream_url: str, names: Sequence[str], static_params: Optional[Dict[str, str]] = None):
+        self.names = tuple(names)
+        static = "".join(
+            f'<Parameter name="{escape_attr(k)}" value="{escape_attr(v)}" />'
+            for k, v in (static_params or {}).items() if k not in self.names
+        )
+        # Literal fragments between the per-call values: len(names) + 1 pieces.
+        self._fragments = [f'{XML_DECLARATION}<Response><Connect><Stream url="{escape_attr(stream_url)}">']
+        for name in self.names:
+            self._fragments[-1] += f'<Parameter name="{escape_attr(name)}" value="'
+            self._fragments.append('" />')
+        self._fragments[-1] += f"{static}</Stream></Connect></Response>"
+
+    def render(self, *values) -> str:
+        if len(values) != len(self.names):
+            raise ValueError(f"Expected values for {self.names}, got {len(values)}")
+        parts = [self._fragments[0]]
+        for value, fragment in zip(values, self._fragments[1:]):
+            parts.append(escape_attr(value))
+            parts.append(fragment)
+        return "".join(parts)
+
+
+@lru_cache(maxsize=256)
+def _cached_template(names: Tuple[str, ...], static_items: Tuple[Tuple[str, str], ...]) -> StreamTemplate:
+    return StreamTemplate(media_stream_url(), names, dict(static_items))
+
+
+def stream_template(names: Sequence[str], static_params: Optional[Dict[str, str]] = None) -> StreamTemplate:
+    """Shared template for this backend's media stream; built once per layout and parameter set."""
+    return _cached_template(tuple(names), tuple(sorted((static_params or {}).items())))
+
+
+def outbound_stream_twiml(from_number: str, to_number: str, static_params: Optional[Dict[str, str]] = None) -> str:
+    return stream_template(("callerNumber", "calleeNumber"), static_params).render(from_number, to_number)
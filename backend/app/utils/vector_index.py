@@ -0,0 +1,266 @@
+"""
+In-memory cosine similarity indexes over unit-length float32 vectors.
+
+`VectorIndex` is exact: one C-contiguous matrix, so a top-k query is a single
+matrix-vector product (BLAS sgemv, which releases the GIL) followed by
+`argpartition` over the scores; only the k winners are sorted.
+
+`IVFIndex` is approximate, for corpora too large to scan within a call's
+latency budget. Spherical k-means on a sample places `nlist` centroids
+(about sqrt(n) by default); every vector is stored in the inverted list of
+its nearest centroid. A query scores the centroids and scans only the
+`nprobe` best lists, so it reads roughly nprobe/nlist of the corpus; raising
+nprobe trades latency for recall. New vectors are appended to their list
+(amortized O(1), lists grow by a quarter); removed ids are masked until the
+next rebuild, which retrains the centroids from the live vectors.
+
+Both indexes support concurrent searches while one writer adds or removes:
+writers publish new (array, size) snapshots instead of mutating what a
+reader may hold.
+"""
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+
+ASSIGN_BLOCK = 8192 # Vectors scored against the centroids at a time
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scales rows to unit length in place (zero rows stay zero) and returns the matrix."""
+    norms = np.sqrt(np.einsum("ij,ij->i", matrix, matrix))[:, None]  # no matrix-sized temporary
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def _as_unit_matrix(vectors: np.ndarray) -> np.ndarray:
+    matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+    if matrix.ndim != 2:
+        raise ValueError("vectors must be a 2-D matrix")
+    return normalize_rows(matrix)
+
+
+def _unit_query(query: np.ndarray) -> Optional[np.ndarray]:
+    query = np.asarray(query, dtype=np.float32)
+    norm = np.linalg.norm(query)
+    return query / norm if norm > 0 else None
+
+
+def _top_k(ids: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    n = len(scores)
+    k = min(k, n)
+    top = np.argpartition(scores, n - k)[n - k:] if k < n else np.arange(n)
+    top = top[np.argsort(-scores[top], kind="stable")]
+    top = top[scores[top] > -np.inf]  # masked (removed) rows
+    return ids[top], scores[top]
+
+
+_NO_RESULTS = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+
+
+class VectorIndex:
+    """
+    Exact index. Takes ownership of `vectors` (normalized in place) when it already is a
+    C-contiguous float32 matrix, so a freshly loaded corpus is not copied.
+    """
+
+    def __init__(self, ids: np.ndarray, vectors: np.ndarray):
+        if len(ids) != len(vectors):
+            raise ValueError("ids and vectors differ in length")
+        self._data = (np.ascontiguousarray(ids, dtype=np.int64), _as_unit_matrix(vectors))
+        self._lock = threading.Lock()
+
+    @classmethod
+    def empty(cls, dimensions: int = 0) -> "VectorIndex":
+        return cls(np.zeros(0, dtype=np.int64), np.zeros((0, dimensions), dtype=np.float32))
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._data[0]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._data[1]
+
+    def __len__(self) -> int:
+        return len(self._data[0])
+
+    @property
+    def dimensions(self) -> int:
+        return self._data[1].shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        return self._data[0].nbytes + self._data[1].nbytes
+
+    def search(self, query: np.ndarray, k: int, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """The ids and cosine similarities of the k nearest rows, best first. nprobe is ignored."""
+        ids, matrix = self._data
+        query = _unit_query(query)
+        if not len(ids) or k <= 0 or query is None:
+            return _NO_RESULTS
+        return _top_k(ids, matrix @ query, k)
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray):
+        """Appends rows. Copies the matrix, so add in batches."""
+        new = _as_unit_matrix(vectors)
+        with self._lock:
+            old_ids, old_matrix = self._data
+            matrix = np.concatenate([old_matrix, new]) if len(old_ids) else new
+            self._data = (np.concatenate([old_ids, np.asarray(ids, dtype=np.int64)]), matrix)
+
+    def remove(self, ids: np.ndarray):
+        with self._lock:
+            old_ids, old_matrix = self._data
+            keep = ~np.isin(old_ids, ids)
+            if not keep.all():
+                self._data = (old_ids[keep], old_matrix[keep])
+
+    def live_ids(self) -> np.ndarray:
+        return self._data[0]
+
+    def vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self._data
+
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the most similar centroid for each (unit) vector."""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BLOCK):
+        block = vectors[start:start + ASSIGN_BLOCK]
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(sample: np.ndarray, nlist: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """Unit centroids maximizing cosine similarity to the (unit) sample rows."""
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_lists(sample, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=nlist)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+        centroids[filled] = np.add.reduceat(sample[order], starts, axis=0)
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            # Restart empty lists at random sample points rather than losing them.
+            centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+        normalize_rows(centroids)
+    return centroids
+
+
+def train_centroids(matrix: np.ndarray, nlist: Optional[int] = None, iterations: int = 10,
+                    sample_per_list: int = 32, seed: int = 0) -> np.ndarray:
+    """IVF centroids (nlist defaults to sqrt(n)) trained on a sample of the unit rows of `matrix`."""
+    n = len(matrix)
+    if n == 0:
+        raise ValueError("cannot train an IVF index without vectors")
+    nlist = max(1, min(n, nlist or int(np.sqrt(n))))
+    rng = np.random.default_rng(seed)
+    sample_size = min(n, nlist * sample_per_list)
+    sample = matrix[np.sort(rng.choice(n, sample_size, replace=False))] if sample_size < n else matrix.copy()
+    return spherical_kmeans(sample, nlist, iterations, rng)
+
+
+class IVFIndex:
+    """Approximate inverted-file index; see the module docstring."""
+
+    def __init__(self, centroids: np.ndarray, nprobe: int = 32):
+        self.centroids = _as_unit_matrix(np.array(centroids, dtype=np.float32))
+        self.nprobe = nprobe
+        empty = (np.zeros((0, self.dimensions), dtype=np.float32), np.zeros(0, dtype=np.int64), 0)
+        self._lists = [empty] * len(self.centroids)  # per list: (vectors, ids, size) with spare capacity
+        self._count = 0
+        self._deleted = np.zeros(0, dtype=np.int64)   # sorted ids masked until the next rebuild
+        self._lock = threading.Lock()
+
+    @classmethod
+    def train(cls, ids: np.ndarray, vectors: np.ndarray, nlist: Optional[int] = None, nprobe: int = 32,
+              iterations: int = 10, sample_per_list: int = 32, seed: int = 0) -> "IVFIndex":
+        """Builds an index over the vectors, with centroids trained on a sample of them."""
+        matrix = _as_unit_matrix(vectors)
+        index = cls(train_centroids(matrix, nlist, iterations, sample_per_list, seed), nprobe)
+        index.add(ids, matrix)
+        return index
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def dimensions(self) -> int:
+        return self.centroids.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        return self.centroids.nbytes + sum(v.nbytes + i.nbytes for v, i, _ in self._lists)
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray):
+        matrix = _as_unit_matrix(vectors)
+        ids = np.asarray(ids, dtype=np.int64)
+        assignments = assign_lists(matrix, self.centroids)
+        order = np.argsort(assignments, kind="stable")
+        lists, starts = np.unique(assignments[order], return_index=True)
+        bounds = np.append(starts, len(order))
+        with self._lock:
+            for l, start, end in zip(lists.tolist(), bounds[:-1].tolist(), bounds[1:].tolist()):
+                rows = order[start:end]
+                vecs, list_ids, size = self._lists[l]
+                needed = size + len(rows)
+                if needed > len(list_ids):
+                    capacity = max(needed, len(list_ids) + len(list_ids) // 4, 16)
+                    grown_vecs = np.empty((capacity, self.dimensions), dtype=np.float32)
+                    grown_ids = np.empty(capacity, dtype=np.int64)
+                    grown_vecs[:size], grown_ids[:size] = vecs[:size], list_ids[:size]
+                    vecs, list_ids = grown_vecs, grown_ids
+                # Rows beyond a published size are invisible to readers, so fill them first.
+                vecs[size:needed] = matrix[rows]
+                list_ids[size:needed] = ids[rows]
+                self._lists[l] = (vecs, list_ids, needed)
+            self._count += len(ids)
+
+    def remove(self, ids: np.ndarray):
+        with self._lock:
+            ids = np.setdiff1d(np.asarray(ids, dtype=np.int64), self._deleted)
+            self._deleted = np.union1d(self._deleted, ids)
+            self._count -= len(ids)
+
+    def search(self, query: np.ndarray, k: int, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Approximate ids and cosine similarities of the k nearest vectors, best first."""
+        query = _unit_query(query)
+        if not self._count or k <= 0 or query is None:
+            return _NO_RESULTS
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        centroid_scores = self.centroids @ query
+        probe = np.argpartition(centroid_scores, self.nlist - nprobe)[self.nlist - nprobe:]
+        lists, deleted = self._lists, self._deleted
+        scores, ids = [], []
+        for l in probe.tolist():
+            vecs, list_ids, size = lists[l]
+            if size:
+                scores.append(vecs[:size] @ query)
+                ids.append(list_ids[:size])
+        if not scores:
+            return _NO_RESULTS
+        scores, ids = np.concatenate(scores), np.concatenate(ids)
+        if len(deleted):
+            scores[np.isin(ids, deleted)] = -np.inf
+        return _top_k(ids, scores, k)
+
+    def vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Copies of the live ids and vectors, e.g. to retrain on."""
+        lists = self._lists
+        ids = np.concatenate([list_ids[:size] for _, list_ids, size in lists])
+        matrix = np.concatenate([vecs[:size] for vecs, _, size in lists])
+        if len(self._deleted):
+            keep = ~np.isin(ids, self._deleted)
+            ids, matrix = ids[keep], matrix[keep]
+        return ids, matrix
+
+    def live_ids(self) -> np.ndarray:
+        ids = np.concatenate([list_ids[:size] for _, list_ids, size in self._lists])
+        return ids[~np.isin(ids, self._deleted)] if len(self._deleted) else ids
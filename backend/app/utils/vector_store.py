@@ -0,0 +1,228 @@
+"""
+Memory-mapped, quantized knowledge-base vector files shared by the gunicorn
+workers of a host.
+
+A VectorIndex or IVFIndex keeps a private float32 copy of the corpus in every
+worker. A vector file stores the corpus once, quantized, and each worker maps
+it read-only: its pages sit in the kernel page cache, are shared by every
+process mapping the file and are scored in place, so a worker's own memory
+only grows by a small conversion buffer per searching thread.
+
+Layout (little endian; sections start on 64-byte boundaries):
+
+    header      HEADER_SIZE bytes: magic b"KBVS", version, dtype, dimensions,
+                rows, nlist, the chunk-table signature (rows, highest id) the
+                file was built from, when that signature was read, and the
+                embedding model
+    ids         int64[rows]
+    scales      float32[rows]             row i ~= scales[i] * matrix[i]
+    offsets     int64[nlist + 1]          list l is rows offsets[l]:offsets[l + 1]
+    centroids   float32[nlist, dims]
+    matrix      int8 or float16 [rows, dims]
+
+int8 rows are scaled so their largest component maps to +-127 (one float32
+scale per row, 4x smaller than float32); float16 rows are stored as they are
+(scale 1, 2x smaller). With nlist > 0 the rows are grouped by inverted list
+and a query scans only its `nprobe` nearest lists, as IVFIndex does; with
+nlist == 0 every row is scanned.
+
+A file is published by writing a temporary file next to it and renaming it
+over the old one, so readers open either the old or the new file, never a
+partial one, and mappings of the old file stay valid until they are dropped.
+"""
+import os
+import mmap
+import fcntl
+import struct
+import threading
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .vector_index import _NO_RESULTS, _as_unit_matrix, _top_k, _unit_query, assign_lists
+
+MAGIC = b"KBVS"
+VERSION = 1
+HEADER = struct.Struct("<4sHB5xIQI4xQQd64s")
+HEADER_SIZE = 256
+ALIGN = 64
+DTYPES = {"int8": 1, "float16": 2}
+_NUMPY_DTYPES = {1: np.int8, 2: np.float16}
+SCORE_BLOCK = 1024  # Rows converted to float32 and scored at a time
+WRITE_BLOCK = 16384 # Rows quantized and written at a time
+
+
+def _layout(rows: int, dimensions: int, nlist: int, itemsize: int) -> dict:
+    offset, layout = HEADER_SIZE, {}
+    for name, size in (("ids", rows * 8), ("scales", rows * 4), ("offsets", (nlist + 1) * 8),
+                       ("centroids", nlist * dimensions * 4), ("matrix", rows * dimensions * itemsize)):
+        layout[name] = offset
+        offset += -(-size // ALIGN) * ALIGN
+    layout["end"] = offset
+    return layout
+
+
+def quantize(block: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Quantized rows and their per-row scales."""
+    if dtype == "float16":
+        return block.astype(np.float16), np.ones(len(block), dtype=np.float32)
+    peaks = np.abs(block).max(axis=1) if block.size else np.zeros(len(block), dtype=np.float32)
+    scales = np.where(peaks > 0, peaks / 127, 1).astype(np.float32)
+    return np.rint(block / scales[:, None]).astype(np.int8), scales
+
+
+def write_vector_file(path: str, ids: np.ndarray, vectors: np.ndarray, dtype: str = "int8",
+                      centroids: Optional[np.ndarray] = None, signature: Tuple[int, int] = (0, 0),
+                      model: str = "", snapshot_time: float = 0.0):
+    """
+    Writes ids and vectors (normalized in place when already float32) as a vector file,
+    atomically replacing `path`. With centroids the rows are grouped into inverted lists.
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported vector file dtype {dtype!r}; use one of {sorted(DTYPES)}")
+    matrix = _as_unit_matrix(vectors)
+    ids = np.asarray(ids, dtype=np.int64)
+    rows, dimensions = matrix.shape
+    if len(ids) != rows:
+        raise ValueError("ids and vectors differ in length")
+    if centroids is not None and len(centroids):
+        centroids = _as_unit_matrix(np.array(centroids, dtype=np.float32))
+        assignments = assign_lists(matrix, centroids)
+        order = np.argsort(assignments, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=len(centroids)))])
+    else:
+        centroids = np.zeros((0, dimensions), dtype=np.float32)
+        order, offsets = np.arange(rows), np.zeros(1)
+    layout = _layout(rows, dimensions, len(centroids), np.dtype(_NUMPY_DTYPES[DTYPES[dtype]]).itemsize)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.truncate(layout["end"])
+            f.write(HEADER.pack(MAGIC, VERSION, DTYPES[dtype], dimensions, rows, len(centroids), *signature,
+                                snapshot_time, model.encode("utf-8")[:64]))
+            scales = np.empty(rows, dtype=np.float32)
+            f.seek(layout["matrix"])
+            for start in range(0, rows, WRITE_BLOCK):
+                quantized, scales[start:start + WRITE_BLOCK] = quantize(matrix[order[start:start + WRITE_BLOCK]], dtype)
+                f.write(quantized.tobytes())
+            for name, array in (("ids", ids[order]), ("scales", scales), ("offsets", offsets.astype(np.int64)),
+                                ("centroids", centroids)):
+                f.seek(layout[name])
+                f.write(array.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@contextmanager
+def publish_lock(path: str):
+    """Exclusive cross-process lock for rebuilding the vector file at `path`."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".lock", "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class MappedVectorIndex:
+    """A vector file mapped read-only, searched like VectorIndex / IVFIndex."""
+
+    def __init__(self, path: str, nprobe: int = 32):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size < HEADER_SIZE:
+                raise ValueError(f"{path} is not a vector file")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, code, dimensions, rows, nlist, table_rows, max_id,
+         snapshot_time, model) = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION or code not in _NUMPY_DTYPES:
+            raise ValueError(f"{path} is not a version {VERSION} vector file")
+        dtype = _NUMPY_DTYPES[code]
+        layout = _layout(rows, dimensions, nlist, np.dtype(dtype).itemsize)
+        if stat.st_size < layout["end"]:
+            raise ValueError(f"{path} is truncated")
+
+        def section(name, section_dtype, count, shape=None):
+            array = np.frombuffer(self._map, dtype=section_dtype, count=count, offset=layout[name])
+            return array.reshape(shape) if shape else array
+
+        self.ids = section("ids", np.int64, rows)
+        self.scales = section("scales", np.float32, rows)
+        self.offsets = section("offsets", np.int64, nlist + 1)
+        self.centroids = section("centroids", np.float32, nlist * dimensions, (nlist, dimensions))
+        self.matrix = section("matrix", dtype, rows * dimensions, (rows, dimensions))
+        self.path = path
+        self.file_id = (stat.st_dev, stat.st_ino)
+        self.signature = (table_rows, max_id)
+        self.snapshot_time = snapshot_time
+        self.model = model.rstrip(b"\0").decode("utf-8")
+        self.nprobe = nprobe
+        self._buffers = threading.local()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def dimensions(self) -> int:
+        return self.matrix.shape[1]
+
+    @property
+    def dtype(self) -> str:
+        return self.matrix.dtype.name
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._map)
+
+    def _score(self, start: int, end: int, query: np.ndarray) -> np.ndarray:
+        """Similarities of rows start:end, dequantized into a per-thread float32 buffer block by block."""
+        buffer = getattr(self._buffers, "block", None)
+        if buffer is None:
+            buffer = self._buffers.block = np.empty((SCORE_BLOCK, self.dimensions), dtype=np.float32)
+        scores = np.empty(end - start, dtype=np.float32)
+        for offset in range(start, end, SCORE_BLOCK):
+            stop = min(end, offset + SCORE_BLOCK)
+            block = buffer[:stop - offset]
+            np.copyto(block, self.matrix[offset:stop])
+            np.dot(block, query, out=scores[offset - start:stop - start])
+        scores *= self.scales[start:end]
+        return scores
+
+    def search(self, query: np.ndarray, k: int, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """The ids and (approximate) cosine similarities of the k nearest rows, best first."""
+        query = _unit_query(query)
+        if not len(self) or k <= 0 or query is None:
+            return _NO_RESULTS
+        if not self.nlist:
+            return _top_k(self.ids, self._score(0, len(self), query), k)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        probe = np.sort(np.argpartition(self.centroids @ query, self.nlist - nprobe)[self.nlist - nprobe:])
+        scores, ids = [], []
+        for l in probe.tolist():
+            start, end = int(self.offsets[l]), int(self.offsets[l + 1])
+            if end > start:
+                scores.append(self._score(start, end, query))
+                ids.append(self.ids[start:end])
+        if not scores:
+            return _NO_RESULTS
+        return _top_k(np.concatenate(ids), np.concatenate(scores), k)
+
+    def live_ids(self) -> np.ndarray:
+        return np.array(self.ids)
+
+    def vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Copies of the ids and the dequantized vectors."""
+        return np.array(self.ids), self.matrix.astype(np.float32) * self.scales[:, None]
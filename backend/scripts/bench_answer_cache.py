@@ -0,0 +1,239 @@
+"""
+Semantic answer cache benchmark (app/services/answer_cache.py).
+
+1. Lookup latency of a full cache (--capacity entries of --dimensions) for
+   exact-text hits, similarity hits and misses: after a warm-up pass, --runs
+   runs of 2000 lookups, reporting the median of the runs' p50 and p99.
+2. A call-center workload through RetrievalService.answer_context: --asks
+   questions drawn from --topics popular topics (Zipf), each phrased in
+   several ways whose embeddings are ~0.97 similar, plus one-off questions.
+   The embedding model is stood in for by a table of synthetic vectors with
+   --embed-ms of latency (the real API call); retrieval itself runs for real
+   on an in-memory vector and keyword index with chunk texts served from
+   memory. Reports the hit rate, time per answer for hits and misses and the
+   kb.answer_cache_seconds_saved metric.
+3. Expiry (an expired phrasing that scores higher must not hide a fresh one),
+   LRU replacement and invalidation: a loaded index change (as after
+   re-vectorizing) must empty the cache.
+
+Exits non-zero if a check fails or hit lookups exceed --budget-ms at the median p99.
+
+Usage (from backend/):
+    python3 scripts/bench_answer_cache.py --capacity 1000 --dimensions 1536
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.answer_cache import AnswerCache  # noqa: E402
+from app.utils.metrics import metrics  # noqa: E402
+
+
+def unit(vector: np.ndarray) -> np.ndarray:
+    return vector / np.linalg.norm(vector)
+
+
+def paraphrase(rng, vector: np.ndarray, similarity: float = 0.97) -> np.ndarray:
+    """A unit vector with the given cosine similarity to `vector`."""
+    noise = rng.standard_normal(len(vector)).astype(np.float32)
+    noise -= noise @ vector * vector
+    return unit(similarity * vector + np.sqrt(1 - similarity ** 2) * unit(noise))
+
+
+def percentiles(times):
+    times = sorted(times)
+    return times[len(times) // 2] * 1e3, times[int(len(times) * 0.99)] * 1e3
+
+
+def bench_lookups(rng, args, failures: list):
+    cache = AnswerCache(capacity=args.capacity, threshold=0.95, ttl_seconds=3600)
+    vectors = [unit(rng.standard_normal(args.dimensions).astype(np.float32)) for _ in range(args.capacity)]
+    for i, vector in enumerate(vectors):
+        cache.put(f"question {i}", vector, f"answer {i}", 0.1)
+    cases = {
+        "exact-text hit": lambda i: cache.get_exact(f"Question {i}?"),
+        "similarity hit": lambda i: cache.get_similar(paraphrase(rng, vectors[i])),
+        "miss": lambda i: cache.get_similar(unit(rng.standard_normal(args.dimensions).astype(np.float32))),
+    }
+    print(f"full cache, {args.capacity} x {args.dimensions}:")
+    for label, lookup in cases.items():
+        def timed_run(lookups: int):
+            times, wrong = [], 0
+            for i in rng.integers(0, args.capacity, lookups).tolist():
+                if label == "similarity hit":
+                    query = paraphrase(rng, vectors[i])
+                    t0 = time.perf_counter()
+                    answer = cache.get_similar(query)
+                else:
+                    t0 = time.perf_counter()
+                    answer = lookup(i)
+                times.append(time.perf_counter() - t0)
+                wrong += answer != (None if label == "miss" else f"answer {i}")
+            return times, wrong
+
+        timed_run(200)  # warm-up: caches, allocator and branch predictors
+        runs = [timed_run(2000) for _ in range(args.runs)]
+        wrong = sum(w for _, w in runs)
+        p50 = float(np.median([percentiles(times)[0] for times, _ in runs]))
+        p99 = float(np.median([percentiles(times)[1] for times, _ in runs]))
+        print(f"  {label:<15} p50={p50:.3f}ms p99={p99:.3f}ms (median of {args.runs} runs) wrong={wrong}")
+        if wrong:
+            failures.append(f"{label}: {wrong} wrong answers")
+        if label != "miss" and p99 > args.budget_ms:
+            failures.append(f"{label} p99 {p99:.3f}ms exceeds {args.budget_ms}ms")
+
+
+async def bench_workload(rng, args, failures: list):
+    from app.services import retrieval_service as module
+    from app.services.answer_cache import answer_cache
+    from app.utils.keyword_index import KeywordIndex
+    from app.utils.vector_index import VectorIndex
+
+    dimensions = args.dimensions
+    topics = [unit(rng.standard_normal(dimensions).astype(np.float32)) for _ in range(args.topics)]
+    phrasings = {}
+    for t, vector in enumerate(topics):
+        for p in range(4):
+            phrasings[f"topic {t} question, phrasing {p}"] = paraphrase(rng, vector)
+    embedded = 0
+
+    async def get_embedding(text, model=None):
+        nonlocal embedded
+        embedded += 1
+        await asyncio.sleep(args.embed_ms / 1000)
+        vector = phrasings.get(text)
+        return (vector if vector is not None else unit(rng.standard_normal(dimensions).astype(np.float32))).tolist()
+
+    module.openai_service.get_embedding = get_embedding
+    service = module.retrieval_service
+    chunks = np.vstack([paraphrase(rng, topics[i % args.topics], 0.8) for i in range(args.chunks)])
+    service.index = VectorIndex(np.arange(args.chunks), chunks)
+    service.keywords = KeywordIndex()
+    texts = {i: f"Policy text {i} for topic {i % args.topics}: " + "details " * 60 for i in range(args.chunks)}
+    service.keywords.add(list(texts), list(texts.values()))
+    service._fetch_chunks = lambda ids: {
+        i: {"id": i, "document_id": "faq.pdf", "chunk_index": i, "text": texts[i]} for i in ids
+    }
+    answer_cache.capacity, answer_cache.threshold = args.capacity, 0.95
+    answer_cache.clear()
+    saved_before = metrics.snapshot()["counters"].get("kb.answer_cache_seconds_saved", 0.0)
+
+    popularity = 1 / np.arange(1, args.topics + 1)
+    popularity /= popularity.sum()
+    timings = {"hit": [], "miss": []}
+    for ask in range(args.asks):
+        if rng.random() < args.one_off:
+            question = f"one-off question {ask}"
+        else:
+            question = f"topic {rng.choice(args.topics, p=popularity)} question, phrasing {rng.integers(4)}"
+        hits = answer_cache.hits
+        t0 = time.perf_counter()
+        await service.answer_context(question)
+        timings["hit" if answer_cache.hits > hits else "miss"].append(time.perf_counter() - t0)
+    saved = metrics.snapshot()["counters"].get("kb.answer_cache_seconds_saved", 0.0) - saved_before
+    hit_p50, hit_p99 = percentiles(timings["hit"])
+    miss_p50, miss_p99 = percentiles(timings["miss"])
+    print(f"\nworkload: {args.asks} questions, {args.topics} topics x 4 phrasings, {args.one_off:.0%} one-off, "
+          f"embedding {args.embed_ms:.0f}ms")
+    print(f"  hit rate {len(timings['hit']) / args.asks:.1%} ({answer_cache.hit_rate:.1%} of lookups), "
+          f"{embedded} embedding calls")
+    print(f"  answer time: hits p50={hit_p50:.2f}ms p99={hit_p99:.2f}ms, misses p50={miss_p50:.2f}ms "
+          f"p99={miss_p99:.2f}ms; retrieval time saved {saved:.1f}s")
+    if len(timings["hit"]) / args.asks < 0.5:
+        failures.append("hit rate below 50% on a repetitive workload")
+
+
+def check_lifecycle(rng, failures: list):
+    from app.config import settings
+    from app.services import retrieval_service as module
+    from app.services.answer_cache import answer_cache
+
+    vector = unit(rng.standard_normal(8).astype(np.float32))
+    cache = AnswerCache(capacity=2, threshold=0.95, ttl_seconds=0.05)
+    cache.put("a", vector, "answer a", 0.1)
+    expired_ok = cache.get_exact("a") == "answer a"
+    time.sleep(0.06)
+    expired_ok = expired_ok and cache.get_exact("a") is None and cache.get_similar(vector) is None
+
+    # Two phrasings of one question, the older and closer one expired: the fresh one still hits.
+    cache = AnswerCache(capacity=4, threshold=0.9, ttl_seconds=0.2)
+    old, fresh = paraphrase(rng, vector, 0.99), paraphrase(rng, vector, 0.95)
+    cache.put("old phrasing", old, "answer", 0.1)
+    time.sleep(0.15)
+    cache.put("fresh phrasing", fresh, "answer", 0.1)
+    time.sleep(0.1)
+    expired_ok = expired_ok and vector @ old > vector @ fresh and cache.get_similar(vector) == "answer"
+
+    cache = AnswerCache(capacity=2, threshold=0.95, ttl_seconds=3600)
+    vectors = [unit(rng.standard_normal(8).astype(np.float32)) for _ in range(3)]
+    cache.put("a", vectors[0], "answer a", 0.1)
+    cache.put("b", vectors[1], "answer b", 0.1)
+    cache.get_exact("a")  # b is now the least recently used
+    cache.put("c", vectors[2], "answer c", 0.1)
+    lru_ok = (cache.get_exact("a"), cache.get_exact("b"), cache.get_similar(vectors[2])) == ("answer a", None, "answer c")
+
+    class Cursor:
+        def execute(self, sql, params):
+            self.rows = [(0, 0)] if "COUNT(*)" in sql else []
+
+        def fetchone(self):
+            return self.rows[0]
+
+        def fetchmany(self, size=None):
+            rows, self.rows = self.rows, []
+            return rows
+
+        fetchall = fetchmany
+
+        def close(self):
+            pass
+
+    class Connection:
+        def cursor(self, **kwargs):
+            return Cursor()
+
+        def close(self):
+            pass
+
+    settings.kb_vector_store_path = ""
+    module.get_db_connection = Connection
+    answer_cache.put("x", vector, "answer x", 0.1)
+    module.RetrievalService().load()
+    invalidated = len(answer_cache) == 0
+    print(f"\nexpiry: {'ok' if expired_ok else 'FAILED'}, LRU replacement: {'ok' if lru_ok else 'FAILED'}, "
+          f"cleared on index change: {'ok' if invalidated else 'FAILED'}")
+    if not (expired_ok and lru_ok and invalidated):
+        failures.append("cache lifecycle")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--capacity", type=int, default=1000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--topics", type=int, default=40)
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--asks", type=int, default=2000)
+    parser.add_argument("--one-off", type=float, default=0.2, help="share of questions asked only once")
+    parser.add_argument("--embed-ms", type=float, default=50.0)
+    parser.add_argument("--budget-ms", type=float, default=1.0)
+    parser.add_argument("--runs", type=int, default=5, help="timed lookup runs; the median p99 is checked")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(4)
+    failures = []
+    bench_lookups(rng, args, failures)
+    asyncio.run(bench_workload(rng, args, failures))
+    check_lifecycle(rng, failures)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Dial-path benchmark against the local fake Twilio server (scripts/fake_twilio.py).
+
+Compares the blocking TwilioService.make_call (run on the event loop, as the
+routes used to) with make_call_async, reporting dials/sec, per-dial latency
+from the twilio.dial_seconds histogram and the worst event-loop stall seen by
+a 10 ms heartbeat task. It also checks that every async dial returned a SID,
+that the fake server received the TwiML and status callback parameters, that
+the aiohttp session reused its connections, and that every call was handed to
+the call_logs writer. MySQL is not touched: the writer's batch insert is
+replaced by an in-memory sink. Exits non-zero if a check fails.
+
+Usage (from backend/):
+    python3 scripts/bench_dial.py --dials 200 --concurrency 20 --latency 0.05
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_twilio import FakeTwilio  # noqa: E402
+
+
+class LoopStallMonitor:
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.max_stall = 0.0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.max_stall = max(self.max_stall, loop.time() - start - self.interval)
+
+    def __enter__(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+
+async def run(args):
+    from twilio.rest import Client
+    from twilio.http.http_client import TwilioHttpClient
+    from app.config import settings
+    from app.utils.metrics import metrics
+    from app.services import twilio_service as twilio_module
+    from app.services.call_log_writer import call_log_writer
+
+    fake = FakeTwilio(args.latency)
+    base_url = fake.start_in_thread()
+    settings.twilio_api_base_url = base_url
+
+    logged = []
+    call_log_writer._write = logged.extend
+    service = twilio_module.TwilioService()
+    twiml = "<Response><Connect><Stream url=\"wss://example.test/media-stream\" /></Connect></Response>"
+    numbers = [f"+1415555{i:04d}" for i in range(args.dials)]
+
+    class LocalHttpClient(TwilioHttpClient):
+        def request(self, method, url, *a, **kw):
+            return super().request(method, url.replace(twilio_module.TWILIO_API_BASE, base_url), *a, **kw)
+
+    # Baseline: the synchronous client called directly from a coroutine.
+    service.client = Client(settings.twilio_account_sid or "AC0", settings.twilio_auth_token or "x",
+                            http_client=LocalHttpClient())
+    sync_dials = min(args.dials, args.sync_dials)
+    twilio_module.get_db_connection = lambda: None  # blocking insert path logs and moves on
+    with LoopStallMonitor() as sync_monitor:
+        start = time.perf_counter()
+        for number in numbers[:sync_dials]:
+            service.make_call(number, settings.twilio_from_number, twiml)
+            await asyncio.sleep(0)
+        sync_elapsed = time.perf_counter() - start
+
+    fake.calls.clear()
+    fake.connections.clear()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def dial(number):
+        async with semaphore:
+            return await service.make_call_async(number, settings.twilio_from_number, twiml)
+
+    with LoopStallMonitor() as async_monitor:
+        start = time.perf_counter()
+        calls = await asyncio.gather(*(dial(n) for n in numbers))
+        async_elapsed = time.perf_counter() - start
+    await call_log_writer.stop()
+    await service.close()
+    fake.stop_thread()
+
+    hist = metrics.histogram("twilio.dial_seconds").snapshot()
+    print(f"{'path':<22} {'dials':>6} {'dials/s':>9} {'max loop stall ms':>18}")
+    print(f"{'make_call (blocking)':<22} {sync_dials:>6} {sync_dials / sync_elapsed:>9.1f} "
+          f"{sync_monitor.max_stall * 1000:>18.1f}")
+    print(f"{'make_call_async':<22} {args.dials:>6} {args.dials / async_elapsed:>9.1f} "
+          f"{async_monitor.max_stall * 1000:>18.1f}")
+    print(f"async dial latency: p50={hist['p50'] * 1000:.1f}ms p90={hist['p90'] * 1000:.1f}ms "
+          f"p99={hist['p99'] * 1000:.1f}ms over {hist['count']} dials; "
+          f"{len(fake.connections)} TCP connections")
+
+    failures = []
+    if not all(c.sid and c.sid.startswith("CA") for c in calls):
+        failures.append("not every dial returned a call SID")
+    if len(fake.calls) != args.dials:
+        failures.append(f"fake server saw {len(fake.calls)} calls, expected {args.dials}")
+    if any(c.get("Twiml") != twiml or not c.get("StatusCallback", "").endswith("/api/calls/call-status")
+           for c in fake.calls):
+        failures.append("TwiML or StatusCallback missing from a request")
+    if len(fake.connections) > args.concurrency:
+        failures.append(f"{len(fake.connections)} connections for concurrency {args.concurrency}: no reuse")
+    if sorted(row[0] for row in logged) != sorted(c.sid for c in calls):
+        failures.append(f"call_logs writer received {len(logged)} rows for {len(calls)} calls")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dials", type=int, default=200)
+    parser.add_argument("--sync-dials", type=int, default=50, help="Dials for the blocking baseline")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake Twilio response delay (s)")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Knowledge-base vectorization benchmark against the local fake OpenAI server
+(scripts/fake_openai.py).
+
+Writes --documents synthetic text files and vectorizes them twice: once
+embedding chunk by chunk (one request per chunk, as many in flight as
+embedding_concurrency allows) and once through
+VectorizationService.vectorize_files, which packs chunks into batched
+requests. Reports chunks/sec and request counts for both, and checks that:
+- every chunk fits kb_chunk_tokens and maps back to its span in the source;
+- chunked without overlap (chunk_text and StreamingChunker), the chunks
+  joined with the source's whitespace between them reproduce the source;
+- every stored vector is the embedding of its own chunk (batch order kept);
+- no request exceeds the provider's input limit and at most
+  embedding_concurrency requests were in flight;
+- per-document embedding costs add up to the total;
+- re-vectorizing the unchanged corpus is served entirely from the embedding
+  cache (zero API calls), and the cache evicts down to its size limit.
+MySQL is not touched: chunk storage is replaced by an in-memory sink. Exits
+non-zero if a check fails.
+
+Usage (from backend/):
+    python3 scripts/bench_embedding.py --documents 40 --words 20000 --latency 0.05
+    python3 scripts/bench_embedding.py --documents 1000 --words 1500
+"""
+import os
+import sys
+import time
+import random
+import logging
+import asyncio
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai import FakeOpenAI, fake_embedding, MAX_INPUTS  # noqa: E402
+
+WORDS = ("call agent customer appointment schedule policy refund order delivery account payment "
+         "support hours address warranty invoice plan upgrade cancel renewal discount "
+         "$3.50 example.com v1.2 e.g.").split()
+
+
+def rejoined(source: str, chunks) -> str:
+    """Chunks without overlap joined back together, with the source's whitespace between them."""
+    pieces, position = [], 0
+    for chunk in chunks:
+        gap = source[position:chunk.start_char]
+        pieces.append((gap if not gap.strip() else "<gap>") + chunk.text)
+        position = chunk.end_char
+    tail = source[position:]
+    return "".join(pieces) + (tail if not tail.strip() else "<gap>")
+
+
+def synthetic_document(rng: random.Random, words: int) -> str:
+    paragraphs, sentence, paragraph = [], [], []
+    for _ in range(words):
+        sentence.append(rng.choice(WORDS))
+        if len(sentence) >= rng.randint(6, 24):
+            paragraph.append(" ".join(sentence).capitalize() + rng.choice(".!?"))
+            sentence = []
+            if len(paragraph) >= rng.randint(3, 8):
+                paragraphs.append(" ".join(paragraph))
+                paragraph = []
+    paragraphs.append(" ".join(paragraph + [" ".join(sentence)]))
+    return "\n\n".join(paragraphs)
+
+
+async def per_chunk_baseline(texts, concurrency: int) -> float:
+    from app.services import openai_service
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(text):
+        async with semaphore:
+            return await openai_service.get_embedding(text)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(t) for t in texts))
+    if any(r is None for r in results):
+        raise RuntimeError("a per-chunk embedding request failed")
+    return time.perf_counter() - start
+
+
+async def run(args, files, failures: list):
+    import openai
+    from app.config import settings
+    from app.services import openai_service
+    from app.services.embedding_cache import embedding_cache
+    from app.services.knowledge_base_service import knowledge_base_service
+    from app.services.vectorization_service import VectorizationService
+    from app.utils.chunking import StreamingChunker, chunk_text, token_counter
+
+    logging.getLogger("openai").setLevel(logging.WARNING)
+    fake = FakeOpenAI(args.dimensions, args.latency, args.per_input_latency)
+    openai.api_base = await fake.start()
+    openai.api_key = "sk-fake"
+    openai_service.openai_client = openai
+    settings.embedding_concurrency = args.concurrency
+    settings.embedding_tokens_per_minute = args.tokens_per_minute
+
+    stored = {}
+
+    def sink(document_id, chunks, vectors, model, cost, mime_type=None):
+        stored[document_id] = (chunks, np.array(vectors), cost)
+
+    knowledge_base_service.replace_document = sink
+    service = VectorizationService()
+    service.detect_file_type = lambda path: "text/plain"
+
+    report = await service.vectorize_files(files)
+    batched_requests, batched_max_active = fake.requests, fake.max_active
+    print(f"batched:   {report['chunks']} chunks from {len(files)} documents in {report['seconds']:.2f}s "
+          f"({report['chunks_per_second']:.0f} chunks/s), {report['embedding_requests']} requests, "
+          f"{report['tokens']} tokens, ${report['embedding_cost']:.4f}")
+
+    fake.requests = 0
+    again = await service.vectorize_files(files)
+    print(f"re-vectorize: {again['cached_chunks']}/{again['chunks']} chunks from cache in {again['seconds']:.2f}s, "
+          f"{fake.requests} requests, ${again['cost_saved']:.4f} saved")
+    if fake.requests or again["cached_chunks"] != again["chunks"] or again["tokens"]:
+        failures.append(f"re-vectorizing an unchanged corpus made {fake.requests} API requests")
+
+    texts = [c.text for chunks, _, _ in stored.values() for c in chunks][:args.baseline_chunks]
+    fake.requests = fake.max_active = 0
+    max_bytes, embedding_cache.max_bytes = embedding_cache.max_bytes, 0
+    elapsed = await per_chunk_baseline(texts, args.concurrency)
+    embedding_cache.max_bytes = max_bytes
+    batched_rate = report["chunks"] / report["seconds"]
+    print(f"per chunk: {len(texts)} chunks in {elapsed:.2f}s ({len(texts) / elapsed:.0f} chunks/s), "
+          f"{fake.requests} requests")
+    print(f"speedup: {batched_rate / (len(texts) / elapsed):.1f}x")
+    await fake.stop()
+
+    stats = await asyncio.to_thread(embedding_cache.stats)
+    embedding_cache.max_bytes = stats["bytes"] // 2
+    await asyncio.to_thread(embedding_cache.evict)
+    after = await asyncio.to_thread(embedding_cache.stats)
+    print(f"eviction: {stats['entries']} entries / {stats['bytes']} bytes -> "
+          f"{after['entries']} entries / {after['bytes']} bytes (limit {embedding_cache.max_bytes})")
+    if after["bytes"] > embedding_cache.max_bytes * 0.9 or after["entries"] == 0:
+        failures.append("the cache was not evicted down to 90% of its limit")
+    embedding_cache.max_bytes = max_bytes
+
+    count = token_counter(settings.embedding_model)
+    sources = {}
+    for path in files:
+        with open(path) as f:
+            sources[path] = f.read()
+    for result in report["results"]:
+        if not result["stored"]:
+            failures.append(f"{result['file']}: {result.get('error')}")
+    for path, (chunks, vectors, _) in stored.items():
+        for chunk, vector in zip(chunks, vectors):
+            if sources[path][chunk.start_char:chunk.end_char] != chunk.text:
+                failures.append(f"{path} chunk {chunk.index}: span does not match the source")
+            if count(chunk.text) > settings.kb_chunk_tokens:
+                failures.append(f"{path} chunk {chunk.index}: {count(chunk.text)} tokens")
+            if not np.allclose(vector, fake_embedding(chunk.text, args.dimensions), atol=1e-6):
+                failures.append(f"{path} chunk {chunk.index}: vector belongs to another chunk")
+                break
+    for path, source in sources.items():
+        whole = chunk_text(source, settings.kb_chunk_tokens, 0, settings.embedding_model)
+        streaming = StreamingChunker(settings.kb_chunk_tokens, 0, settings.embedding_model)
+        streamed = [c for i in range(0, len(source), 4096) for c in streaming.feed(source[i:i + 4096])]
+        streamed += streaming.finish()
+        for label, chunks in (("chunk_text", whole), ("StreamingChunker", streamed)):
+            if rejoined(source, chunks) != source:
+                failures.append(f"{path}: {label} chunks without overlap do not rejoin to the source")
+    if report["chunks"] > batched_requests * MAX_INPUTS:
+        failures.append("a request exceeded the provider input limit")
+    if batched_max_active > args.concurrency:
+        failures.append(f"{batched_max_active} requests in flight, limit {args.concurrency}")
+    total_cost = sum(r["embedding_cost"] for r in report["results"])
+    if abs(total_cost - report["embedding_cost"]) > 1e-5 * max(1, len(files)):
+        failures.append(f"per-document costs {total_cost} do not add up to {report['embedding_cost']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=40)
+    parser.add_argument("--words", type=int, default=20000, help="words per document")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--baseline-chunks", type=int, default=1000, help="chunks embedded one by one")
+    parser.add_argument("--tokens-per-minute", type=int, default=100_000_000, help="account TPM limit")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per request")
+    parser.add_argument("--per-input-latency", type=float, default=0.0005, help="extra seconds per input")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as directory:
+        files = []
+        for i in range(args.documents):
+            path = os.path.join(directory, f"doc{i}.txt")
+            with open(path, "w") as f:
+                f.write(synthetic_document(rng, args.words))
+            files.append(path)
+        from app.services.embedding_cache import embedding_cache
+        embedding_cache.path = os.path.join(directory, "embeddings.sqlite3")
+        failures = []
+        asyncio.run(run(args, files, failures))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
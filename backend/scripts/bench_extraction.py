@@ -0,0 +1,248 @@
+"""
+Document extraction benchmark (app/services/extraction_service.py).
+
+Writes a synthetic PDF of --pages pages and a workbook of --rows rows, and
+extracts each twice while a ticker measures event-loop lag (how late a
+10 ms sleep wakes up, i.e. how long a live call's audio would be held up):
+once as before, the whole document parsed in a thread of this process, and
+once through document_extractor, which parses in worker processes and
+streams the text block by block.
+
+Reported per file and mode: total time, time to the first block and the
+loop lag (p99/max). Checked: with the process pool the loop lag stays under
+--max-lag-ms, the streamed blocks join to the same text as the in-process
+extraction, a file exceeding the time limit (the PDF at 0.2 s) or the
+memory limit (a Word document of --docx-mb MB of XML) fails with an
+ExtractionError while the same pool still extracts a small file afterwards,
+and with a worker process killed while both files extract, they are
+submitted again and still extract to the same text.
+
+Exits non-zero if a check fails.
+
+Usage (from backend/):
+    python3 scripts/bench_extraction.py --pages 400 --rows 100000
+"""
+import os
+import sys
+import time
+import signal
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings  # noqa: E402
+from app.utils.metrics import metrics  # noqa: E402
+from app.services.extraction_service import ExtractionError, document_extractor  # noqa: E402
+from app.services.vectorization_service import VectorizationService  # noqa: E402
+
+WORDS = ("call agent customer appointment schedule policy refund order delivery account payment "
+         "support hours address warranty invoice plan upgrade cancel renewal discount").split()
+TICK_SECONDS = 0.01
+
+
+def write_pdf(path: str, pages: int, rng: random.Random):
+    """A PDF with `pages` pages of 50 text lines in Helvetica, written object by object."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for _ in range(pages):
+        lines = [" ".join(rng.choice(WORDS) for _ in range(12)) for _ in range(50)]
+        stream = "BT /F1 9 Tf 40 800 Td 12 TL " + " ".join(f"({line}) '" for line in lines) + " ET"
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream.encode()))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects)))
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), pages)
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        f.write(b"".join(b"%010d 00000 n \n" % offset for offset in offsets))
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+
+def write_docx(path: str, megabytes: int, rng: random.Random):
+    """A Word document whose text is `megabytes` MB uncompressed (a few hundred KB zipped)."""
+    import zipfile
+    import docx
+    template = os.path.join(os.path.dirname(path), "template.docx")
+    docx.Document().save(template)
+    paragraph = "<w:p><w:r><w:t>%s</w:t></w:r></w:p>" % " ".join(rng.choice(WORDS) for _ in range(150))
+    with zipfile.ZipFile(template) as source, zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            if item.filename != "word/document.xml":
+                target.writestr(item, source.read(item))
+                continue
+            head, tail = source.read(item).decode().split("<w:body>")
+            with target.open(item.filename, "w", force_zip64=True) as document:
+                document.write((head + "<w:body>").encode())
+                for _ in range(megabytes * 2 ** 20 // len(paragraph)):
+                    document.write(paragraph.encode())
+                document.write(tail.encode())
+
+
+def write_xlsx(path: str, rows: int, rng: random.Random):
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    for name, count in (("Orders", rows - rows // 4), ("Customers", rows // 4)):
+        sheet = workbook.create_sheet(name)
+        sheet.append(["id", "customer", "item", "amount", "note"])
+        for n in range(count):
+            sheet.append([n, f"customer {rng.randint(1, 5000)}", rng.choice(WORDS), round(rng.random() * 500, 2),
+                          " ".join(rng.choice(WORDS) for _ in range(6))])
+    workbook.save(path)
+
+
+class LagMonitor:
+    def __init__(self):
+        self.lags = []
+        self._task = None
+
+    async def _tick(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(TICK_SECONDS)
+            self.lags.append(time.perf_counter() - start - TICK_SECONDS)
+
+    def __enter__(self):
+        self._task = asyncio.create_task(self._tick())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+    def summary(self) -> str:
+        lags = sorted(self.lags) or [0.0]
+        return f"loop lag p99={lags[int(len(lags) * 0.99)] * 1e3:.1f}ms max={lags[-1] * 1e3:.1f}ms"
+
+
+async def in_thread(file_path: str):
+    start = time.perf_counter()
+    with LagMonitor() as monitor:
+        text = await asyncio.to_thread(VectorizationService().extract_content, file_path)
+    elapsed = time.perf_counter() - start
+    return text, elapsed, elapsed, monitor
+
+
+async def in_pool(file_path: str):
+    blocks, first = [], None
+    start = time.perf_counter()
+    with LagMonitor() as monitor:
+        async for block in document_extractor.blocks(file_path):
+            first = first or time.perf_counter() - start
+            blocks.append(block)
+    return "".join(blocks), time.perf_counter() - start, first, monitor
+
+
+async def with_worker_killed(file_paths) -> dict:
+    """Extracts the files concurrently and SIGKILLs a worker process once blocks are flowing."""
+    killed = []
+
+    async def collect(file_path):
+        blocks = []
+        async for block in document_extractor.blocks(file_path):
+            blocks.append(block)
+            if len(blocks) == 2 and not killed:
+                killed.append(multiprocessing.active_children()[0].pid)
+                os.kill(killed[0], signal.SIGKILL)
+        return "".join(blocks)
+
+    texts = await asyncio.gather(*(collect(f) for f in file_paths))
+    return dict(zip(file_paths, texts))
+
+
+async def fails(file_path: str) -> str:
+    try:
+        async for _ in document_extractor.blocks(file_path):
+            pass
+    except ExtractionError as e:
+        return str(e)
+    return ""
+
+
+async def bench(args, failures: list, directory: str):
+    rng = random.Random(7)
+    pdf, xlsx = os.path.join(directory, "manual.pdf"), os.path.join(directory, "orders.xlsx")
+    write_pdf(pdf, args.pages, rng)
+    write_xlsx(xlsx, args.rows, rng)
+    manual = os.path.join(directory, "handbook.docx")
+    write_docx(manual, args.docx_mb, rng)
+    note = os.path.join(directory, "note.txt")
+    with open(note, "w") as f:
+        f.write("Opening hours are nine to five on weekdays.\n")
+    print(f"files: {args.pages}-page PDF ({os.path.getsize(pdf) / 2 ** 20:.1f} MiB), "
+          f"{args.rows}-row workbook ({os.path.getsize(xlsx) / 2 ** 20:.1f} MiB)")
+
+    # Starts the pool before timing, as an already-running worker would have it.
+    await in_pool(pdf)
+    expected_texts = {}
+    for file_path in (pdf, xlsx):
+        name = os.path.basename(file_path)
+        expected, thread_seconds, _, thread_lag = await in_thread(file_path)
+        expected_texts[file_path] = expected
+        text, pool_seconds, first, pool_lag = await in_pool(file_path)
+        print(f"{name}: in-thread {thread_seconds:.2f}s, {thread_lag.summary()}")
+        print(f"{name}: process pool {pool_seconds:.2f}s, first block after {first * 1e3:.0f}ms, "
+              f"{pool_lag.summary()}")
+        if text != expected:
+            failures.append(f"{name}: streamed blocks differ from the in-process text")
+        if max(pool_lag.lags, default=0) * 1e3 > args.max_lag_ms:
+            failures.append(f"{name}: event loop lagged {max(pool_lag.lags) * 1e3:.1f}ms with the process pool")
+
+    retries = metrics.snapshot()["counters"].get("kb.extraction_retries", 0)
+    texts = await with_worker_killed([pdf, xlsx])
+    retries = metrics.snapshot()["counters"].get("kb.extraction_retries", 0) - retries
+    print(f"worker killed mid-extraction: {retries} jobs submitted again")
+    if not retries:
+        failures.append("no extraction job was submitted again after its worker was killed")
+    for file_path, text in texts.items():
+        if text != expected_texts[file_path]:
+            failures.append(f"{os.path.basename(file_path)}: text differs after a worker was killed")
+
+    limits = (("extraction_timeout_seconds", 0.2, pdf), ("extraction_max_memory_mb", args.memory_limit_mb, manual))
+    for setting, value, file_path in limits:
+        saved = getattr(settings, setting)
+        setattr(settings, setting, value)
+        await asyncio.to_thread(document_extractor.stop)  # the next pool starts with the limit
+        start = time.perf_counter()
+        error = await fails(file_path)
+        print(f"{setting}={value:g}: {os.path.basename(file_path)} failed after "
+              f"{time.perf_counter() - start:.2f}s with {error!r}")
+        if not error:
+            failures.append(f"{os.path.basename(file_path)} did not fail with {setting}={value:g}")
+        text, _, _, _ = await in_pool(note)  # same pool, same limit
+        if not text:
+            failures.append(f"the pool did not extract the next file after the {setting} failure")
+        setattr(settings, setting, saved)
+    await asyncio.to_thread(document_extractor.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--max-lag-ms", type=float, default=50.0)
+    parser.add_argument("--docx-mb", type=int, default=300)
+    parser.add_argument("--memory-limit-mb", type=float, default=512)
+    args = parser.parse_args()
+
+    logging.disable(logging.ERROR)
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(bench(args, failures, directory))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
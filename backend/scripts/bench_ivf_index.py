@@ -0,0 +1,143 @@
+"""
+IVF knowledge-base index benchmark (app/utils/vector_index.py).
+
+For each corpus size, generates clustered synthetic embeddings, trains an
+IVFIndex on 90% of them and inserts the rest incrementally in batches (as
+vectorization does), then reports for several nprobe values the recall@10
+against exact search and the query latency, next to the exact scan's latency.
+It also checks that RetrievalService.rebuild() keeps chunks inserted and
+removed while it retrains. Exits non-zero if recall at the default nprobe
+falls below --min-recall.
+
+Vectors are --dimensions wide (64 by default so 5M of them, plus the exact
+copy used as ground truth, fit in a few GB); latency scales with dimensions
+for both modes, recall depends mostly on how clustered the data is.
+
+Usage (from backend/):
+    python3 scripts/bench_ivf_index.py --sizes 1000000 5000000
+    python3 scripts/bench_ivf_index.py --sizes 200000 --dimensions 1536 --nprobe 8 16 32
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.vector_index import IVFIndex, VectorIndex, normalize_rows  # noqa: E402
+
+
+def synthetic_corpus(rng: np.random.Generator, size: int, dimensions: int) -> np.ndarray:
+    """Unit embeddings around topics of uneven popularity, generated in blocks."""
+    topics = max(100, size // 2000)
+    centers = rng.standard_normal((topics, dimensions), dtype=np.float32)
+    popularity = rng.pareto(1.5, topics) + 1
+    popularity /= popularity.sum()
+    matrix = np.empty((size, dimensions), dtype=np.float32)
+    for start in range(0, size, 100000):
+        block = matrix[start:start + 100000]
+        block[:] = centers[rng.choice(topics, len(block), p=popularity)]
+        block += 0.7 * rng.standard_normal(block.shape, dtype=np.float32)
+    return normalize_rows(matrix)
+
+
+def percentile(times, q):
+    return sorted(times)[min(len(times) - 1, int(len(times) * q))] * 1e3
+
+
+def bench_size(size: int, args, rng, failures: list):
+    corpus = synthetic_corpus(rng, size, args.dimensions)
+    ids = np.arange(size, dtype=np.int64)
+    exact = VectorIndex(ids, corpus)
+    initial = int(size * 0.9)
+
+    start = time.perf_counter()
+    ivf = IVFIndex.train(ids[:initial], corpus[:initial], nprobe=args.nprobe[0])
+    trained = time.perf_counter() - start
+    start = time.perf_counter()
+    for offset in range(initial, size, args.insert_batch):
+        ivf.add(ids[offset:offset + args.insert_batch], corpus[offset:offset + args.insert_batch])
+    inserted = time.perf_counter() - start
+    print(f"\n{size:,} x {args.dimensions}: trained {ivf.nlist} lists on {initial:,} vectors in {trained:.1f}s, "
+          f"inserted {size - initial:,} in {inserted:.2f}s ({(size - initial) / inserted:,.0f}/s); "
+          f"index {ivf.nbytes / 2 ** 20:,.0f} MiB")
+
+    queries = corpus[rng.integers(0, size, args.queries)] + \
+        0.3 * rng.standard_normal((args.queries, args.dimensions), dtype=np.float32)
+    truth, exact_times = [], []
+    for query in queries:
+        t0 = time.perf_counter()
+        found, _ = exact.search(query, 10)
+        exact_times.append(time.perf_counter() - t0)
+        truth.append(set(found.tolist()))
+    print(f"  exact:      p50={percentile(exact_times, 0.5):7.2f}ms p99={percentile(exact_times, 0.99):7.2f}ms")
+    for nprobe in args.nprobe:
+        times, recall = [], []
+        for query, expected in zip(queries, truth):
+            t0 = time.perf_counter()
+            found, _ = ivf.search(query, 10, nprobe)
+            times.append(time.perf_counter() - t0)
+            recall.append(len(expected & set(found.tolist())) / 10)
+        print(f"  nprobe={nprobe:<4} p50={percentile(times, 0.5):7.2f}ms p99={percentile(times, 0.99):7.2f}ms "
+              f"recall@10={np.mean(recall):.3f} (scans ~{100 * nprobe / ivf.nlist:.1f}% of vectors)")
+        if nprobe == args.nprobe[0] and np.mean(recall) < args.min_recall:
+            failures.append(f"{size}: recall@10 {np.mean(recall):.3f} at nprobe={nprobe} below {args.min_recall}")
+    return corpus[:200000]
+
+
+def check_rebuild(corpus: np.ndarray, failures: list):
+    """Chunks added and removed while a rebuild trains must survive the swap."""
+    from app.services.retrieval_service import RetrievalService
+    from app.config import settings
+
+    settings.kb_index_mode = "ivf"
+    service = RetrievalService()
+    base = len(corpus) - 1000
+    service.index = IVFIndex.train(np.arange(base), corpus[:base])
+    service.index.remove(np.arange(100))
+
+    removed = set(range(100))
+    rebuild = threading.Thread(target=service.rebuild)
+    rebuild.start()
+    for step, offset in enumerate(range(base, len(corpus), 100)):
+        gone = np.arange(1000 + step * 10, 1010 + step * 10)
+        removed.update(gone.tolist())
+        with service._sync_lock:
+            service._apply(np.arange(offset, offset + 100), corpus[offset:offset + 100], gone)
+        time.sleep(0.01)
+    rebuild.join()
+    live = set(service.index.live_ids().tolist())
+    if live != set(range(len(corpus))) - removed:
+        failures.append(f"rebuild lost updates: {len(live)} live ids, expected {len(corpus) - len(removed)}")
+    found, _ = service.index.search(corpus[len(corpus) - 1], 1, nprobe=service.index.nlist)
+    print(f"\nrebuild with concurrent updates: {len(live):,} live ids, nearest to the last insert is {found.tolist()}")
+    if found.tolist() != [len(corpus) - 1]:
+        failures.append("a vector inserted during the rebuild is not found")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000000, 5000000])
+    parser.add_argument("--dimensions", type=int, default=64)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[32, 8, 16, 64], help="first is the default")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--insert-batch", type=int, default=10000)
+    parser.add_argument("--min-recall", type=float, default=0.85)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(5)
+    failures = []
+    sample = None
+    for size in args.sizes:
+        sample = bench_size(size, args, rng, failures)
+    check_rebuild(sample[:50000], failures)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
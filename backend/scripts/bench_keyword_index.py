@@ -0,0 +1,181 @@
+"""
+Keyword (BM25) index benchmark (app/utils/keyword_index.py) and hybrid
+retrieval check.
+
+Indexes --chunks synthetic chunks with a Zipf-distributed vocabulary in
+batches, as the retrieval service's incremental sync does; one chunk in
+--sku-every carries a product SKU and a policy number. Then times questions
+mixing frequent and topical words, identifier lookups ("How much does
+SKU-10042-C cost?", checked to rank their chunk first) and, for reference,
+questions made only of the most frequent words (the worst case, not gated).
+
+Finally runs RetrievalService.search end to end (query embedded by the local
+fake OpenAI server, scripts/fake_openai.py) on a corpus where the SKU
+chunk's embedding is unrelated to the question: with keyword search the
+chunk must be in the top 3 through reciprocal rank fusion, without it the
+vector ranking alone misses it.
+
+Exits non-zero if a check fails or keyword lookup p99 exceeds --budget-ms.
+
+Usage (from backend/):
+    python3 scripts/bench_keyword_index.py --chunks 200000
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.utils.keyword_index import KeywordIndex  # noqa: E402
+
+LETTERS = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+
+
+def vocabulary(rng: np.random.Generator, size: int) -> np.ndarray:
+    lengths = rng.integers(3, 11, size)
+    return np.array(["".join(LETTERS[rng.integers(0, 26, n)]) for n in lengths])
+
+
+def sku(i: int) -> str:
+    return f"SKU-{10000 + i}-{'ABCDEFGH'[i % 8]}"
+
+
+def chunk_texts(rng, words: np.ndarray, start: int, count: int, args):
+    ranks = np.minimum(rng.zipf(1.15, (count, args.words)), len(words)) - 1
+    texts = []
+    for offset, row in enumerate(ranks):
+        text = " ".join(words[row])
+        if (start + offset) % args.sku_every == 0:
+            text += f". Item {sku(start + offset)} is covered by policy {start + offset:07d}/B."
+        texts.append(text)
+    return texts
+
+
+def percentiles(times):
+    times = sorted(times)
+    return times[len(times) // 2] * 1e3, times[int(len(times) * 0.99)] * 1e3
+
+
+def bench_index(rng, args, failures: list) -> KeywordIndex:
+    words = vocabulary(rng, args.vocabulary)
+    index = KeywordIndex()
+    start = time.perf_counter()
+    for offset in range(0, args.chunks, args.batch):
+        count = min(args.batch, args.chunks - offset)
+        index.add(range(offset, offset + count), chunk_texts(rng, words, offset, count, args))
+    elapsed = time.perf_counter() - start
+    print(f"indexed {args.chunks:,} chunks x {args.words} words in {elapsed:.1f}s "
+          f"({args.chunks / elapsed:,.0f} chunks/s, text generation included): {index.vocabulary_size:,} terms, "
+          f"{index.segments} segments, postings {index.nbytes / 2 ** 20:.0f} MiB")
+
+    head = words[np.minimum(rng.zipf(1.15, (args.queries, 6)), len(words)) - 1]
+    topical = words[rng.integers(0, len(words), (args.queries, 2))]
+    query_sets = {
+        "questions (frequent + topical words)": [f"what about {' '.join(h[:rng.integers(2, 5)])} {' '.join(t)}?"
+                                                 for h, t in zip(head, topical)],
+        "frequent words only (not gated)": [f"what about {' '.join(h[:rng.integers(3, 7)])}?" for h in head],
+    }
+    for label, questions in query_sets.items():
+        times = []
+        for question in questions:
+            t0 = time.perf_counter()
+            index.search(question, 20)
+            times.append(time.perf_counter() - t0)
+        p50, p99 = percentiles(times)
+        print(f"{label}: p50={p50:.2f}ms p99={p99:.2f}ms")
+        if "gated" not in label and p99 > args.budget_ms:
+            failures.append(f"{label} p99 {p99:.2f}ms exceeds {args.budget_ms}ms")
+
+    times, misses = [], 0
+    targets = rng.integers(0, args.chunks // args.sku_every, args.queries) * args.sku_every
+    for i, target in enumerate(targets.tolist()):
+        question = f"How much does {sku(target)} cost?" if i % 2 else f"Is policy number {target:07d}/B still active?"
+        t0 = time.perf_counter()
+        found, _ = index.search(question, 20)
+        times.append(time.perf_counter() - t0)
+        misses += not len(found) or found[0] != target
+    p50, p99 = percentiles(times)
+    print(f"identifier queries: p50={p50:.2f}ms p99={p99:.2f}ms, top-1 misses {misses}/{len(targets)}")
+    if misses:
+        failures.append(f"{misses} identifier queries did not rank their chunk first")
+    if p99 > args.budget_ms:
+        failures.append(f"identifier query p99 {p99:.2f}ms exceeds {args.budget_ms}ms")
+    return index
+
+
+async def check_hybrid(args, failures: list):
+    import openai
+    from app.config import settings
+    from app.services import openai_service
+    from app.services.embedding_cache import embedding_cache
+    from app.services.retrieval_service import retrieval_service
+    from app.utils.vector_index import VectorIndex
+    from fake_openai import FakeOpenAI, fake_embedding
+
+    logging.getLogger("openai").setLevel(logging.WARNING)
+    embedding_cache.max_bytes = 0
+    dimensions = 256
+    fake = FakeOpenAI(dimensions, latency=0.0)
+    openai.api_base = await fake.start()
+    openai.api_key = "sk-fake"
+    openai_service.openai_client = openai
+
+    question = "How much does the SKU-88812-D cordless drill cost?"
+    texts = {i: f"General product information, part {i}: drills, saws and garden tools." for i in range(2000)}
+    texts[1234] = "Price list: SKU-88812-D costs 149 dollars including the battery."
+    rng = np.random.default_rng(1)
+    matrix = rng.standard_normal((len(texts), dimensions), dtype=np.float32)
+    matrix[:50] = fake_embedding(question, dimensions) + 0.3 * matrix[:50]  # generic chunks close to the question
+    retrieval_service.index = VectorIndex(np.arange(len(texts)), matrix)
+    retrieval_service.keywords = KeywordIndex()
+    retrieval_service.keywords.add(list(texts), list(texts.values()))
+    retrieval_service._fetch_chunks = lambda ids: {
+        i: {"id": i, "document_id": "catalog.pdf", "chunk_index": i, "text": texts[i]} for i in ids
+    }
+    times = []
+    for _ in range(30):
+        t0 = time.perf_counter()
+        hybrid = await retrieval_service.search(question, 3)
+        times.append(time.perf_counter() - t0)
+    settings.kb_keyword_search = False
+    vector_only = await retrieval_service.search(question, 3)
+    settings.kb_keyword_search = True
+    await fake.stop()
+    p50, p99 = percentiles(times)
+    print(f"\nhybrid search (embedding via local fake server included): p50={p50:.2f}ms p99={p99:.2f}ms")
+    print(f"  hybrid top-3:      {[(r['chunk_index'], r['similarity_score'], r['keyword_score']) for r in hybrid]}")
+    print(f"  vector-only top-3: {[(r['chunk_index'], r['similarity_score']) for r in vector_only]}")
+    if not any(r["chunk_index"] == 1234 for r in hybrid):
+        failures.append("hybrid search missed the SKU chunk")
+    if any(r["chunk_index"] == 1234 for r in vector_only):
+        failures.append("the check is not meaningful: vector search alone found the SKU chunk")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=200000)
+    parser.add_argument("--words", type=int, default=300, help="words per chunk")
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--sku-every", type=int, default=100)
+    parser.add_argument("--batch", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--budget-ms", type=float, default=10.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    failures = []
+    bench_index(rng, args, failures)
+    asyncio.run(check_hybrid(args, failures))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
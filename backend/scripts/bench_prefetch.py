@@ -0,0 +1,186 @@
+"""
+Speculative retrieval benchmark (app/services/question_prefetch.py).
+
+Replays --calls simulated tool turns, --concurrency calls at a time: the
+caller's utterance streams in as Ultravox user transcript deltas (one word
+every --word-ms, then a final message), and --model-ms later the agent invokes
+question_and_answer with its own restatement of the question. In --mismatch of
+the turns the agent asks about something the caller did not say, which must
+fall back to a fresh query.
+
+Retrieval runs for real on an in-memory vector and keyword index; the
+embedding model is stood in for by bag-of-words vectors with --embed-ms of
+latency, and the answer cache is disabled so only prefetching is measured.
+The same turns run once with kb_prefetch_enabled off and once on; reported
+are the tool response times (invocation to context ready), the prefetch hit
+rate and how often the context's first passage is about the same topic as
+that of a fresh query for the agent's question.
+
+Exits non-zero if a check fails.
+
+Usage (from backend/):
+    python3 scripts/bench_prefetch.py --calls 60 --embed-ms 150 --model-ms 500
+"""
+import os
+import sys
+import time
+import zlib
+import asyncio
+import logging
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings  # noqa: E402
+from app.utils.metrics import metrics  # noqa: E402
+
+FILLER = "um hi yes so I was wondering could you tell me".split()
+LETTERS = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+
+
+def percentiles(times):
+    times = sorted(times)
+    return times[len(times) // 2] * 1e3, times[int(len(times) * 0.99)] * 1e3
+
+
+def word_vector(word: str, dimensions: int) -> np.ndarray:
+    return np.random.default_rng(zlib.crc32(word.encode())).standard_normal(dimensions).astype(np.float32)
+
+
+def setup(rng, args):
+    """Topics of three keywords each, with chunks about them loaded into the retrieval service."""
+    from app.services import retrieval_service as module
+    from app.services.answer_cache import answer_cache
+    from app.utils.keyword_index import KeywordIndex, tokenize
+    from app.utils.vector_index import VectorIndex
+
+    def embed(text: str) -> np.ndarray:
+        vector = sum((word_vector(w, args.dimensions) for w in tokenize(text)), np.zeros(args.dimensions, np.float32))
+        return vector / (np.linalg.norm(vector) or 1)
+
+    async def get_embedding(text, model=None):
+        await asyncio.sleep(args.embed_ms / 1000)
+        return embed(text).tolist()
+
+    topics = [["".join(LETTERS[rng.integers(0, 26, 7)]) for _ in range(3)] for _ in range(args.topics)]
+    texts = {i: f"Passage {i} about {' '.join(topics[i % args.topics])} and related policies." for i in range(args.chunks)}
+    module.openai_service.get_embedding = get_embedding
+    service = module.retrieval_service
+    service.index = VectorIndex(np.arange(args.chunks), np.vstack([embed(t) for t in texts.values()]))
+    service.keywords = KeywordIndex()
+    service.keywords.add(list(texts), list(texts.values()))
+    service._fetch_chunks = lambda ids: {
+        i: {"id": i, "document_id": "faq.pdf", "chunk_index": i, "text": texts[i]} for i in ids
+    }
+    answer_cache.capacity = 0
+    answer_cache.clear()
+    return service, topics
+
+
+def turns(rng, topics, args):
+    result = []
+    for i in range(args.calls):
+        topic = int(rng.integers(len(topics)))
+        words = topics[topic]
+        utterance = FILLER[:rng.integers(3, len(FILLER))] + ["what", "about", "the"] + list(words) + ["please"]
+        if rng.random() < args.mismatch:
+            other = topics[(topic + int(rng.integers(1, len(topics)))) % len(topics)]
+            question = f"What is the policy on {other[0]} {other[1]}?"
+        else:
+            question = f"What about the {' '.join(words[:2])} {words[2]}?"
+        result.append((f"CA{i:04d}", utterance, question))
+    return result
+
+
+async def replay(turn, args):
+    """One tool turn; returns (tool response seconds, context)."""
+    from app.services.question_prefetch import QuestionPrefetcher
+
+    call_sid, utterance, question = turn
+    prefetcher = QuestionPrefetcher(call_sid)
+    for n, word in enumerate(utterance):
+        prefetcher.on_transcript({"type": "transcript", "role": "user", "ordinal": 1, "final": False,
+                                  "delta": ("" if n == 0 else " ") + word})
+        await asyncio.sleep(args.word_ms / 1000)
+    prefetcher.on_transcript({"type": "transcript", "role": "user", "ordinal": 1, "final": True,
+                              "text": " ".join(utterance)})
+    await asyncio.sleep(args.model_ms / 1000)
+    start = time.perf_counter()
+    context = await prefetcher.answer(question)
+    elapsed = time.perf_counter() - start
+    prefetcher.close()
+    return elapsed, context
+
+
+async def run(turns_, args):
+    results = []
+    for offset in range(0, len(turns_), args.concurrency):
+        results += await asyncio.gather(*(replay(t, args) for t in turns_[offset:offset + args.concurrency]))
+    return results
+
+
+async def bench(args, failures: list):
+    from app.services.retrieval_service import retrieval_service
+
+    rng = np.random.default_rng(5)
+    _, topics = setup(rng, args)
+    turns_ = turns(rng, topics, args)
+    settings.kb_prefetch_enabled = False
+    baseline = await run(turns_, args)
+    settings.kb_prefetch_enabled = True
+    counters = metrics.snapshot()["counters"]
+    hits_before = counters.get("kb.prefetch_hits", 0)
+    misses_before = counters.get("kb.prefetch_misses", 0)
+    prefetched = await run(turns_, args)
+    counters = metrics.snapshot()["counters"]
+    hits = counters.get("kb.prefetch_hits", 0) - hits_before
+    misses = counters.get("kb.prefetch_misses", 0) - misses_before
+
+    def topic(context: str) -> str:
+        return context.split("\n\n")[0].split(" about ", 1)[-1]
+
+    same_top = 0
+    for (_, _, question), (_, context) in zip(turns_, prefetched):
+        same_top += topic(context) == topic(await retrieval_service.answer_context(question))
+    base_p50, base_p99 = percentiles([t for t, _ in baseline])
+    pre_p50, pre_p99 = percentiles([t for t, _ in prefetched])
+    print(f"{args.calls} tool turns, {args.concurrency} concurrent, embedding {args.embed_ms:.0f}ms, "
+          f"agent {args.model_ms:.0f}ms after the final transcript, {args.mismatch:.0%} restated differently")
+    print(f"  without prefetch: tool response p50={base_p50:.1f}ms p99={base_p99:.1f}ms")
+    print(f"  with prefetch:    tool response p50={pre_p50:.1f}ms p99={pre_p99:.1f}ms "
+          f"({hits} prefetch hits, {misses} fresh queries)")
+    print(f"  first passage on the same topic as a fresh query's: {same_top}/{len(turns_)}")
+    expected_misses = sum(not q.startswith("What about") for _, _, q in turns_)
+    if misses != expected_misses:
+        failures.append(f"{misses} fresh queries, expected {expected_misses} (the mismatched turns)")
+    if same_top < len(turns_):
+        failures.append(f"{len(turns_) - same_top} turns answered with a first passage on another topic")
+    if pre_p50 > 0.5 * base_p50:
+        failures.append("prefetching did not halve the median tool response time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--topics", type=int, default=50)
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--word-ms", type=float, default=120.0)
+    parser.add_argument("--model-ms", type=float, default=500.0)
+    parser.add_argument("--embed-ms", type=float, default=150.0)
+    parser.add_argument("--mismatch", type=float, default=0.2, help="share of turns the agent restates differently")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    failures = []
+    asyncio.run(bench(args, failures))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Throughput benchmark for dial-list screening (app/utils/number_screening.py).
+
+Builds a synthetic DNC list and recent-call set, then times each stage on a
+list of --size raw numbers in mixed formats (E.164, national, punctuated,
+invalid, with duplicates): normalization, Bloom/hash-set lookups and the full
+screen. No database is needed.
+
+Usage (from backend/):
+    python3 scripts/bench_screening.py --size 10000000
+    python3 scripts/bench_screening.py --size 1000000 --dnc 2000000 --recent 500000
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.number_screening import NumberSet, normalize_numbers, screen  # noqa: E402
+
+
+def synthetic_numbers(rng, size):
+    national = rng.integers(2012000000, 9899999999, size=size, dtype=np.int64)
+    fmt = rng.integers(0, 10, size=size)
+    raw = np.empty(size, dtype=object)
+    s = national.astype(str)
+    raw[:] = s
+    plus = fmt < 4
+    raw[plus] = np.char.add("+1", s[plus].astype("U10"))
+    dashed = fmt == 4
+    raw[dashed] = [f"({v[:3]}) {v[3:6]}-{v[6:]}" for v in s[dashed].tolist()]
+    raw[fmt == 5] = "12345"  # invalid
+    dup_from = rng.integers(0, size, size=size // 20)
+    dup_to = rng.integers(0, size, size=size // 20)
+    raw[dup_to] = raw[dup_from]
+    return raw.tolist(), national
+
+
+def timed(label, size, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {elapsed:>8.2f}s {size / elapsed / 1e6:>8.2f}M numbers/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=10_000_000, help="Numbers in the dial list")
+    parser.add_argument("--dnc", type=int, default=1_000_000, help="Entries in the DNC set")
+    parser.add_argument("--recent", type=int, default=200_000, help="Recently called numbers")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"Generating {args.size:,} numbers...")
+    raw, national = synthetic_numbers(rng, args.size)
+    e164 = national + 10_000_000_000
+    dnc_values = np.concatenate([rng.choice(e164, args.dnc // 2),
+                                 rng.integers(12012000000, 19899999999, args.dnc - args.dnc // 2)])
+    recent_values = rng.choice(e164, args.recent)
+
+    dnc = timed("build DNC set", args.dnc, lambda: NumberSet(dnc_values))
+    recent = timed("build recent set", args.recent, lambda: NumberSet(recent_values))
+    print(f"Bloom filter: {dnc.bloom.bits.nbytes / 2**20:.1f} MiB, {dnc.bloom.hashes} hashes")
+
+    normalized = timed("normalize", args.size, lambda: normalize_numbers(raw))
+    timed("bloom contains", args.size, lambda: dnc.bloom.contains(normalized))
+    timed("exact contains", args.size, lambda: dnc.contains(normalized))
+    reasons = timed("full screen", args.size, lambda: screen(normalized, dnc, recent))
+
+    labels, counts = np.unique(reasons.astype(str), return_counts=True)
+    print("  ".join(f"{label}={count:,}" for label, count in zip(labels, counts)))
+
+    probe = rng.integers(20_000_000_000, 29_999_999_999, size=1_000_000)
+    fpr = dnc.bloom.contains(probe).mean()
+    print(f"Bloom false-positive rate on 1M absent keys: {fpr:.4%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Measures backend startup cost: the time to import `app.main` and the time for the
+application lifespan to boot far enough to answer /healthz, both with the
+configured MySQL and with MySQL unreachable.
+
+Each measurement runs in a fresh interpreter so imports are cold.
+
+Usage (from backend/):
+    python3 scripts/bench_startup.py [--runs 5]
+
+Requires httpx (used by FastAPI's TestClient).
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Executed in a child interpreter; prints a JSON object with timings in ms.
+CHILD = r"""
+import json, time
+t0 = time.perf_counter()
+import app.main
+t1 = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app.main.app) as client:
+    resp = client.get("/healthz")
+    t2 = time.perf_counter()
+    assert resp.status_code == 200
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "boot_ms": (t2 - t1) * 1000}))
+"""
+
+# TEST-NET-3 address: connection attempts hang until the connect timeout.
+UNREACHABLE_DB_HOST = "203.0.113.1"
+
+
+def run_once(env_overrides):
+    env = dict(os.environ, **env_overrides)
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    scenarios = {
+        "configured DB": {},
+        "DB unreachable": {"DB_HOST": UNREACHABLE_DB_HOST},
+    }
+    print(f"{'scenario':<16} {'import p50 ms':>14} {'boot p50 ms':>12} {'boot max ms':>12}")
+    for name, overrides in scenarios.items():
+        samples = [run_once(overrides) for _ in range(args.runs)]
+        imports = [s["import_ms"] for s in samples]
+        boots = [s["boot_ms"] for s in samples]
+        print(f"{name:<16} {statistics.median(imports):>14.1f} {statistics.median(boots):>12.1f} {max(boots):>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
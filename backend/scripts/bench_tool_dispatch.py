@@ -0,0 +1,172 @@
+"""
+Client tool dispatch benchmark (app/services/tool_registry.py).
+
+Replays an Ultravox socket that streams agent audio (one frame every 20 ms)
+for --seconds while tool invocations arrive: a slow tool (--slow-ms), a tool
+that never answers (must time out after its declared timeout), and a burst
+of --burst invocations of a tool limited to 2 concurrent runs. The message
+loop forwards audio like websocket_endpoint does, and handles tools either
+inline (awaiting each tool, as before) or through a ToolDispatcher.
+
+Reported per mode: how late audio frames were forwarded (p50/p99/max) and
+the tool latencies from the per-tool histograms. Checked: with the
+dispatcher no audio frame is delayed by more than --max-lag-ms, the stuck
+tool answers with an error at its timeout, the burst never exceeds its
+concurrency limit, every invocation gets exactly one result and the socket
+never sees two sends at once.
+
+Exits non-zero if a check fails.
+
+Usage (from backend/):
+    python3 scripts/bench_tool_dispatch.py --seconds 5 --slow-ms 1500
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.tool_registry import ToolCall, ToolDispatcher, ToolRegistry, ToolSpec  # noqa: E402
+from app.utils.metrics import metrics  # noqa: E402
+
+FRAME_SECONDS = 0.02
+
+
+class ReplaySocket:
+    """Yields scripted messages at their arrival times and checks that sends never overlap."""
+
+    def __init__(self, script):
+        self.script = script  # (seconds from start, message)
+        self.sent = []
+        self.overlapping_sends = 0
+        self._sending = False
+
+    async def __aiter__(self):
+        start = time.perf_counter()
+        for at, message in self.script:
+            await asyncio.sleep(max(0.0, start + at - time.perf_counter()))
+            yield start + at, message
+
+    async def send(self, message):
+        if self._sending:
+            self.overlapping_sends += 1
+        self._sending = True
+        await asyncio.sleep(0.001)  # a send that yields to the loop, as a real socket write can
+        self._sending = False
+        self.sent.append(message)
+
+
+def bench_registry(args):
+    registry = ToolRegistry()
+    running = {"now": 0, "max": 0}
+
+    async def slow(call: ToolCall) -> str:
+        await asyncio.sleep(args.slow_ms / 1000)
+        return "slow answer"
+
+    async def stuck(call: ToolCall) -> str:
+        await asyncio.sleep(3600)
+        return "never"
+
+    async def limited(call: ToolCall) -> str:
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        await asyncio.sleep(0.2)
+        running["now"] -= 1
+        return "limited answer"
+
+    registry.register(ToolSpec("slow_lookup", "A slow backend lookup", slow, {"query": "What to look up"}))
+    registry.register(ToolSpec("stuck_lookup", "A lookup that never answers", stuck, timeout=args.stuck_timeout))
+    registry.register(ToolSpec("limited_lookup", "A rate-limited lookup", limited, max_concurrency=2))
+    return registry, running
+
+
+def script(args):
+    messages = [(i * FRAME_SECONDS, b"\x00" * 320) for i in range(int(args.seconds / FRAME_SECONDS))]
+    invocations = [(0.5, "slow_lookup"), (1.0, "stuck_lookup")] + [(1.5, "limited_lookup")] * args.burst
+    for n, (at, name) in enumerate(invocations):
+        messages.append((at, json.dumps({"type": "client_tool_invocation", "toolName": name,
+                                         "invocationId": f"inv-{n}", "parameters": {"query": "x"}})))
+    messages.sort(key=lambda m: m[0])
+    return messages, len(invocations)
+
+
+async def replay(mode: str, registry, args):
+    socket = ReplaySocket(script(args)[0])
+    tools = ToolDispatcher(socket, "CA-bench", registry=registry)
+    lags = []
+    async for arrived, raw_message in socket:
+        if isinstance(raw_message, bytes):
+            lags.append(time.perf_counter() - arrived)  # forwarded to Twilio here
+            continue
+        message = json.loads(raw_message)
+        if mode == "inline":
+            result = await registry.invoke(message["toolName"], ToolCall(message["invocationId"], message["parameters"],
+                                                                         "CA-bench", {}))
+            await tools.send(json.dumps(result))
+        else:
+            tools.dispatch(message)
+    while tools.active:
+        await asyncio.sleep(0.05)
+    await tools.drain()
+    await tools.close()
+    return socket, sorted(lags)
+
+
+async def bench(args, failures: list):
+    expected = script(args)[1]
+    for mode in ("inline", "dispatcher"):
+        metrics.histograms.clear()
+        registry, running = bench_registry(args)
+        start = time.perf_counter()
+        socket, lags = await replay(mode, registry, args)
+        elapsed = time.perf_counter() - start
+        results = [json.loads(m) for m in socket.sent if isinstance(m, str)]
+        print(f"{mode}: audio forwarded late by p50={lags[len(lags) // 2] * 1e3:.1f}ms "
+              f"p99={lags[int(len(lags) * 0.99)] * 1e3:.1f}ms max={lags[-1] * 1e3:.1f}ms; "
+              f"{len(results)} results, replay took {elapsed:.1f}s")
+        for name in ("slow_lookup", "stuck_lookup", "limited_lookup"):
+            histogram = metrics.histograms[f"tools.{name}_seconds"].snapshot()
+            print(f"  tools.{name}_seconds: count={histogram['count']} mean={histogram['mean'] * 1e3:.0f}ms "
+                  f"max={histogram['max'] * 1e3:.0f}ms")
+        if mode != "dispatcher":
+            continue
+        stuck = [r for r in results if r["invocationId"] == "inv-1"]
+        stuck_seconds = metrics.histograms["tools.stuck_lookup_seconds"].max
+        print(f"  stuck tool: {stuck[0].get('error_message') if stuck else None!r} after {stuck_seconds:.2f}s; "
+              f"limited tool ran at most {running['max']} at once; overlapping sends {socket.overlapping_sends}")
+        if lags[-1] * 1e3 > args.max_lag_ms:
+            failures.append(f"audio delayed by {lags[-1] * 1e3:.1f}ms with the dispatcher")
+        if sorted(r["invocationId"] for r in results) != sorted(f"inv-{n}" for n in range(expected)):
+            failures.append("not every invocation got exactly one result")
+        if not stuck or "error_type" not in stuck[0] or abs(stuck_seconds - args.stuck_timeout) > 0.1:
+            failures.append("the stuck tool did not time out at its declared timeout")
+        if running["max"] > 2:
+            failures.append(f"limited tool ran {running['max']} at once")
+        if socket.overlapping_sends:
+            failures.append(f"{socket.overlapping_sends} overlapping socket sends")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--slow-ms", type=float, default=1500.0)
+    parser.add_argument("--stuck-timeout", type=float, default=1.0)
+    parser.add_argument("--burst", type=int, default=8)
+    parser.add_argument("--max-lag-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    logging.disable(logging.ERROR)
+    failures = []
+    asyncio.run(bench(args, failures))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Knowledge-base vector index benchmark (app/utils/vector_index.py).
+
+Builds an index of --chunks synthetic clustered embeddings and times top-k
+queries, checking the results against a full sort of all scores. Then runs
+the question_and_answer tool end to end through a ToolDispatcher
+(app/services/tool_registry.py): the question is embedded by the
+local fake OpenAI server (scripts/fake_openai.py), searched in the index, and
+the answer sent to a stub Ultravox socket must contain the chunk stored under
+the question's own embedding. MySQL is not touched: chunk texts come from an
+in-memory table. Exits non-zero if a check fails or p99 exceeds --budget-ms.
+
+Usage (from backend/):
+    python3 scripts/bench_vector_index.py --chunks 100000 --dimensions 1536
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai import FakeOpenAI, fake_embedding  # noqa: E402
+
+
+def synthetic_corpus(rng: np.random.Generator, chunks: int, dimensions: int, clusters: int = 500) -> np.ndarray:
+    """Embeddings grouped around topics, as chunks of related documents are."""
+    centers = rng.standard_normal((clusters, dimensions), dtype=np.float32)
+    matrix = centers[rng.integers(0, clusters, chunks)]
+    for start in range(0, chunks, 10000):
+        block = matrix[start:start + 10000]
+        block += 0.8 * rng.standard_normal(block.shape, dtype=np.float32)
+    return matrix
+
+
+def bench_search(index, corpus: np.ndarray, rng, args, failures: list) -> float:
+    times = []
+    for q in range(args.queries):
+        query = corpus[rng.integers(len(corpus))] + 0.5 * rng.standard_normal(corpus.shape[1], dtype=np.float32)
+        start = time.perf_counter()
+        ids, scores = index.search(query, args.top_k)
+        times.append(time.perf_counter() - start)
+        if q < 20:
+            exact = index.matrix @ (query / np.linalg.norm(query))
+            expected = np.argsort(-exact, kind="stable")[:args.top_k]
+            if not np.allclose(scores, exact[expected], atol=1e-5):
+                failures.append(f"query {q}: top-{args.top_k} differs from a full sort")
+    times.sort()
+    p50, p99 = times[len(times) // 2], times[int(len(times) * 0.99)]
+    print(f"search: {len(index)} chunks x {index.dimensions} dims ({index.nbytes / 2 ** 20:.0f} MiB), "
+          f"top-{args.top_k} p50={p50 * 1e3:.2f}ms p99={p99 * 1e3:.2f}ms max={times[-1] * 1e3:.2f}ms")
+    return p99
+
+
+class StubSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+async def check_tool(index, args, failures: list):
+    import openai
+    from app.services import openai_service
+    from app.services.embedding_cache import embedding_cache
+    from app.services.retrieval_service import retrieval_service
+    from app.services.tool_registry import ToolDispatcher
+    from app.services import ultravox_service  # noqa: F401 (registers the tools)
+    from app.utils.vector_index import VectorIndex
+
+    logging.getLogger("openai").setLevel(logging.WARNING)
+    embedding_cache.max_bytes = 0
+    fake = FakeOpenAI(index.dimensions, latency=0.0)
+    openai.api_base = await fake.start()
+    openai.api_key = "sk-fake"
+    openai_service.openai_client = openai
+
+    question = "What are your support hours on weekends?"
+    answer_id = len(index)
+    retrieval_service.index = VectorIndex(np.append(index.ids, answer_id),
+                                          np.vstack([index.matrix, fake_embedding(question, index.dimensions)]))
+    texts = {answer_id: "Support is available 9am to 5pm on Saturdays and closed on Sundays."}
+    retrieval_service._fetch_chunks = lambda ids: {
+        i: {"id": i, "document_id": "handbook.pdf", "chunk_index": i, "text": texts.get(i, f"chunk {i}")} for i in ids
+    }
+    socket = StubSocket()
+    tools = ToolDispatcher(socket)
+    invocation = {"toolName": "question_and_answer", "invocationId": "inv-1", "parameters": {"question": question}}
+    times = []
+    for _ in range(50):
+        start = time.perf_counter()
+        await tools.dispatch(invocation)
+        times.append(time.perf_counter() - start)
+    await tools.drain()
+    await tools.close()
+    await fake.stop()
+    result = socket.sent[-1]
+    times.sort()
+    print(f"question_and_answer tool: p50={times[25] * 1e3:.2f}ms p99={times[-1] * 1e3:.2f}ms "
+          f"(embedding via local fake server included)")
+    if result.get("invocationId") != "inv-1" or len(socket.sent) != 50:
+        failures.append(f"unexpected tool result {result}")
+    elif not result.get("result", "").startswith(texts[answer_id]):
+        failures.append(f"the answer is not grounded in the best chunk: {result.get('result', '')[:80]!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail if search p99 exceeds this")
+    args = parser.parse_args()
+
+    from app.utils.vector_index import VectorIndex
+
+    rng = np.random.default_rng(11)
+    corpus = synthetic_corpus(rng, args.chunks, args.dimensions)
+    start = time.perf_counter()
+    index = VectorIndex(np.arange(args.chunks), corpus)
+    print(f"built index in {time.perf_counter() - start:.2f}s")
+    failures = []
+    p99 = bench_search(index, index.matrix, rng, args, failures)
+    if args.budget_ms is not None and p99 * 1e3 > args.budget_ms:
+        failures.append(f"search p99 {p99 * 1e3:.2f}ms exceeds {args.budget_ms}ms")
+    asyncio.run(check_tool(index, args, failures))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Shared vector file benchmark (app/utils/vector_store.py).
+
+1. Quality: recall@10 and query latency of int8 and float16 vector files
+   against the exact float32 VectorIndex on clustered synthetic embeddings.
+2. Memory: starts --workers processes (like gunicorn workers) that each load
+   the corpus, once as a private float32 VectorIndex and once by mapping the
+   int8 file, run queries while all of them hold their index, and report RSS
+   (split into private anonymous memory and file-backed pages) and PSS before
+   and after loading. Mapped pages are shared, so PSS divides them between
+   the workers.
+3. Publishing: several processes run RetrievalService._load_file at once
+   against a stand-in MySQL cursor; exactly one of them must build the file.
+   A reader searching while a new file is swapped in must keep working on the
+   old mapping.
+
+Exits non-zero if a check fails.
+
+Usage (from backend/):
+    python3 scripts/bench_vector_store.py --chunks 100000 --dimensions 1536 --workers 3
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.vector_index import VectorIndex, normalize_rows  # noqa: E402
+from app.utils.vector_store import MappedVectorIndex, write_vector_file  # noqa: E402
+
+
+def synthetic_corpus(rng: np.random.Generator, chunks: int, dimensions: int, clusters: int = 500) -> np.ndarray:
+    centers = rng.standard_normal((clusters, dimensions), dtype=np.float32)
+    matrix = centers[rng.integers(0, clusters, chunks)]
+    for start in range(0, chunks, 10000):
+        block = matrix[start:start + 10000]
+        block += 0.8 * rng.standard_normal(block.shape, dtype=np.float32)
+    return normalize_rows(matrix)
+
+
+def memory_kib() -> dict:
+    """RSS split and PSS of this process, in KiB."""
+    values = {}
+    for source in ("/proc/self/status", "/proc/self/smaps_rollup"):
+        with open(source) as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("VmRSS", "RssAnon", "RssFile", "Pss"):
+                    values[key] = int(rest.split()[0])
+    return values
+
+
+def bench_quality(corpus: np.ndarray, directory: str, rng, args, failures: list):
+    exact = VectorIndex(np.arange(len(corpus)), corpus.copy())
+    queries = corpus[rng.integers(0, len(corpus), args.queries)] + \
+        0.5 * rng.standard_normal((args.queries, corpus.shape[1]), dtype=np.float32)
+    truth, times = [], []
+    for query in queries:
+        start = time.perf_counter()
+        found, _ = exact.search(query, 10)
+        times.append(time.perf_counter() - start)
+        truth.append(set(found.tolist()))
+    times.sort()
+    print(f"float32 in memory: {exact.nbytes / 2 ** 20:7.1f} MiB  "
+          f"p50={times[len(times) // 2] * 1e3:6.2f}ms p99={times[int(len(times) * 0.99)] * 1e3:6.2f}ms")
+    for dtype in ("int8", "float16"):
+        path = os.path.join(directory, f"kb_vectors.{dtype}.bin")
+        write_vector_file(path, np.arange(len(corpus)), corpus.copy(), dtype)
+        index = MappedVectorIndex(path)
+        times, recall = [], []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            found, _ = index.search(query, 10)
+            times.append(time.perf_counter() - start)
+            recall.append(len(expected & set(found.tolist())) / 10)
+        times.sort()
+        print(f"{dtype:>7} mapped file: {index.nbytes / 2 ** 20:7.1f} MiB  "
+              f"p50={times[len(times) // 2] * 1e3:6.2f}ms p99={times[int(len(times) * 0.99)] * 1e3:6.2f}ms "
+              f"recall@10={np.mean(recall):.3f}")
+        if np.mean(recall) < args.min_recall:
+            failures.append(f"{dtype} recall@10 {np.mean(recall):.3f} below {args.min_recall}")
+
+
+def worker(mode: str, source: str, queries: np.ndarray, barrier, results):
+    before = memory_kib()
+    if mode == "float32":
+        corpus = np.load(source)  # stands in for the rows read from MySQL
+        index = VectorIndex(np.arange(len(corpus)), corpus)
+    else:
+        index = MappedVectorIndex(source)
+    for query in queries:
+        index.search(query, 10)
+    barrier.wait()  # every worker holds its index while memory is measured
+    after = memory_kib()
+    barrier.wait()
+    results.put((mode, os.getpid(), before, after))
+
+
+def bench_memory(corpus: np.ndarray, directory: str, rng, args, failures: list):
+    npy = os.path.join(directory, "corpus.npy")
+    np.save(npy, corpus)
+    store = os.path.join(directory, "kb_vectors.int8.bin")
+    queries = corpus[rng.integers(0, len(corpus), 20)]
+    context = multiprocessing.get_context("spawn")
+    growth = {}
+    for mode, source in (("float32", npy), ("int8 mmap", store)):
+        barrier, results = context.Barrier(args.workers), context.Queue()
+        processes = [context.Process(target=worker, args=(mode, source, queries, barrier, results))
+                     for _ in range(args.workers)]
+        for process in processes:
+            process.start()
+        reports = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        print(f"\n{mode}, {args.workers} workers (KiB)      VmRSS   RssAnon   RssFile       Pss")
+        for _, pid, before, after in sorted(reports, key=lambda r: r[1]):
+            for label, values in (("before", before), ("after", after)):
+                print(f"  worker {pid:>7} {label:<6} {values['VmRSS']:>9} {values['RssAnon']:>9} "
+                      f"{values['RssFile']:>9} {values['Pss']:>9}")
+        growth[mode] = np.mean([after["RssAnon"] - before["RssAnon"] for _, _, before, after in reports])
+        pss = sum(after["Pss"] - before["Pss"] for _, _, before, after in reports)
+        print(f"  private memory added per worker {growth[mode] / 1024:.1f} MiB, "
+              f"PSS added across workers {pss / 1024:.1f} MiB")
+    if growth["int8 mmap"] > 0.1 * growth["float32"]:
+        failures.append(f"mapped workers grew {growth['int8 mmap']:.0f} KiB of private memory each")
+
+
+def publisher(path: str, corpus: np.ndarray, published):
+    """Runs RetrievalService._load_file with a cursor serving `corpus` as knowledge_base_chunks."""
+    from app.config import settings
+    from app.services.retrieval_service import RetrievalService
+
+    class Cursor:
+        def execute(self, sql, params):
+            published.put(os.getpid())  # only the publisher reads vectors
+            self.rows = [(i, corpus[i].tobytes()) for i in range(len(corpus))]
+
+        def fetchmany(self, size):
+            rows, self.rows = self.rows[:size], self.rows[size:]
+            return rows
+
+    settings.kb_vector_store_path = path
+    settings.kb_index_mode = "exact"
+    service = RetrievalService()
+    service._load_file(Cursor(), (len(corpus), len(corpus) - 1), time.time())
+    if len(service.index) != len(corpus):
+        published.put(-1)
+
+
+def check_publishing(corpus: np.ndarray, directory: str, args, failures: list):
+    path = os.path.join(directory, "published.bin")
+    context = multiprocessing.get_context("spawn")
+    published = context.Queue()
+    processes = [context.Process(target=publisher, args=(path, corpus, published)) for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    builders = []
+    while not published.empty():
+        builders.append(published.get())
+    print(f"\n{args.workers} workers loading a missing file: {len([b for b in builders if b > 0])} built it")
+    if builders.count(-1) or len(builders) != 1 or any(p.exitcode for p in processes):
+        failures.append(f"concurrent publishing: builders {builders}, exit codes {[p.exitcode for p in processes]}")
+
+    old = MappedVectorIndex(path)
+    errors, stop = [], threading.Event()
+
+    def search():
+        while not stop.is_set():
+            try:
+                found, _ = old.search(corpus[7], 1)
+                if found.tolist() != [7]:
+                    errors.append(found.tolist())
+            except Exception as e:
+                errors.append(repr(e))
+
+    reader = threading.Thread(target=search)
+    reader.start()
+    write_vector_file(path, np.arange(len(corpus)) + 10 ** 6, corpus[::-1].copy(), signature=(len(corpus), 2 * 10 ** 6))
+    stop.set()
+    reader.join()
+    new = MappedVectorIndex(path)
+    leftovers = [name for name in os.listdir(directory) if name.endswith(".tmp")]
+    print(f"swap under a searching reader: old mapping errors={len(errors)}, new signature {new.signature}, "
+          f"leftover temporary files {leftovers}")
+    if errors or new.signature != (len(corpus), 2 * 10 ** 6) or leftovers:
+        failures.append("atomic swap")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--min-recall", type=float, default=0.9)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(3)
+    corpus = synthetic_corpus(rng, args.chunks, args.dimensions)
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        bench_quality(corpus, directory, rng, args, failures)
+        bench_memory(corpus, directory, rng, args, failures)
+        check_publishing(corpus[:2000], directory, args, failures)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+call_logs partitioning check against a real MySQL server (settings' DB_HOST,
+DB_USER, DB_PASSWORD; the user must be allowed to create databases).
+
+Creates a scratch database (--database), creates the tables, seeds --calls
+call_logs rows spread over the last months, partitions call_logs with
+ArchiveService.enable_partitioning() and then runs every call_logs writer
+twice for the same calls: the background CallLogWriter (once more from two
+threads at the same moment), the status-callback placeholder in
+apply_twilio_status, and insert_call_logs with update_status as the
+inbound-call route and TwilioService.make_call use it. Checks that every
+call_sid still has exactly one call_logs row, that update_status moved the
+status of the existing row, and that retention prunes call_sid_index along
+with the dropped partitions. The scratch database is dropped afterwards
+unless --keep is given. Exits non-zero if a check fails.
+
+Usage (from backend/):
+    python3 scripts/check_call_log_partitioning.py --calls 500
+"""
+import os
+import sys
+import logging
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+import mysql.connector
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings  # noqa: E402
+from app import database  # noqa: E402
+
+
+def query(sql: str, params: tuple = ()):
+    conn = database.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def in_transaction(work):
+    conn = database.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        result = work(cursor)
+        conn.commit()
+        return result
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def duplicates() -> list:
+    return query("SELECT call_sid, COUNT(*) FROM call_logs GROUP BY call_sid HAVING COUNT(*) > 1")
+
+
+def run(args, failures: list):
+    from app.services.archive_service import archive_service, add_months, insert_call_logs, month_start
+    from app.services.call_log_writer import call_log_writer
+    from app.services.webhook_service import apply_twilio_status
+
+    now = datetime.utcnow().replace(microsecond=0)
+    seeded = [(f"CA{n:032x}", "+15550000001", "+15550000002", "outbound", "completed",
+               now - timedelta(days=n * 120 // args.calls)) for n in range(args.calls)]
+    in_transaction(lambda cursor: insert_call_logs(cursor, seeded))
+    archive_service.enable_partitioning()
+    partitions = in_transaction(archive_service.list_partitions)
+    print(f"seeded {len(seeded)} calls; call_logs has {len(partitions)} partitions")
+    if not partitions:
+        failures.append("call_logs was not partitioned")
+
+    fresh = [(f"CB{n:032x}", "+15550000001", "+15550000003", "outbound", "queued", now) for n in range(args.calls)]
+    writer_rows = seeded[: args.calls // 2] + fresh
+    for _ in range(2):
+        call_log_writer._write(writer_rows)
+    racing = [(f"CC{n:032x}", "+15550000001", "+15550000004", "outbound", "queued", now) for n in range(args.calls)]
+    threads = [threading.Thread(target=call_log_writer._write, args=(racing,)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    callbacks = [{"CallSid": f"CD{n:032x}", "CallStatus": "ringing", "Direction": "outbound-api",
+                  "From": "+15550000001", "To": "+15550000005"} for n in range(min(args.calls, 50))]
+    for _ in range(2):
+        for data in callbacks:
+            in_transaction(lambda cursor: apply_twilio_status(cursor, data))
+
+    inbound = [(f"CE{n:032x}", "+15550000006", "+15550000001", "inbound", "initiated", now) for n in range(50)]
+    in_transaction(lambda cursor: insert_call_logs(cursor, inbound, update_status=True))
+    answered = [row[:4] + ("in-progress",) + row[5:] for row in inbound]
+    in_transaction(lambda cursor: insert_call_logs(cursor, answered, update_status=True))
+
+    expected = len(seeded) + len(fresh) + len(racing) + len(callbacks) + len(inbound)
+    rows = query("SELECT COUNT(*), COUNT(DISTINCT call_sid) FROM call_logs")[0]
+    duplicated = duplicates()
+    print(f"after writing every call twice: {rows[0]} rows for {rows[1]} calls, {len(duplicated)} duplicated")
+    if duplicated or rows[0] != expected:
+        failures.append(f"expected {expected} rows with unique call_sids, found {rows[0]} "
+                        f"({len(duplicated)} call_sids duplicated, e.g. {duplicated[:3]})")
+    statuses = query("SELECT DISTINCT status FROM call_logs WHERE call_sid LIKE 'CE%%'")
+    if statuses != [("in-progress",)]:
+        failures.append(f"update_status left inbound calls at {statuses}")
+
+    archive_service.retention_months = 2
+    archive_service.archive_dir = tempfile.mkdtemp(prefix="call_logs_archive_")
+    archived = archive_service.run_retention()
+    cutoff = add_months(month_start(datetime.utcnow().date()), -2)
+    stale = query("SELECT COUNT(*) FROM call_sid_index WHERE start_time < %s", (cutoff,))[0][0]
+    print(f"retention archived {sum(rows for _, rows in archived)} rows in {len(archived)} months; "
+          f"{stale} stale call_sid_index rows left")
+    if not archived or stale:
+        failures.append(f"retention archived {len(archived)} months and left {stale} call_sid_index rows")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=f"{settings.db_name}_partition_check")
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--keep", action="store_true")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    server = mysql.connector.connect(host=settings.db_host, port=settings.db_port, user=settings.db_user,
+                                     password=settings.db_password)
+    cursor = server.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS `{args.database}`")
+    cursor.execute(f"CREATE DATABASE `{args.database}`")
+    settings.db_name = args.database
+    database.close_db_pool()
+    failures = []
+    try:
+        database.create_tables()
+        run(args, failures)
+    finally:
+        database.close_db_pool()
+        if not args.keep:
+            cursor.execute(f"DROP DATABASE IF EXISTS `{args.database}`")
+        cursor.close()
+        server.close()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Local dual-channel recorder check (app/services/call_recorder.py).
+
+Simulates concurrent media bridges in real time: every call sends a 20 ms
+caller frame per tick with its Twilio timestamp (with arrival jitter) and
+agent audio in bursts, as Ultravox does. Caller frame k carries the sample
+value k+1 and agent chunk j the value -(j+1), so the resulting WAV files show
+whether both legs landed where they were played. Checks that:
+- every file is a valid 8 kHz stereo WAV covering the call;
+- each caller frame sits at its timestamp and agent chunks play back to back in order;
+- nothing is dropped while the writer keeps up, and drops are counted when
+  it stalls longer than the ring buffer;
+- adding a frame on the event loop stays in the microseconds.
+MySQL is not touched. Exits non-zero if a check fails.
+
+Usage (from backend/):
+    python3 scripts/check_call_recorder.py --calls 8 --seconds 6
+"""
+import os
+import sys
+import time
+import wave
+import random
+import asyncio
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FRAME = 160  # 20 ms at 8 kHz
+
+
+async def simulate_call(recorder_module, call_sid: str, seconds: float, add_times: list, rng: random.Random):
+    recording = recorder_module.recording_writer.open(call_sid)
+    frames = int(seconds * 50)
+    agent_chunks = 0
+    start = time.monotonic()
+    for k in range(frames):
+        await asyncio.sleep(max(0.0, start + k * 0.02 + rng.uniform(0, 0.015) - time.monotonic()))
+        t0 = time.perf_counter()
+        recording.add_caller(np.full(FRAME, k + 1, dtype=np.int16).tobytes(), str(k * 20))
+        add_times.append(time.perf_counter() - t0)
+        if k % 25 == 5:  # an agent reply: 300 ms of audio in one burst
+            for _ in range(15):
+                t0 = time.perf_counter()
+                recording.add_agent(np.full(FRAME, -(agent_chunks + 1), dtype=np.int16).tobytes())
+                add_times.append(time.perf_counter() - t0)
+                agent_chunks += 1
+    recording.close()
+    return recording, frames, agent_chunks
+
+
+def verify(path: str, frames: int, agent_chunks: int, failures: list, label: str):
+    with wave.open(path, "rb") as w:
+        if (w.getnchannels(), w.getsampwidth(), w.getframerate()) != (2, 2, 8000):
+            failures.append(f"{label}: unexpected WAV format")
+            return
+        audio = np.frombuffer(w.readframes(w.getnframes()), dtype=np.int16).reshape(-1, 2)
+    if len(audio) < frames * FRAME:
+        failures.append(f"{label}: {len(audio)} frames, expected at least {frames * FRAME}")
+        return
+    caller = audio[:frames * FRAME, 0].reshape(frames, FRAME)
+    if not (caller == np.arange(1, frames + 1, dtype=np.int16)[:, None]).all():
+        failures.append(f"{label}: caller frames are not at their timestamps")
+    agent = audio[:, 1]
+    values = -agent[agent != 0].astype(np.int64)
+    expected = np.repeat(np.arange(1, agent_chunks + 1), FRAME)
+    if len(values) != len(expected) or not (values == expected).all():
+        failures.append(f"{label}: agent audio missing or out of order")
+    # Chunks of one burst must be contiguous in the file.
+    first = np.flatnonzero(agent == -1)[0]
+    if not (agent[first:first + 15 * FRAME] != 0).all():
+        failures.append(f"{label}: gap inside an agent burst")
+
+
+async def run(args, failures: list):
+    from app.services import call_recorder
+    from app.config import settings
+
+    settings.local_recording_enabled = True
+    rng = random.Random(3)
+    add_times = []
+    started = time.perf_counter()
+    results = await asyncio.gather(*(simulate_call(call_recorder, f"CAsim{i}", args.seconds, add_times, rng)
+                                     for i in range(args.calls)))
+    await asyncio.to_thread(call_recorder.recording_writer.stop)
+    elapsed = time.perf_counter() - started
+    total_bytes = sum(r.bytes_written for r, _, _ in results)
+    dropped = sum(r.dropped_blocks for r, _, _ in results)
+    add_times.sort()
+    print(f"{args.calls} calls x {args.seconds}s in {elapsed:.1f}s: {total_bytes / 1e6:.1f} MB written, "
+          f"{dropped} dropped blocks; add_* p50={add_times[len(add_times) // 2] * 1e6:.1f}us "
+          f"p99={add_times[int(len(add_times) * 0.99)] * 1e6:.1f}us")
+    for recording, frames, agent_chunks in results:
+        verify(recording.path, frames, agent_chunks, failures, recording.call_sid)
+    if dropped:
+        failures.append(f"{dropped} blocks dropped although the writer kept up")
+    if add_times[int(len(add_times) * 0.99)] > 0.001:
+        failures.append("adding audio took over 1 ms at p99")
+
+    # Stall the writer for longer than the ring buffer: drops must be counted, not block the loop.
+    settings.local_recording_buffer_seconds = 1.0
+    settings.local_recording_block_seconds = 0.25
+    settings.local_recording_lag_ms = 250
+    original_flush = call_recorder.CallRecording.flush
+
+    def stalled_flush(self, final=False):
+        if not final and not getattr(self, "_stalled", False):
+            self._stalled = True
+            time.sleep(2.0)
+        return original_flush(self, final)
+
+    call_recorder.CallRecording.flush = stalled_flush
+    recording, _, _ = await simulate_call(call_recorder, "CAstall", 3, [], rng)
+    await asyncio.to_thread(call_recorder.recording_writer.stop)
+    call_recorder.CallRecording.flush = original_flush
+    print(f"stalled writer: {recording.bytes_written} bytes written, {recording.dropped_blocks} dropped blocks")
+    if not recording.dropped_blocks:
+        failures.append("a stalled writer did not lead to counted drops")
+    if recording.bytes_written < 2.5 * 8000 * 4:
+        failures.append("the recording did not recover after the writer stall")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=6)
+    args = parser.parse_args()
+
+    from app.services.recording_service import recording_archiver
+    from app.services import call_recorder
+    with tempfile.TemporaryDirectory() as directory:
+        recording_archiver.directory = directory
+        call_recorder.RecordingWriter._save = lambda self, row: None  # no MySQL here
+        failures = []
+        asyncio.run(run(args, failures))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Cost reconciliation check against the local fakes (scripts/fake_twilio.py,
+scripts/fake_ultravox.py).
+
+Seeds both fakes with completed calls (a few still unpriced) and runs
+ReconciliationService.reconcile() for each source. Checks that every priced call
+is fetched exactly once through the paginated list APIs, in ceil(calls / page)
+requests instead of one per call, that Twilio prices and Ultravox billed
+minutes turn into the expected costs, and that the stored high-water mark stops
+at the oldest unpriced call so it is picked up by the next run. MySQL is not
+touched: page application and the state table are replaced by in-memory
+stand-ins. Exits non-zero if a check fails.
+
+Usage (from backend/):
+    python3 scripts/check_reconciliation.py --calls 5000
+"""
+import os
+import sys
+import math
+import time
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_twilio import FakeTwilio  # noqa: E402
+from fake_ultravox import FakeUltravox  # noqa: E402
+
+
+class StateConnection:
+    """Just enough of a MySQL connection for reconcile()'s high-water bookkeeping."""
+
+    def __init__(self, state: dict):
+        self.state = state
+
+    def cursor(self, *args, **kwargs):
+        return self
+
+    def execute(self, sql, params=None):
+        self._row = None
+        if sql.startswith("SELECT high_water"):
+            self._row = (self.state[params[0]],) if params[0] in self.state else None
+        elif "INTO reconciliation_state" in sql:
+            self.state[params[0]] = params[1]
+
+    def fetchone(self):
+        return self._row
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def run(args) -> bool:
+    from app.config import settings
+    from app.services import reconciliation_service as recon
+
+    rng = random.Random(7)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    twilio, ultravox = FakeTwilio(), FakeUltravox()
+    settings.twilio_api_base_url = twilio.start_in_thread()
+    settings.ultravox_api_base_url = ultravox.start_in_thread()
+    settings.twilio_account_sid = settings.twilio_account_sid or "AC0"
+    settings.reconcile_page_size = args.page_size
+
+    expected = {recon.TWILIO: {}, recon.ULTRAVOX: {}}
+    unpriced = {}
+    for i in range(args.calls):
+        ended = now - timedelta(minutes=i * 3 % (24 * 60), seconds=i)
+        duration = rng.randint(5, 600)
+        sid = f"CA{i:032x}"
+        price = None if i in (args.calls // 2, args.calls // 3) else round(0.0085 * math.ceil(duration / 60), 5)
+        twilio.add_completed_call(sid, ended, duration, price)
+        if price is None:
+            unpriced[recon.TWILIO] = min(unpriced.get(recon.TWILIO, ended), ended)
+        else:
+            expected[recon.TWILIO][sid] = (price, math.ceil(duration / 60))
+        uv_id = f"uv-{i:08d}"
+        billed = None if i == args.calls // 4 else duration + 0.5
+        ultravox.add_call(uv_id, ended, billed)
+        if billed is None:
+            unpriced[recon.ULTRAVOX] = min(unpriced.get(recon.ULTRAVOX, ended), ended)
+        else:
+            expected[recon.ULTRAVOX][uv_id] = (round(billed / 60 * settings.ultravox_price_per_minute, 5), None)
+    # Calls from before the look-back window must not be fetched.
+    ultravox.add_call("uv-ancient", now - timedelta(days=30), 60)
+
+    state = {recon.TWILIO: (now - timedelta(days=2)).replace(tzinfo=None),
+             recon.ULTRAVOX: (now - timedelta(days=2)).replace(tzinfo=None)}
+    applied = {recon.TWILIO: {}, recon.ULTRAVOX: {}}
+
+    def apply_page(conn, source, records):
+        for sid, cost, segments, _ in records:
+            applied[source][sid] = applied[source].get(sid, []) + [(cost, segments)]
+        return len(records)
+
+    service = recon.ReconciliationService()
+    service._apply_page = apply_page
+    recon.get_db_connection = lambda: StateConnection(state)
+
+    failures = []
+    for source, fake in ((recon.TWILIO, twilio), (recon.ULTRAVOX, ultravox)):
+        start = time.perf_counter()
+        result = service.reconcile(source)
+        elapsed = time.perf_counter() - start
+        page_size = args.page_size if source == recon.TWILIO else min(args.page_size, 100)
+        print(f"{source:<9} fetched={result['fetched']} matched={result['matched']} "
+              f"requests={fake.list_requests} (per-call lookups would be {len(expected[source])}) "
+              f"{elapsed:.2f}s high_water={state[source]}")
+        got = applied[source]
+        if set(got) != set(expected[source]):
+            failures.append(f"{source}: applied {len(got)} calls, expected {len(expected[source])}")
+        if any(len(v) != 1 for v in got.values()):
+            failures.append(f"{source}: some calls were applied more than once")
+        wrong = [sid for sid, v in got.items() if abs(v[0][0] - expected[source][sid][0]) > 1e-5
+                 or v[0][1] != expected[source][sid][1]]
+        if wrong:
+            failures.append(f"{source}: {len(wrong)} calls with the wrong cost, e.g. {wrong[0]}")
+        if fake.list_requests > math.ceil((args.calls + 1) / page_size) + 1:
+            failures.append(f"{source}: {fake.list_requests} list requests for {args.calls} calls")
+        if state[source] != unpriced[source].replace(tzinfo=None):
+            failures.append(f"{source}: high-water {state[source]} is not the oldest unpriced call "
+                            f"{unpriced[source]}")
+    twilio.stop_thread()
+    ultravox.stop_thread()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--page-size", type=int, default=1000)
+    args = parser.parse_args()
+    sys.exit(0 if run(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
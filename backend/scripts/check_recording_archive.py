@@ -0,0 +1,166 @@
+"""
+Recording archiver check against a local recordings server.
+
+Serves generated recordings (with Range support) and archives them through
+recording_archiver.archive(), checking that:
+- SHA-256 and size of every archived file match the source;
+- no more than recording_archive_concurrency downloads run at once;
+- peak Python memory stays bounded by the chunk size, not the recording size;
+- a download cut off midway resumes from its .part file with a Range request;
+- RangeFileResponse answers full, ranged, suffix and unsatisfiable requests.
+MySQL is not touched. Exits non-zero if a check fails.
+
+Usage (from backend/):
+    python3 scripts/check_recording_archive.py --recordings 12 --size-mb 8
+"""
+import os
+import sys
+import time
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import tracemalloc
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class RecordingServer:
+    def __init__(self, blobs: dict, cut_after: dict):
+        self.blobs = blobs
+        self.cut_after = dict(cut_after)  # name -> bytes sent before dropping the connection (once)
+        self.active = self.max_active = 0
+        self.range_requests = []
+        self.app = web.Application()
+        self.app.router.add_get("/recordings/{name}", self.serve)
+
+    async def serve(self, request: web.Request) -> web.StreamResponse:
+        name = request.match_info["name"]
+        blob = self.blobs[name]
+        start = 0
+        resp = web.StreamResponse(headers={"Content-Type": "audio/x-wav"})
+        if "Range" in request.headers:
+            start = int(request.headers["Range"][6:].split("-")[0])
+            self.range_requests.append((name, start))
+            resp.set_status(206)
+            resp.headers["Content-Range"] = f"bytes {start}-{len(blob) - 1}/{len(blob)}"
+        resp.content_length = len(blob) - start
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await resp.prepare(request)
+            cut = self.cut_after.pop(name, None)
+            for offset in range(start, len(blob), 64 * 1024):
+                if cut is not None and offset >= cut:
+                    request.transport.close()
+                    return resp
+                await resp.write(blob[offset:offset + 64 * 1024])
+                await asyncio.sleep(0)
+            await resp.write_eof()
+            return resp
+        finally:
+            self.active -= 1
+
+
+async def check_archiver(args, failures: list):
+    from app.services.recording_service import recording_archiver, IncompleteDownload
+
+    blobs = {f"rec{i}": os.urandom(args.size_mb * 1024 * 1024) for i in range(args.recordings)}
+    cut_name = "rec0"
+    server = RecordingServer(blobs, {cut_name: len(blobs[cut_name]) * 2 // 5})
+    runner = web.AppRunner(server.app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    base = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/recordings"
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    results = await asyncio.gather(*(recording_archiver.archive(f"CA{name}", "twilio", f"{base}/{name}")
+                                     for name in blobs), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if not isinstance(results[0], IncompleteDownload):
+        failures.append(f"the interrupted download did not fail with IncompleteDownload: {results[0]!r}")
+    if recording_archiver.active:
+        failures.append(f"{recording_archiver.active} downloads still counted as active")
+    retried = await recording_archiver.archive(f"CA{cut_name}", "twilio", f"{base}/{cut_name}")
+    results[0] = retried
+    await recording_archiver.close()
+    await runner.cleanup()
+
+    total_mb = args.recordings * args.size_mb
+    print(f"archived {args.recordings} x {args.size_mb} MB in {elapsed:.2f}s ({total_mb / elapsed:.0f} MB/s), "
+          f"max concurrent downloads {server.max_active}, peak Python memory {peak / 2 ** 20:.1f} MB, "
+          f"resumed from {server.range_requests}")
+    for name, result in zip(blobs, results):
+        if isinstance(result, Exception):
+            failures.append(f"{name}: {result!r}")
+            continue
+        path = os.path.join(recording_archiver.directory, result["path"])
+        with open(path, "rb") as f:
+            data = f.read()
+        if data != blobs[name] or result["sha256"] != hashlib.sha256(blobs[name]).hexdigest():
+            failures.append(f"{name}: archived file or checksum differs from the source")
+        if result["bytes"] != len(blobs[name]) or not path.endswith(".wav"):
+            failures.append(f"{name}: wrong size or extension ({result['bytes']}, {path})")
+    if server.max_active > recording_archiver.concurrency:
+        failures.append(f"{server.max_active} concurrent downloads, limit {recording_archiver.concurrency}")
+    chunk_budget = recording_archiver.concurrency * 4 * recording_archiver.chunk_bytes + 8 * 2 ** 20
+    if peak > chunk_budget:
+        failures.append(f"peak memory {peak} exceeds {chunk_budget} bytes")
+    if [n for n, _ in server.range_requests] != [cut_name]:
+        failures.append(f"expected one resumed download of {cut_name}, saw {server.range_requests}")
+    return blobs, results
+
+
+def check_range_response(path: str, data: bytes, failures: list):
+    from starlette.applications import Starlette
+    from starlette.routing import Route
+    from starlette.testclient import TestClient
+    from app.utils.range_response import RangeFileResponse
+
+    async def endpoint(request):
+        return RangeFileResponse(path, "audio/wav", request.headers.get("range"), chunk_size=100_000)
+
+    client = TestClient(Starlette(routes=[Route("/r", endpoint)]))
+    size = len(data)
+    cases = [
+        ({}, 200, data),
+        ({"Range": "bytes=1000-1999"}, 206, data[1000:2000]),
+        ({"Range": "bytes=500000-"}, 206, data[500000:]),
+        ({"Range": "bytes=-300"}, 206, data[-300:]),
+        ({"Range": f"bytes={size}-"}, 416, b""),
+    ]
+    for headers, status, body in cases:
+        resp = client.get("/r", headers=headers)
+        if resp.status_code != status or resp.content != body:
+            failures.append(f"range {headers or 'none'}: got {resp.status_code} with {len(resp.content)} bytes")
+    print(f"range responses checked: {len(cases)} cases")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recordings", type=int, default=12)
+    parser.add_argument("--size-mb", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    from app.services.recording_service import recording_archiver
+    with tempfile.TemporaryDirectory() as directory:
+        recording_archiver.directory = directory
+        recording_archiver.concurrency = args.concurrency
+        failures = []
+        blobs, results = asyncio.run(check_archiver(args, failures))
+        if not isinstance(results[1], Exception):
+            check_range_response(os.path.join(directory, results[1]["path"]), blobs["rec1"], failures)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Local fake of the OpenAI embeddings API, for embedding benchmarks without an
+OpenAI account.
+
+Implements POST /v1/embeddings: every input gets a deterministic unit vector
+derived from its SHA-256 (so tests can recompute the expected embedding with
+fake_embedding()), usage counts approximate tokens, and base64 or float
+encoding is honoured like the real API. Each request waits --latency seconds
+plus --per-input-latency per input. Requests over the provider's batch limit
+are rejected with 400.
+
+Point the backend at it by setting openai.api_base to
+http://127.0.0.1:<port>/v1 (scripts do this in-process).
+
+Usage (from backend/):
+    python3 scripts/fake_openai.py --port 8097
+"""
+import base64
+import asyncio
+import hashlib
+import argparse
+import threading
+
+import numpy as np
+from aiohttp import web
+
+MAX_INPUTS = 2048
+
+
+def fake_embedding(text: str, dimensions: int = 1536) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class FakeOpenAI:
+    def __init__(self, dimensions: int = 1536, latency: float = 0.05, per_input_latency: float = 0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.per_input_latency = per_input_latency
+        self.requests = 0
+        self.inputs = 0
+        self.active = self.max_active = 0
+        self.app = web.Application(client_max_size=256 * 1024 * 1024)
+        self.app.router.add_post("/v1/embeddings", self.embeddings)
+        self._runner = None
+
+    async def embeddings(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        if len(texts) > MAX_INPUTS:
+            return web.json_response({"error": {"message": f"Too many inputs: {len(texts)}", "type": "invalid_request_error"}},
+                                     status=400)
+        self.requests += 1
+        self.inputs += len(texts)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency + self.per_input_latency * len(texts))
+        finally:
+            self.active -= 1
+        data = []
+        for i, text in enumerate(texts):
+            vector = fake_embedding(text, self.dimensions)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(max(1, len(text) // 4) for text in texts)
+        return web.json_response({
+            "object": "list",
+            "data": data,
+            "model": body.get("model"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Starts serving and returns the API base URL."""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{bound_port}/v1"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serves from a private event loop on a daemon thread (for blocking clients)."""
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(self.start(host, port), self._loop).result()
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8097)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+    web.run_app(FakeOpenAI(args.dimensions, args.latency).app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Local fake of the Twilio REST endpoints the backend calls, for benchmarks and
+manual testing without a Twilio account.
+
+Implements POST /2010-04-01/Accounts/{AccountSid}/Calls.json (returns a queued
+call with a fresh CA... SID after --latency seconds) and records each request's
+form fields and client connection. GET on the same path pages through the
+completed calls in `history` (filters Status and EndTime>, honours PageSize
+and follows next_page_uri like the real list API). Point the backend at it with
+TWILIO_API_BASE_URL=http://127.0.0.1:<port>.
+
+Usage (from backend/):
+    python3 scripts/fake_twilio.py --port 8099 --latency 0.15
+"""
+import uuid
+import asyncio
+import threading
+import argparse
+from urllib.parse import urlencode
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+
+class FakeTwilio:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = []           # form fields of each Calls.json request
+        self.connections = set()  # (host, port) of client sockets seen
+        self.history = []         # call resources served by the list API, newest first
+        self.list_requests = 0
+        self.app = web.Application()
+        self.app.router.add_post("/2010-04-01/Accounts/{account_sid}/Calls.json", self.create_call)
+        self.app.router.add_get("/2010-04-01/Accounts/{account_sid}/Calls.json", self.list_calls)
+        self._runner = None
+
+    async def create_call(self, request: web.Request) -> web.Response:
+        self.connections.add(request.transport.get_extra_info("peername"))
+        form = dict(await request.post())
+        if "To" not in form or "From" not in form:
+            return web.json_response({"code": 21201, "message": "To and From are required", "status": 400}, status=400)
+        self.calls.append(form)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        sid = "CA" + uuid.uuid4().hex
+        account_sid = request.match_info["account_sid"]
+        now = datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S +0000")
+        return web.json_response({
+            "sid": sid,
+            "account_sid": account_sid,
+            "to": form["To"],
+            "from": form["From"],
+            "status": "queued",
+            "direction": "outbound-api",
+            "date_created": now,
+            "date_updated": now,
+            "uri": f"/2010-04-01/Accounts/{account_sid}/Calls/{sid}.json",
+        }, status=201)
+
+    def add_completed_call(self, sid: str, end_time: datetime, duration: int, price):
+        """Seeds the list API; `price` is a positive amount or None while unpriced."""
+        self.history.append({
+            "sid": sid,
+            "status": "completed",
+            "duration": str(duration),
+            "end_time": end_time.strftime("%a, %d %b %Y %H:%M:%S +0000"),
+            "price": None if price is None else f"-{price:.5f}",
+            "price_unit": "USD",
+            "_ended": end_time,
+        })
+        self.history.sort(key=lambda c: c["_ended"], reverse=True)
+
+    async def list_calls(self, request: web.Request) -> web.Response:
+        self.list_requests += 1
+        query = request.query
+        calls = [c for c in self.history if c["status"] == query.get("Status", c["status"])]
+        if "EndTime>" in query:
+            since = datetime.strptime(query["EndTime>"], "%Y-%m-%d").replace(tzinfo=timezone.utc)
+            calls = [c for c in calls if c["_ended"] >= since]
+        page, page_size = int(query.get("Page", 0)), min(int(query.get("PageSize", 50)), 1000)
+        chunk = calls[page * page_size:(page + 1) * page_size]
+        next_page_uri = None
+        if (page + 1) * page_size < len(calls):
+            params = dict(query, Page=str(page + 1), PageSize=str(page_size))
+            next_page_uri = f"{request.path}?{urlencode(params)}"
+        return web.json_response({
+            "calls": [{k: v for k, v in c.items() if not k.startswith("_")} for c in chunk],
+            "page": page,
+            "page_size": page_size,
+            "next_page_uri": next_page_uri,
+        })
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Starts serving and returns the base URL."""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{bound_port}"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Serves from a private event loop on a daemon thread, so clients that block
+        their own loop (the synchronous Twilio client) can still be answered.
+        """
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(self.start(host, port), self._loop).result()
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.15, help="Seconds before each response")
+    args = parser.parse_args()
+    web.run_app(FakeTwilio(args.latency).app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
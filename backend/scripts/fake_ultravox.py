@@ -0,0 +1,84 @@
+"""
+Local fake of the Ultravox calls list API, for reconciliation checks without
+an Ultravox account.
+
+Implements GET /api/calls, newest first, with pageSize and an opaque `next`
+cursor URL like the real API. Seed calls with add_call(). Point the backend at
+it with ULTRAVOX_API_BASE_URL=http://127.0.0.1:<port>/api.
+
+Usage (from backend/):
+    python3 scripts/fake_ultravox.py --port 8098
+"""
+import asyncio
+import threading
+import argparse
+from datetime import datetime
+
+from aiohttp import web
+
+
+class FakeUltravox:
+    def __init__(self):
+        self.history = []  # call resources, newest first
+        self.list_requests = 0
+        self.app = web.Application()
+        self.app.router.add_get("/api/calls", self.list_calls)
+        self._runner = None
+
+    def add_call(self, call_id: str, created: datetime, billed_seconds, ended: bool = True):
+        """`created` is aware UTC; `billed_seconds` None leaves the call unbilled."""
+        self.history.append({
+            "callId": call_id,
+            "created": created.isoformat().replace("+00:00", "Z"),
+            "ended": created.isoformat().replace("+00:00", "Z") if ended else None,
+            "billedDuration": None if billed_seconds is None else f"{billed_seconds:.3f}s",
+            "_created": created,
+        })
+        self.history.sort(key=lambda c: c["_created"], reverse=True)
+
+    async def list_calls(self, request: web.Request) -> web.Response:
+        self.list_requests += 1
+        page_size = min(int(request.query.get("pageSize", 100)), 100)
+        offset = int(request.query.get("cursor", 0))
+        chunk = self.history[offset:offset + page_size]
+        has_more = offset + page_size < len(self.history)
+        return web.json_response({
+            "results": [{k: v for k, v in c.items() if not k.startswith("_")} for c in chunk],
+            "next": f"{request.url.with_query(cursor=offset + page_size, pageSize=page_size)}" if has_more else None,
+            "total": len(self.history),
+        })
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Starts serving and returns the API base URL."""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{bound_port}/api"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serves from a private event loop on a daemon thread (for blocking clients)."""
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(self.start(host, port), self._loop).result()
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8098)
+    args = parser.parse_args()
+    web.run_app(FakeUltravox().app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
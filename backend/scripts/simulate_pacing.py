@@ -0,0 +1,150 @@
+"""
+Replays historical answer-rate distributions through the campaign pacing logic
+to tune the adaptive dialer (see app/services/pacing_service.py).
+
+History comes from outbound rows in call_logs (answer rate per hour of day and
+talk-time samples of answered calls), or from synthetic defaults with
+--synthetic. The simulation steps once per second, compares the fixed-cap
+dialer against the adaptive controller, and reports how closely bridged calls
+track the target and how often media capacity would have been exceeded.
+
+Usage (from backend/):
+    python3 scripts/simulate_pacing.py --target 15 --capacity 20 --hours 9-17
+    python3 scripts/simulate_pacing.py --synthetic --target 40 --capacity 60 --z 1.5
+"""
+import os
+import sys
+import random
+import argparse
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def load_history(days):
+    """{hour: (answer_rate, [talk seconds])} from outbound call_logs."""
+    from app.database import get_db_connection
+
+    conn = get_db_connection()
+    if conn is None:
+        raise SystemExit("Database unavailable; use --synthetic.")
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT HOUR(start_time), status, duration FROM call_logs
+        WHERE direction LIKE 'outbound%%' AND start_time > UTC_TIMESTAMP() - INTERVAL %s DAY
+          AND status IN ('completed', 'no-answer', 'busy', 'failed', 'canceled')
+        """,
+        (days,)
+    )
+    per_hour = {}
+    for hour, status, duration in cursor.fetchall():
+        answered, total, talk = per_hour.setdefault(hour, [0, 0, []])
+        per_hour[hour][1] += 1
+        if status == 'completed' and duration:
+            per_hour[hour][0] += 1
+            talk.append(int(duration))
+    cursor.close()
+    conn.close()
+    return {h: (a / t, talk or [90]) for h, (a, t, talk) in per_hour.items() if t}
+
+
+def synthetic_history():
+    rng = random.Random(7)
+    talk = [max(10, int(rng.lognormvariate(4.3, 0.6))) for _ in range(2000)]
+    rates = {9: 0.22, 10: 0.30, 11: 0.35, 12: 0.18, 13: 0.25, 14: 0.38, 15: 0.33, 16: 0.28, 17: 0.15}
+    return {h: (r, talk) for h, r in rates.items()}
+
+
+def simulate(history, hours, strategy, args, seed=1):
+    from app.services.pacing_service import compute_dials, OutcomeWindow
+
+    rng = random.Random(seed)
+    ringing = []   # (answer_at or None, done_at)
+    bridged = []   # hangup times
+    outcomes = deque()  # (time, answered)
+    pending = args.targets
+    stats = {"ticks": 0, "bridged_sum": 0, "over_capacity": 0, "max_bridged": 0,
+             "idle_seconds": 0, "dials": 0, "answered": 0, "abs_err": 0}
+
+    t = 0
+    for hour in hours:
+        rate, talk = history.get(hour, (args.prior, [90]))
+        for _ in range(3600):
+            t += 1
+            # Advance calls.
+            still_ringing = []
+            for answer_at, done_at in ringing:
+                if answer_at is not None and t >= answer_at:
+                    bridged.append(t + rng.choice(talk))
+                    outcomes.append((t, True))
+                    stats["answered"] += 1
+                elif answer_at is None and t >= done_at:
+                    outcomes.append((t, False))
+                else:
+                    still_ringing.append((answer_at, done_at))
+            ringing = still_ringing
+            bridged = [end for end in bridged if end > t]
+            while outcomes and outcomes[0][0] < t - args.window:
+                outcomes.popleft()
+
+            # Decide dials (dispatcher tick), bounded by CPS.
+            if strategy == "fixed":
+                dials = max(0, min(args.max_concurrent - len(bridged) - len(ringing), pending))
+            else:
+                window = OutcomeWindow(answered=sum(1 for _, a in outcomes if a),
+                                       no_answer=sum(1 for _, a in outcomes if not a))
+                dials = compute_dials(args.target, args.capacity, len(bridged), len(ringing),
+                                      window.answer_rate(args.prior, args.prior_weight), pending, z=args.z)
+            dials = min(dials, int(args.cps))
+            for _ in range(dials):
+                if rng.random() < rate:
+                    ringing.append((t + max(1, int(rng.expovariate(1 / args.ring_answered))), None))
+                else:
+                    ringing.append((None, t + max(1, int(rng.expovariate(1 / args.ring_unanswered)))))
+            pending -= dials
+            stats["dials"] += dials
+
+            n = len(bridged)
+            stats["ticks"] += 1
+            stats["bridged_sum"] += n
+            stats["abs_err"] += abs(n - args.target)
+            stats["max_bridged"] = max(stats["max_bridged"], n)
+            stats["over_capacity"] += n > args.capacity
+            stats["idle_seconds"] += max(0, args.target - n)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic", action="store_true", help="Use built-in answer-rate distribution")
+    parser.add_argument("--days", type=int, default=30, help="History window read from call_logs")
+    parser.add_argument("--hours", default="9-17", help="Hours of day to replay, e.g. 9-17")
+    parser.add_argument("--target", type=int, default=15, help="Target bridged calls")
+    parser.add_argument("--capacity", type=int, default=20, help="Total media sessions across workers")
+    parser.add_argument("--max-concurrent", type=int, default=15, help="Live-call cap of the fixed dialer")
+    parser.add_argument("--cps", type=float, default=1.0)
+    parser.add_argument("--targets", type=int, default=100000, help="Numbers in the campaign")
+    parser.add_argument("--ring-answered", type=float, default=12.0, help="Mean ring seconds before answer")
+    parser.add_argument("--ring-unanswered", type=float, default=25.0, help="Mean seconds to no-answer/busy")
+    parser.add_argument("--window", type=int, default=900)
+    parser.add_argument("--prior", type=float, default=0.3)
+    parser.add_argument("--prior-weight", type=float, default=20.0)
+    parser.add_argument("--z", type=float, default=2.0)
+    args = parser.parse_args()
+
+    history = synthetic_history() if args.synthetic else load_history(args.days)
+    first, last = (int(x) for x in args.hours.split("-"))
+    hours = list(range(first, last + 1))
+
+    print(f"{'strategy':<9} {'mean bridged':>12} {'MAE vs target':>13} {'max':>5} "
+          f"{'% over cap':>10} {'idle slot-h':>11} {'dials':>7} {'answered':>8}")
+    for strategy in ("fixed", "adaptive"):
+        s = simulate(history, hours, strategy, args)
+        print(f"{strategy:<9} {s['bridged_sum'] / s['ticks']:>12.2f} {s['abs_err'] / s['ticks']:>13.2f} "
+              f"{s['max_bridged']:>5} {100.0 * s['over_capacity'] / s['ticks']:>10.2f} "
+              f"{s['idle_seconds'] / 3600:>11.1f} {s['dials']:>7} {s['answered']:>8}")
+
+
+if __name__ == "__main__":
+    main()
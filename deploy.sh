@@ -159,6 +159,13 @@ server {
         proxy_set_header X-Forwarded-Proto \$scheme;
     }
 
+    # Archived call recordings, sent by nginx when the backend answers with
+    # X-Accel-Redirect (set RECORDING_ACCEL_REDIRECT_PREFIX=/_recordings/ in backend/.env)
+    location /_recordings/ {
+        internal;
+        alias ${BACKEND_DIR}/archive/recordings/;
+    }
+
     # Serve static frontend files
     location / {
         root ${WEB_ROOT};
@@ -187,6 +194,13 @@ server {
         proxy_set_header X-Forwarded-Proto \$scheme;
     }
 
+    # Archived call recordings, sent by nginx when the backend answers with
+    # X-Accel-Redirect (set RECORDING_ACCEL_REDIRECT_PREFIX=/_recordings/ in backend/.env)
+    location /_recordings/ {
+        internal;
+        alias ${BACKEND_DIR}/archive/recordings/;
+    }
+
     location / {
         root ${WEB_ROOT};
         try_files \$uri \$uri/ /index.html;